@@ -1,6 +1,10 @@
 from django.contrib import admin
 
 from .models import DataSource, DataRouter, ECCServer, ConfigId, RunMetadata, Experiment, Observable, Measurement
+from .models import ConfigBlob, ConfigManifestEntry, RunFile, DataRateSample
+from .models import DiskUsageSample, TaskTiming, TraceSpan, TransitionEvent, TransitionIncident, RunSequence
+from .models import RunBoundary
+from .models import HostLock, HostSlot, PollLease, PollSchedule, PollRecord, PollCycle, CircuitBreaker
 
 
 @admin.register(ECCServer)
@@ -46,4 +50,125 @@ class ObservableAdmin(admin.ModelAdmin):
 
 @admin.register(Measurement)
 class MeasurementAdmin(admin.ModelAdmin):
-    model = Measurement
\ No newline at end of file
+    model = Measurement
+
+
+@admin.register(ConfigBlob)
+class ConfigBlobAdmin(admin.ModelAdmin):
+    model = ConfigBlob
+    list_display = ['checksum', 'host', 'store_root', 'created']
+
+
+@admin.register(ConfigManifestEntry)
+class ConfigManifestEntryAdmin(admin.ModelAdmin):
+    model = ConfigManifestEntry
+    list_display = ['run', 'ecc_server', 'file_name', 'checksum']
+
+
+@admin.register(RunFile)
+class RunFileAdmin(admin.ModelAdmin):
+    model = RunFile
+    list_display = ['path', 'run', 'data_router', 'size', 'mtime']
+
+
+@admin.register(DataRateSample)
+class DataRateSampleAdmin(admin.ModelAdmin):
+    model = DataRateSample
+    list_display = ['data_router', 'time', 'interval', 'bytes_written']
+
+
+@admin.register(DiskUsageSample)
+class DiskUsageSampleAdmin(admin.ModelAdmin):
+    model = DiskUsageSample
+    list_display = ['data_router', 'time', 'total_bytes', 'free_bytes']
+
+
+@admin.register(TaskTiming)
+class TaskTimingAdmin(admin.ModelAdmin):
+    model = TaskTiming
+    list_display = ['task_name', 'target_name', 'start_time', 'duration', 'queue_wait', 'outcome']
+    list_filter = ['task_name', 'outcome']
+
+
+@admin.register(TraceSpan)
+class TraceSpanAdmin(admin.ModelAdmin):
+    model = TraceSpan
+    list_display = ['name', 'kind', 'target', 'trace_id', 'start_time', 'duration', 'failed']
+    list_filter = ['kind', 'failed']
+
+
+@admin.register(TransitionEvent)
+class TransitionEventAdmin(admin.ModelAdmin):
+    model = TransitionEvent
+    list_display = ['ecc_server_name', 'transition', 'event', 'time', 'latency']
+    list_filter = ['event', 'transition']
+
+
+@admin.register(TransitionIncident)
+class TransitionIncidentAdmin(admin.ModelAdmin):
+    model = TransitionIncident
+    list_display = ['ecc_server_name', 'transition', 'resolution', 'started_time', 'detected_time', 'resolved_time',
+                    'time_lost']
+    list_filter = ['resolution', 'transition']
+
+
+@admin.register(HostLock)
+class HostLockAdmin(admin.ModelAdmin):
+    model = HostLock
+    list_display = ['host', 'updated_time']
+
+
+@admin.register(HostSlot)
+class HostSlotAdmin(admin.ModelAdmin):
+    model = HostSlot
+    list_display = ['host', 'operation', 'priority', 'is_running', 'created_time', 'acquired_time', 'expires_time']
+    list_filter = ['is_running', 'priority']
+
+
+@admin.register(PollLease)
+class PollLeaseAdmin(admin.ModelAdmin):
+    model = PollLease
+    list_display = ['poll', 'target_pk', 'created_time', 'expires_time', 'skipped']
+    list_filter = ['poll']
+
+
+@admin.register(PollSchedule)
+class PollScheduleAdmin(admin.ModelAdmin):
+    model = PollSchedule
+    list_display = ['experiment', 'state_interval', 'status_interval', 'data_rate_interval', 'transition_interval',
+                    'idle_factor', 'offline_factor']
+
+
+@admin.register(PollRecord)
+class PollRecordAdmin(admin.ModelAdmin):
+    model = PollRecord
+    list_display = ['poll', 'target_pk', 'last_time', 'offline_cycles']
+    list_filter = ['poll']
+
+
+@admin.register(PollCycle)
+class PollCycleAdmin(admin.ModelAdmin):
+    model = PollCycle
+    list_display = ['poll', 'next_time']
+
+
+@admin.register(CircuitBreaker)
+class CircuitBreakerAdmin(admin.ModelAdmin):
+    model = CircuitBreaker
+    list_display = ['endpoint', 'state', 'failures', 'failed_probes', 'opened_time', 'next_probe_time',
+                    'last_error']
+    list_filter = ['state']
+
+
+@admin.register(RunSequence)
+class RunSequenceAdmin(admin.ModelAdmin):
+    model = RunSequence
+    list_display = ['experiment', 'state', 'max_duration', 'max_bytes', 'run_count', 'runs_completed',
+                    'created_time']
+    list_filter = ['state']
+
+
+@admin.register(RunBoundary)
+class RunBoundaryAdmin(admin.ModelAdmin):
+    model = RunBoundary
+    list_display = ['sequence', 'run', 'reason', 'planned_time', 'stop_time', 'start_time', 'failed']
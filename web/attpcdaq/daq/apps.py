@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class DaqConfig(AppConfig):
     name = 'attpcdaq.daq'
+
+    def ready(self):
+        # Connect the Celery signal handlers that record task timings and propagate traces
+        from . import instrumentation  # noqa: F401
+        from . import tracing  # noqa: F401
@@ -0,0 +1,259 @@
+"""Circuit breakers for the periodic status checks of the remote hosts.
+
+When an ECC server is down, every state refresh waits until the task's soft time limit, and when a DAQ computer is
+down, every status check waits for the SSH connection to time out. Those tasks hold a worker the whole time, and
+the poll cycles keep queueing more of them. Each status check is therefore wrapped in :func:`circuit_breaker`,
+which counts the failures of each endpoint.
+
+An endpoint is named like the hosts in :mod:`~attpcdaq.daq.hostlimits`: ``ecc:10.0.0.1:8083`` for the SOAP calls to an
+ECC server and ``ssh:10.0.0.1`` for the SSH sessions to a DAQ computer. After ``CIRCUIT_BREAKER_THRESHOLD`` failures
+in a row, the endpoint's breaker opens. While it is open, checks of the endpoint raise :class:`CircuitOpenError`
+right away instead of contacting it, and the tasks mark the ECC server or data router offline. Every so often, one
+check is let through as a probe. The first probe is made ``CIRCUIT_BREAKER_BACKOFF`` seconds after the breaker
+opens, and the wait doubles after each failed probe, up to ``CIRCUIT_BREAKER_MAX_BACKOFF`` seconds. The breaker
+closes as soon as a check succeeds.
+
+Only failures to reach the endpoint are counted. A :class:`~attpcdaq.daq.hostlimits.HostBusyError` means the
+endpoint was never contacted, and an :class:`~attpcdaq.daq.models.ECCError` means that the ECC server answered, so
+neither counts as a failure or a success.
+
+The breakers are :class:`~attpcdaq.daq.models.CircuitBreaker` rows, since there is no cache shared between the
+processes.
+
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import CircuitBreaker, ECCError
+from .hostlimits import HostBusyError, ecc_host, ssh_host
+from .. import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: Errors that don't tell whether the endpoint can be reached
+IGNORED_ERRORS = (HostBusyError, ECCError)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a check is refused because the endpoint's breaker is open.
+
+    Parameters
+    ----------
+    endpoint : str
+        The endpoint.
+    retry_time : datetime
+        When the next probe of the endpoint will be let through.
+
+    """
+    def __init__(self, endpoint, retry_time):
+        super().__init__('Checks of {} are paused after repeated failures until {:%H:%M:%S}'
+                         .format(endpoint, retry_time))
+        self.endpoint = endpoint
+        self.retry_time = retry_time
+
+
+def probe_interval(failed_probes):
+    """Get the time to wait before the next probe of an open breaker.
+
+    Parameters
+    ----------
+    failed_probes : int
+        The number of probes that have failed since the breaker opened.
+
+    Returns
+    -------
+    float
+        The wait, in seconds.
+
+    """
+    backoff = getattr(settings, 'CIRCUIT_BREAKER_BACKOFF', 5)
+    max_backoff = getattr(settings, 'CIRCUIT_BREAKER_MAX_BACKOFF', 300)
+    return min(backoff * 2 ** failed_probes, max_backoff)
+
+
+def _check(endpoint, now):
+    """Decide whether a check of the endpoint may go ahead.
+
+    Returns
+    -------
+    int or None
+        The state of the breaker, or None if it has nothing to reset if the check succeeds.
+
+    Raises
+    ------
+    CircuitOpenError
+        If the breaker is open and it isn't time for a probe, or another check has already taken the probe.
+
+    """
+    row = (CircuitBreaker.objects.filter(endpoint=endpoint)
+           .values_list('state', 'failures', 'failed_probes', 'next_probe_time')
+           .first())
+    if row is None:
+        return None
+
+    state, failures, failed_probes, next_probe_time = row
+    if state == CircuitBreaker.CLOSED:
+        return state if failures > 0 else None
+
+    if next_probe_time is None or next_probe_time <= now:
+        # Only one check can take the probe, since the others will no longer match the old probe time
+        taken = (CircuitBreaker.objects
+                 .filter(endpoint=endpoint, state__in=(CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN),
+                         next_probe_time=next_probe_time)
+                 .update(state=CircuitBreaker.HALF_OPEN,
+                         next_probe_time=now + timedelta(seconds=probe_interval(failed_probes + 1))))
+        if taken:
+            logger.info('Probing %s after %d failed probes', endpoint, failed_probes)
+            return CircuitBreaker.HALF_OPEN
+
+        next_probe_time = now
+
+    metrics.CIRCUIT_BREAKER_REJECTED.inc(endpoint=endpoint)
+    raise CircuitOpenError(endpoint, next_probe_time)
+
+
+def _record_success(endpoint, state):
+    CircuitBreaker.objects.filter(endpoint=endpoint).update(state=CircuitBreaker.CLOSED, failures=0, failed_probes=0,
+                                                            opened_time=None, next_probe_time=None)
+    if state != CircuitBreaker.CLOSED:
+        metrics.CIRCUIT_BREAKER_OPEN.set(0, endpoint=endpoint)
+        logger.info('Closed circuit breaker for %s', endpoint)
+
+
+def _record_failure(endpoint, err, now):
+    """Count a failed check.
+
+    Returns
+    -------
+    CircuitBreaker
+        The breaker after the failure.
+    bool
+        Whether this failure opened the breaker.
+
+    """
+    threshold = getattr(settings, 'CIRCUIT_BREAKER_THRESHOLD', 3)
+    error = '{}: {}'.format(type(err).__name__, err) if str(err) else type(err).__name__
+
+    with transaction.atomic():
+        breaker, _ = CircuitBreaker.objects.select_for_update().get_or_create(endpoint=endpoint)
+        breaker.failures += 1
+        breaker.last_failure_time = now
+        breaker.last_error = error[:200]
+
+        opened = False
+        if breaker.state != CircuitBreaker.CLOSED:
+            breaker.state = CircuitBreaker.OPEN
+            breaker.failed_probes += 1
+            breaker.next_probe_time = now + timedelta(seconds=probe_interval(breaker.failed_probes))
+        elif breaker.failures >= threshold:
+            breaker.state = CircuitBreaker.OPEN
+            breaker.failed_probes = 0
+            breaker.opened_time = now
+            breaker.next_probe_time = now + timedelta(seconds=probe_interval(0))
+            opened = True
+
+        breaker.save()
+
+    return breaker, opened
+
+
+@contextmanager
+def circuit_breaker(endpoint):
+    """Run a check of a remote endpoint in the ``with`` block, unless the endpoint's breaker is open.
+
+    An exception raised in the block counts as a failure of the endpoint, unless it is one of
+    :data:`IGNORED_ERRORS`, and is raised again. If the failure opens the breaker, a :class:`CircuitOpenError` is
+    raised instead, with the original exception as its cause. If the block finishes, the breaker is closed.
+
+    Parameters
+    ----------
+    endpoint : str
+        The endpoint, as given by :func:`~attpcdaq.daq.hostlimits.ssh_host` or
+        :func:`~attpcdaq.daq.hostlimits.ecc_host`.
+
+    Raises
+    ------
+    CircuitOpenError
+        If the breaker is open, in which case the block isn't run, or if the block's failure opened it.
+
+    """
+    state = _check(endpoint, datetime.now())
+
+    try:
+        yield
+    except IGNORED_ERRORS:
+        raise
+    except Exception as err:
+        try:
+            breaker, opened = _record_failure(endpoint, err, datetime.now())
+        except Exception:
+            logger.exception('Failed to record failure of %s', endpoint)
+            raise err
+
+        if opened:
+            metrics.CIRCUIT_BREAKER_OPEN.set(1, endpoint=endpoint)
+            logger.warning('Opened circuit breaker for %s after %d failures in a row. Last error: %s',
+                           endpoint, breaker.failures, breaker.last_error)
+            raise CircuitOpenError(endpoint, breaker.next_probe_time) from err
+        raise
+
+    if state is not None:
+        _record_success(endpoint, state)
+
+
+def circuit_breaker_states(ecc_servers=(), data_routers=()):
+    """List the breakers that are open, or that have counted failures.
+
+    Parameters
+    ----------
+    ecc_servers : iterable of ECCServer, optional
+        ECC servers whose names should be listed with their endpoints. This is only iterated over if there are
+        breakers to list, so a query set costs nothing when every breaker is closed.
+    data_routers : iterable of DataRouter, optional
+        Data routers whose names should be listed with their endpoints, in the same way.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per breaker, sorted by endpoint. The keys are ``endpoint``, ``state``, the name of the state,
+        ``is_open``, whether checks are being refused, ``failures``, ``last_error``, ``targets``, the names of the
+        given ECC servers and data routers that use the endpoint, and ``next_probe``, the time until the next
+        probe in seconds, or None if the breaker is closed.
+
+    """
+    now = datetime.now()
+    breakers = list(CircuitBreaker.objects
+                    .exclude(state=CircuitBreaker.CLOSED, failures=0)
+                    .values_list('endpoint', 'state', 'failures', 'next_probe_time', 'last_error'))
+    if not breakers:
+        return []
+
+    state_names = dict(CircuitBreaker.state_choices)
+
+    targets = {}
+    for ecc_server in ecc_servers:
+        targets.setdefault(ecc_host(ecc_server), []).append(ecc_server.name)
+        targets.setdefault(ssh_host(ecc_server.ip_address), []).append(ecc_server.name)
+    for data_router in data_routers:
+        targets.setdefault(ssh_host(data_router.ip_address), []).append(data_router.name)
+
+    states = []
+    for endpoint, state, failures, next_probe_time, last_error in breakers:
+        is_closed = state == CircuitBreaker.CLOSED
+        states.append({
+            'endpoint': endpoint,
+            'state': state_names.get(state, state),
+            'is_open': not is_closed,
+            'failures': failures,
+            'last_error': last_error,
+            'targets': targets.get(endpoint, []),
+            'next_probe': None if is_closed or next_probe_time is None
+            else max((next_probe_time - now).total_seconds(), 0),
+        })
+
+    return states
@@ -4,6 +4,7 @@ from crispy_forms.layout import Submit, Layout, Fieldset, HTML
 from crispy_forms.bootstrap import FormActions, AppendedText
 
 from .models import DataSource, ECCServer, DataRouter, Experiment, ConfigId, RunMetadata, Observable, Measurement
+from .models import RunSequence, PollSchedule
 
 
 class CrispyModelFormBase(forms.ModelForm):
@@ -72,6 +73,42 @@ class ExperimentForm(CrispyModelFormBase):
         fields = ['name']
 
 
+class PollScheduleForm(CrispyModelFormBase):
+    """Edits how often the ECC servers and data routers are checked. See :mod:`attpcdaq.daq.pollschedule`."""
+    class Meta:
+        model = PollSchedule
+        fields = ['state_interval', 'status_interval', 'data_rate_interval', 'transition_interval', 'idle_factor',
+                  'offline_factor', 'offline_cycles', 'max_interval']
+        help_texts = {
+            'state_interval': 'How often the state of each ECC server is checked during a run.',
+            'status_interval': 'How often each ECC server and data router is checked over SSH during a run.',
+            'data_rate_interval': 'How often the data rate of each data router is sampled during a run.',
+            'transition_interval': 'How often the state of an ECC server is checked while it changes state.',
+            'idle_factor': 'The intervals are multiplied by this when no run is in progress.',
+            'offline_factor': 'The intervals are multiplied by this for a host that has been offline for a while.',
+            'offline_cycles': 'The number of checks in a row a host must be offline before it is checked less '
+                              'often.',
+            'max_interval': 'No host is checked less often than this.',
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper.form_action = 'daq/poll_schedule_settings'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for name in ('state_interval', 'status_interval', 'data_rate_interval', 'transition_interval',
+                     'max_interval'):
+            value = cleaned_data.get(name)
+            if value is not None and value <= 0:
+                self.add_error(name, 'The interval must be greater than zero.')
+        for name in ('idle_factor', 'offline_factor'):
+            value = cleaned_data.get(name)
+            if value is not None and value < 1:
+                self.add_error(name, 'The factor must be at least 1.')
+        return cleaned_data
+
+
 class ExperimentChoiceForm(forms.Form):
     experiment = forms.ModelChoiceField(queryset=Experiment.objects.all(), label='Choose experiment')
 
@@ -193,6 +230,44 @@ class ObservableForm(CrispyModelFormBase):
                 raise ValueError('Cannot disable field {:s} which does not exist.'.format(field_name)) from None
 
 
+class RunSequenceForm(CrispyModelFormBase):
+    """Starts a :class:`~attpcdaq.daq.models.RunSequence`.
+
+    The size limit is entered in gigabytes and stored in bytes.
+
+    """
+    max_gigabytes = forms.FloatField(required=False, min_value=0, label='Maximum GB per data router',
+                                     help_text='End the run when any data router has written this much data.')
+
+    class Meta:
+        model = RunSequence
+        fields = ['max_duration', 'run_count']
+        help_texts = {
+            'max_duration': 'End the run after this long, like 01:00:00.',
+            'run_count': 'Stop the DAQ after this many runs, counting the current one. Leave blank to continue '
+                         'until cancelled.',
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.helper.inputs = []
+        self.helper.add_input(Submit('submit', 'Start sequence'))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('max_duration') is None and cleaned_data.get('max_gigabytes') is None:
+            raise forms.ValidationError('Give a maximum duration or a maximum size.')
+        return cleaned_data
+
+    def save(self, commit=True):
+        instance = super().save(commit=False)
+        max_gigabytes = self.cleaned_data.get('max_gigabytes')
+        instance.max_bytes = int(max_gigabytes * 1e9) if max_gigabytes is not None else None
+        if commit:
+            instance.save()
+        return instance
+
+
 class DataSourceListUploadForm(forms.Form):
     data_source_list = forms.FileField()
 
@@ -0,0 +1,296 @@
+"""Limits on the number of operations running at once on each remote host.
+
+The Celery workers run many tasks at once, so without a limit, a status check, a file organization, a config
+backup, and a log request could all open SSH sessions to the same computer at the same moment, and a transition
+request could be sent to an ECC server while it is answering a GetState poll. Each remote operation is therefore
+wrapped in :func:`host_slot`, which waits until fewer than the allowed number of operations are running on the host.
+
+The hosts are named by the kind of connection and the address, like ``ssh:10.0.0.1`` for SSH sessions to a DAQ
+computer, or ``ecc:10.0.0.1:8083`` for SOAP calls to an ECC server. The number of slots for each kind is given by the
+``HOST_CONCURRENCY`` setting.
+
+The web app and the workers run in separate processes, and there is no shared cache, so the slots are kept in the
+database as :class:`~attpcdaq.daq.models.HostSlot` records. A process that wants a slot first updates the
+:class:`~attpcdaq.daq.models.HostLock` row for the host, which makes any other process doing the same wait until it
+has finished. Operations waiting for a slot are queued by priority: transitions go before ordinary operations, which
+go before status polls. Within a priority, the first to ask is the first to go.
+
+"""
+
+import time
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+
+from .. import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class HostBusyError(Exception):
+    """Raised when no slot on a host became free in time.
+
+    Parameters
+    ----------
+    host : str
+        The host that was busy.
+    timeout : float
+        How long the operation waited, in seconds.
+
+    """
+    def __init__(self, host, timeout):
+        super().__init__('No slot on {} became free within {:g} s'.format(host, timeout))
+        self.host = host
+
+
+def ssh_host(ip_address):
+    """Get the host name used to limit the SSH sessions to a computer."""
+    return 'ssh:{}'.format(ip_address)
+
+
+def ecc_host(ecc_server):
+    """Get the host name used to limit the SOAP calls to an ECC server."""
+    return 'ecc:{}:{}'.format(ecc_server.ip_address, ecc_server.port)
+
+
+def host_limit(host):
+    """Get the number of slots for a host from the ``HOST_CONCURRENCY`` setting.
+
+    Returns
+    -------
+    int or None
+        The number of operations that may run at once, or None if there is no limit.
+
+    """
+    limits = getattr(settings, 'HOST_CONCURRENCY', {'ssh': 2, 'ecc': 1})
+    if limits is None:
+        return None
+    return limits.get(host.partition(':')[0])
+
+
+def _try_acquire(host, operation, priority, limit, slot_pk, lease, wait_until):
+    """Take a slot on the host if one is free and nothing is ahead in the queue.
+
+    Parameters
+    ----------
+    host, operation, priority, limit
+        As in :func:`host_slot`.
+    slot_pk : int or None
+        The primary key of this operation's queued slot, or None if it isn't in the queue yet.
+    lease : float
+        How long the slot is held before it expires, in seconds.
+    wait_until : datetime
+        When a queued slot expires, since the operation stops waiting then.
+
+    Returns
+    -------
+    slot_pk : int
+        The primary key of the slot.
+    acquired : bool
+        Whether the operation got the slot. If not, it has been put in the queue.
+
+    """
+    from .models import HostLock, HostSlot  # The models module imports this one
+
+    with transaction.atomic():
+        now = datetime.now()
+
+        # Updating the lock row makes other processes wait here until this transaction is finished
+        lock = HostLock.objects.filter(host=host)
+        if not lock.update(updated_time=now):
+            HostLock.objects.get_or_create(host=host, defaults={'updated_time': now})
+            lock.update(updated_time=now)
+
+        slots = HostSlot.objects.filter(host=host)
+        fields = ('pk', 'is_running', 'priority', 'expires_time')
+
+        running = 0
+        is_first = True
+        expired = []
+        for pk, is_running, other_priority, expires_time in slots.order_by().values_list(*fields):
+            if expires_time < now:
+                expired.append(pk)
+            elif is_running:
+                running += 1
+            elif pk != slot_pk and (other_priority > priority
+                                    or (other_priority == priority and (slot_pk is None or pk < slot_pk))):
+                is_first = False  # Someone queued ahead of this operation
+
+        if expired:
+            slots.filter(pk__in=expired).delete()
+
+        if running < limit and is_first:
+            expires_time = now + timedelta(seconds=lease)
+            if slot_pk is not None and slots.filter(pk=slot_pk).update(is_running=True, acquired_time=now,
+                                                                      expires_time=expires_time):
+                return slot_pk, True
+
+            slot = HostSlot.objects.create(host=host, operation=operation, priority=priority, is_running=True,
+                                           created_time=now, acquired_time=now, expires_time=expires_time)
+            return slot.pk, True
+
+        if slot_pk is None:
+            slot_pk = HostSlot.objects.create(host=host, operation=operation, priority=priority,
+                                              created_time=now, expires_time=wait_until).pk
+
+        return slot_pk, False
+
+
+def _default_timeout(priority):
+    from .models import HostSlot
+    if priority == HostSlot.POLL:
+        return getattr(settings, 'HOST_SLOT_POLL_TIMEOUT', 2)
+    return getattr(settings, 'HOST_SLOT_TIMEOUT', 30)
+
+
+def _release(slot_pk):
+    from .models import HostSlot
+    try:
+        HostSlot.objects.filter(pk=slot_pk).delete()
+    except Exception:
+        logger.exception('Failed to release host slot %d', slot_pk)
+
+
+@contextmanager
+def host_slot(host, operation, priority=None, timeout=None, lease=None):
+    """Hold one of the slots on a remote host for the duration of the ``with`` block.
+
+    If every slot is in use, this waits for one to become free, checking every ``HOST_SLOT_RETRY_INTERVAL``
+    seconds. This shouldn't be used inside a transaction, since the lock on the host would be held until the
+    transaction ended.
+
+    Parameters
+    ----------
+    host : str
+        The host, as given by :func:`ssh_host` or :func:`ecc_host`.
+    operation : str
+        A description of the operation, for the queue listing.
+    priority : int, optional
+        One of the priority constants of :class:`~attpcdaq.daq.models.HostSlot`. Defaults to ``NORMAL``.
+    timeout : float, optional
+        The longest time to wait for a slot, in seconds. Defaults to the ``HOST_SLOT_POLL_TIMEOUT`` setting for
+        polls and the ``HOST_SLOT_TIMEOUT`` setting for everything else.
+    lease : float, optional
+        How long the slot can be held before it is given to someone else, in seconds. This should be longer than
+        the operation can take. Defaults to the ``HOST_SLOT_LEASE`` setting.
+
+    Raises
+    ------
+    HostBusyError
+        If no slot became free before the timeout.
+
+    """
+    from .models import HostSlot
+
+    limit = host_limit(host)
+    if limit is None:
+        yield
+        return
+
+    if priority is None:
+        priority = HostSlot.NORMAL
+    if timeout is None:
+        timeout = _default_timeout(priority)
+    if lease is None:
+        lease = getattr(settings, 'HOST_SLOT_LEASE', 120)
+    interval = getattr(settings, 'HOST_SLOT_RETRY_INTERVAL', 0.05)
+
+    priority_name = dict(HostSlot.priority_choices)[priority].lower()
+    start = time.monotonic()
+    wait_until = datetime.now() + timedelta(seconds=timeout)
+
+    slot_pk = None
+    try:
+        while True:
+            was_queued = slot_pk is not None
+            slot_pk, acquired = _try_acquire(host, operation, priority, limit, slot_pk, lease, wait_until)
+            if acquired:
+                if was_queued:
+                    metrics.HOST_SLOTS.dec(host=host, state='queued')
+                break
+            if not was_queued:
+                metrics.HOST_SLOTS.inc(host=host, state='queued')
+
+            if time.monotonic() - start >= timeout:
+                metrics.HOST_SLOTS.dec(host=host, state='queued')
+                metrics.HOST_SLOT_TIMEOUTS.inc(host=host, priority=priority_name)
+                raise HostBusyError(host, timeout)
+
+            time.sleep(interval)
+
+    except BaseException:
+        if slot_pk is not None:
+            _release(slot_pk)
+        raise
+
+    metrics.HOST_SLOT_WAIT_DURATION.observe(time.monotonic() - start, host=host, priority=priority_name)
+    metrics.HOST_SLOTS.inc(host=host, state='running')
+    try:
+        yield
+    finally:
+        metrics.HOST_SLOTS.dec(host=host, state='running')
+        _release(slot_pk)
+
+
+@contextmanager
+def host_slots(hosts, operation, priority=None, timeout=None, lease=None):
+    """Hold a slot on each of several hosts for the duration of the ``with`` block.
+
+    This is for operations that are run on several hosts at once from a thread pool. The slots are taken here, in
+    the calling thread, so that the threads don't need database connections of their own. Each host is only given
+    one slot, even if it is listed more than once. The slots are taken in order of host name, so two processes
+    that want some of the same hosts don't each end up holding a slot that the other is waiting for.
+
+    The parameters are the same as for :func:`host_slot`, except that ``hosts`` is an iterable of host names and
+    the timeout is for getting all of the slots.
+
+    """
+    from .models import HostSlot
+
+    if timeout is None:
+        timeout = _default_timeout(HostSlot.NORMAL if priority is None else priority)
+    deadline = time.monotonic() + timeout
+
+    with ExitStack() as stack:
+        for host in sorted(set(hosts)):
+            remaining = max(deadline - time.monotonic(), 0)
+            stack.enter_context(host_slot(host, operation, priority, remaining, lease))
+        yield
+
+
+def host_usage():
+    """List the operations using or waiting for a slot on each host.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per host with any slots, sorted by host. The keys are ``host``, ``limit``, ``running``, and
+        ``queued`` (the number of operations in each state), and ``slots``, a list of dictionaries with the keys
+        ``operation``, ``priority``, ``is_running``, and ``age`` (the time since the operation asked for its slot,
+        in seconds). The running operations are listed first, and then the queue in the order it will be served.
+
+    """
+    from .models import HostSlot
+
+    now = datetime.now()
+    fields = ('host', 'operation', 'priority', 'is_running', 'created_time')
+    priority_names = dict(HostSlot.priority_choices)
+
+    usage = []
+    for host, operation, priority, is_running, created_time in \
+            HostSlot.objects.filter(expires_time__gte=now).values_list(*fields):
+        if not usage or usage[-1]['host'] != host:
+            usage.append({'host': host, 'limit': host_limit(host), 'running': 0, 'queued': 0, 'slots': []})
+        summary = usage[-1]
+        summary['running' if is_running else 'queued'] += 1
+        summary['slots'].append({
+            'operation': operation,
+            'priority': priority_names.get(priority, priority),
+            'is_running': is_running,
+            'age': (now - created_time).total_seconds(),
+        })
+
+    return usage
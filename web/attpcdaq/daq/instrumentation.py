@@ -0,0 +1,335 @@
+"""Timing and outcome instrumentation for the Celery tasks.
+
+The handlers in this module are connected to Celery's signals when the app is loaded. Each time a task runs, they
+record its duration, the time it spent waiting in the queue, the ECC server or data router it acted on, and how it
+ended, as a :class:`~attpcdaq.daq.models.TaskTiming`. The records are summarized into latency histograms and
+percentiles for each task and target by :func:`summarize`, and the queue waits are summarized for each Celery
+queue by :func:`summarize_queues`. The duration and queue wait are also added to the in-memory histograms in
+:mod:`attpcdaq.metrics`.
+
+The queue wait is measured from a timestamp added to the message headers when the task is sent, so it includes
+any difference between the clocks of the sending and receiving hosts.
+
+Most of the tasks catch :class:`~celery.exceptions.SoftTimeLimitExceeded` themselves, so the exception doesn't
+reach the failure signal. Instead, a task that ran for at least its soft time limit is counted as timed out.
+
+A poll cycle that queued no checks calls :func:`skip_task_timing`, so the cycles that found nothing to do don't
+fill the table.
+
+"""
+
+import inspect
+import math
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_failure
+from celery.exceptions import SoftTimeLimitExceeded, TimeLimitExceeded
+
+from .models import TaskTiming, ECCServer, DataRouter
+from .. import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: The message header holding the time when the task was sent
+PUBLISH_TIME_HEADER = 'attpcdaq_published_at'
+
+#: The upper edges of the latency histogram bins, in seconds. A final bin holds everything longer.
+HISTOGRAM_EDGES = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+#: The task arguments that identify the target of a task, and the type of target each one refers to
+TARGET_ARGUMENTS = {
+    'eccserver_pk': (TaskTiming.ECC_SERVER, ECCServer),
+    'ecc_pk': (TaskTiming.ECC_SERVER, ECCServer),
+    'datarouter_pk': (TaskTiming.DATA_ROUTER, DataRouter),
+}
+
+#: The start times and outcomes of the tasks running in this process, keyed by task ID
+_running_tasks = {}
+
+
+def _is_enabled():
+    return getattr(settings, 'TASK_TIMING_ENABLED', True)
+
+
+def find_target(task, args, kwargs):
+    """Find the ECC server or data router that a task is acting on.
+
+    Parameters
+    ----------
+    task : celery.Task
+        The task.
+    args, kwargs
+        The arguments the task was called with.
+
+    Returns
+    -------
+    tuple(str, int, str) or None
+        The target type (a constant from :class:`~attpcdaq.daq.models.TaskTiming`), primary key, and name.
+        This is None if the task doesn't take one of the arguments in :data:`TARGET_ARGUMENTS`.
+
+    """
+    try:
+        params = list(inspect.signature(task.run).parameters)
+    except (TypeError, ValueError):
+        params = []
+
+    for arg_name, (target_type, model) in TARGET_ARGUMENTS.items():
+        if arg_name in kwargs:
+            pk = kwargs[arg_name]
+        elif arg_name in params and params.index(arg_name) < len(args):
+            pk = args[params.index(arg_name)]
+        else:
+            continue
+
+        name = model.objects.filter(pk=pk).values_list('name', flat=True).first()
+        return target_type, pk, name
+
+    return None
+
+
+@before_task_publish.connect
+def add_publish_time(sender=None, headers=None, **kwargs):
+    """Record when a task is sent, so its time in the queue can be found."""
+    if headers is not None and _is_enabled():
+        headers.setdefault(PUBLISH_TIME_HEADER, time.time())
+
+
+def find_queue(task):
+    """Find the name of the Celery queue that a task was taken from.
+
+    This is the routing key of the message, if the worker knows it. Otherwise, such as when the task is run with
+    ``apply``, it is the queue the task would be sent to by ``CELERY_ROUTES``.
+
+    Returns
+    -------
+    str or None
+        The name of the queue, or None if it couldn't be found.
+
+    """
+    delivery_info = getattr(task.request, 'delivery_info', None) or {}
+    queue = delivery_info.get('routing_key')
+    if queue:
+        return queue
+
+    try:
+        return task.app.amqp.router.route({}, task.name)['queue'].name
+    except Exception:
+        return None
+
+
+@task_prerun.connect
+def start_task_timer(sender=None, task_id=None, task=None, **kwargs):
+    """Note the start time of a task."""
+    if not _is_enabled():
+        return
+
+    published = getattr(task.request, PUBLISH_TIME_HEADER, None)
+    if published is None:
+        published = (getattr(task.request, 'headers', None) or {}).get(PUBLISH_TIME_HEADER)
+
+    now = time.time()
+    _running_tasks[task_id] = {
+        'start': time.monotonic(),
+        'start_time': datetime.fromtimestamp(now),
+        'queue_wait': max(now - published, 0) if published is not None else None,
+        'queue': find_queue(task),
+        'outcome': None,
+    }
+
+
+@task_failure.connect
+def note_task_failure(sender=None, task_id=None, exception=None, **kwargs):
+    """Note that a task raised an exception."""
+    info = _running_tasks.get(task_id)
+    if info is not None:
+        if isinstance(exception, (SoftTimeLimitExceeded, TimeLimitExceeded)):
+            info['outcome'] = TaskTiming.TIMEOUT
+        else:
+            info['outcome'] = TaskTiming.FAILURE
+
+
+def skip_task_timing(task):
+    """Don't save a timing record for the current run of a task.
+
+    This is for the poll cycles, which run several times a second and usually find nothing to do. The task's
+    duration is still added to the metrics, and a record is still saved if the task fails or times out.
+
+    Parameters
+    ----------
+    task : celery.Task
+        The task that is running.
+
+    """
+    info = _running_tasks.get(task.request.id)
+    if info is not None:
+        info['skip'] = True
+
+
+@task_postrun.connect
+def record_task_timing(sender=None, task_id=None, task=None, args=None, kwargs=None, state=None, **extra):
+    """Save the timing and outcome of a finished task."""
+    info = _running_tasks.pop(task_id, None)
+    if info is None:
+        return
+
+    try:
+        duration = time.monotonic() - info['start']
+        metrics.TASK_DURATION.observe(duration, task=task.name)
+        if info['queue_wait'] is not None and info['queue'] is not None:
+            metrics.TASK_QUEUE_WAIT.observe(info['queue_wait'], queue=info['queue'])
+
+        outcome = info['outcome']
+        if outcome is None:
+            soft_limit = getattr(task, 'soft_time_limit', None)
+            if state != 'SUCCESS':
+                outcome = TaskTiming.FAILURE
+            elif soft_limit is not None and duration >= soft_limit:
+                outcome = TaskTiming.TIMEOUT
+            else:
+                outcome = TaskTiming.SUCCESS
+
+        if info.get('skip') and outcome == TaskTiming.SUCCESS:
+            return
+
+        target = find_target(task, args or (), kwargs or {})
+        target_type, target_pk, target_name = target if target is not None else (None, None, None)
+
+        TaskTiming.objects.create(
+            task_name=task.name,
+            target_type=target_type,
+            target_pk=target_pk,
+            target_name=target_name,
+            start_time=info['start_time'],
+            duration=duration,
+            queue_wait=info['queue_wait'],
+            queue=info['queue'],
+            outcome=outcome,
+        )
+    except Exception:
+        logger.exception('Failed to record the timing of task %s', task.name)
+
+
+def percentile(sorted_values, q):
+    """Find a percentile of a sorted list using the nearest-rank method.
+
+    Parameters
+    ----------
+    sorted_values : list
+        The values, in increasing order. This must not be empty.
+    q : float
+        The percentile, between 0 and 100.
+
+    Returns
+    -------
+    The value at the given percentile.
+
+    """
+    rank = max(int(math.ceil(q / 100 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def histogram(values):
+    """Count the values falling in each bin of :data:`HISTOGRAM_EDGES`.
+
+    Returns
+    -------
+    list[int]
+        The counts, with one more entry than :data:`HISTOGRAM_EDGES` for the values longer than the last edge.
+
+    """
+    counts = [0] * (len(HISTOGRAM_EDGES) + 1)
+    for value in values:
+        for i, edge in enumerate(HISTOGRAM_EDGES):
+            if value <= edge:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return counts
+
+
+def summarize(timings):
+    """Summarize task timings for each task and target.
+
+    Parameters
+    ----------
+    timings : QuerySet
+        The :class:`~attpcdaq.daq.models.TaskTiming` records to summarize.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per combination of task and target, sorted by task name and then target name. The keys are
+        ``task``, ``target_type``, ``target_pk``, ``target``, ``count``, ``p50``, ``p90``, ``p99``, ``max``,
+        ``mean_queue_wait``, ``timeouts``, ``failures``, and ``histogram``. Times are in seconds, and the
+        histogram bins are given by :data:`HISTOGRAM_EDGES`.
+
+    """
+    groups = defaultdict(list)
+    fields = ('task_name', 'target_type', 'target_pk', 'target_name', 'duration', 'queue_wait', 'outcome')
+    for task_name, target_type, target_pk, target_name, duration, queue_wait, outcome in \
+            timings.order_by('start_time').values_list(*fields):
+        groups[(task_name, target_type, target_pk)].append((target_name, duration, queue_wait, outcome))
+
+    summaries = []
+    for (task_name, target_type, target_pk), rows in groups.items():
+        durations = sorted(r[1] for r in rows)
+        waits = [r[2] for r in rows if r[2] is not None]
+        outcomes = [r[3] for r in rows]
+
+        summaries.append({
+            'task': task_name,
+            'target_type': target_type,
+            'target_pk': target_pk,
+            'target': rows[-1][0],  # The most recent name
+            'count': len(rows),
+            'p50': percentile(durations, 50),
+            'p90': percentile(durations, 90),
+            'p99': percentile(durations, 99),
+            'max': durations[-1],
+            'mean_queue_wait': sum(waits) / len(waits) if waits else None,
+            'timeouts': outcomes.count(TaskTiming.TIMEOUT),
+            'failures': outcomes.count(TaskTiming.FAILURE),
+            'histogram': histogram(durations),
+        })
+
+    summaries.sort(key=lambda s: (s['task'], s['target'] or ''))
+    return summaries
+
+
+def summarize_queues(timings):
+    """Summarize the time that tasks spent waiting in each Celery queue.
+
+    Parameters
+    ----------
+    timings : QuerySet
+        The :class:`~attpcdaq.daq.models.TaskTiming` records to summarize.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per queue, sorted by name. The keys are ``queue``, ``count``, ``p50``, ``p90``, ``p99``, and
+        ``max``. The percentiles are of the queue wait, in seconds, and are None if no waits were recorded.
+
+    """
+    groups = defaultdict(list)
+    for queue, queue_wait in timings.filter(queue__isnull=False).values_list('queue', 'queue_wait'):
+        groups[queue].append(queue_wait)
+
+    summaries = []
+    for queue, rows in sorted(groups.items()):
+        waits = sorted(w for w in rows if w is not None)
+        summaries.append({
+            'queue': queue,
+            'count': len(rows),
+            'p50': percentile(waits, 50) if waits else None,
+            'p90': percentile(waits, 90) if waits else None,
+            'p99': percentile(waits, 99) if waits else None,
+            'max': waits[-1] if waits else None,
+        })
+
+    return summaries
@@ -0,0 +1,106 @@
+"""Run simulated ECC servers on local ports.
+
+Example::
+
+    python manage.py run_ecc_simulator --count 100 --base-port 9000 --latency 2 --register
+
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import ECCServer, ConfigId, Experiment
+from ...simulators.ecc import EccSimulator
+
+
+class Command(BaseCommand):
+    help = 'Run simulated ECC servers for load and latency testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1, help='Number of ECC servers to simulate')
+        parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+        parser.add_argument('--base-port', type=int, default=9000,
+                            help='Port of the first server. Use 0 to pick free ports.')
+        parser.add_argument('--latency', type=float, default=0, help='Duration of each transition, in seconds')
+        parser.add_argument('--jitter', type=float, default=0,
+                            help='Maximum random time added to each transition, in seconds')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Probability that a transition request fails')
+        parser.add_argument('--state-error-rate', type=float, default=0,
+                            help='Probability that a GetState request fails')
+        parser.add_argument('--config', action='append', dest='config_names',
+                            help='Name of a config set to report. Can be given more than once.')
+        parser.add_argument('--initial-state', type=int, default=ECCServer.IDLE,
+                            choices=sorted(ECCServer.STATE_DICT.keys()), help='Starting state of each server')
+        parser.add_argument('--seed', type=int, help='Random seed for jitter and errors')
+        parser.add_argument('--register', action='store_true',
+                            help='Add the simulated servers to the active experiment')
+
+    def handle(self, *args, **options):
+        simulator = EccSimulator(
+            options['count'],
+            host=options['host'],
+            base_port=options['base_port'],
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            state_error_rate=options['state_error_rate'],
+            config_names=options['config_names'],
+            initial_state=options['initial_state'],
+            seed=options['seed'],
+        )
+
+        if options['register']:
+            try:
+                experiment = Experiment.objects.get(is_active=True)
+            except Experiment.DoesNotExist:
+                raise CommandError('There is no active experiment to register the servers with')
+
+        try:
+            simulator.start()
+        except OSError as err:
+            simulator.stop()
+            raise CommandError('Could not start the servers: {}'.format(err))
+
+        try:
+            if options['register']:
+                self.register(experiment, simulator)
+
+            self.stdout.write('Simulating {} ECC servers on {}, ports {}-{}. Press Ctrl-C to stop.'.format(
+                len(simulator.ports), simulator.host, min(simulator.ports), max(simulator.ports)))
+
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.stop()
+
+    def register(self, experiment, simulator):
+        """Create or update an :class:`~attpcdaq.daq.models.ECCServer` for each simulated server.
+
+        Each one is given a config set reported by the simulator, so it can be taken through the transitions
+        right away.
+
+        """
+        for ecc, port in zip(simulator.ecc_servers, simulator.ports):
+            ecc_server, _ = ECCServer.objects.update_or_create(
+                name='Simulated {}'.format(ecc.name),
+                experiment=experiment,
+                defaults={'ip_address': simulator.host, 'port': port},
+            )
+
+            config_name = ecc.config_names[0]
+            config, _ = ConfigId.objects.get_or_create(
+                describe=config_name,
+                prepare=config_name,
+                configure=config_name,
+                ecc_server=ecc_server,
+            )
+            ecc_server.selected_config = config
+            ecc_server.state = ecc.state
+            ecc_server.save()
+
+        self.stdout.write('Registered {} ECC servers with experiment {}'.format(
+            len(simulator.ecc_servers), experiment.name))
@@ -1,9 +1,17 @@
 from django.utils.functional import SimpleLazyObject
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.conf import settings
+from django.db import connections
 from functools import wraps
+from collections import defaultdict
+from contextlib import ExitStack
+from datetime import timedelta
+import threading
+import time
 
 from .models import Experiment
+from .. import metrics
 
 import logging
 logger = logging.getLogger(__name__)
@@ -49,3 +57,146 @@ class NeedsExperimentMixin:
             return super().dispatch(request, *args, **kwargs)
         else:
             return redirect(reverse('daq/choose_experiment'))
+
+
+#: Holds the :class:`RequestTiming` of the request being handled by the current thread
+_current_request = threading.local()
+
+
+class RequestTiming(object):
+    """Collects the database queries and external calls made while handling a request.
+
+    Attributes
+    ----------
+    queries : list[tuple(str, float)]
+        The SQL of each query and the time it took, in seconds.
+    external : dict
+        The total time spent in external calls, in seconds, keyed by the kind of call (``'soap'`` or ``'ssh'``).
+
+    """
+    def __init__(self):
+        self.queries = []
+        self.external = defaultdict(float)
+
+    @property
+    def db_time(self):
+        """The total time spent in database queries, in seconds."""
+        return sum(duration for sql, duration in self.queries)
+
+    def record_query(self, execute, sql, params, many, context):
+        """Time a database query. This is installed with :meth:`connection.execute_wrapper`."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def top_queries(self, count):
+        """Find the queries that took the most total time.
+
+        Queries with the same SQL but different parameters are grouped together, so a query that is repeated for
+        each object in a loop shows up as one entry.
+
+        Parameters
+        ----------
+        count : int
+            The maximum number of queries to return.
+
+        Returns
+        -------
+        list[tuple(str, int, float)]
+            The SQL, the number of times it was run, and its total time in seconds, starting with the slowest.
+
+        """
+        totals = defaultdict(lambda: [0, 0.0])
+        for sql, duration in self.queries:
+            totals[sql][0] += 1
+            totals[sql][1] += duration
+        top = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        return [(sql, num, total) for sql, (num, total) in top]
+
+    def server_timing(self, total):
+        """Format the timing as the value of a ``Server-Timing`` header.
+
+        Parameters
+        ----------
+        total : float
+            The total time taken by the request, in seconds.
+
+        """
+        entries = [
+            'total;dur={:.1f}'.format(total * 1000),
+            'db;dur={:.1f};desc="{} queries"'.format(self.db_time * 1000, len(self.queries)),
+        ]
+        for kind, duration in sorted(self.external.items()):
+            entries.append('{};dur={:.1f}'.format(kind, duration * 1000))
+        return ', '.join(entries)
+
+
+def _external_call_listener(kind):
+    def listener(amount, labels):
+        timing = getattr(_current_request, 'timing', None)
+        if timing is not None:
+            timing.external[kind] += amount
+
+    return listener
+
+
+metrics.SOAP_CALL_DURATION.add_listener(_external_call_listener('soap'))
+metrics.SSH_CALL_DURATION.add_listener(_external_call_listener('ssh'))
+
+
+class RequestTimingMiddleware(object):
+    """Measures the time taken by each request, and the time spent in database queries and external calls.
+
+    The timing is sent to the browser in a ``Server-Timing`` header, which shows up in the network panel of the
+    browser's developer tools, and it is added to the request metrics in :mod:`attpcdaq.metrics`. Requests that take
+    longer than the ``SLOW_REQUEST_THRESHOLD`` setting are logged as warnings along with the
+    ``SLOW_REQUEST_TOP_QUERIES`` queries that took the most time.
+
+    The external call time includes the SOAP calls to the ECC servers and the SSH operations made through
+    :class:`~attpcdaq.daq.workertasks.WorkerInterface` in the thread handling the request.
+
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        _current_request.timing = timing
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(timing.record_query))
+                response = self.get_response(request)
+        finally:
+            _current_request.timing = None
+        total = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match is not None else 'unresolved'
+        metrics.REQUEST_DURATION.observe(total, view=view_name)
+        metrics.REQUEST_DB_DURATION.observe(timing.db_time, view=view_name)
+        metrics.REQUEST_QUERIES.observe(len(timing.queries), view=view_name)
+
+        response['Server-Timing'] = timing.server_timing(total)
+
+        threshold = getattr(settings, 'SLOW_REQUEST_THRESHOLD', timedelta(seconds=2))
+        if threshold is not None and total >= threshold.total_seconds():
+            self.log_slow_request(request, view_name, total, timing)
+
+        return response
+
+    @staticmethod
+    def log_slow_request(request, view_name, total, timing):
+        external = ', '.join('{} {:.2f} s'.format(kind, duration) for kind, duration in sorted(timing.external.items()))
+        lines = ['Slow request: {} {} ({}) took {:.2f} s, with {} queries taking {:.2f} s{}'.format(
+            request.method, request.path, view_name, total, len(timing.queries), timing.db_time,
+            ' and external calls taking ' + external if external else '')]
+
+        num_top = getattr(settings, 'SLOW_REQUEST_TOP_QUERIES', 5)
+        for sql, count, duration in timing.top_queries(num_top):
+            lines.append('  {:.3f} s in {} x {}'.format(duration, count, sql if len(sql) <= 300 else sql[:300] + '...'))
+
+        logger.warning('\n'.join(lines))
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:49
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0040_experiment_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=64)),
+                ('host', models.GenericIPAddressField()),
+                ('store_root', models.CharField(max_length=500)),
+                ('created', models.DateTimeField(default=datetime.datetime.now)),
+            ],
+            options={
+                'unique_together': {('checksum', 'host', 'store_root')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ConfigManifestEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=200)),
+                ('checksum', models.CharField(db_index=True, max_length=64)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='daq.configblob')),
+                ('ecc_server', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='daq.eccserver')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='config_manifest', to='daq.runmetadata')),
+            ],
+            options={
+                'verbose_name_plural': 'config manifest entries',
+                'ordering': ('run', 'file_name'),
+            },
+        ),
+    ]
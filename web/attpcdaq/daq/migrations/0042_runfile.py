@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0041_configblob_configmanifestentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunFile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500)),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.DateTimeField(verbose_name='modification time')),
+                ('data_router', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='daq.datarouter')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='daq.runmetadata')),
+            ],
+            options={
+                'ordering': ('run', 'path'),
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0042_runfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='runfile',
+            name='checksum',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='runfile',
+            name='checksum_algorithm',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+    ]
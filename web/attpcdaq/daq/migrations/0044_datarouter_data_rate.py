@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0043_runfile_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datarouter',
+            name='data_rate',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='datarouter',
+            name='is_stalled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='datarouter',
+            name='last_growth_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datarouter',
+            name='last_sample_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datarouter',
+            name='staging_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='DataRateSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True)),
+                ('interval', models.FloatField()),
+                ('bytes_written', models.BigIntegerField()),
+                ('data_router', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='daq.datarouter')),
+            ],
+            options={
+                'ordering': ('time',),
+            },
+        ),
+    ]
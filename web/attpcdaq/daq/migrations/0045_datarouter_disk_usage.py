@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0044_datarouter_data_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datarouter',
+            name='disk_free_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datarouter',
+            name='disk_total_bytes',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='DiskUsageSample',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(db_index=True)),
+                ('total_bytes', models.BigIntegerField()),
+                ('free_bytes', models.BigIntegerField()),
+                ('data_router', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='daq.datarouter')),
+            ],
+            options={
+                'ordering': ('time',),
+            },
+        ),
+    ]
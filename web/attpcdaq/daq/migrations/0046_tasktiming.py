@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0045_datarouter_disk_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(db_index=True, max_length=200)),
+                ('target_type', models.CharField(blank=True, choices=[('ecc', 'ECC server'), ('router', 'Data router')], max_length=6, null=True)),
+                ('target_pk', models.PositiveIntegerField(blank=True, null=True)),
+                ('target_name', models.CharField(blank=True, max_length=50, null=True)),
+                ('start_time', models.DateTimeField(db_index=True)),
+                ('duration', models.FloatField()),
+                ('queue_wait', models.FloatField(blank=True, null=True)),
+                ('outcome', models.CharField(choices=[('ok', 'Success'), ('timeout', 'Time limit exceeded'), ('fail', 'Failure')], max_length=7)),
+            ],
+            options={
+                'ordering': ('start_time',),
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0046_tasktiming'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TraceSpan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trace_id', models.CharField(db_index=True, max_length=32)),
+                ('span_id', models.CharField(max_length=16)),
+                ('parent_id', models.CharField(blank=True, max_length=16, null=True)),
+                ('name', models.CharField(max_length=200)),
+                ('kind', models.CharField(choices=[('view', 'Web request'), ('task', 'Celery task'), ('soap', 'SOAP call'), ('ssh', 'SSH operation'), ('transition', 'ECC transition'), ('wait', 'Waiting')], max_length=10)),
+                ('target', models.CharField(blank=True, max_length=100)),
+                ('start_time', models.DateTimeField(db_index=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('failed', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ('start_time',),
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0047_tracespan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransitionEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ecc_server_name', models.CharField(max_length=50)),
+                ('event', models.CharField(choices=[('requested', 'Requested'), ('failed', 'Failed'), ('finished', 'Finished')], max_length=9)),
+                ('transition', models.CharField(max_length=10)),
+                ('from_state', models.IntegerField(choices=[(1, 'Idle'), (2, 'Described'), (3, 'Prepared'), (4, 'Ready'), (5, 'Running')])),
+                ('to_state', models.IntegerField(choices=[(1, 'Idle'), (2, 'Described'), (3, 'Prepared'), (4, 'Ready'), (5, 'Running')])),
+                ('time', models.DateTimeField(db_index=True)),
+                ('latency', models.FloatField(blank=True, null=True)),
+                ('ecc_server', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='daq.eccserver')),
+            ],
+            options={
+                'ordering': ('time',),
+            },
+        ),
+    ]
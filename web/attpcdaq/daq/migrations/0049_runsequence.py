@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:27
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0048_transitionevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RunSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('max_duration', models.DurationField(blank=True, null=True, verbose_name='maximum run duration')),
+                ('max_bytes', models.BigIntegerField(blank=True, null=True, verbose_name='maximum bytes per data router')),
+                ('run_count', models.PositiveIntegerField(blank=True, null=True, verbose_name='number of runs')),
+                ('state', models.CharField(choices=[('active', 'Active'), ('finished', 'Finished'), ('cancelled', 'Cancelled'), ('failed', 'Failed')], default='active', max_length=9)),
+                ('runs_completed', models.PositiveIntegerField(default=0)),
+                ('created_time', models.DateTimeField(default=datetime.datetime.now)),
+                ('finished_time', models.DateTimeField(blank=True, null=True)),
+                ('rollover_started_time', models.DateTimeField(blank=True, null=True)),
+                ('message', models.CharField(blank=True, max_length=200)),
+                ('experiment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='daq.experiment')),
+            ],
+            options={
+                'ordering': ('-created_time',),
+            },
+        ),
+        migrations.CreateModel(
+            name='RunBoundary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('duration', 'Duration'), ('bytes', 'Size')], max_length=8)),
+                ('planned_time', models.DateTimeField()),
+                ('stop_time', models.DateTimeField(blank=True, null=True)),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('failed', models.BooleanField(default=False)),
+                ('next_run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='daq.runmetadata')),
+                ('run', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='daq.runmetadata')),
+                ('sequence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='boundaries', to='daq.runsequence')),
+            ],
+            options={
+                'ordering': ('planned_time',),
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0049_runsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=100, unique=True)),
+                ('updated_time', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HostSlot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(db_index=True, max_length=100)),
+                ('operation', models.CharField(max_length=100)),
+                ('priority', models.SmallIntegerField(choices=[(0, 'Poll'), (1, 'Normal'), (2, 'Transition')], default=1)),
+                ('is_running', models.BooleanField(default=False)),
+                ('created_time', models.DateTimeField()),
+                ('acquired_time', models.DateTimeField(blank=True, null=True)),
+                ('expires_time', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ('host', '-is_running', '-priority', 'pk'),
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0050_hostslot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tasktiming',
+            name='queue',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+    ]
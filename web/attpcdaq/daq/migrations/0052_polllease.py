@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-19 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0051_tasktiming_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('poll', models.CharField(max_length=50)),
+                ('target_pk', models.PositiveIntegerField()),
+                ('token', models.CharField(max_length=32)),
+                ('created_time', models.DateTimeField()),
+                ('expires_time', models.DateTimeField()),
+                ('skipped', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('poll', 'target_pk'),
+                'unique_together': {('poll', 'target_pk')},
+            },
+        ),
+    ]
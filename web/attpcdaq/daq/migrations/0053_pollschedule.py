@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0052_polllease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state_interval', models.FloatField(default=5, verbose_name='ECC state interval (s)')),
+                ('status_interval', models.FloatField(default=15, verbose_name='online check interval (s)')),
+                ('data_rate_interval', models.FloatField(default=5, verbose_name='data rate interval (s)')),
+                ('transition_interval', models.FloatField(default=0.5, verbose_name='transition interval (s)')),
+                ('idle_factor', models.FloatField(default=6)),
+                ('offline_factor', models.FloatField(default=12)),
+                ('offline_cycles', models.PositiveIntegerField(default=3)),
+                ('max_interval', models.FloatField(default=300, verbose_name='maximum interval (s)')),
+                ('experiment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='poll_schedule', to='daq.experiment')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PollRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('poll', models.CharField(max_length=50)),
+                ('target_pk', models.PositiveIntegerField()),
+                ('last_time', models.DateTimeField()),
+                ('offline_cycles', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('poll', 'target_pk'),
+                'unique_together': {('poll', 'target_pk')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0053_pollschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CircuitBreaker',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=100, unique=True)),
+                ('state', models.SmallIntegerField(choices=[(0, 'Closed'), (1, 'Open'), (2, 'Half-open')], default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('failed_probes', models.PositiveIntegerField(default=0)),
+                ('opened_time', models.DateTimeField(blank=True, null=True)),
+                ('next_probe_time', models.DateTimeField(blank=True, null=True)),
+                ('last_failure_time', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.CharField(blank=True, max_length=200)),
+            ],
+            options={
+                'ordering': ('endpoint',),
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-19 12:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0054_circuitbreaker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eccserver',
+            name='transition_started_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='TransitionIncident',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ecc_server_name', models.CharField(max_length=50)),
+                ('transition', models.CharField(blank=True, max_length=10)),
+                ('resolution', models.CharField(choices=[('cleared', 'Cleared'), ('unreachable', 'Unreachable'), ('escalated', 'Escalated')], max_length=11)),
+                ('started_time', models.DateTimeField()),
+                ('detected_time', models.DateTimeField(db_index=True)),
+                ('resolved_time', models.DateTimeField(blank=True, null=True)),
+                ('time_lost', models.FloatField(default=0)),
+                ('message', models.CharField(blank=True, max_length=200)),
+                ('ecc_server', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='daq.eccserver')),
+            ],
+            options={
+                'ordering': ('-detected_time',),
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 14:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0055_transitionincident'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollCycle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('poll', models.CharField(max_length=50, unique=True)),
+                ('next_time', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ('poll',),
+            },
+        ),
+    ]
@@ -7,12 +7,20 @@ subclasses attached as attributes will be the columns in the database table.
 """
 
 from django.db import models
+from django.db.models import Sum
 from django.contrib.auth.models import User
 from django.conf import settings
 import xml.etree.ElementTree as ET
 from zeep import Client as SoapClient
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlsplit
+from collections import namedtuple
+from .workertasks import blob_path
+from .hostlimits import host_slot, ecc_host
+from .. import metrics
+from . import tracing
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import logging
 logger = logging.getLogger(__name__)
@@ -63,6 +71,7 @@ class EccClient(object):
         """
         wsdl_url = os.path.join(settings.BASE_DIR, 'attpcdaq', 'daq', 'ecc.wsdl')
         client = SoapClient(wsdl_url)  # Loads the service definition from ecc.wsdl
+        self.host = urlsplit(ecc_url).netloc
         self.service = client.create_service('{urn:ecc}ecc', ecc_url)  # This overrides the default URL from the file
 # This line prevents zeep from writing the namespace in the xml code. BUG BUG BUG
         client.set_ns_prefix(None, 'urn:ecc')
@@ -80,12 +89,182 @@ class EccClient(object):
 
     def __getattr__(self, item):
         if item in self.operations:
-            return getattr(self.service, item)
+            operation = getattr(self.service, item)
+
+            def timed_operation(*args, **kwargs):
+                with metrics.SOAP_CALL_DURATION.time(host=self.host, operation=item), \
+                        tracing.span(item, TraceSpan.SOAP, target=self.host):
+                    return operation(*args, **kwargs)
+
+            return timed_operation
 
         else:
             raise AttributeError('EccClient has no attribute {}'.format(item))
 
 
+#: The result of a GetState request. The fields have the same names as in the SOAP response.
+StateResult = namedtuple('StateResult', ['ErrorCode', 'ErrorMessage', 'State', 'Transition'])
+
+
+class EccStateClient(object):
+    """A lightweight client for the ECC server's GetState operation.
+
+    The state of every ECC server is polled every few seconds, and building a request and parsing the response
+    with zeep is much more expensive than the request itself. The GetState request never changes, though, so
+    this class sends a prebuilt SOAP envelope and pulls the fields out of the response with a streaming
+    parser. HTTP connections are kept open and shared between instances in the same process.
+
+    The full :class:`EccClient` should still be used for all other operations.
+
+    Parameters
+    ----------
+    ecc_url : str
+        The full URL of the ECC server (i.e. "http://{address}:{port}").
+    timeout : float, optional
+        The socket timeout, in seconds.
+
+    """
+
+    #: The body of the GetState request.
+    request_body = (b'<?xml version="1.0" encoding="utf-8"?>\n'
+                    b'<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/">'
+                    b'<soap-env:Body><GetState xmlns="urn:ecc"/></soap-env:Body></soap-env:Envelope>')
+
+    #: The HTTP headers sent with the request.
+    request_headers = {
+        'Content-Type': 'text/xml; charset=utf-8',
+        'SOAPAction': '""',
+        'Connection': 'keep-alive',
+    }
+
+    #: The response fields to look for.
+    fields = StateResult._fields
+
+    #: Idle connections, keyed by (host, port). A connection is removed while it is in use.
+    _connections = {}
+
+    def __init__(self, ecc_url, timeout=5):
+        url = urlsplit(ecc_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.path = url.path or '/'
+        self.timeout = timeout
+
+    def _get_connection(self):
+        """Take an idle connection from the pool, or open a new one.
+
+        Returns
+        -------
+        conn : HTTPConnection
+            The connection.
+        reused : bool
+            Whether the connection came from the pool.
+
+        """
+        conn = self._connections.pop((self.host, self.port), None)
+        if conn is not None:
+            return conn, True
+        return HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+    def _release_connection(self, conn):
+        """Return a connection to the pool, closing any other idle connection to the same server."""
+        old_conn = self._connections.pop((self.host, self.port), None)
+        if old_conn is not None:
+            old_conn.close()
+        self._connections[(self.host, self.port)] = conn
+
+    @classmethod
+    def parse_response(cls, response):
+        """Parse the fields out of a GetState response.
+
+        Parameters
+        ----------
+        response : file-like
+            The response body. It is read in chunks, and it is always read to the end so that the connection
+            can be reused.
+
+        Returns
+        -------
+        StateResult
+            The values of the response fields, as strings.
+
+        Raises
+        ------
+        ECCError
+            If the response is a SOAP fault or is missing a field.
+
+        """
+        parser = ET.XMLPullParser(events=('end',))
+        values = {}
+        fault = None
+        done = False
+
+        while True:
+            chunk = response.read(4096)
+            if not chunk:
+                break
+            if done:
+                continue  # Drain the rest of the response
+
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                tag = elem.tag.rpartition('}')[2]
+                if tag in cls.fields:
+                    values[tag] = elem.text or ''
+                elif tag == 'faultstring':
+                    fault = elem.text or ''
+
+            done = fault is not None or len(values) == len(cls.fields)
+
+        if fault is not None:
+            raise ECCError('SOAP fault: {}'.format(fault))
+
+        missing = [f for f in cls.fields if f not in values]
+        if missing:
+            raise ECCError('GetState response was missing {}'.format(', '.join(missing)))
+
+        return StateResult(**values)
+
+    def GetState(self):
+        """Fetch the current state of the ECC state machine.
+
+        A pooled connection may have been closed by the server since it was last used. If a request on a pooled
+        connection fails, it is retried once on a new connection.
+
+        Returns
+        -------
+        StateResult
+            The response fields, as strings, like the object returned by :class:`EccClient`.
+
+        """
+        host = '{}:{}'.format(self.host, self.port)
+        with metrics.SOAP_CALL_DURATION.time(host=host, operation='GetState'), \
+                tracing.span('GetState', TraceSpan.SOAP, target=host):
+            can_retry = True
+            while True:
+                conn, reused = self._get_connection()
+                try:
+                    conn.request('POST', self.path, body=self.request_body, headers=self.request_headers)
+                    response = conn.getresponse()
+                    result = self.parse_response(response)
+                except (HTTPException, OSError):
+                    conn.close()
+                    if reused and can_retry:
+                        can_retry = False
+                        continue
+                    raise
+                except Exception:
+                    conn.close()
+                    raise
+
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._release_connection(conn)
+
+                return result
+
+
 class ConfigId(models.Model):
     """Represents a configuration file set as seen by the ECC servers.
 
@@ -252,6 +431,21 @@ class ECCServer(models.Model):
     #: A dictionary mapping state constants back to state names
     STATE_DICT = dict(STATE_CHOICES)
 
+    #: The name of the SOAP operation that changes the state, keyed by the current and target states
+    TRANSITIONS = {
+        (IDLE, DESCRIBED): 'Describe',
+        (DESCRIBED, IDLE): 'Undo',
+
+        (DESCRIBED, PREPARED): 'Prepare',
+        (PREPARED, DESCRIBED): 'Undo',
+
+        (PREPARED, READY): 'Configure',
+        (READY, PREPARED): 'Breakup',
+
+        (READY, RUNNING): 'Start',
+        (RUNNING, READY): 'Stop',
+    }
+
     #: The state of the ECC server with respect to the CoBo state machine. This must be one of the choices defined by
     #: the constants attached to this class.
     state = models.IntegerField(default=IDLE, choices=STATE_CHOICES)
@@ -259,6 +453,10 @@ class ECCServer(models.Model):
     #: Whether the ECC server is currently changing state
     is_transitioning = models.BooleanField(default=False)
 
+    #: When :attr:`is_transitioning` was set, or None if the ECC server isn't transitioning. This is kept up to date
+    #: by :meth:`save`, and is used to find transitions that never finished (see :mod:`~attpcdaq.daq.watchdog`).
+    transition_started_time = models.DateTimeField(null=True, blank=True)
+
     #: Whether the ECC server process is currently available and responding to requests
     is_online = models.BooleanField(default=False)
 
@@ -269,6 +467,20 @@ class ECCServer(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Override of save to record when the ECC server started transitioning."""
+        if not self.is_transitioning:
+            self.transition_started_time = None
+        elif self.transition_started_time is None:
+            self.transition_started_time = datetime.now()
+            PollCycle.objects.filter(poll='ecc_state').delete()  # So the state poll checks the server soon
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'is_transitioning' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'transition_started_time'}
+
+        super().save(*args, **kwargs)
+
     @property
     def ecc_url(self):
         """Get the URL of the ECC server as a string.
@@ -307,6 +519,23 @@ class ECCServer(models.Model):
         """
         return EccClient(self.ecc_url)
 
+    def _get_state_client(self):
+        """Creates a client for polling the state of the ECC server.
+
+        This is an :class:`EccStateClient` unless the ``ECC_FAST_GET_STATE`` setting is False, in which case the
+        full SOAP client from :meth:`_get_soap_client` is used.
+
+        Returns
+        -------
+        EccStateClient or EccClient
+            A client with a ``GetState`` method.
+
+        """
+        if getattr(settings, 'ECC_FAST_GET_STATE', True):
+            return EccStateClient(self.ecc_url)
+        else:
+            return self._get_soap_client()
+
     @classmethod
     def _get_transition(cls, client, current_state, target_state):
         """Look up the appropriate SOAP request to change the ECC server from one state to another.
@@ -337,26 +566,12 @@ class ECCServer(models.Model):
         if target_state == current_state:
             raise ValueError('No transition needed.')
 
-        transitions = {
-            (cls.IDLE, cls.DESCRIBED): client.Describe,
-            (cls.DESCRIBED, cls.IDLE): client.Undo,
-
-            (cls.DESCRIBED, cls.PREPARED): client.Prepare,
-            (cls.PREPARED, cls.DESCRIBED): client.Undo,
-
-            (cls.PREPARED, cls.READY): client.Configure,
-            (cls.READY, cls.PREPARED): client.Breakup,
-
-            (cls.READY, cls.RUNNING): client.Start,
-            (cls.RUNNING, cls.READY): client.Stop,
-        }
-
         try:
-            trans = transitions[(current_state, target_state)]
+            name = cls.TRANSITIONS[(current_state, target_state)]
         except KeyError:
             raise ValueError('Can only transition one step at a time.') from None
 
-        return trans
+        return getattr(client, name)
 
     def get_data_link_xml_from_clients(self):
         """Get an XML representation of the data link for this source.
@@ -400,7 +615,8 @@ class ECCServer(models.Model):
 
         """
         client = self._get_soap_client()
-        result = client.GetConfigIDs()
+        with host_slot(ecc_host(self), 'GetConfigIDs'):
+            result = client.GetConfigIDs()
         fetch_time = datetime.now()
 
         config_list_xml = ET.fromstring(result.Text)
@@ -414,34 +630,74 @@ class ECCServer(models.Model):
 
         self.configid_set.filter(last_fetched__lt=fetch_time).delete()
 
-    def refresh_state(self):
+    def refresh_state(self, priority=None):
         """Gets the current state of the data source from the ECC server and updates the database.
 
         This will update the :attr:`~ECCServer.state` and :attr:`~ECCServer.is_transitioning` fields of the
-        :class:`ECCServer`.
+        :class:`ECCServer`. If this shows that a transition has finished, a :class:`TransitionEvent` is recorded
+        for it, and any open transition spans for this server are closed (see :mod:`~attpcdaq.daq.tracing`).
+
+        Parameters
+        ----------
+        priority : int, optional
+            The priority of the request for a slot on the ECC server (see :mod:`~attpcdaq.daq.hostlimits`). The
+            default is :attr:`HostSlot.POLL`.
 
         Raises
         ------
         ECCError
             If the return code from the ECC server is nonzero.
+        HostBusyError
+            If the ECC server was too busy with other requests.
         """
-        client = self._get_soap_client()
-        result = client.GetState()
+        if priority is None:
+            priority = HostSlot.POLL
+
+        client = self._get_state_client()
+        with host_slot(ecc_host(self), 'GetState', priority):
+            result = client.GetState()
+
+        self.update_state(result)
 
+    def update_state(self, result):
+        """Update the database from the result of a GetState request.
+
+        This is the second half of :meth:`refresh_state`, for callers that make the request themselves.
+
+        Parameters
+        ----------
+        result : object
+            The result of ``GetState``, with the attributes ``ErrorCode``, ``ErrorMessage``, ``State``, and
+            ``Transition``.
+
+        Raises
+        ------
+        ECCError
+            If the return code from the ECC server is nonzero.
+
+        """
         if int(result.ErrorCode) != 0:
             raise ECCError(result.ErrorMessage)
 
+        was_transitioning = self.is_transitioning
+
         self.state = int(result.State)
         self.is_transitioning = int(result.Transition) != 0
         self.save()
 
+        if was_transitioning and not self.is_transitioning:
+            TransitionEvent.record_finished(self)
+            tracing.close_spans(TraceSpan.TRANSITION, self.name)
+
     def change_state(self, target_state):
         """Tells the ECC server to transition the data source to a new state.
 
-        If the request is successful, the :attr:`~ECCServer.is_transitioning` field will be set to True, but the
-        :attr:`~ECCServer.state` field will *not* be updated automatically. To update this,
+        If the request is successful, the :attr:`~ECCServer.is_transitioning` field will be set to True and saved,
+        but the :attr:`~ECCServer.state` field will *not* be updated automatically. To update this,
         :meth:`~ECCServer.refresh_state` should be called to see if the transition has completed.
 
+        The request is recorded as a :class:`TransitionEvent`.
+
         Parameters
         ----------
         target_state : int
@@ -465,15 +721,32 @@ class ECCServer(models.Model):
 
         # Get the function corresponding to the requested transition
         transition = self._get_transition(client, self.state, target_state)
+        event = TransitionEvent(
+            ecc_server=self,
+            ecc_server_name=self.name,
+            transition=self.TRANSITIONS[(self.state, target_state)],
+            from_state=self.state,
+            to_state=target_state,
+        )
 
         # Finally, perform the transition
-        res = transition(config_xml, datalink_xml)
+        try:
+            with host_slot(ecc_host(self), event.transition, HostSlot.TRANSITION):
+                res = transition(config_xml, datalink_xml)
+        except Exception:
+            event.record(TransitionEvent.FAILED)
+            raise
 
         if int(res.ErrorCode) != 0:
             self.is_transitioning = False
+            event.record(TransitionEvent.FAILED)
             raise ECCError(res.ErrorMessage)
         else:
             self.is_transitioning = True
+            self.save(update_fields=['is_transitioning'])
+            event.record(TransitionEvent.REQUESTED)
+            tracing.open_span('Transition to {}'.format(self.STATE_DICT.get(target_state, target_state)),
+                              TraceSpan.TRANSITION, target=self.name)
 
 
 class DataRouter(models.Model):
@@ -526,6 +799,27 @@ class DataRouter(models.Model):
     #: Whether the directory where the data router is running contains any GRAW files.
     staging_directory_is_clean = models.BooleanField(default=True)
 
+    #: The total size of the GRAW files in the staging directory at the last sample, in bytes
+    staging_bytes = models.BigIntegerField(default=0)
+
+    #: When the size of the staging directory was last sampled
+    last_sample_time = models.DateTimeField(null=True, blank=True)
+
+    #: When the staging directory was last seen to grow
+    last_growth_time = models.DateTimeField(null=True, blank=True)
+
+    #: The rate at which data was written between the last two samples, in bytes per second
+    data_rate = models.FloatField(default=0)
+
+    #: Whether no data has been written for longer than the ``DATA_RATE_STALL_SECONDS`` setting during a run
+    is_stalled = models.BooleanField(default=False)
+
+    #: The size of the filesystem holding the staging directory, in bytes
+    disk_total_bytes = models.BigIntegerField(null=True, blank=True)
+
+    #: The free space on the filesystem holding the staging directory, in bytes
+    disk_free_bytes = models.BigIntegerField(null=True, blank=True)
+
     class Meta:
         ordering = ('name',)
         unique_together = ('name', 'experiment')
@@ -533,6 +827,738 @@ class DataRouter(models.Model):
     def __str__(self):
         return self.name
 
+    def record_data_sample(self, total_bytes, sample_time=None):
+        """Record a sample of the size of the staging directory and update the data rate.
+
+        If :attr:`last_sample_time` is None, this sample only sets the baseline. Later samples store the growth
+        since the previous sample as a :class:`DataRateSample`. If the directory shrinks, e.g. because the files
+        were organized, the new size is counted as the growth.
+
+        If the directory hasn't grown for longer than ``settings.DATA_RATE_STALL_SECONDS``, the router is marked as
+        stalled and a warning is logged. Set that setting to None to disable this alarm.
+
+        Only the fields set here are saved, since the status check may be updating the same router at the same time.
+
+        Parameters
+        ----------
+        total_bytes : int
+            The total size of the GRAW files in the staging directory.
+        sample_time : datetime, optional
+            When the sample was taken. Defaults to the current time.
+
+        """
+        if sample_time is None:
+            sample_time = datetime.now()
+
+        if self.last_sample_time is None:
+            self.data_rate = 0
+            self.last_growth_time = sample_time
+        else:
+            interval = (sample_time - self.last_sample_time).total_seconds()
+            growth = total_bytes - self.staging_bytes
+            if growth < 0:
+                growth = total_bytes
+
+            if interval > 0:
+                self.data_rate = growth / interval
+                DataRateSample.objects.create(data_router=self, time=sample_time, interval=interval,
+                                              bytes_written=growth)
+
+            if growth > 0:
+                self.last_growth_time = sample_time
+
+        stall_seconds = getattr(settings, 'DATA_RATE_STALL_SECONDS', None)
+        was_stalled = self.is_stalled
+        self.is_stalled = (stall_seconds is not None and
+                           (sample_time - self.last_growth_time).total_seconds() > stall_seconds)
+        if self.is_stalled and not was_stalled:
+            logger.warning('Data router %s has not written any data in %d seconds', self.name, stall_seconds)
+
+        self.staging_bytes = total_bytes
+        self.last_sample_time = sample_time
+        self.save(update_fields=['staging_bytes', 'last_sample_time', 'data_rate', 'last_growth_time', 'is_stalled'])
+
+    @property
+    def time_to_full(self):
+        """The time until the staging volume fills up at the current data rate.
+
+        Returns
+        -------
+        datetime.timedelta or None
+            The estimated time until the disk is full, or None if the free space is unknown or no data is
+            being written.
+
+        """
+        if self.disk_free_bytes is None or self.data_rate <= 0:
+            return None
+        return timedelta(seconds=self.disk_free_bytes / self.data_rate)
+
+    def record_disk_usage(self, total_bytes, free_bytes, sample_time=None):
+        """Record the size and free space of the staging volume.
+
+        The values are stored on this object and as a :class:`DiskUsageSample`. A warning is logged when the
+        :attr:`time_to_full` first drops below ``settings.DISK_FULL_WARNING_TIME``.
+
+        Parameters
+        ----------
+        total_bytes : int
+            The size of the filesystem, in bytes.
+        free_bytes : int
+            The free space on the filesystem, in bytes.
+        sample_time : datetime, optional
+            When the values were measured. Defaults to the current time.
+
+        """
+        if sample_time is None:
+            sample_time = datetime.now()
+
+        warning_time = getattr(settings, 'DISK_FULL_WARNING_TIME', None)
+        old_time_to_full = self.time_to_full
+
+        self.disk_total_bytes = total_bytes
+        self.disk_free_bytes = free_bytes
+        self.save(update_fields=['disk_total_bytes', 'disk_free_bytes'])
+
+        DiskUsageSample.objects.create(data_router=self, time=sample_time, total_bytes=total_bytes,
+                                       free_bytes=free_bytes)
+
+        new_time_to_full = self.time_to_full
+        if warning_time is not None and new_time_to_full is not None and new_time_to_full < warning_time:
+            if old_time_to_full is None or old_time_to_full >= warning_time:
+                logger.warning('Disk on data router %s will be full in about %d minutes',
+                               self.name, new_time_to_full.total_seconds() // 60)
+
+    def forecast_run_bytes(self, run_length):
+        """Estimate how much data this data router will write in a run.
+
+        The estimate uses the average data rate of this router in the most recent finished run, as found from
+        the :class:`RunFile` objects recorded for that run.
+
+        Parameters
+        ----------
+        run_length : datetime.timedelta
+            The length of the run.
+
+        Returns
+        -------
+        float or None
+            The projected number of bytes, or None if there is no previous run to base the estimate on.
+
+        """
+        last_run = (RunMetadata.objects.filter(experiment=self.experiment, stop_datetime__isnull=False)
+                                       .order_by('-run_number').first())
+        if last_run is None:
+            return None
+
+        duration = last_run.duration.total_seconds()
+        written = last_run.files.filter(data_router=self).aggregate(total=Sum('size'))['total']
+        if written is None or duration <= 0:
+            return None
+
+        return written / duration * run_length.total_seconds()
+
+
+class DiskUsageSample(models.Model):
+    """The size and free space of a data router's staging volume at some time.
+
+    See :meth:`DataRouter.record_disk_usage`.
+
+    """
+    #: The data router whose disk was checked
+    data_router = models.ForeignKey(DataRouter, on_delete=models.CASCADE)
+
+    #: When the disk was checked
+    time = models.DateTimeField(db_index=True)
+
+    #: The size of the filesystem, in bytes
+    total_bytes = models.BigIntegerField()
+
+    #: The free space on the filesystem, in bytes
+    free_bytes = models.BigIntegerField()
+
+    class Meta:
+        ordering = ('time',)
+
+    def __str__(self):
+        return '{} at {}'.format(self.data_router.name, self.time)
+
+
+class DataRateSample(models.Model):
+    """The amount of data written by a data router between two samples of its staging directory.
+
+    See :meth:`DataRouter.record_data_sample`.
+
+    """
+    #: The data router that wrote the data
+    data_router = models.ForeignKey(DataRouter, on_delete=models.CASCADE)
+
+    #: When the sample was taken
+    time = models.DateTimeField(db_index=True)
+
+    #: The time since the previous sample, in seconds
+    interval = models.FloatField()
+
+    #: The number of bytes written since the previous sample
+    bytes_written = models.BigIntegerField()
+
+    class Meta:
+        ordering = ('time',)
+
+    def __str__(self):
+        return '{} at {}'.format(self.data_router.name, self.time)
+
+    @property
+    def rate(self):
+        """The average data rate over the interval, in bytes per second."""
+        return self.bytes_written / self.interval
+
+
+class TransitionEvent(models.Model):
+    """A record of a transition of an ECC server being requested, failing, or finishing.
+
+    A "requested" event is recorded by :meth:`ECCServer.change_state` when the ECC server accepts a transition, and a
+    "failed" event is recorded if it doesn't. When :meth:`ECCServer.refresh_state` sees that the server has stopped
+    transitioning, a "finished" event is recorded along with the time since it was requested, or a "failed" event if
+    the server didn't reach the target state. Since the state is polled, this latency is only as precise as the
+    polling interval.
+
+    These records are never changed or deleted by the app. They are summarized by the functions in
+    :mod:`attpcdaq.daq.transitions`.
+
+    """
+    #: The ECC server, or None if it has since been deleted
+    ecc_server = models.ForeignKey('ECCServer', on_delete=models.SET_NULL, null=True, blank=True)
+
+    #: The name of the ECC server when the event was recorded
+    ecc_server_name = models.CharField(max_length=50)
+
+    #: Constant for a transition that the ECC server accepted
+    REQUESTED = 'requested'
+
+    #: Constant for a transition that the ECC server refused, that couldn't be requested, or that ended in the wrong
+    #: state
+    FAILED = 'failed'
+
+    #: Constant for a transition that the ECC server finished
+    FINISHED = 'finished'
+
+    event_choices = (
+        (REQUESTED, 'Requested'),
+        (FAILED, 'Failed'),
+        (FINISHED, 'Finished'),
+    )
+
+    #: What happened. Use one of the constants attached to this class.
+    event = models.CharField(max_length=9, choices=event_choices)
+
+    #: The name of the SOAP operation, like "Configure"
+    transition = models.CharField(max_length=10)
+
+    #: The state of the ECC server before the transition
+    from_state = models.IntegerField(choices=ECCServer.STATE_CHOICES)
+
+    #: The state the transition leads to
+    to_state = models.IntegerField(choices=ECCServer.STATE_CHOICES)
+
+    #: When the event happened
+    time = models.DateTimeField(db_index=True)
+
+    #: For a finished transition, the time since it was requested, in seconds. This is None for a failed one.
+    latency = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('time',)
+
+    def __str__(self):
+        return '{} {} {}'.format(self.ecc_server_name, self.transition, self.event)
+
+    def record(self, event):
+        """Save this as a new event of the given type, happening now."""
+        self.pk = None
+        self.event = event
+        self.time = datetime.now()
+        try:
+            self.save()
+        except Exception:
+            logger.exception('Failed to record %s transition event for %s', event, self.ecc_server_name)
+
+    @classmethod
+    def record_finished(cls, ecc_server):
+        """Record that the ECC server has stopped the last transition requested from it.
+
+        If the server is now in the state the transition leads to, the transition is recorded as finished, with its
+        latency. Otherwise, such as when the server aborted the transition and stayed in its old state or went to the
+        error state, it is recorded as failed, without a latency.
+
+        Nothing is recorded if the latest event for the server isn't a request, such as when the transition was
+        started outside of this app.
+
+        Parameters
+        ----------
+        ecc_server : ECCServer
+            The ECC server.
+
+        """
+        latest = cls.objects.filter(ecc_server=ecc_server).order_by('-time').first()
+        if latest is None or latest.event != cls.REQUESTED:
+            return
+
+        event = cls(
+            ecc_server=ecc_server,
+            ecc_server_name=ecc_server.name,
+            transition=latest.transition,
+            from_state=latest.from_state,
+            to_state=latest.to_state,
+        )
+        if ecc_server.state != latest.to_state:
+            logger.warning('%s ended the %s transition in state %s', ecc_server.name, latest.transition,
+                           ecc_server.get_state_display())
+            event.record(cls.FAILED)
+            return
+
+        event.latency = (datetime.now() - latest.time).total_seconds()
+        event.record(cls.FINISHED)
+
+
+class TransitionIncident(models.Model):
+    """A transition of an ECC server that didn't finish within its timeout.
+
+    These are recorded by :func:`~attpcdaq.daq.watchdog.reconcile_transitions`, which asks the ECC server for its
+    real state. An incident stays open while the server reports that it is still transitioning, and is closed when
+    the transitioning flag is cleared.
+
+    """
+    #: The ECC server, or None if it has since been deleted
+    ecc_server = models.ForeignKey('ECCServer', on_delete=models.SET_NULL, null=True, blank=True)
+
+    #: The name of the ECC server when the incident was recorded
+    ecc_server_name = models.CharField(max_length=50)
+
+    #: The name of the transition, like "Configure", or an empty string if no request was recorded for it
+    transition = models.CharField(max_length=10, blank=True)
+
+    #: Constant for a flag that was stale: the ECC server had already stopped transitioning
+    CLEARED = 'cleared'
+
+    #: Constant for a flag that was cleared because the ECC server couldn't be reached
+    UNREACHABLE = 'unreachable'
+
+    #: Constant for a transition that the ECC server still reports as running after its timeout
+    ESCALATED = 'escalated'
+
+    resolution_choices = (
+        (CLEARED, 'Cleared'),
+        (UNREACHABLE, 'Unreachable'),
+        (ESCALATED, 'Escalated'),
+    )
+
+    #: What the watchdog did about it. Use one of the constants attached to this class.
+    resolution = models.CharField(max_length=11, choices=resolution_choices)
+
+    #: When the ECC server started transitioning
+    started_time = models.DateTimeField()
+
+    #: When the watchdog found the transition
+    detected_time = models.DateTimeField(db_index=True)
+
+    #: When the transitioning flag was cleared, or None while the incident is open
+    resolved_time = models.DateTimeField(null=True, blank=True)
+
+    #: The time the transition held up the system, in seconds. This runs from the end of the timeout until the flag
+    #: was cleared, and is updated by each check while the incident is open.
+    time_lost = models.FloatField(default=0)
+
+    #: What the ECC server reported, or the error from asking it
+    message = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ('-detected_time',)
+
+    def __str__(self):
+        return '{} {} {}'.format(self.ecc_server_name, self.transition or 'transition', self.resolution)
+
+
+class TaskTiming(models.Model):
+    """The duration and outcome of one run of a Celery task.
+
+    These are recorded by the signal handlers in :mod:`attpcdaq.daq.instrumentation`, and records older than the
+    ``TASK_TIMING_HISTORY`` setting are deleted periodically.
+
+    """
+    #: The name of the task
+    task_name = models.CharField(max_length=200, db_index=True)
+
+    #: Constant for tasks acting on an ECC server
+    ECC_SERVER = 'ecc'
+
+    #: Constant for tasks acting on a data router
+    DATA_ROUTER = 'router'
+
+    target_type_choices = (
+        (ECC_SERVER, 'ECC server'),
+        (DATA_ROUTER, 'Data router'),
+    )
+
+    #: The type of object the task acted on, or None if it didn't act on one ECC server or data router
+    target_type = models.CharField(max_length=6, choices=target_type_choices, null=True, blank=True)
+
+    #: The primary key of the object the task acted on
+    target_pk = models.PositiveIntegerField(null=True, blank=True)
+
+    #: The name of the object the task acted on, as it was when the task ran
+    target_name = models.CharField(max_length=50, null=True, blank=True)
+
+    #: When the task started
+    start_time = models.DateTimeField(db_index=True)
+
+    #: How long the task ran, in seconds
+    duration = models.FloatField()
+
+    #: How long the task waited in the queue before it started, in seconds, if this is known
+    queue_wait = models.FloatField(null=True, blank=True)
+
+    #: The Celery queue the task was taken from, if this is known
+    queue = models.CharField(max_length=50, null=True, blank=True, db_index=True)
+
+    #: Constant for a task that finished normally
+    SUCCESS = 'ok'
+
+    #: Constant for a task that reached its time limit
+    TIMEOUT = 'timeout'
+
+    #: Constant for a task that raised an exception
+    FAILURE = 'fail'
+
+    outcome_choices = (
+        (SUCCESS, 'Success'),
+        (TIMEOUT, 'Time limit exceeded'),
+        (FAILURE, 'Failure'),
+    )
+
+    #: How the task ended. Use one of the constants attached to this class.
+    outcome = models.CharField(max_length=7, choices=outcome_choices)
+
+    class Meta:
+        ordering = ('start_time',)
+
+    def __str__(self):
+        return '{} at {}'.format(self.task_name, self.start_time)
+
+
+class TraceSpan(models.Model):
+    """One timed step in a trace that follows a request through the system.
+
+    A trace is started by a view like :func:`~attpcdaq.daq.views.api.source_change_state_all`, and it is passed on
+    to the Celery tasks that the view sends, then to the SOAP and SSH calls that those tasks make. Each step is
+    recorded as a span, and the spans are linked to their parents to form a tree. See :mod:`attpcdaq.daq.tracing`.
+
+    Spans older than the ``TRACE_HISTORY`` setting are deleted periodically.
+
+    """
+    #: The ID shared by all spans in the trace
+    trace_id = models.CharField(max_length=32, db_index=True)
+
+    #: The ID of this span
+    span_id = models.CharField(max_length=16)
+
+    #: The ID of the span that this one is part of, or None for the root of the trace
+    parent_id = models.CharField(max_length=16, null=True, blank=True)
+
+    #: A description of the step, like the name of the view, task, or SOAP operation
+    name = models.CharField(max_length=200)
+
+    #: Constant for a span covering a web request
+    VIEW = 'view'
+
+    #: Constant for a span covering a Celery task
+    TASK = 'task'
+
+    #: Constant for a span covering a SOAP call to an ECC server
+    SOAP = 'soap'
+
+    #: Constant for a span covering an SSH operation on a DAQ worker
+    SSH = 'ssh'
+
+    #: Constant for a span lasting from a transition request until the ECC server reports that it has finished
+    TRANSITION = 'transition'
+
+    #: Constant for a span where the code is waiting for something else to happen
+    WAIT = 'wait'
+
+    kind_choices = (
+        (VIEW, 'Web request'),
+        (TASK, 'Celery task'),
+        (SOAP, 'SOAP call'),
+        (SSH, 'SSH operation'),
+        (TRANSITION, 'ECC transition'),
+        (WAIT, 'Waiting'),
+    )
+
+    #: The type of step. Use one of the constants attached to this class.
+    kind = models.CharField(max_length=10, choices=kind_choices)
+
+    #: The name of the host, ECC server, or data router that the step acted on, if any
+    target = models.CharField(max_length=100, blank=True)
+
+    #: When the step started
+    start_time = models.DateTimeField(db_index=True)
+
+    #: How long the step took, in seconds, or None if it hasn't finished
+    duration = models.FloatField(null=True, blank=True)
+
+    #: Whether the step raised an exception
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ('start_time',)
+
+    def __str__(self):
+        return '{} at {}'.format(self.name, self.start_time)
+
+
+class HostLock(models.Model):
+    """A row that is locked while a process decides who gets a slot on a remote host.
+
+    See :mod:`attpcdaq.daq.hostlimits`. There is one of these for each host that has been used.
+
+    """
+    #: The host, like ``ssh:10.0.0.1`` or ``ecc:10.0.0.1:8083``
+    host = models.CharField(max_length=100, unique=True)
+
+    #: When a slot on the host was last requested
+    updated_time = models.DateTimeField()
+
+    def __str__(self):
+        return self.host
+
+
+class HostSlot(models.Model):
+    """An operation that is using, or waiting for, one of the slots on a remote host.
+
+    These are created and deleted by :func:`~attpcdaq.daq.hostlimits.host_slot`.
+
+    """
+    #: The host, like ``ssh:10.0.0.1`` or ``ecc:10.0.0.1:8083``
+    host = models.CharField(max_length=100, db_index=True)
+
+    #: A description of the operation, like the name of the SOAP call
+    operation = models.CharField(max_length=100)
+
+    #: Constant for periodic status checks, which give way to everything else
+    POLL = 0
+
+    #: Constant for ordinary operations, like organizing files
+    NORMAL = 1
+
+    #: Constant for the operations that change the state of the system, which go first
+    TRANSITION = 2
+
+    priority_choices = (
+        (POLL, 'Poll'),
+        (NORMAL, 'Normal'),
+        (TRANSITION, 'Transition'),
+    )
+
+    #: The priority of the operation. Use one of the constants attached to this class.
+    priority = models.SmallIntegerField(choices=priority_choices, default=NORMAL)
+
+    #: Whether the operation has its slot. If this is False, it is waiting in the queue.
+    is_running = models.BooleanField(default=False)
+
+    #: When the operation asked for a slot
+    created_time = models.DateTimeField()
+
+    #: When the operation got its slot
+    acquired_time = models.DateTimeField(null=True, blank=True)
+
+    #: When the slot is given up if it hasn't been released, in case the process holding it died
+    expires_time = models.DateTimeField()
+
+    class Meta:
+        ordering = ('host', '-is_running', '-priority', 'pk')
+
+    def __str__(self):
+        return '{} on {}'.format(self.operation, self.host)
+
+
+class PollLease(models.Model):
+    """A periodic status check of one ECC server or data router that has been queued but hasn't finished.
+
+    These are created by :func:`~attpcdaq.daq.pollleases.acquire_poll_leases` when a poll cycle queues its tasks,
+    and deleted when each task finishes. While a lease exists, later cycles of the same poll skip its target.
+
+    """
+    #: The name of the poll, like ``ecc_state``
+    poll = models.CharField(max_length=50)
+
+    #: The primary key of the ECC server or data router being checked
+    target_pk = models.PositiveIntegerField()
+
+    #: A random token identifying the cycle that took the lease, so that a task only releases its own lease
+    token = models.CharField(max_length=32)
+
+    #: When the task was queued
+    created_time = models.DateTimeField()
+
+    #: When the lease is given up if it hasn't been released, in case the task was lost
+    expires_time = models.DateTimeField()
+
+    #: How many later cycles skipped this target because the lease was still held
+    skipped = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('poll', 'target_pk')
+        ordering = ('poll', 'target_pk')
+
+    def __str__(self):
+        return '{} of {}'.format(self.poll, self.target_pk)
+
+
+class PollSchedule(models.Model):
+    """How often the ECC servers and data routers of an experiment are checked.
+
+    Celery beat starts the poll cycles every fraction of a second, and each cycle only checks the targets that are
+    due according to this schedule (see :mod:`attpcdaq.daq.pollschedule`). The intervals below are used while a run
+    is in progress. They are multiplied by :attr:`idle_factor` when no run is in progress, and by
+    :attr:`offline_factor` for a target that has been offline for :attr:`offline_cycles` checks in a row. An ECC
+    server that is changing state is checked every :attr:`transition_interval` seconds. If an experiment has no
+    schedule, the defaults of these fields are used.
+
+    """
+    #: The experiment this schedule is for
+    experiment = models.OneToOneField('Experiment', on_delete=models.CASCADE, related_name='poll_schedule')
+
+    #: The time between checks of each ECC server's state, in seconds
+    state_interval = models.FloatField(default=5, verbose_name='ECC state interval (s)')
+
+    #: The time between checks of whether each ECC server and data router is online, in seconds
+    status_interval = models.FloatField(default=15, verbose_name='online check interval (s)')
+
+    #: The time between samples of each data router's data rate, in seconds
+    data_rate_interval = models.FloatField(default=5, verbose_name='data rate interval (s)')
+
+    #: The time between checks of the state of an ECC server that is changing state, in seconds
+    transition_interval = models.FloatField(default=0.5, verbose_name='transition interval (s)')
+
+    #: The factor by which the intervals are multiplied when no run is in progress
+    idle_factor = models.FloatField(default=6)
+
+    #: The factor by which the intervals are multiplied for a target that has been offline for a while
+    offline_factor = models.FloatField(default=12)
+
+    #: The number of checks in a row that a target must be offline before it is checked less often
+    offline_cycles = models.PositiveIntegerField(default=3)
+
+    #: The longest time between checks of a target, in seconds
+    max_interval = models.FloatField(default=300, verbose_name='maximum interval (s)')
+
+    def __str__(self):
+        return 'Poll schedule for {}'.format(self.experiment)
+
+
+class PollRecord(models.Model):
+    """When a poll last checked a target, and how many times in a row the target was offline.
+
+    These are updated by :func:`~attpcdaq.daq.pollschedule.start_poll_cycle` when it queues the checks.
+
+    """
+    #: The name of the poll, like ``ecc_state``
+    poll = models.CharField(max_length=50)
+
+    #: The primary key of the ECC server or data router
+    target_pk = models.PositiveIntegerField()
+
+    #: When the last check of the target was queued
+    last_time = models.DateTimeField()
+
+    #: The number of checks in a row that were queued while the target was offline
+    offline_cycles = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('poll', 'target_pk')
+        ordering = ('poll', 'target_pk')
+
+    def __str__(self):
+        return '{} of {}'.format(self.poll, self.target_pk)
+
+
+class PollCycle(models.Model):
+    """The earliest time that the next cycle of a poll could find a target due.
+
+    This is set by :func:`~attpcdaq.daq.pollschedule.start_poll_cycle` and read by
+    :func:`~attpcdaq.daq.pollschedule.poll_cycle_is_due`, so the cycles in every worker process can be skipped
+    until then with one query. It is deleted when an ECC server starts a transition, so that the state poll checks
+    it quickly.
+
+    """
+    #: The name of the poll, like ``ecc_state``
+    poll = models.CharField(max_length=50, unique=True)
+
+    #: No target of the poll can be due before this time
+    next_time = models.DateTimeField()
+
+    class Meta:
+        ordering = ('poll',)
+
+    def __str__(self):
+        return self.poll
+
+
+class CircuitBreaker(models.Model):
+    """The recent failures of the status checks of one remote endpoint, and whether checks of it are paused.
+
+    These are updated by :func:`~attpcdaq.daq.circuitbreakers.circuit_breaker`. While the breaker is closed, every
+    check is made. After :attr:`failures` reaches the ``CIRCUIT_BREAKER_THRESHOLD`` setting, the breaker opens, and
+    checks are refused without contacting the endpoint until :attr:`next_probe_time`. The first check after that is
+    let through as a probe. The breaker closes again if the probe succeeds, and otherwise waits twice as long
+    before the next probe.
+
+    """
+    #: The endpoint, like ``ssh:10.0.0.1`` or ``ecc:10.0.0.1:8083``
+    endpoint = models.CharField(max_length=100, unique=True)
+
+    #: Constant for a breaker that lets every check through
+    CLOSED = 0
+
+    #: Constant for a breaker that refuses checks until the next probe
+    OPEN = 1
+
+    #: Constant for a breaker whose probe is running
+    HALF_OPEN = 2
+
+    state_choices = (
+        (CLOSED, 'Closed'),
+        (OPEN, 'Open'),
+        (HALF_OPEN, 'Half-open'),
+    )
+
+    #: The state of the breaker. Use one of the constants attached to this class.
+    state = models.SmallIntegerField(choices=state_choices, default=CLOSED)
+
+    #: The number of checks in a row that failed
+    failures = models.PositiveIntegerField(default=0)
+
+    #: The number of probes that failed since the breaker opened
+    failed_probes = models.PositiveIntegerField(default=0)
+
+    #: When the breaker opened
+    opened_time = models.DateTimeField(null=True, blank=True)
+
+    #: When the next probe is let through
+    next_probe_time = models.DateTimeField(null=True, blank=True)
+
+    #: When the last check failed
+    last_failure_time = models.DateTimeField(null=True, blank=True)
+
+    #: The error from the last failed check
+    last_error = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ('endpoint',)
+
+    def __str__(self):
+        return self.endpoint
+
 
 class DataSource(models.Model):
     """A source of data, probably a CoBo or a MuTAnT.
@@ -706,6 +1732,37 @@ class Experiment(models.Model):
             config_name=config_names_str,
         )
 
+    def check_disk_space(self, run_length=None):
+        """Check whether each data router has enough free space for a run.
+
+        The amount of data each router will write is estimated using :meth:`DataRouter.forecast_run_bytes`.
+        A warning is logged for each router that would run out of space.
+
+        Parameters
+        ----------
+        run_length : datetime.timedelta, optional
+            The projected length of the run. Defaults to ``settings.EXPECTED_RUN_LENGTH``.
+
+        Returns
+        -------
+        list[DataRouter]
+            The data routers that are projected to run out of space.
+
+        """
+        if run_length is None:
+            run_length = getattr(settings, 'EXPECTED_RUN_LENGTH', timedelta(hours=1))
+
+        short_routers = []
+        for router in self.datarouter_set.exclude(disk_free_bytes__isnull=True):
+            projected = router.forecast_run_bytes(run_length)
+            if projected is not None and projected > router.disk_free_bytes:
+                logger.warning('Data router %s may run out of disk space: a run of %s would write about %.1f GB, '
+                               'but only %.1f GB is free', router.name, run_length, projected / 1e9,
+                               router.disk_free_bytes / 1e9)
+                short_routers.append(router)
+
+        return short_routers
+
     def stop_run(self):
         """Stops the current run.
 
@@ -816,6 +1873,217 @@ class RunMetadata(models.Model):
         return '{:02d}:{:02d}:{:02d}'.format(h, m, s)
 
 
+class RunFile(models.Model):
+    """A GRAW file written during a run.
+
+    These are recorded in bulk when the files are organized at the end of each run, so the amount of data
+    written by a run can be found without contacting the data routers.
+
+    """
+    #: The run that the file belongs to
+    run = models.ForeignKey(RunMetadata, on_delete=models.CASCADE, related_name='files')
+
+    #: The data router that wrote the file
+    data_router = models.ForeignKey(DataRouter, on_delete=models.SET_NULL, null=True, blank=True)
+
+    #: The full path to the file on the data router's computer
+    path = models.CharField(max_length=500)
+
+    #: The size of the file, in bytes
+    size = models.BigIntegerField()
+
+    #: When the file was last modified
+    mtime = models.DateTimeField(verbose_name='modification time')
+
+    #: The hex digest of the file's contents, if it has been computed
+    checksum = models.CharField(max_length=128, null=True, blank=True)
+
+    #: The hash algorithm used to compute :attr:`checksum`
+    checksum_algorithm = models.CharField(max_length=10, null=True, blank=True)
+
+    class Meta:
+        ordering = ('run', 'path')
+
+    def __str__(self):
+        return self.path
+
+
+class RunSequence(models.Model):
+    """A policy for ending runs automatically and starting the next one.
+
+    While a sequence is active, :func:`~attpcdaq.daq.tasks.run_sequencer_task` checks the current run against the
+    policy, and when the run has reached its limit, it is rolled over to the next run by
+    :func:`~attpcdaq.daq.tasks.run_sequence_boundary_task`. Each rollover is recorded as a :class:`RunBoundary`.
+
+    The state of the sequence is kept here, so a sequence carries on if the web app or the Celery workers are
+    restarted. Setting :attr:`state` to :attr:`CANCELLED` stops the sequence without stopping the current run.
+
+    """
+    #: The experiment whose runs are sequenced
+    experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE)
+
+    #: End each run once it has lasted this long
+    max_duration = models.DurationField(null=True, blank=True, verbose_name='maximum run duration')
+
+    #: End each run once the staging directory of any data router holds this many bytes
+    max_bytes = models.BigIntegerField(null=True, blank=True, verbose_name='maximum bytes per data router')
+
+    #: The number of runs to record, including the one in progress when the sequence started. After the last run,
+    #: the DAQ is stopped. If this is None, the sequence continues until it is cancelled.
+    run_count = models.PositiveIntegerField(null=True, blank=True, verbose_name='number of runs')
+
+    #: Constant for a sequence that is running
+    ACTIVE = 'active'
+
+    #: Constant for a sequence that recorded all of its runs
+    FINISHED = 'finished'
+
+    #: Constant for a sequence that was cancelled, or whose run was stopped by hand
+    CANCELLED = 'cancelled'
+
+    #: Constant for a sequence that stopped because a rollover failed
+    FAILED = 'failed'
+
+    state_choices = (
+        (ACTIVE, 'Active'),
+        (FINISHED, 'Finished'),
+        (CANCELLED, 'Cancelled'),
+        (FAILED, 'Failed'),
+    )
+
+    #: The state of the sequence. Use one of the constants attached to this class.
+    state = models.CharField(max_length=9, choices=state_choices, default=ACTIVE)
+
+    #: The number of runs that have been ended by the sequence
+    runs_completed = models.PositiveIntegerField(default=0)
+
+    #: When the sequence was created
+    created_time = models.DateTimeField(default=datetime.now)
+
+    #: When the sequence finished, failed, or was cancelled
+    finished_time = models.DateTimeField(null=True, blank=True)
+
+    #: When the rollover in progress was started, or None if there isn't one
+    rollover_started_time = models.DateTimeField(null=True, blank=True)
+
+    #: Why the sequence ended, if it didn't finish normally
+    message = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        ordering = ('-created_time',)
+
+    def __str__(self):
+        return '{} run sequence {}'.format(self.experiment.name, self.pk)
+
+    @property
+    def is_last_run(self):
+        """Whether the run in progress is the last one in the sequence."""
+        return self.run_count is not None and self.runs_completed + 1 >= self.run_count
+
+    def find_boundary(self, run, data_routers, now=None):
+        """Check whether a run has reached a limit of this sequence.
+
+        The data routers' :attr:`~DataRouter.staging_bytes` are only used if they were sampled after the run started,
+        since the staging directory may not have been emptied before that.
+
+        Parameters
+        ----------
+        run : RunMetadata
+            The run in progress.
+        data_routers : iterable of DataRouter
+            The data routers of the experiment.
+        now : datetime, optional
+            The current time.
+
+        Returns
+        -------
+        tuple(str, datetime) or None
+            The reason for ending the run (one of the constants on :class:`RunBoundary`) and the time when it
+            should have ended, or None if the run should continue.
+
+        """
+        if now is None:
+            now = datetime.now()
+
+        if self.max_duration is not None:
+            planned_time = run.start_datetime + self.max_duration
+            if planned_time <= now:
+                return RunBoundary.DURATION, planned_time
+
+        if self.max_bytes is not None:
+            for router in data_routers:
+                sampled_during_run = router.last_sample_time is not None and \
+                    router.last_sample_time >= run.start_datetime
+                if sampled_during_run and router.staging_bytes >= self.max_bytes:
+                    return RunBoundary.BYTES, router.last_sample_time
+
+        return None
+
+
+class RunBoundary(models.Model):
+    """The end of one run in a :class:`RunSequence` and the start of the next.
+
+    The planned time is when the run reached the limit of the sequence, and the other times are when the run actually
+    stopped and the next one started. The difference shows how long the sequencer took to react and how much beam
+    time was lost to the rollover.
+
+    """
+    #: The sequence that ended the run
+    sequence = models.ForeignKey(RunSequence, on_delete=models.CASCADE, related_name='boundaries')
+
+    #: The run that was ended
+    run = models.ForeignKey(RunMetadata, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    #: The run that was started, if any
+    next_run = models.ForeignKey(RunMetadata, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    #: Constant for a run that reached the maximum duration
+    DURATION = 'duration'
+
+    #: Constant for a run that reached the maximum size
+    BYTES = 'bytes'
+
+    reason_choices = (
+        (DURATION, 'Duration'),
+        (BYTES, 'Size'),
+    )
+
+    #: Which limit the run reached. Use one of the constants attached to this class.
+    reason = models.CharField(max_length=8, choices=reason_choices)
+
+    #: When the run reached the limit
+    planned_time = models.DateTimeField()
+
+    #: When the run was actually stopped
+    stop_time = models.DateTimeField(null=True, blank=True)
+
+    #: When the next run was started
+    start_time = models.DateTimeField(null=True, blank=True)
+
+    #: Whether the rollover failed
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ('planned_time',)
+
+    def __str__(self):
+        return 'Boundary after {}'.format(self.run)
+
+    @property
+    def delay(self):
+        """The time between reaching the limit and stopping the run, or None if the run wasn't stopped."""
+        if self.stop_time is None:
+            return None
+        return self.stop_time - self.planned_time
+
+    @property
+    def dead_time(self):
+        """The time between stopping the run and starting the next one, or None if the next run didn't start."""
+        if self.stop_time is None or self.start_time is None:
+            return None
+        return self.start_time - self.stop_time
+
+
 class Observable(models.Model):
     """Something that can be measured.
 
@@ -909,3 +2177,65 @@ class Measurement(models.Model):
             received_type = type(new_value)
             raise ValueError('New value was of type{:s}. Expected {:s}.'.format(
                 str(received_type), str(self.python_type)))
+
+
+class ConfigBlob(models.Model):
+    """A config file stored once in the content-addressed backup store on a remote host.
+
+    Each unique config file is copied to ``[store_root]/objects/[aa]/[checksum]`` on the ECC server's computer,
+    where ``aa`` is the first two characters of the checksum. This object records that the copy exists, so
+    later backups of an unchanged file only need to compare checksums.
+
+    """
+    #: The SHA-256 hex digest of the file's contents
+    checksum = models.CharField(max_length=64)
+
+    #: The address of the computer where the blob is stored
+    host = models.GenericIPAddressField()
+
+    #: The root directory of the backup store on that computer
+    store_root = models.CharField(max_length=500)
+
+    #: When the blob was first stored
+    created = models.DateTimeField(default=datetime.now)
+
+    class Meta:
+        unique_together = ('checksum', 'host', 'store_root')
+
+    def __str__(self):
+        return self.checksum
+
+    @property
+    def path(self):
+        """The path to the blob on the remote computer."""
+        return blob_path(self.store_root, self.checksum)
+
+
+class ConfigManifestEntry(models.Model):
+    """Records that a config file with a given checksum was used by an ECC server in a run.
+
+    Together, the entries for a run form the manifest of the config files that were backed up for it. Since the
+    checksum is indexed, this can also be used to find every run that used a given config file.
+
+    """
+    #: The run that used the config file
+    run = models.ForeignKey(RunMetadata, on_delete=models.CASCADE, related_name='config_manifest')
+
+    #: The ECC server that used the config file
+    ecc_server = models.ForeignKey(ECCServer, on_delete=models.SET_NULL, null=True, blank=True)
+
+    #: The name of the config file, e.g. ``describe-name.xcfg``
+    file_name = models.CharField(max_length=200)
+
+    #: The SHA-256 hex digest of the file's contents
+    checksum = models.CharField(max_length=64, db_index=True)
+
+    #: The stored copy of the file
+    blob = models.ForeignKey(ConfigBlob, on_delete=models.PROTECT)
+
+    class Meta:
+        verbose_name_plural = 'config manifest entries'
+        ordering = ('run', 'file_name')
+
+    def __str__(self):
+        return '{} - {}'.format(self.file_name, self.checksum)
@@ -0,0 +1,138 @@
+"""Overlap protection for the periodic status checks.
+
+Celery beat starts a poll cycle every few seconds whether or not the last one has finished. If an ECC server or data
+router is slow to answer, its tasks from earlier cycles are still queued or running when the next cycle starts, and
+queueing another one for it only makes the backlog longer. This happens during exactly the outages when fresh state
+matters most.
+
+Each poll cycle therefore takes a lease on every target before it queues the target's task, using
+:func:`acquire_poll_leases`, and the task gives the lease back with :func:`release_poll_lease` when it finishes.
+A cycle skips any target whose lease is still held, and the skip is counted on the lease and in
+:mod:`attpcdaq.metrics`. A lease that isn't released, for example because the worker was killed, expires after the
+``POLL_LEASE_TIMEOUT`` setting.
+
+The leases are :class:`~attpcdaq.daq.models.PollLease` rows, since there is no cache shared between the processes.
+The rows are unique by poll and target, so two cycles running at once can't both take the same lease.
+
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import F
+
+from .models import PollLease, ECCServer, DataRouter
+from .. import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: The kind of object checked by each poll
+POLL_TARGETS = {
+    'ecc_state': ECCServer,
+    'ecc_online': ECCServer,
+    'data_router_status': DataRouter,
+    'data_rate': DataRouter,
+}
+
+
+def acquire_poll_leases(poll, pks, lease=None):
+    """Take a lease on each target of a poll cycle that isn't still being checked by an earlier cycle.
+
+    Parameters
+    ----------
+    poll : str
+        The name of the poll, like ``ecc_state``.
+    pks : iterable of int
+        The primary keys of the targets.
+    lease : float, optional
+        How long the leases last if they aren't released, in seconds. Defaults to the ``POLL_LEASE_TIMEOUT``
+        setting.
+
+    Returns
+    -------
+    token : str
+        The token of the new leases. Pass this to the tasks so they can release their leases.
+    acquired : list[int]
+        The primary keys of the targets that were leased, in the order given. The tasks should only be queued for
+        these.
+
+    """
+    pks = list(pks)
+    if lease is None:
+        lease = getattr(settings, 'POLL_LEASE_TIMEOUT', 60)
+
+    now = datetime.now()
+    token = uuid.uuid4().hex
+    leases = PollLease.objects.filter(poll=poll)
+
+    leases.filter(expires_time__lt=now).delete()
+    PollLease.objects.bulk_create([PollLease(poll=poll, target_pk=pk, token=token, created_time=now,
+                                             expires_time=now + timedelta(seconds=lease)) for pk in pks],
+                                  ignore_conflicts=True)
+
+    leased = set(leases.filter(token=token).values_list('target_pk', flat=True))
+    acquired = [pk for pk in pks if pk in leased]
+
+    skipped = [pk for pk in pks if pk not in leased]
+    if skipped:
+        leases.filter(target_pk__in=skipped).update(skipped=F('skipped') + 1)
+        metrics.POLL_TARGETS_SKIPPED.inc(len(skipped), poll=poll)
+        if not acquired:
+            metrics.POLL_CYCLES_SKIPPED.inc(poll=poll)
+        logger.warning('Skipped %d of %d targets of poll %s since their last check has not finished',
+                       len(skipped), len(pks), poll)
+
+    return token, acquired
+
+
+def release_poll_lease(poll, pk, token):
+    """Give back the lease on a target, if it is still held under the given token.
+
+    This is called by each per-target poll task when it finishes. If ``token`` is None, as when the task was queued
+    by something other than a poll cycle, nothing is released.
+
+    """
+    if token is None:
+        return
+
+    try:
+        PollLease.objects.filter(poll=poll, target_pk=pk, token=token).delete()
+    except Exception:
+        logger.exception('Failed to release lease for poll %s of %d', poll, pk)
+
+
+def poll_lease_usage():
+    """List the targets of each poll that are still being checked.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per lease, sorted by poll and then target name. The keys are ``poll``, ``target``, the name
+        of the ECC server or data router, ``age``, the time since the task was queued in seconds, and ``skipped``,
+        the number of later cycles that skipped the target.
+
+    """
+    now = datetime.now()
+    leases = list(PollLease.objects.filter(expires_time__gte=now).values_list('poll', 'target_pk', 'created_time',
+                                                                             'skipped'))
+
+    names = {}
+    for model in set(POLL_TARGETS.values()):
+        pks = [pk for poll, pk, _, _ in leases if POLL_TARGETS.get(poll) is model]
+        if pks:
+            names[model] = dict(model.objects.filter(pk__in=pks).values_list('pk', 'name'))
+
+    usage = []
+    for poll, pk, created_time, skipped in leases:
+        model = POLL_TARGETS.get(poll)
+        usage.append({
+            'poll': poll,
+            'target': names.get(model, {}).get(pk, str(pk)),
+            'age': (now - created_time).total_seconds(),
+            'skipped': skipped,
+        })
+
+    usage.sort(key=lambda u: (u['poll'], u['target']))
+    return usage
@@ -0,0 +1,236 @@
+"""Adaptive intervals for the periodic status checks.
+
+Celery beat starts each poll cycle every fraction of a second, but a cycle only queues the checks of the targets
+that are due. How often a target is due depends on the state of the system, as set by the experiment's
+:class:`~attpcdaq.daq.models.PollSchedule`:
+
+- An ECC server that is changing state has its state checked every ``transition_interval`` seconds, so the end of a
+  transition is seen quickly.
+- While a run is in progress, each poll uses its normal interval.
+- When no run is in progress, the intervals are multiplied by ``idle_factor``.
+- A target that has been offline for ``offline_cycles`` checks in a row is checked ``offline_factor`` times less
+  often, until it comes back online.
+
+No interval is longer than ``max_interval``. The time each target was last checked, and how many checks in a row
+found it offline, are kept as :class:`~attpcdaq.daq.models.PollRecord` rows. The checks that are due are then passed
+through :func:`~attpcdaq.daq.pollleases.acquire_poll_leases`, so a target is still skipped if its last check hasn't
+finished.
+
+Most beat ticks find nothing due, so each cycle also saves the earliest time that the next one could find a target
+due, as a :class:`~attpcdaq.daq.models.PollCycle`. Until then, :func:`poll_cycle_is_due` lets the cycle return
+after that one query, in whichever worker process it runs. The saved time is cleared when an ECC server starts a
+transition. Otherwise it is never later than the shortest interval the poll can have, so a new target, a change to
+the schedule, or the start of a run is still picked up within that interval.
+
+"""
+
+from datetime import datetime, timedelta
+
+from django.db.models import F
+
+from .models import PollSchedule, PollRecord, PollCycle
+from .pollleases import acquire_poll_leases
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: The field of :class:`~attpcdaq.daq.models.PollSchedule` giving the normal interval of each poll
+INTERVAL_FIELDS = {
+    'ecc_state': 'state_interval',
+    'ecc_online': 'status_interval',
+    'data_router_status': 'status_interval',
+    'data_rate': 'data_rate_interval',
+}
+
+#: A target due within this many seconds is checked now, since the beat ticks don't arrive exactly on time
+DUE_SLACK = 0.1
+
+
+def get_poll_schedule(experiment):
+    """Get the poll schedule of an experiment, or a schedule with the default intervals if it doesn't have one."""
+    try:
+        return experiment.poll_schedule
+    except PollSchedule.DoesNotExist:
+        return PollSchedule(experiment=experiment)
+
+
+def poll_interval(schedule, poll, is_running, is_transitioning=False, offline_cycles=0):
+    """Find the time between checks of a target.
+
+    Parameters
+    ----------
+    schedule : PollSchedule
+        The experiment's schedule.
+    poll : str
+        The name of the poll, like ``ecc_state``.
+    is_running : bool
+        Whether a run is in progress.
+    is_transitioning : bool, optional
+        Whether the target is an ECC server that is changing state.
+    offline_cycles : int, optional
+        The number of checks in a row that found the target offline.
+
+    Returns
+    -------
+    float
+        The interval, in seconds.
+
+    """
+    if poll == 'ecc_state' and is_transitioning:
+        return schedule.transition_interval
+
+    interval = getattr(schedule, INTERVAL_FIELDS[poll])
+    if offline_cycles >= schedule.offline_cycles:
+        interval *= schedule.offline_factor
+    elif not is_running:
+        interval *= schedule.idle_factor
+
+    return min(interval, schedule.max_interval)
+
+
+def shortest_interval(schedule, poll):
+    """Find the shortest interval that a target of a poll can have, leaving out the transition interval.
+
+    This is the normal interval of the poll, or ``max_interval`` if that is shorter. The idle and offline factors
+    only make the interval longer.
+
+    """
+    return min(getattr(schedule, INTERVAL_FIELDS[poll]), schedule.max_interval)
+
+
+def poll_cycle_is_due(poll, now=None):
+    """Check whether the next cycle of a poll could find any target due.
+
+    This reads the :class:`~attpcdaq.daq.models.PollCycle` saved by the last cycle of the poll, in one query.
+
+    Parameters
+    ----------
+    poll : str
+        The name of the poll, like ``ecc_state``.
+    now : datetime, optional
+        The current time. Defaults to now.
+
+    Returns
+    -------
+    bool
+        False if no target can be due yet, and the cycle can be skipped.
+
+    """
+    return not PollCycle.objects.filter(poll=poll, next_time__gt=now or datetime.now()).exists()
+
+
+def _set_next_cycle_time(poll, next_time):
+    """Save the earliest time that the next cycle of a poll could find a target due, or clear it if this is None."""
+    if next_time is None:
+        PollCycle.objects.filter(poll=poll).delete()
+    elif not PollCycle.objects.filter(poll=poll).update(next_time=next_time):
+        PollCycle.objects.bulk_create([PollCycle(poll=poll, next_time=next_time)], ignore_conflicts=True)
+
+
+def postpone_poll_cycle(poll, experiment, now=None):
+    """Skip the cycles of a poll for the shortest interval of the poll.
+
+    This is for a poll that found nothing to check without calling :func:`start_poll_cycle`, like the data rate
+    poll when no run is in progress.
+
+    """
+    now = now or datetime.now()
+    interval = shortest_interval(get_poll_schedule(experiment), poll)
+    _set_next_cycle_time(poll, now + timedelta(seconds=interval - DUE_SLACK))
+
+
+def clear_poll_cycle_times():
+    """Clear the times saved for :func:`poll_cycle_is_due`, so the next cycle of each poll looks at every target."""
+    PollCycle.objects.all().delete()
+
+
+def start_poll_cycle(poll, experiment, targets, is_running=None):
+    """Find the targets of a poll that are due, and take a lease on each of them.
+
+    The earliest time that a target could be due next is saved for :func:`poll_cycle_is_due`, unless a target that
+    was due was skipped because its last check hasn't finished.
+
+    Parameters
+    ----------
+    poll : str
+        The name of the poll, like ``ecc_state``.
+    experiment : Experiment or None
+        The active experiment. If this is None, nothing is due.
+    targets : QuerySet
+        The ECC servers or data routers to consider.
+    is_running : bool, optional
+        Whether a run is in progress. This is looked up from the experiment if it isn't given.
+
+    Returns
+    -------
+    token : str or None
+        The token of the leases, as returned by :func:`~attpcdaq.daq.pollleases.acquire_poll_leases`.
+    pks : list[int]
+        The primary keys of the targets whose checks should be queued.
+
+    """
+    if experiment is None:
+        return None, []
+
+    now = datetime.now()
+    schedule = get_poll_schedule(experiment)
+    next_time = now + timedelta(seconds=shortest_interval(schedule, poll) - DUE_SLACK)
+
+    fields = ['pk', 'is_online']
+    if poll == 'ecc_state':
+        fields.append('is_transitioning')
+    rows = list(targets.values(*fields))
+    if not rows:
+        _set_next_cycle_time(poll, next_time)
+        return None, []
+
+    if is_running is None:
+        is_running = experiment.is_running
+
+    records = PollRecord.objects.filter(poll=poll)
+    last_checks = {pk: (last_time, offline_cycles) for pk, last_time, offline_cycles in
+                   records.filter(target_pk__in=[r['pk'] for r in rows])
+                          .values_list('target_pk', 'last_time', 'offline_cycles')}
+
+    due = []
+    is_online = {}
+    for row in rows:
+        pk = row['pk']
+        is_online[pk] = row['is_online']
+        if row.get('is_transitioning', False):
+            next_time = min(next_time, now + timedelta(seconds=schedule.transition_interval - DUE_SLACK))
+
+        if pk not in last_checks:
+            due.append(pk)
+            continue
+
+        last_time, offline_cycles = last_checks[pk]
+        interval = poll_interval(schedule, poll, is_running, row.get('is_transitioning', False),
+                                 0 if row['is_online'] else offline_cycles)
+        if (now - last_time).total_seconds() + DUE_SLACK >= interval:
+            due.append(pk)
+        else:
+            next_time = min(next_time, last_time + timedelta(seconds=interval - DUE_SLACK))
+
+    if not due:
+        _set_next_cycle_time(poll, next_time)
+        return None, []
+
+    token, pks = acquire_poll_leases(poll, due)
+    _set_next_cycle_time(poll, next_time if len(pks) == len(due) else None)
+
+    if pks:
+        online = [pk for pk in pks if is_online[pk] and pk in last_checks]
+        offline = [pk for pk in pks if not is_online[pk] and pk in last_checks]
+        if online:
+            records.filter(target_pk__in=online).update(last_time=now, offline_cycles=0)
+        if offline:
+            records.filter(target_pk__in=offline).update(last_time=now, offline_cycles=F('offline_cycles') + 1)
+
+        new = [pk for pk in pks if pk not in last_checks]
+        if new:
+            PollRecord.objects.bulk_create([PollRecord(poll=poll, target_pk=pk, last_time=now,
+                                                       offline_cycles=0 if is_online[pk] else 1) for pk in new],
+                                           ignore_conflicts=True)
+
+    return token, pks
@@ -0,0 +1,358 @@
+"""Checks that the system is ready before a run is started.
+
+The status shown on the main page comes from the periodic tasks, so it can be several seconds old when the user
+clicks "Start all". The pre-flight check looks at every ECC server and data router of the experiment again, right
+before the run starts. The checks that contact a remote computer run at the same time, one thread per host, and the
+whole check is cut off after ``PREFLIGHT_DEADLINE`` seconds. Any check that hasn't finished by then fails.
+
+The result is a report listing each check with whether it passed and how long it took. The run is only started if
+every check passed.
+
+The checks take a slot on each host (see :mod:`attpcdaq.daq.hostlimits`) before the threads are started, so they
+don't run alongside more than the allowed number of other operations on any host. If a host stays too busy, the
+check that needed the slot fails. The time spent waiting for the slots counts towards the deadline. The report is
+returned at the deadline even if some threads are still waiting for an answer, but the slots are only released once
+every thread has stopped, so a host that was too slow to answer isn't given more sessions while the late one is still
+open. This is done by a separate thread. Each SSH and SOAP read times out after the deadline, and a thread that has run
+out of time doesn't start its next check, so the slots aren't held for long.
+
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+
+from .models import ECCServer, EccStateClient, ECCError, HostSlot
+from .workertasks import WorkerInterface
+from .hostlimits import HostBusyError, host_slots, ssh_host, ecc_host
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+#: The checks made for each ECC server in its own thread, in order
+ECC_CHECKS = ('ecc_reachable',)
+
+#: The checks made for each data router in its own thread, in order
+DATA_ROUTER_CHECKS = ('ssh_connect', 'data_router_alive', 'staging_clean', 'disk_space')
+
+
+def _run_check(results, target, check, func):
+    """Run one check and append its result to the list.
+
+    The function should return a message describing the result, and raise an exception if the check fails.
+    Returns whether the check passed.
+
+    """
+    start = time.monotonic()
+    try:
+        message = func()
+        passed = True
+    except Exception as err:
+        message = str(err) or type(err).__name__
+        passed = False
+
+    results.append({
+        'target': target,
+        'check': check,
+        'passed': passed,
+        'message': message,
+        'duration': time.monotonic() - start,
+    })
+    return passed
+
+
+def check_ecc_server(results, name, ecc_url, timeout):
+    """Run the ``ecc_reachable`` check for one ECC server.
+
+    The check passes if the ECC server answers a GetState request without an error code. The message gives the
+    state it reported.
+
+    Parameters
+    ----------
+    results : list
+        The list to append the result to.
+    name : str
+        The name of the ECC server.
+    ecc_url : str
+        The URL of the ECC server.
+    timeout : float
+        The socket timeout, in seconds.
+
+    """
+    def reachable():
+        result = EccStateClient(ecc_url, timeout=timeout).GetState()
+        if int(result.ErrorCode) != 0:
+            raise ECCError(result.ErrorMessage)
+
+        state_name = ECCServer.STATE_DICT.get(int(result.State), result.State)
+        if int(result.Transition) != 0:
+            return 'Transitioning from {}'.format(state_name)
+        return state_name
+
+    _run_check(results, name, 'ecc_reachable', reachable)
+
+
+def check_data_router(results, name, ip_address, min_free_bytes, forecast_bytes, timeout=None, cancelled=None):
+    """Run the checks for one data router over a single SSH connection.
+
+    The checks are ``ssh_connect``, ``data_router_alive``, ``staging_clean``, and ``disk_space``. Each one is only
+    run if the one before passed, and if the check hasn't been cancelled.
+
+    Parameters
+    ----------
+    results : list
+        The list to append the results to.
+    name : str
+        The name of the data router.
+    ip_address : str
+        The address of the computer running the data router.
+    min_free_bytes : int
+        The least free space on the staging volume for the disk space check to pass.
+    forecast_bytes : float or None
+        The amount of data the router is expected to write in a run, if known. Having less free space than this
+        is noted in the message, but it doesn't fail the check, since the forecast is a rough estimate.
+    timeout : float, optional
+        The timeout for connecting and for each read over the SSH connection, in seconds.
+    cancelled : threading.Event, optional
+        Set when the result is no longer wanted. The checks that haven't started yet are then skipped.
+
+    """
+    connection = None
+
+    def connect():
+        nonlocal connection
+        connection = WorkerInterface(ip_address, timeout=timeout)
+        return 'Connected'
+
+    if not _run_check(results, name, 'ssh_connect', connect):
+        return
+
+    with connection as wint:
+        def alive():
+            if not wint.check_data_router_status():
+                raise RuntimeError('The data router process is not running')
+            return 'Running'
+
+        def clean():
+            if not wint.working_dir_is_clean():
+                raise RuntimeError('The staging directory contains GRAW files')
+            return 'Clean'
+
+        def disk_space():
+            total, free = wint.get_disk_usage()
+            if free < min_free_bytes:
+                raise RuntimeError('Only {:.1f} GB is free'.format(free / 1e9))
+            message = '{:.1f} GB free'.format(free / 1e9)
+            if forecast_bytes is not None and forecast_bytes > free:
+                message += ', but a run may write {:.1f} GB'.format(forecast_bytes / 1e9)
+            return message
+
+        for check, func in (('data_router_alive', alive), ('staging_clean', clean), ('disk_space', disk_space)):
+            if cancelled is not None and cancelled.is_set():
+                return
+            if not _run_check(results, name, check, func):
+                return
+
+
+def forecast_run_bytes(experiment, run_length):
+    """Estimate how much data each data router of the experiment will write in a run.
+
+    This makes the same estimate as :meth:`~attpcdaq.daq.models.DataRouter.forecast_run_bytes`, but for all
+    routers at once.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment.
+    run_length : timedelta
+        The length of the run.
+
+    Returns
+    -------
+    dict
+        The projected number of bytes, keyed by data router primary key. Routers with no estimate are left out.
+
+    """
+    last_run = experiment.runmetadata_set.filter(stop_datetime__isnull=False).order_by('-run_number').first()
+    if last_run is None:
+        return {}
+
+    duration = last_run.duration.total_seconds()
+    if duration <= 0:
+        return {}
+
+    written = last_run.files.order_by().values('data_router').annotate(total=Sum('size'))
+    return {row['data_router']: row['total'] / duration * run_length.total_seconds() for row in written}
+
+
+def _run_jobs(checks, jobs, timeout, deadline, cancelled):
+    """Run the checks that contact remote hosts, one thread per host, and add their results to the list.
+
+    A check that hasn't finished within ``timeout`` seconds fails, and the checks after it on the same host are
+    left out. The ``deadline`` is only used in the message. When the time is up, ``cancelled`` is set so that the
+    late threads don't start any more checks. This doesn't wait for them to stop.
+
+    Returns the set of futures of the jobs that are still running.
+
+    """
+    executor = ThreadPoolExecutor(max_workers=len(jobs))
+    futures = [executor.submit(func, *args) for _, _, func, args in jobs]
+    done, not_done = wait(futures, timeout=timeout)
+    cancelled.set()
+    executor.shutdown(wait=False)
+    _report_jobs(checks, jobs, futures, done, deadline)
+    return not_done
+
+
+def _release_slots_when_stopped(futures, slots):
+    """Wait for the late jobs to stop, and then release the host slots.
+
+    This runs in its own thread, so that the pre-flight check can return at its deadline while a late thread may
+    still be using its host's slot.
+
+    Parameters
+    ----------
+    futures : iterable
+        The futures of the jobs that were still running at the deadline.
+    slots : contextlib.ExitStack
+        The stack holding the host slots.
+
+    """
+    try:
+        wait(futures)
+        slots.close()
+    finally:
+        connection.close()  # This thread's own database connection
+
+
+def _report_jobs(checks, jobs, futures, done, deadline):
+    """Add the results of the jobs to the list, with a failure for each job that didn't finish in time."""
+    for (results, expected, _, args), future in zip(jobs, futures):
+        finished = list(results)  # The thread may still be adding to the list
+        checks.extend(finished)
+        if future not in done:
+            # Report the check that was in progress. The later ones wouldn't have been started.
+            finished_names = {r['check'] for r in finished}
+            pending = next((check for check in expected if check not in finished_names), None)
+            if pending is None:
+                continue  # It finished just after the deadline
+            checks.append({
+                'target': args[1],
+                'check': pending,
+                'passed': False,
+                'message': 'No answer within {:g} s'.format(deadline),
+                'duration': None,
+            })
+
+
+def run_preflight(experiment, deadline=None):
+    """Check that every ECC server and data router of an experiment is ready for a run.
+
+    These checks are made:
+
+    ``config_selected``
+        The ECC server has a config selected. This is read from the database.
+    ``ecc_reachable``
+        The ECC server answers a GetState request.
+    ``ssh_connect``
+        An SSH connection can be made to the data router's computer.
+    ``data_router_alive``
+        The data router process is running.
+    ``staging_clean``
+        The data router's staging directory has no GRAW files left from the last run.
+    ``disk_space``
+        The staging volume has at least ``PREFLIGHT_MIN_FREE_BYTES`` free.
+    ``host_slot``
+        A slot was free on each host before the deadline. This is only listed if it fails, and then the checks
+        that contact the remote hosts aren't made.
+
+    The report is returned within about ``deadline`` seconds, including the time spent waiting for the host slots.
+    The slots of any checks that are still waiting for an answer then are released by another thread once those
+    checks have stopped.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment.
+    deadline : float, optional
+        The longest time to wait for the checks, in seconds. Defaults to the ``PREFLIGHT_DEADLINE`` setting.
+
+    Returns
+    -------
+    dict
+        The report. The key ``passed`` is True if every check passed, ``duration`` is the total time taken in
+        seconds, and ``checks`` is a list of dictionaries with the keys ``target`` (the name of the ECC server or
+        data router), ``check``, ``passed``, ``message``, and ``duration`` (in seconds). A check that didn't
+        finish in time fails with a duration of None, and the checks after it on the same host are left out.
+
+    """
+    if deadline is None:
+        deadline = getattr(settings, 'PREFLIGHT_DEADLINE', 2)
+    min_free_bytes = getattr(settings, 'PREFLIGHT_MIN_FREE_BYTES', 1e9)
+    run_length = getattr(settings, 'EXPECTED_RUN_LENGTH', timedelta(hours=1))
+
+    start = time.monotonic()
+
+    ecc_servers = list(experiment.eccserver_set.select_related('selected_config').order_by('name'))
+    data_routers = list(experiment.datarouter_set.order_by('name'))
+    forecasts = forecast_run_bytes(experiment, run_length)
+
+    checks = []
+    for ecc_server in ecc_servers:
+        def config_selected(ecc_server=ecc_server):
+            if ecc_server.selected_config is None:
+                raise RuntimeError('No config is selected')
+            return str(ecc_server.selected_config)
+        _run_check(checks, ecc_server.name, 'config_selected', config_selected)
+
+    # Each job appends to its own list, so the results of the checks that finished are kept if the job times out
+    jobs = []
+    cancelled = threading.Event()
+    for ecc_server in ecc_servers:
+        results = []
+        jobs.append((results, ECC_CHECKS, check_ecc_server, (results, ecc_server.name, ecc_server.ecc_url, deadline)))
+    for router in data_routers:
+        results = []
+        jobs.append((results, DATA_ROUTER_CHECKS, check_data_router,
+                     (results, router.name, router.ip_address, min_free_bytes, forecasts.get(router.pk), deadline,
+                      cancelled)))
+
+    if jobs:
+        hosts = [ecc_host(e) for e in ecc_servers] + [ssh_host(r.ip_address) for r in data_routers]
+        slots = ExitStack()
+        try:
+            slots.enter_context(host_slots(hosts, 'preflight', HostSlot.TRANSITION, timeout=deadline))
+        except HostBusyError as err:
+            names = [e.name for e in ecc_servers if ecc_host(e) == err.host]
+            names += [r.name for r in data_routers if ssh_host(r.ip_address) == err.host]
+            checks.append({
+                'target': ', '.join(names),
+                'check': 'host_slot',
+                'passed': False,
+                'message': str(err),
+                'duration': time.monotonic() - start,
+            })
+        else:
+            try:
+                late = _run_jobs(checks, jobs, max(deadline - (time.monotonic() - start), 0), deadline, cancelled)
+            except BaseException:
+                slots.close()
+                raise
+
+            if late:
+                threading.Thread(target=_release_slots_when_stopped, args=(late, slots), daemon=True).start()
+            else:
+                slots.close()
+
+    return {
+        'passed': all(c['passed'] for c in checks),
+        'duration': time.monotonic() - start,
+        'checks': checks,
+    }
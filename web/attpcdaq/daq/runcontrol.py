@@ -0,0 +1,249 @@
+"""Run control operations made of several steps.
+
+The views in :mod:`attpcdaq.daq.views.api` queue one transition per ECC server and return, leaving the periodic
+state refresh to notice when the transitions finish. The functions in this module are for operations that need
+to carry on as soon as each step is done, such as rolling over to the next run. They request the transitions
+directly and poll the ECC servers themselves while they wait, so they should be called from a Celery task rather
+than a view.
+
+"""
+
+import time
+
+from django.conf import settings
+
+from .models import ECCServer, TraceSpan, HostSlot
+from .tracing import span
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RunControlError(Exception):
+    """Raised when a run control operation can't continue."""
+
+
+def is_mutant(ecc_server):
+    """Whether the ECC server controls a Mutant rather than CoBos."""
+    return ecc_server.name.find('Mutant') != -1
+
+
+def transition_phases(ecc_servers, target_state, is_running):
+    """Split the ECC servers into groups that must be transitioned one after the other.
+
+    The ECC server of the Mutants has been modified to not perform some transitions on the CoBos, so the Mutants
+    and the CoBos are transitioned separately. The Mutants go first when preparing and when stopping a run, and the
+    CoBos go first when describing, configuring, and starting a run. Starting the CoBos first avoids the "shelf not
+    ready" error. This is the same order used by :func:`~attpcdaq.daq.views.api.source_change_state_all`.
+
+    Parameters
+    ----------
+    ecc_servers : iterable of ECCServer
+        The ECC servers to transition.
+    target_state : int
+        The state to transition to.
+    is_running : bool
+        Whether a run is in progress. This distinguishes stopping a run from configuring.
+
+    Returns
+    -------
+    list[list[ECCServer]]
+        The groups, in order. Empty groups are left out.
+
+    """
+    ecc_servers = list(ecc_servers)
+    mutants = [e for e in ecc_servers if is_mutant(e)]
+    cobos = [e for e in ecc_servers if not is_mutant(e)]
+
+    if target_state == ECCServer.PREPARED or (target_state == ECCServer.READY and is_running):
+        phases = [mutants, cobos]
+    elif target_state in (ECCServer.DESCRIBED, ECCServer.READY, ECCServer.RUNNING):
+        phases = [cobos, mutants]
+    else:
+        phases = [ecc_servers]
+
+    return [phase for phase in phases if phase]
+
+
+def wait_for_state(ecc_servers, target_state, timeout):
+    """Poll the ECC servers until they have all finished transitioning to the target state.
+
+    The state of each server is refreshed with :meth:`~attpcdaq.daq.models.ECCServer.refresh_state` every
+    ``RUN_CONTROL_POLL_INTERVAL`` seconds. These requests are part of a transition, so they go ahead of the
+    periodic status polls.
+
+    Parameters
+    ----------
+    ecc_servers : iterable of ECCServer
+        The ECC servers to wait for.
+    target_state : int
+        The state they should reach.
+    timeout : float
+        The longest time to wait, in seconds.
+
+    Returns
+    -------
+    list[ECCServer]
+        The servers that didn't reach the target state in time. This is empty on success.
+
+    """
+    interval = getattr(settings, 'RUN_CONTROL_POLL_INTERVAL', 0.25)
+    deadline = time.monotonic() + timeout
+
+    pending = list(ecc_servers)
+    while True:
+        still_pending = []
+        for ecc_server in pending:
+            try:
+                ecc_server.refresh_state(priority=HostSlot.TRANSITION)
+            except Exception:
+                logger.exception('Failed to refresh state of %s', ecc_server.name)
+
+            if ecc_server.is_transitioning or ecc_server.state != target_state:
+                still_pending.append(ecc_server)
+
+        pending = still_pending
+        if not pending or time.monotonic() >= deadline:
+            return pending
+
+        time.sleep(interval)
+
+
+def change_state_in_phases(ecc_servers, target_state, is_running, timeout=None):
+    """Transition the ECC servers to the target state in the order given by :func:`transition_phases`.
+
+    Each group is started once the previous group has finished. The call returns when the last group has finished.
+    Servers that are already in the target state are skipped.
+
+    Parameters
+    ----------
+    ecc_servers : iterable of ECCServer
+        The ECC servers to transition.
+    target_state : int
+        The state to transition to. This must be one step away from the current state of each server.
+    is_running : bool
+        Whether a run is in progress.
+    timeout : float, optional
+        The longest time to wait for each group, in seconds. Defaults to the ``RUN_CONTROL_TRANSITION_TIMEOUT``
+        setting.
+
+    Raises
+    ------
+    RunControlError
+        If a transition couldn't be requested, or if a group didn't finish in time.
+
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'RUN_CONTROL_TRANSITION_TIMEOUT', 60)
+
+    state_name = ECCServer.STATE_DICT.get(target_state, target_state)
+
+    for phase in transition_phases(ecc_servers, target_state, is_running):
+        for ecc_server in phase:
+            if ecc_server.state == target_state and not ecc_server.is_transitioning:
+                continue
+            try:
+                ecc_server.change_state(target_state)
+            except Exception as err:
+                raise RunControlError('Failed to change state of {} to {}: {}'
+                                      .format(ecc_server.name, state_name, err)) from err
+
+        group_name = 'Mutants' if is_mutant(phase[0]) else 'CoBos'
+        with span('Wait for {}'.format(group_name), TraceSpan.WAIT):
+            late = wait_for_state(phase, target_state, timeout)
+
+        if late:
+            raise RunControlError('Timed out waiting for {} to reach state {}'
+                                  .format(', '.join(e.name for e in late), state_name))
+
+
+def plan_transitions(current_state, target_state):
+    """List the states passed through on the way from one state to another.
+
+    The states form a chain from :attr:`~attpcdaq.daq.models.ECCServer.IDLE` to
+    :attr:`~attpcdaq.daq.models.ECCServer.RUNNING`, and each transition moves one step along it.
+
+    Parameters
+    ----------
+    current_state : int
+        The state to start from.
+    target_state : int
+        The state to end in.
+
+    Returns
+    -------
+    list[int]
+        The state reached after each step, ending with the target state. This is empty if the states are the same.
+
+    Raises
+    ------
+    ValueError
+        If either state isn't a real state, like :attr:`~attpcdaq.daq.models.ECCServer.RESET`.
+
+    """
+    for state in (current_state, target_state):
+        if state not in (ECCServer.IDLE, ECCServer.DESCRIBED, ECCServer.PREPARED, ECCServer.READY,
+                         ECCServer.RUNNING):
+            raise ValueError('Invalid state {}'.format(state))
+
+    step = 1 if target_state > current_state else -1
+    return list(range(current_state + step, target_state + step, step))
+
+
+def change_state_to(ecc_servers, target_state, timeout=None):
+    """Bring the ECC servers to the target state, however many steps away it is.
+
+    The servers don't have to start in the same state. At each step, the servers that are furthest from the target
+    are moved one state closer with :func:`change_state_in_phases`, so the Mutant/CoBo ordering is kept, until they
+    have caught up with the others. Servers above the target state are brought down before those below it are
+    brought up. Each step starts as soon as the last one has finished.
+
+    Parameters
+    ----------
+    ecc_servers : iterable of ECCServer
+        The ECC servers to transition. None of them may be transitioning already.
+    target_state : int
+        The state to end in.
+    timeout : float, optional
+        The longest time to wait for each group in each step, in seconds. See :func:`change_state_in_phases`.
+
+    Returns
+    -------
+    list[tuple(str, float)]
+        The name of each transition that was made, like "Describe", and the time it took in seconds, in order.
+
+    Raises
+    ------
+    RunControlError
+        If a server is already transitioning, or if a step fails.
+    ValueError
+        If the target state isn't a real state.
+
+    """
+    ecc_servers = list(ecc_servers)
+    plan_transitions(target_state, target_state)  # Check that the target is valid
+
+    busy = [e.name for e in ecc_servers if e.is_transitioning]
+    if busy:
+        raise RunControlError('ECC servers are already transitioning: {}'.format(', '.join(busy)))
+
+    timings = []
+    while True:
+        above = [e for e in ecc_servers if e.state > target_state]
+        below = [e for e in ecc_servers if e.state < target_state]
+        if above:
+            from_state = max(e.state for e in above)
+            group = [e for e in above if e.state == from_state]
+        elif below:
+            from_state = min(e.state for e in below)
+            group = [e for e in below if e.state == from_state]
+        else:
+            return timings
+
+        next_state = plan_transitions(from_state, target_state)[0]
+        name = ECCServer.TRANSITIONS[(from_state, next_state)]
+
+        start = time.monotonic()
+        with span(name, TraceSpan.WAIT):
+            change_state_in_phases(group, next_state, is_running=from_state == ECCServer.RUNNING, timeout=timeout)
+        timings.append((name, time.monotonic() - start))
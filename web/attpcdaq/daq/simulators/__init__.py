@@ -0,0 +1,6 @@
+"""Simulated DAQ components for load testing and benchmarks.
+
+These stand in for the GET hardware and the DAQ computers so that the web app and the Celery tasks can be exercised
+on a single machine.
+
+"""
@@ -0,0 +1,323 @@
+"""A simulator for the ECC server's SOAP interface.
+
+This serves the operations defined in ``ecc.wsdl`` for any number of virtual ECC servers, each listening on its own
+local port. Each virtual server runs the CoBo state machine, with a configurable delay for transitions and a
+configurable rate of injected errors.
+
+"""
+
+import random
+import socketserver
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from xml.sax.saxutils import escape
+
+from ..models import ECCServer, ConfigId
+
+import logging
+logger = logging.getLogger(__name__)
+
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+#: The start of each response envelope, as written by the ECC server.
+ENVELOPE_START = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                  '<SOAP-ENV:Envelope xmlns:SOAP-ENV="{}" xmlns:ecc="urn:ecc"><SOAP-ENV:Body>'.format(SOAP_ENV_NS))
+
+#: The end of each response envelope.
+ENVELOPE_END = '</SOAP-ENV:Body></SOAP-ENV:Envelope>\n'
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """An HTTP server that handles each request in a new thread.
+
+    This is the same as :class:`http.server.ThreadingHTTPServer`, which is only in Python 3.7 and later.
+
+    """
+    daemon_threads = True
+
+
+def make_response(tag, **fields):
+    """Build a SOAP response envelope.
+
+    Parameters
+    ----------
+    tag : str
+        The name of the response element, e.g. "ResponseState".
+    fields
+        The values of the response fields, in order.
+
+    Returns
+    -------
+    bytes
+        The encoded envelope.
+
+    """
+    body = ''.join('<ecc:{0}>{1}</ecc:{0}>'.format(k, escape(str(v))) for k, v in fields.items())
+    return '{}<ecc:{}>{}</ecc:{}>{}'.format(ENVELOPE_START, tag, body, tag, ENVELOPE_END).encode('utf-8')
+
+
+def make_fault(message):
+    """Build a SOAP fault envelope with the given fault string."""
+    return ('{}<SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode><faultstring>{}</faultstring>'
+            '</SOAP-ENV:Fault>{}'.format(ENVELOPE_START, escape(message), ENVELOPE_END)).encode('utf-8')
+
+
+class VirtualEccServer(object):
+    """The state machine of one simulated ECC server.
+
+    Transitions take effect after a delay. Until then, GetState reports the old state with the transition flag set,
+    as the real ECC server does while it configures its CoBos.
+
+    Parameters
+    ----------
+    name : str
+        A name for the server, used in log messages.
+    latency : float, optional
+        The time a transition takes, in seconds.
+    jitter : float, optional
+        A random amount of up to this many seconds is added to each transition's latency.
+    error_rate : float, optional
+        The probability that a transition request fails with a nonzero error code.
+    state_error_rate : float, optional
+        The probability that a GetState request fails with a nonzero error code.
+    config_names : list[str], optional
+        The names of the config sets reported by GetConfigIDs. Each name is used for all three steps.
+    initial_state : int, optional
+        The starting state. Use one of the state constants from :class:`~attpcdaq.daq.models.ECCServer`.
+    seed : int, optional
+        Seed for the random number generator used for jitter and errors.
+    clock : callable, optional
+        A function returning the current time in seconds. This is mainly useful for testing.
+
+    """
+
+    #: The state changes caused by each transition operation, as {operation: {old_state: new_state}}
+    transitions = {
+        'Describe': {ECCServer.IDLE: ECCServer.DESCRIBED},
+        'Prepare': {ECCServer.DESCRIBED: ECCServer.PREPARED},
+        'Configure': {ECCServer.PREPARED: ECCServer.READY},
+        'Start': {ECCServer.READY: ECCServer.RUNNING},
+        'Stop': {ECCServer.RUNNING: ECCServer.READY},
+        'Breakup': {ECCServer.READY: ECCServer.PREPARED},
+        'Undo': {ECCServer.DESCRIBED: ECCServer.IDLE, ECCServer.PREPARED: ECCServer.DESCRIBED},
+    }
+
+    #: The error code returned for failed requests
+    ERROR_CODE = 1
+
+    def __init__(self, name, latency=0, jitter=0, error_rate=0, state_error_rate=0, config_names=None,
+                 initial_state=ECCServer.IDLE, seed=None, clock=time.monotonic):
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.state_error_rate = state_error_rate
+        self.config_names = config_names if config_names is not None else ['default']
+        self.state = initial_state
+        self.clock = clock
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pending_state = None
+        self._done_time = None
+
+    def _update(self):
+        """Finish the pending transition if its time is up. The lock must be held."""
+        if self._pending_state is not None and self.clock() >= self._done_time:
+            self.state = self._pending_state
+            self._pending_state = None
+            self._done_time = None
+
+    @property
+    def is_transitioning(self):
+        """Whether a transition is in progress."""
+        with self._lock:
+            self._update()
+            return self._pending_state is not None
+
+    def get_state(self):
+        """Handle a GetState request.
+
+        Returns
+        -------
+        dict
+            The fields of the ResponseState element.
+
+        """
+        with self._lock:
+            self._update()
+            if self._random.random() < self.state_error_rate:
+                return dict(ErrorCode=self.ERROR_CODE, ErrorMessage='Injected GetState error', State=0,
+                            Transition=0)
+            return dict(ErrorCode=0, ErrorMessage='', State=self.state,
+                        Transition=int(self._pending_state is not None))
+
+    def get_config_ids(self):
+        """Handle a GetConfigIDs request.
+
+        Returns
+        -------
+        dict
+            The fields of the ResponseText element. The text is a ``ConfigIdList`` XML document.
+
+        """
+        configs = [ConfigId(describe=n, prepare=n, configure=n).as_xml() for n in self.config_names]
+        return dict(ErrorCode=0, ErrorMessage='', Text='<ConfigIdList>{}</ConfigIdList>'.format(''.join(configs)))
+
+    def transition(self, operation):
+        """Handle a transition request like Describe or Start.
+
+        Parameters
+        ----------
+        operation : str
+            The name of the operation. This must be a key in :attr:`transitions`.
+
+        Returns
+        -------
+        dict
+            The fields of the ResponseText element.
+
+        """
+        with self._lock:
+            self._update()
+
+            if self._pending_state is not None:
+                return dict(ErrorCode=self.ERROR_CODE, ErrorMessage='Transition already in progress', Text='')
+
+            try:
+                new_state = self.transitions[operation][self.state]
+            except KeyError:
+                message = 'Cannot {} from state {}'.format(operation, ECCServer.STATE_DICT.get(self.state))
+                return dict(ErrorCode=self.ERROR_CODE, ErrorMessage=message, Text='')
+
+            if self._random.random() < self.error_rate:
+                logger.info('Injecting error in %s for %s', operation, self.name)
+                return dict(ErrorCode=self.ERROR_CODE, ErrorMessage='Injected {} error'.format(operation), Text='')
+
+            self._pending_state = new_state
+            self._done_time = self.clock() + self.latency + self._random.uniform(0, self.jitter)
+            self._update()
+
+            return dict(ErrorCode=0, ErrorMessage='', Text='')
+
+    def handle(self, operation):
+        """Handle a request for the named operation.
+
+        Parameters
+        ----------
+        operation : str
+            The name of the SOAP operation.
+
+        Returns
+        -------
+        tag : str
+            The name of the response element.
+        fields : dict
+            The response fields.
+
+        Raises
+        ------
+        KeyError
+            If the operation isn't supported.
+
+        """
+        if operation == 'GetState':
+            return 'ResponseState', self.get_state()
+        elif operation == 'GetConfigIDs':
+            return 'ResponseText', self.get_config_ids()
+        elif operation in self.transitions:
+            return 'ResponseText', self.transition(operation)
+        else:
+            raise KeyError(operation)
+
+
+class EccRequestHandler(BaseHTTPRequestHandler):
+    """Handles SOAP requests for the :class:`VirtualEccServer` attached to the HTTP server."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        try:
+            root = ET.fromstring(body)
+            soap_body = root.find('{{{}}}Body'.format(SOAP_ENV_NS))
+            operation = soap_body[0].tag.rpartition('}')[2]
+            tag, fields = self.server.ecc.handle(operation)
+        except (ET.ParseError, TypeError, IndexError):
+            self._send(500, make_fault('Malformed request'))
+        except KeyError as err:
+            self._send(500, make_fault('Method {} not implemented'.format(err.args[0])))
+        else:
+            self._send(200, make_response(tag, **fields))
+
+    def _send(self, status, content):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug('%s: %s', self.server.ecc.name, format % args)
+
+
+class EccSimulator(object):
+    """Runs a set of virtual ECC servers on local ports.
+
+    This can be used as a context manager, which starts the servers on entry and stops them on exit.
+
+    Parameters
+    ----------
+    count : int
+        The number of virtual ECC servers.
+    host : str, optional
+        The address to listen on.
+    base_port : int, optional
+        The port of the first server. The others use the following ports. If this is 0, each server
+        uses a free port chosen by the operating system.
+    server_kwargs
+        Any other keyword arguments are passed to each :class:`VirtualEccServer`.
+
+    """
+    def __init__(self, count, host='127.0.0.1', base_port=0, **server_kwargs):
+        self.host = host
+        self.base_port = base_port
+        self.ecc_servers = [VirtualEccServer('ECC{}'.format(i), **server_kwargs) for i in range(count)]
+        self._http_servers = []
+
+    def start(self):
+        """Start listening. Each server runs in its own thread."""
+        for i, ecc in enumerate(self.ecc_servers):
+            port = self.base_port + i if self.base_port else 0
+            http_server = ThreadingHTTPServer((self.host, port), EccRequestHandler)
+            http_server.daemon_threads = True
+            http_server.ecc = ecc
+            threading.Thread(target=http_server.serve_forever, daemon=True).start()
+            self._http_servers.append(http_server)
+
+    def stop(self):
+        """Stop all of the servers."""
+        for http_server in self._http_servers:
+            http_server.shutdown()
+            http_server.server_close()
+        self._http_servers = []
+
+    @property
+    def ports(self):
+        """The ports the servers are listening on, in order."""
+        return [s.server_address[1] for s in self._http_servers]
+
+    @property
+    def urls(self):
+        """The URLs of the servers, in the format of :attr:`~attpcdaq.daq.models.ECCServer.ecc_url`."""
+        return ['http://{}:{}/'.format(self.host, port) for port in self.ports]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,351 @@
+"""A local stand-in for the SSH server on a DAQ computer.
+
+:class:`FakeDaqNode` accepts SSH connections on a local port, so the real
+:class:`~attpcdaq.daq.workertasks.WorkerInterface` can be used against it. The process table is emulated: ``ps -e``
+lists the configured processes, and ``lsof`` reports a staging directory as the data router's working directory.
+Other commands are run by the local shell, and SFTP requests are served from the local filesystem. Any client key
+is accepted.
+
+The staging directory, log file, and config files all live under a local root directory, and they can be filled
+with synthetic data using the methods of :class:`FakeDaqNode`.
+
+"""
+
+import os
+import socket
+import subprocess
+import threading
+from datetime import datetime
+
+import paramiko
+from paramiko import ServerInterface, SFTPServerInterface, SFTPServer, SFTPAttributes, SFTPHandle
+from paramiko.sftp import SFTP_OK
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LocalSFTPHandle(SFTPHandle):
+    """An open file on the local filesystem."""
+
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def chattr(self, attr):
+        return SFTP_OK
+
+
+class LocalSFTPServer(SFTPServerInterface):
+    """Serves SFTP requests from the local filesystem.
+
+    Relative paths are taken relative to ``root``, which acts as the user's home directory.
+
+    """
+    def __init__(self, server, root, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _local_path(self, path):
+        return os.path.normpath(os.path.join(self.root, path))
+
+    def canonicalize(self, path):
+        return self._local_path(path)
+
+    def list_folder(self, path):
+        path = self._local_path(path)
+        try:
+            return [SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name) for name in os.listdir(path)]
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def lstat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.lstat(self._local_path(path)))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+    def open(self, path, flags, attr):
+        path = self._local_path(path)
+        try:
+            fd = os.open(path, flags, 0o666)
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+
+        handle = LocalSFTPHandle(flags)
+        handle.filename = path
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local_path(path))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._local_path(oldpath), self._local_path(newpath))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local_path(path))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local_path(path))
+        except OSError as err:
+            return SFTPServer.convert_errno(err.errno)
+        return SFTP_OK
+
+    def chattr(self, path, attr):
+        return SFTP_OK
+
+
+class FakeDaqNodeServer(ServerInterface):
+    """The SSH server interface for a :class:`FakeDaqNode`. All authentication attempts succeed."""
+
+    def __init__(self, node):
+        self.node = node
+
+    def get_allowed_auths(self, username):
+        return 'publickey,password'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        thread = threading.Thread(target=self.node.run_command, args=(channel, command.decode('utf-8')),
+                                  daemon=True)
+        thread.start()
+        return True
+
+
+class FakeDaqNode(object):
+    """A local SSH server that behaves like a DAQ computer running a data router and an ECC server.
+
+    This can be used as a context manager, which starts the server on entry and stops it on exit.
+
+    Parameters
+    ----------
+    root : str
+        A local directory to hold the node's files. It acts as the home directory for SFTP requests and shell
+        commands, so a path like ``~/config_backups`` ends up inside it.
+    host : str, optional
+        The address to listen on.
+    port : int, optional
+        The port to listen on. If this is 0, a free port is chosen.
+    host_key : paramiko.PKey, optional
+        The server's host key. A new RSA key is generated if this is not given.
+    processes : iterable of str, optional
+        The names of the processes listed by ``ps -e``. The data router is only found by ``lsof`` if
+        ``dataRouter`` is in this list.
+
+    """
+    def __init__(self, root, host='127.0.0.1', port=0, host_key=None, processes=('dataRouter', 'getEccSoapServer')):
+        self.root = os.path.abspath(root)
+        self.host = host
+        self.port = port
+        self.host_key = host_key if host_key is not None else paramiko.RSAKey.generate(2048)
+        self.processes = list(processes)
+
+        self.staging_dir = os.path.join(self.root, 'staging')
+        self.log_path = os.path.join(self.root, 'Library', 'Logs', 'dataRouter.log')
+        self.config_dir = os.path.join(self.root, 'configs')
+        for path in (self.staging_dir, os.path.dirname(self.log_path), self.config_dir):
+            os.makedirs(path, exist_ok=True)
+
+        self._socket = None
+        self._transports = []
+        self._running = False
+
+    def start(self):
+        """Start accepting connections in a background thread."""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(100)
+        self.port = self._socket.getsockname()[1]
+        self._running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def stop(self):
+        """Stop accepting connections and close any open ones."""
+        self._running = False
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                sock, _ = self._socket.accept()
+            except OSError:
+                break  # The socket was closed
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(sock)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', SFTPServer, LocalSFTPServer, self.root)
+            self._transports = [t for t in self._transports if t.is_active()] + [transport]
+
+            # Negotiation runs in the transport's own thread, so this doesn't wait for it
+            transport.start_server(event=threading.Event(), server=FakeDaqNodeServer(self))
+
+    def emulate_command(self, command):
+        """Produce the output of one of the emulated commands.
+
+        Parameters
+        ----------
+        command : str
+            The command line.
+
+        Returns
+        -------
+        tuple(str, int) or None
+            The output and exit status, or None if the command isn't emulated.
+
+        """
+        if command == 'ps -e':
+            lines = ['  PID TTY           TIME CMD']
+            lines += ['{:5d} ??         0:01.00 /usr/local/bin/{}'.format(1000 + i, name)
+                      for i, name in enumerate(self.processes)]
+            return '\n'.join(lines) + '\n', 0
+
+        elif command.startswith('lsof '):
+            if 'dataRouter' not in self.processes:
+                return '', 1
+            pid = 1000 + self.processes.index('dataRouter')
+            return 'p{}\ncdataRouter\nfcwd\nn{}\n'.format(pid, self.staging_dir), 0
+
+        else:
+            return None
+
+    def run_command(self, channel, command):
+        """Run a command requested over SSH and send the results back on the channel."""
+        try:
+            try:
+                emulated = self.emulate_command(command)
+                if emulated is not None:
+                    output, status = emulated
+                    channel.sendall(output.encode('utf-8'))
+                else:
+                    env = dict(os.environ, HOME=self.root)
+                    proc = subprocess.run(command, shell=True, cwd=self.root, env=env,
+                                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    channel.sendall(proc.stdout)
+                    channel.sendall_stderr(proc.stderr)
+                    status = proc.returncode
+                channel.send_exit_status(status)
+            except EOFError:
+                raise
+            except Exception:
+                logger.exception('Failed to run command %s', command)
+                channel.send_exit_status(255)
+            finally:
+                # Closing the channel here could race with the reply to the exec request, so just send EOF.
+                # The client closes the channel when it's done with it.
+                channel.shutdown_write()
+        except EOFError:
+            logger.debug('Client disconnected while running %s', command)
+
+    def create_graw_files(self, count, size, cobo=0):
+        """Create synthetic GRAW files in the staging directory.
+
+        The files are sparse, so they take little space on disk and are quick to create.
+
+        Parameters
+        ----------
+        count : int
+            The number of files to create.
+        size : int
+            The size of each file, in bytes.
+        cobo : int, optional
+            The CoBo number used in the file names.
+
+        Returns
+        -------
+        list[str]
+            The paths to the new files.
+
+        """
+        timestamp = datetime.now().strftime('%Y-%m-%dT%H-%M-%S.%f')[:-3]
+        paths = []
+        for i in range(count):
+            name = 'CoBo_AsAd{}_{}_{:04d}.graw'.format(cobo, timestamp, i)
+            path = os.path.join(self.staging_dir, name)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+            paths.append(path)
+        return paths
+
+    def write_log(self, num_lines):
+        """Write a synthetic data router log file with the given number of lines."""
+        with open(self.log_path, 'w') as f:
+            for i in range(num_lines):
+                f.write('{} [info] dataRouter: received frame {} from CoBo[0]\n'.format(datetime.now(), i))
+
+    def create_config_files(self, name, size=100000):
+        """Create a synthetic set of config files.
+
+        Parameters
+        ----------
+        name : str
+            The name of the config set.
+        size : int, optional
+            The approximate size of each file, in bytes.
+
+        Returns
+        -------
+        list[str]
+            The paths to the describe, prepare, and configure files.
+
+        """
+        paths = []
+        for step in ('describe', 'prepare', 'configure'):
+            path = os.path.join(self.config_dir, '{}-{}.xcfg'.format(step, name))
+            line = '<Setup id="{}"><Value>{}</Value></Setup>\n'.format(step, name)
+            with open(path, 'w') as f:
+                f.write(line * (size // len(line) + 1))
+            paths.append(path)
+        return paths
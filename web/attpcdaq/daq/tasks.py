@@ -1,26 +1,68 @@
 """Celery asynchronous tasks for the daq module."""
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from celery import shared_task, group
 from celery.exceptions import SoftTimeLimitExceeded
-from .models import ECCServer, DataRouter, Experiment, RunMetadata
+from .models import ECCServer, DataRouter, Experiment, RunMetadata, ConfigBlob, ConfigManifestEntry, RunFile
+from .models import DataRateSample, DiskUsageSample, TaskTiming, TraceSpan, RunSequence, RunBoundary, HostSlot
 from .workertasks import WorkerInterface
+from .hostlimits import HostBusyError, host_slot, host_slots, ssh_host, ecc_host
+from .circuitbreakers import CircuitOpenError, circuit_breaker
+from .pollleases import release_poll_lease
+from .pollschedule import start_poll_cycle, poll_cycle_is_due, postpone_poll_cycle
+from .runcontrol import RunControlError, change_state_in_phases, change_state_to
+from .watchdog import reconcile_transitions
+from .tracing import span
+from .instrumentation import skip_task_timing
+from .. import metrics
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from datetime import datetime, timedelta
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+def mark_offline(target, err):
+    """Mark an ECC server or data router offline because the circuit breaker of one of its endpoints is open.
+
+    Parameters
+    ----------
+    target : ECCServer or DataRouter
+        The ECC server or data router whose check was refused.
+    err : CircuitOpenError
+        The error raised by :func:`~attpcdaq.daq.circuitbreakers.circuit_breaker`.
+
+    """
+    logger.debug('Skipped checking %s: %s', target.name, err)
+    type(target).objects.filter(pk=target.pk, is_online=True).update(is_online=False)
+    target.is_online = False
+
+    if isinstance(target, ECCServer):
+        metrics.ECC_ONLINE.set(False, ecc_server=target.name)
+    else:
+        metrics.DATA_ROUTER_ONLINE.set(False, data_router=target.name)
+
+
 @shared_task(soft_time_limit=5, time_limit=10)
-def eccserver_refresh_state_task(eccserver_pk):
+def eccserver_refresh_state_task(eccserver_pk, lease_token=None):
     """Fetch the state of the given ECC server.
 
     This will contact the ECC server identified by the given primary key, fetch its state, and
-    update the state in the database.
+    update the state in the database. If the ECC server has failed to answer several times in a row, it isn't
+    contacted, and it is marked offline instead (see :mod:`attpcdaq.daq.circuitbreakers`).
 
     Parameters
     ----------
     eccserver_pk : int
         The integer primary key of the ECCServer object in the database.
+    lease_token : str, optional
+        The token of the poll lease on the ECC server, if the task was queued by :func:`eccserver_refresh_all_task`.
+        The lease is released when the task finishes.
 
     """
     try:
@@ -30,25 +72,66 @@ def eccserver_refresh_state_task(eccserver_pk):
         return
 
     try:
-        ecc_server.refresh_state()
+        with circuit_breaker(ecc_host(ecc_server)):
+            ecc_server.refresh_state()
+
+        metrics.ECC_STATE.set(ecc_server.state, ecc_server=ecc_server.name)
+        metrics.ECC_TRANSITIONING.set(ecc_server.is_transitioning, ecc_server=ecc_server.name)
+        metrics.LAST_POLL_TIME.set(time.time(), host=ecc_server.name, poll='ecc_state')
+    except CircuitOpenError as err:
+        mark_offline(ecc_server, err)
+    except HostBusyError as err:
+        logger.warning('Skipped refreshing state of %s: %s', ecc_server.name, err)
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while refreshing state of %s', ecc_server.name)
     except Exception:
         logger.exception('Failed to refresh state of ECC server %s', ecc_server.name)
+    finally:
+        release_poll_lease('ecc_state', eccserver_pk, lease_token)
+
+
+def update_run_metrics():
+    """Set the run metrics from the latest run of the active experiment."""
+    try:
+        run = (RunMetadata.objects.filter(experiment__is_active=True)
+               .select_related('experiment')
+               .latest('start_datetime'))
+    except RunMetadata.DoesNotExist:
+        return
+
+    experiment_name = run.experiment.name
+    metrics.RUN_NUMBER.set(run.run_number, experiment=experiment_name)
+    metrics.RUN_RUNNING.set(run.stop_datetime is None, experiment=experiment_name)
+    metrics.RUN_START_TIME.set(run.start_datetime.timestamp(), experiment=experiment_name)
+    metrics.RUN_DURATION.set(run.duration.total_seconds(), experiment=experiment_name)
 
 
 @shared_task(soft_time_limit=8, time_limit=10)
 def eccserver_refresh_all_task():
     """Fetch the state of all ECC servers.
 
-    This calls :func:`eccserver_refresh_state_task` for each ECC server in the database.
+    This calls :func:`eccserver_refresh_state_task` for each ECC server in the active experiment that is due
+    to be checked (see :mod:`attpcdaq.daq.pollschedule`), skipping any server whose last refresh hasn't finished
+    (see :mod:`attpcdaq.daq.pollleases`). The run metrics are also updated from the latest run of the active
+    experiment.
 
     """
     try:
-        pk_list = ECCServer.objects.filter(experiment__is_active=True).values_list('pk', flat=True)
-        if pk_list.exists():
-            gp = group([eccserver_refresh_state_task.s(i) for i in pk_list])
-            gp()
+        if not poll_cycle_is_due('ecc_state'):
+            skip_task_timing(eccserver_refresh_all_task)
+            return
+
+        with metrics.POLL_CYCLE_DURATION.time(poll='ecc_state'):
+            experiment = Experiment.objects.filter(is_active=True).select_related('poll_schedule').first()
+            token, pk_list = start_poll_cycle('ecc_state', experiment,
+                                              ECCServer.objects.filter(experiment=experiment))
+            if pk_list:
+                gp = group([eccserver_refresh_state_task.s(i, token) for i in pk_list])
+                gp()
+            else:
+                skip_task_timing(eccserver_refresh_all_task)
+
+        update_run_metrics()
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while refreshing state of all ECC servers')
     except Exception:
@@ -85,17 +168,22 @@ def eccserver_change_state_task(eccserver_pk, target_state):
 
 
 @shared_task(soft_time_limit=10, time_limit=40)
-def check_ecc_server_online_task(eccserver_pk):
+def check_ecc_server_online_task(eccserver_pk, lease_token=None):
     """Checks if the ECC server is online.
 
     This is done by checking if the process is running via SSH. Specifically, the method
     :meth:`~attpcdaq.daq.workertasks.WorkerInterface.check_ecc_server_status` of the
-    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object is used.
+    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object is used. If the computer has failed to answer
+    several times in a row, it isn't contacted, and the ECC server is marked offline instead (see
+    :mod:`attpcdaq.daq.circuitbreakers`).
 
     Parameters
     ----------
     eccserver_pk : int
         The primary key of the ECC server in the database.
+    lease_token : str, optional
+        The token of the poll lease on the ECC server, if the task was queued by
+        :func:`check_ecc_server_online_all_task`. The lease is released when the task finishes.
 
     """
     try:
@@ -105,29 +193,50 @@ def check_ecc_server_online_task(eccserver_pk):
         return
 
     try:
-        with WorkerInterface(ecc_server.ip_address) as wint:
+        with circuit_breaker(ssh_host(ecc_server.ip_address)), \
+                host_slot(ssh_host(ecc_server.ip_address), 'check_ecc_server_status', HostSlot.POLL), \
+                WorkerInterface(ecc_server.ip_address) as wint:
             ecc_alive = wint.check_ecc_server_status()
 
         ecc_server.is_online = ecc_alive
         ecc_server.save()
+
+        metrics.ECC_ONLINE.set(ecc_alive, ecc_server=ecc_server.name)
+        metrics.LAST_POLL_TIME.set(time.time(), host=ecc_server.name, poll='ecc_online')
+    except CircuitOpenError as err:
+        mark_offline(ecc_server, err)
+    except HostBusyError as err:
+        logger.warning('Skipped checking whether %s is online: %s', ecc_server.name, err)
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while checking whether %s is online', ecc_server.name)
     except Exception:
         logger.exception('Failed to check whether %s is online', ecc_server.name)
+    finally:
+        release_poll_lease('ecc_online', eccserver_pk, lease_token)
 
 
 @shared_task(soft_time_limit=60, time_limit=80)
 def check_ecc_server_online_all_task():
     """Check and update the state of all known ECC servers.
 
-    This calls :func:`check_ecc_server_online_task` for each ECC server.
+    This calls :func:`check_ecc_server_online_task` for each ECC server in the active experiment that is due to
+    be checked (see :mod:`attpcdaq.daq.pollschedule`), skipping any server whose last check hasn't finished (see
+    :mod:`attpcdaq.daq.pollleases`).
 
     """
     try:
-        pks = ECCServer.objects.filter(experiment__is_active=True).values_list('pk', flat=True)
-        if pks.exists():
-            gp = group([check_ecc_server_online_task.s(i) for i in pks])
-            gp()
+        if not poll_cycle_is_due('ecc_online'):
+            skip_task_timing(check_ecc_server_online_all_task)
+            return
+
+        with metrics.POLL_CYCLE_DURATION.time(poll='ecc_online'):
+            experiment = Experiment.objects.filter(is_active=True).select_related('poll_schedule').first()
+            token, pks = start_poll_cycle('ecc_online', experiment, ECCServer.objects.filter(experiment=experiment))
+            if pks:
+                gp = group([check_ecc_server_online_task.s(i, token) for i in pks])
+                gp()
+            else:
+                skip_task_timing(check_ecc_server_online_all_task)
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while refreshing state of all ECC servers')
     except Exception:
@@ -135,19 +244,25 @@ def check_ecc_server_online_all_task():
 
 
 @shared_task(soft_time_limit=10, time_limit=40)
-def check_data_router_status_task(datarouter_pk):
+def check_data_router_status_task(datarouter_pk, lease_token=None):
     """Checks whether the data router is online and if the staging directory is clean.
 
     This is done by checking if the process is running via SSH. Specifically, the method
     :meth:`~attpcdaq.daq.workertasks.WorkerInterface.check_data_router_status` of the
     :class:`~attpcdaq.daq.workertasks.WorkerInterface` object is used. Then, the staging directory
     is checked for GRAW files using :meth:`~attpcdaq.daq.workertasks.WorkerInterface.working_dir_is_clean`
-    from the same class.
+    from the same class, and the free space on its volume is recorded using
+    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.get_disk_usage`. If the computer has failed to answer several
+    times in a row, it isn't contacted, and the data router is marked offline instead (see
+    :mod:`attpcdaq.daq.circuitbreakers`).
 
     Parameters
     ----------
     datarouter_pk : int
         The primary key of the data router in the database.
+    lease_token : str, optional
+        The token of the poll lease on the data router, if the task was queued by
+        :func:`check_data_router_status_all_task`. The lease is released when the task finishes.
 
     """
     try:
@@ -157,7 +272,9 @@ def check_data_router_status_task(datarouter_pk):
         return
 
     try:
-        with WorkerInterface(data_router.ip_address) as wint:
+        with circuit_breaker(ssh_host(data_router.ip_address)), \
+                host_slot(ssh_host(data_router.ip_address), 'check_data_router_status', HostSlot.POLL), \
+                WorkerInterface(data_router.ip_address) as wint:
             data_router_alive = wint.check_data_router_status()
             data_router.is_online = data_router_alive
 
@@ -165,39 +282,278 @@ def check_data_router_status_task(datarouter_pk):
                 # If the router isn't running, this next step will fail anyway
                 staging_dir_clean = wint.working_dir_is_clean()
                 data_router.staging_directory_is_clean = staging_dir_clean
+                disk_total, disk_free = wint.get_disk_usage()
+
+        # Only save the fields set here, since a data rate sample may have been saved during the SSH calls
+        data_router.save(update_fields=['is_online', 'staging_directory_is_clean'])
+
+        if data_router_alive:
+            data_router.record_disk_usage(disk_total, disk_free)
 
-        data_router.save()
+        metrics.DATA_ROUTER_ONLINE.set(data_router.is_online, data_router=data_router.name)
+        metrics.DATA_ROUTER_CLEAN.set(data_router.staging_directory_is_clean, data_router=data_router.name)
+        metrics.LAST_POLL_TIME.set(time.time(), host=data_router.name, poll='data_router_status')
+    except CircuitOpenError as err:
+        mark_offline(data_router, err)
+    except HostBusyError as err:
+        logger.warning('Skipped checking whether %s is online: %s', data_router.name, err)
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while checking whether %s is online', data_router.name)
     except Exception:
         logger.exception('Failed to check whether %s is online', data_router.name)
+    finally:
+        release_poll_lease('data_router_status', datarouter_pk, lease_token)
 
 
 @shared_task(soft_time_limit=60, time_limit=80)
 def check_data_router_status_all_task():
     """Check and update the state of all known data routers.
 
-    This calls :func:`check_data_router_status_task` for each data router.
+    This calls :func:`check_data_router_status_task` for each data router in the active experiment that is due
+    to be checked (see :mod:`attpcdaq.daq.pollschedule`), skipping any router whose last check hasn't finished
+    (see :mod:`attpcdaq.daq.pollleases`).
 
     """
     try:
-        pks = DataRouter.objects.filter(experiment__is_active=True).values_list('pk', flat=True)
-        if pks.exists():
-            gp = group([check_data_router_status_task.s(i) for i in pks])
-            gp()
+        if not poll_cycle_is_due('data_router_status'):
+            skip_task_timing(check_data_router_status_all_task)
+            return
+
+        with metrics.POLL_CYCLE_DURATION.time(poll='data_router_status'):
+            experiment = Experiment.objects.filter(is_active=True).select_related('poll_schedule').first()
+            token, pks = start_poll_cycle('data_router_status', experiment,
+                                          DataRouter.objects.filter(experiment=experiment))
+            if pks:
+                gp = group([check_data_router_status_task.s(i, token) for i in pks])
+                gp()
+            else:
+                skip_task_timing(check_data_router_status_all_task)
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while refreshing state of all data routers')
     except Exception:
         logger.exception('Failed to refresh state of all data routers')
 
 
+@shared_task(soft_time_limit=5, time_limit=10)
+def sample_data_rate_task(datarouter_pk, lease_token=None):
+    """Samples the size of a data router's staging directory to measure its data rate.
+
+    The total size of the GRAW files is found using
+    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.get_graw_size`, and it is recorded using
+    :meth:`~attpcdaq.daq.models.DataRouter.record_data_sample`. Like :func:`check_data_router_status_task`, this
+    marks the data router offline without contacting it if its computer has failed to answer several times in a row.
+
+    Parameters
+    ----------
+    datarouter_pk : int
+        The primary key of the data router in the database.
+    lease_token : str, optional
+        The token of the poll lease on the data router, if the task was queued by :func:`sample_data_rate_all_task`.
+        The lease is released when the task finishes.
+
+    """
+    try:
+        data_router = DataRouter.objects.get(pk=datarouter_pk)
+    except DataRouter.DoesNotExist:
+        logger.error('No data router exists with pk %d', datarouter_pk)
+        return
+
+    try:
+        with circuit_breaker(ssh_host(data_router.ip_address)), \
+                host_slot(ssh_host(data_router.ip_address), 'get_graw_size', HostSlot.POLL), \
+                WorkerInterface(data_router.ip_address) as wint:
+            total_bytes = wint.get_graw_size()
+
+        data_router.record_data_sample(total_bytes)
+    except CircuitOpenError as err:
+        mark_offline(data_router, err)
+    except HostBusyError as err:
+        logger.warning('Skipped sampling data rate of %s: %s', data_router.name, err)
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while sampling data rate of %s', data_router.name)
+    except Exception:
+        logger.exception('Failed to sample data rate of %s', data_router.name)
+    finally:
+        release_poll_lease('data_rate', datarouter_pk, lease_token)
+
+
+@shared_task(soft_time_limit=5, time_limit=10)
+def sample_data_rate_all_task():
+    """Sample the data rate of all data routers in the active experiment.
+
+    This calls :func:`sample_data_rate_task` for each data router that is due to be sampled (see
+    :mod:`attpcdaq.daq.pollschedule`) and whose last sample has finished (see :mod:`attpcdaq.daq.pollleases`), but
+    only while a run is in progress. When no run is in progress, the data rates are cleared so that the next run
+    starts from a new baseline.
+
+    """
+    try:
+        if not poll_cycle_is_due('data_rate'):
+            skip_task_timing(sample_data_rate_all_task)
+            return
+
+        experiment = Experiment.objects.filter(is_active=True).select_related('poll_schedule').first()
+        routers = DataRouter.objects.filter(experiment=experiment)
+
+        if experiment is not None and experiment.is_running:
+            with metrics.POLL_CYCLE_DURATION.time(poll='data_rate'):
+                token, pks = start_poll_cycle('data_rate', experiment, routers, is_running=True)
+                if pks:
+                    gp = group([sample_data_rate_task.s(i, token) for i in pks])
+                    gp()
+                else:
+                    skip_task_timing(sample_data_rate_all_task)
+        else:
+            routers.filter(last_sample_time__isnull=False).update(data_rate=0, is_stalled=False,
+                                                                  last_sample_time=None, last_growth_time=None)
+            if experiment is not None:
+                postpone_poll_cycle('data_rate', experiment)
+            skip_task_timing(sample_data_rate_all_task)
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while sampling data rates')
+    except Exception:
+        logger.exception('Failed to sample data rates')
+
+
+@shared_task(soft_time_limit=20, time_limit=30)
+def prune_task_timings_task():
+    """Delete task timing records older than the ``TASK_TIMING_HISTORY`` setting.
+
+    The records are made by the signal handlers in :mod:`attpcdaq.daq.instrumentation`.
+
+    """
+    try:
+        history = getattr(settings, 'TASK_TIMING_HISTORY', timedelta(hours=1))
+        TaskTiming.objects.filter(start_time__lt=datetime.now() - history).delete()
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while pruning task timings')
+    except Exception:
+        logger.exception('Failed to prune task timings')
+
+
+@shared_task(soft_time_limit=20, time_limit=30)
+def prune_samples_task():
+    """Delete data rate samples older than the ``DATA_RATE_HISTORY`` setting, and disk usage samples older than the
+    ``DISK_USAGE_HISTORY`` setting.
+
+    The samples are recorded by :func:`sample_data_rate_task` and :func:`check_data_router_status_task`.
+
+    """
+    try:
+        now = datetime.now()
+        data_rate_history = getattr(settings, 'DATA_RATE_HISTORY', timedelta(hours=1))
+        DataRateSample.objects.filter(time__lt=now - data_rate_history).delete()
+
+        disk_usage_history = getattr(settings, 'DISK_USAGE_HISTORY', timedelta(hours=6))
+        DiskUsageSample.objects.filter(time__lt=now - disk_usage_history).delete()
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while pruning samples')
+    except Exception:
+        logger.exception('Failed to prune samples')
+
+
+@shared_task(soft_time_limit=20, time_limit=30)
+def prune_trace_spans_task():
+    """Delete trace spans older than the ``TRACE_HISTORY`` setting.
+
+    The spans are recorded by :mod:`attpcdaq.daq.tracing`.
+
+    """
+    try:
+        history = getattr(settings, 'TRACE_HISTORY', timedelta(days=1))
+        TraceSpan.objects.filter(start_time__lt=datetime.now() - history).delete()
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while pruning trace spans')
+    except Exception:
+        logger.exception('Failed to prune trace spans')
+
+
+@shared_task(soft_time_limit=20, time_limit=30)
+def reconcile_transitions_task():
+    """Find ECC server transitions that have outlasted their timeouts, and clear or escalate the stale flags.
+
+    This calls :func:`~attpcdaq.daq.watchdog.reconcile_transitions`. It is run periodically by Celery beat.
+
+    """
+    try:
+        reconcile_transitions()
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while reconciling transitions')
+    except Exception:
+        logger.exception('Failed to reconcile transitions')
+
+
+def organize_remote_files(ip_address, experiment_name, run_number):
+    """Organize the files on a data router's host and check that its staging directory is left clean.
+
+    This only talks to the remote host, so it is safe to call from several threads at once. The caller should hold
+    a slot on the host (see :mod:`~attpcdaq.daq.hostlimits`).
+
+    Parameters
+    ----------
+    ip_address : str
+        The address of the data router's host.
+    experiment_name : str
+        The name of the experiment.
+    run_number : int
+        The number of the run that the files belong to.
+
+    Returns
+    -------
+    inventory : list[dict]
+        The files in the run directory, as returned by
+        :meth:`~attpcdaq.daq.workertasks.WorkerInterface.organize_files`.
+    is_clean : bool
+        Whether the staging directory was clean after the files were moved.
+
+    """
+    with WorkerInterface(ip_address) as wint:
+        inventory = wint.organize_files(experiment_name, run_number)
+        is_clean = wint.working_dir_is_clean()
+
+    return inventory, is_clean
+
+
+def record_organized_files(router, experiment, run, inventory, is_clean):
+    """Store the result of :func:`organize_remote_files` and queue the checksums of the files.
+
+    Parameters
+    ----------
+    router : DataRouter
+        The data router whose files were organized.
+    experiment : Experiment
+        The experiment.
+    run : RunMetadata
+        The run that the files belong to.
+    inventory, is_clean
+        The results of :func:`organize_remote_files`.
+
+    """
+    router.staging_directory_is_clean = is_clean
+    router.save(update_fields=['staging_directory_is_clean'])
+
+    RunFile.objects.filter(run=run, data_router=router).delete()
+    RunFile.objects.bulk_create([
+        RunFile(run=run, data_router=router, path=f['path'], size=f['size'],
+                mtime=datetime.fromtimestamp(f['mtime']))
+        for f in inventory
+    ])
+
+    # This runs separately so that it doesn't hold up the start of the next run
+    checksum_run_files_task.delay(router.pk, experiment.pk, run.pk)
+
+
 @shared_task(soft_time_limit=30, time_limit=40)
 def organize_files_task(datarouter_pk, experiment_pk, run_pk):
     """Connects to the DAQ worker nodes to organize files at the end of a run.
 
     This is done via SSH using the method
     :meth:`~attpcdaq.daq.workertasks.WorkerInterface.organize_files` of the
-    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object.
+    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object. The staging directory is then checked with
+    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.working_dir_is_clean` in the same session, so the data
+    router is marked clean without waiting for the next status check. The files found in the run directory are
+    recorded as :class:`~attpcdaq.daq.models.RunFile` objects, replacing any previously recorded for this
+    data router and run. Finally, :func:`checksum_run_files_task` is queued to compute checksums of the files.
 
     Parameters
     ----------
@@ -218,11 +574,9 @@ def organize_files_task(datarouter_pk, experiment_pk, run_pk):
         return
 
     try:
-        with WorkerInterface(router.ip_address) as wint:
-            wint.organize_files(experiment.name, run.run_number)
-
-        router.staging_directory_is_clean = True
-        router.save()
+        with host_slot(ssh_host(router.ip_address), 'organize_files'):
+            inventory, is_clean = organize_remote_files(router.ip_address, experiment.name, run.run_number)
+        record_organized_files(router, experiment, run, inventory, is_clean)
 
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while organizing files at for data source %s', router.name)
@@ -230,6 +584,56 @@ def organize_files_task(datarouter_pk, experiment_pk, run_pk):
         logger.exception('Organize files task failed')
 
 
+@shared_task(soft_time_limit=600, time_limit=660)
+def checksum_run_files_task(datarouter_pk, experiment_pk, run_pk):
+    """Computes checksums of the GRAW files from a run and records them in the database.
+
+    The checksums are computed on the data router's host using
+    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.checksum_graw_files`, which also writes a manifest next to
+    the run directory. The algorithm and the number of files hashed at once are set by the settings
+    ``GRAW_CHECKSUM_ALGORITHM`` and ``GRAW_CHECKSUM_PARALLELISM``. The results are stored in the
+    corresponding :class:`~attpcdaq.daq.models.RunFile` objects.
+
+    Parameters
+    ----------
+    datarouter_pk : int
+        Integer primary key of the data router
+    experiment_pk : int
+        The primary key of the current experiment
+    run_pk : int
+        The primary key of the run whose files should be checked
+
+    """
+    try:
+        experiment = Experiment.objects.get(pk=experiment_pk)
+        run = RunMetadata.objects.get(pk=run_pk)
+        router = DataRouter.objects.get(pk=datarouter_pk)
+    except ObjectDoesNotExist:
+        logger.exception('Checksum task failed: invalid primary key given.')
+        return
+
+    algorithm = getattr(settings, 'GRAW_CHECKSUM_ALGORITHM', 'sha256')
+    parallelism = getattr(settings, 'GRAW_CHECKSUM_PARALLELISM', 4)
+
+    try:
+        lease = checksum_run_files_task.time_limit  # Hashing a large run can take a long time
+        with host_slot(ssh_host(router.ip_address), 'checksum_graw_files', lease=lease), \
+                WorkerInterface(router.ip_address) as wint:
+            checksums = wint.checksum_graw_files(experiment.name, run.run_number, algorithm, parallelism)
+
+        with transaction.atomic():
+            for path, digest in checksums.items():
+                updated = RunFile.objects.filter(run=run, data_router=router, path=path) \
+                    .update(checksum=digest, checksum_algorithm=algorithm)
+                if updated == 0:
+                    logger.warning('Computed checksum for unrecorded file %s on %s', path, router.name)
+
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while computing checksums for data router %s', router.name)
+    except Exception:
+        logger.exception('Checksum task failed')
+
+
 @shared_task(soft_time_limit=30, time_limit=40)
 def organize_files_all_task(experiment_pk, run_pk):
     """Organize files on all remote nodes.
@@ -255,13 +659,63 @@ def organize_files_all_task(experiment_pk, run_pk):
         logger.exception('Failed to reorganize files on all nodes')
 
 
+def store_config_backup(wint, ecc, run):
+    """Back up an ECC server's config files into the content-addressed store and record the run's manifest.
+
+    The files are hashed on the remote host, and only files whose checksums are not yet known to be in the store
+    are copied there. A :class:`~attpcdaq.daq.models.ConfigManifestEntry` is then created for each file, replacing
+    any entries already recorded for this ECC server and run.
+
+    Parameters
+    ----------
+    wint : attpcdaq.daq.workertasks.WorkerInterface
+        An open connection to the ECC server's computer.
+    ecc : attpcdaq.daq.models.ECCServer
+        The ECC server whose config files should be backed up.
+    run : attpcdaq.daq.models.RunMetadata
+        The run that used the config files.
+
+    Returns
+    -------
+    dict
+        The SHA-256 checksum of each file, keyed by file name.
+
+    """
+    store_root = ecc.config_backup_root
+    checksums = wint.hash_files(ecc.config_file_paths())
+
+    stored_blobs = ConfigBlob.objects.filter(host=ecc.ip_address, store_root=store_root,
+                                             checksum__in=checksums.values())
+    blobs = {blob.checksum: blob for blob in stored_blobs}
+
+    missing = {path: digest for path, digest in checksums.items() if digest not in blobs}
+    if missing:
+        wint.store_blobs(missing, store_root)
+        for digest in set(missing.values()):
+            blobs[digest], _ = ConfigBlob.objects.get_or_create(checksum=digest, host=ecc.ip_address,
+                                                                store_root=store_root)
+
+    ConfigManifestEntry.objects.filter(run=run, ecc_server=ecc).delete()
+    ConfigManifestEntry.objects.bulk_create([
+        ConfigManifestEntry(run=run, ecc_server=ecc, file_name=os.path.basename(path),
+                            checksum=digest, blob=blobs[digest])
+        for path, digest in checksums.items()
+    ])
+
+    return {os.path.basename(path): digest for path, digest in checksums.items()}
+
+
 @shared_task(soft_time_limit=30, time_limit=40)
 def backup_config_files_task(ecc_pk, experiment_pk, run_pk):
     """Makes a backup copy of the config files for the most recent run.
 
     Backups are stored in the directory specified in the ECC server's attribute
-    :attr:`~attpcdaq.daq.models.ECCServer.config_backup_root`. The backup is done using
-    the :class:`~attpcdaq.daq.workertasks.WorkerInterface` method
+    :attr:`~attpcdaq.daq.models.ECCServer.config_backup_root`. How the backup is made depends on the
+    ``CONFIG_BACKUP_MODE`` setting. In ``'store'`` mode, the files are added to a content-addressed store on
+    the remote host and the run's manifest is recorded in the database (see :func:`store_config_backup`).
+    In ``'archive'`` mode, the files are bundled into one compressed archive
+    on the remote host using :meth:`~attpcdaq.daq.workertasks.WorkerInterface.archive_config_files`. In
+    ``'copy'`` mode, each file is copied individually over SFTP using
     :meth:`~attpcdaq.daq.workertasks.WorkerInterface.backup_config_files`.
 
     Parameters
@@ -273,6 +727,12 @@ def backup_config_files_task(ecc_pk, experiment_pk, run_pk):
     run_pk : int
         The primary key of the most recent run.
 
+    Returns
+    -------
+    dict or None
+        In ``'store'`` and ``'archive'`` modes, the SHA-256 checksum of each backed-up file, keyed by file name.
+        Otherwise None.
+
     """
     try:
         experiment = Experiment.objects.get(pk=experiment_pk)
@@ -282,9 +742,18 @@ def backup_config_files_task(ecc_pk, experiment_pk, run_pk):
         logger.exception('One of the provided primary keys was invalid')
         return
 
+    backup_mode = getattr(settings, 'CONFIG_BACKUP_MODE', 'store')
+
     try:
-        with WorkerInterface(ecc.ip_address) as wint:
-            wint.backup_config_files(experiment.name, run.run_number, ecc.config_file_paths(), ecc.config_backup_root)
+        with host_slot(ssh_host(ecc.ip_address), 'backup_config_files'), WorkerInterface(ecc.ip_address) as wint:
+            if backup_mode == 'store':
+                return store_config_backup(wint, ecc, run)
+            elif backup_mode == 'archive':
+                return wint.archive_config_files(experiment.name, run.run_number, ecc.config_file_paths(),
+                                                 ecc.config_backup_root)
+            else:
+                wint.backup_config_files(experiment.name, run.run_number, ecc.config_file_paths(),
+                                         ecc.config_backup_root)
 
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while backing up configs for ECC server %s', ecc.name)
@@ -318,3 +787,383 @@ def backup_config_files_all_task(experiment_pk, run_pk):
         logger.error('Time limit exceeded while backing up config files on all nodes')
     except Exception:
         logger.exception('Failed to back up config files on all nodes')
+
+
+def roll_over_run(experiment, start_next=True):
+    """Stop the current run, organize its files, and start the next run.
+
+    The ECC servers are stopped with :func:`~attpcdaq.daq.runcontrol.change_state_in_phases`, which moves on as
+    soon as each group of servers has stopped. The files are then organized on all data routers at once, and the
+    cleanliness of each staging directory is taken from the result, so the next run can start without waiting
+    for :func:`check_data_router_status_task`. The config files are backed up by
+    :func:`backup_config_files_all_task` in the background.
+
+    The time taken by each phase is added to the run rollover histogram in :mod:`attpcdaq.metrics`.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment. A run must be in progress.
+    start_next : bool, optional
+        If False, the DAQ is left stopped once the files are organized.
+
+    Returns
+    -------
+    dict
+        The time taken by each phase, in seconds, with the keys ``stop``, ``organize``, ``start``, and ``total``.
+        The ``start`` phase is left out if ``start_next`` is False.
+
+    Raises
+    ------
+    RunControlError
+        If there is no run in progress, or if a step fails. The run is marked as stopped as soon as the stop is
+        requested, so it stays stopped if a later step fails, and the next run isn't started. If the ECC servers
+        fail to stop, the files are organized by :func:`organize_files_all_task` as after a manual stop.
+
+    """
+    run = experiment.latest_run
+    if run is None or run.stop_datetime is not None:
+        raise RunControlError('No run is in progress')
+
+    ecc_servers = list(experiment.eccserver_set.all())
+    data_routers = list(experiment.datarouter_set.all())
+
+    timings = {}
+    start = time.monotonic()
+
+    with span('Stop', TraceSpan.WAIT):
+        experiment.stop_run()
+        backup_config_files_all_task.delay(experiment.pk, run.pk)
+        try:
+            change_state_in_phases(ecc_servers, ECCServer.READY, is_running=True)
+        except Exception:
+            # Leave the files as a manual stop would
+            organize_files_all_task.delay(experiment.pk, run.pk)
+            raise
+
+    timings['stop'] = time.monotonic() - start
+
+    with span('Organize files', TraceSpan.WAIT):
+        if data_routers:
+            hosts = [ssh_host(router.ip_address) for router in data_routers]
+            with host_slots(hosts, 'organize_files', HostSlot.TRANSITION), \
+                    ThreadPoolExecutor(max_workers=len(data_routers)) as executor:
+                futures = [executor.submit(organize_remote_files, router.ip_address, experiment.name,
+                                           run.run_number)
+                           for router in data_routers]
+
+            not_clean = []
+            for router, future in zip(data_routers, futures):
+                try:
+                    inventory, is_clean = future.result()
+                except Exception as err:
+                    raise RunControlError('Failed to organize files on {}: {}'.format(router.name, err)) from err
+
+                record_organized_files(router, experiment, run, inventory, is_clean)
+                if not is_clean:
+                    not_clean.append(router.name)
+
+            if not_clean:
+                raise RunControlError('Staging directory not clean after organizing files: '
+                                      '{}'.format(', '.join(not_clean)))
+
+    timings['organize'] = time.monotonic() - start - timings['stop']
+
+    if start_next:
+        with span('Start', TraceSpan.WAIT):
+            experiment.check_disk_space()  # This only warns
+            change_state_in_phases(ecc_servers, ECCServer.RUNNING, is_running=False)
+            experiment.start_run()
+
+    timings['total'] = time.monotonic() - start
+    if start_next:
+        timings['start'] = timings['total'] - timings['stop'] - timings['organize']
+
+    for phase, duration in timings.items():
+        metrics.RUN_ROLLOVER_DURATION.observe(duration, phase=phase)
+
+    return timings
+
+
+@shared_task(soft_time_limit=300, time_limit=330)
+def next_run_task(experiment_pk):
+    """Roll over from the current run to the next one as quickly as possible.
+
+    This calls :func:`roll_over_run` and logs how long it took.
+
+    Parameters
+    ----------
+    experiment_pk : int
+        The primary key of the experiment.
+
+    """
+    try:
+        experiment = Experiment.objects.get(pk=experiment_pk)
+    except Experiment.DoesNotExist:
+        logger.error('No experiment exists with pk %d', experiment_pk)
+        return
+
+    try:
+        timings = roll_over_run(experiment)
+        logger.info('Started run %d after %.1f s (stop %.1f s, organize %.1f s, start %.1f s)',
+                    experiment.latest_run.run_number, timings['total'], timings['stop'], timings['organize'],
+                    timings['start'])
+    except RunControlError as err:
+        logger.error('Run rollover failed: %s', err)
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while rolling over to the next run')
+    except Exception:
+        logger.exception('Run rollover failed')
+
+
+def change_experiment_state(experiment, target_state):
+    """Bring all ECC servers of an experiment to the target state, however many steps away it is.
+
+    The steps are made by :func:`~attpcdaq.daq.runcontrol.change_state_to`. If a run is in progress and the target
+    is below :attr:`~attpcdaq.daq.models.ECCServer.RUNNING`, the run is first stopped as with the "Stop all" button,
+    and its files are organized and its config files backed up in the background. If the target is
+    :attr:`~attpcdaq.daq.models.ECCServer.RUNNING`, a new run is started once every server is running.
+
+    The total time and the time taken by each step are added to the state change histograms in
+    :mod:`attpcdaq.metrics`. The total from Idle to Running is the cold-start time of the system.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment.
+    target_state : int
+        The state to bring the ECC servers to.
+
+    Returns
+    -------
+    total : float
+        The total time taken, in seconds.
+    steps : list[tuple(str, float)]
+        The name of each transition and the time it took, in seconds, in order.
+
+    Raises
+    ------
+    RunControlError
+        If a step fails. The steps that have already finished are not undone.
+
+    """
+    ecc_servers = list(experiment.eccserver_set.all())
+    states = {e.state for e in ecc_servers}
+    from_state = ECCServer.STATE_DICT[states.pop()] if len(states) == 1 else 'Mixed'
+    to_state = ECCServer.STATE_DICT[target_state]
+
+    steps = []
+    start = time.monotonic()
+
+    if experiment.is_running and target_state < ECCServer.RUNNING:
+        steps += change_state_to(ecc_servers, ECCServer.READY)
+        run = experiment.latest_run
+        experiment.stop_run()
+        organize_files_all_task.delay(experiment.pk, run.pk)
+        backup_config_files_all_task.delay(experiment.pk, run.pk)
+
+    steps += change_state_to(ecc_servers, target_state)
+
+    if target_state == ECCServer.RUNNING and not experiment.is_running:
+        experiment.start_run()
+
+    total = time.monotonic() - start
+
+    metrics.STATE_CHANGE_DURATION.observe(total, from_state=from_state, to_state=to_state)
+    for name, duration in steps:
+        metrics.STATE_CHANGE_STEP_DURATION.observe(duration, transition=name)
+
+    return total, steps
+
+
+@shared_task(soft_time_limit=600, time_limit=630)
+def change_state_all_task(experiment_pk, target_state):
+    """Bring all ECC servers of an experiment to a state more than one step away.
+
+    This calls :func:`change_experiment_state` and logs how long each step took.
+
+    Parameters
+    ----------
+    experiment_pk : int
+        The primary key of the experiment.
+    target_state : int
+        The state to bring the ECC servers to.
+
+    """
+    try:
+        experiment = Experiment.objects.get(pk=experiment_pk)
+    except Experiment.DoesNotExist:
+        logger.error('No experiment exists with pk %d', experiment_pk)
+        return
+
+    state_name = ECCServer.STATE_DICT.get(target_state, target_state)
+
+    try:
+        total, steps = change_experiment_state(experiment, target_state)
+        logger.info('Reached state %s in %.1f s (%s)', state_name, total,
+                    ', '.join('{} {:.1f} s'.format(name, duration) for name, duration in steps))
+    except RunControlError as err:
+        logger.error('Failed to change state to %s: %s', state_name, err)
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while changing state to %s', state_name)
+    except Exception:
+        logger.exception('Failed to change state to %s', state_name)
+
+
+def check_run_sequence(sequence, now=None):
+    """Start a rollover if the current run of a sequence has reached its limit.
+
+    If a rollover is already in progress, nothing is done, unless it started so long ago that the task performing it
+    must have died. The rollover is claimed by setting :attr:`~attpcdaq.daq.models.RunSequence.rollover_started_time`
+    with a conditional update, so only one rollover can be started for a boundary even if the checks overlap.
+
+    Parameters
+    ----------
+    sequence : RunSequence
+        An active run sequence.
+    now : datetime, optional
+        The current time.
+
+    """
+    if now is None:
+        now = datetime.now()
+
+    if sequence.rollover_started_time is not None:
+        if now - sequence.rollover_started_time < timedelta(seconds=run_sequence_boundary_task.time_limit):
+            return
+        logger.warning('The rollover for %s was abandoned. Trying again.', sequence)
+        RunSequence.objects.filter(pk=sequence.pk).update(rollover_started_time=None)
+
+    experiment = sequence.experiment
+    run = experiment.latest_run
+    if run is None or run.stop_datetime is not None:
+        logger.warning('The run was stopped outside of %s, so it was cancelled', sequence)
+        RunSequence.objects.filter(pk=sequence.pk, state=RunSequence.ACTIVE).update(
+            state=RunSequence.CANCELLED, finished_time=now, message='The run was stopped outside of the sequence')
+        return
+
+    boundary = sequence.find_boundary(run, experiment.datarouter_set.all(), now)
+    if boundary is None:
+        return
+
+    claimed = RunSequence.objects.filter(pk=sequence.pk, state=RunSequence.ACTIVE,
+                                         rollover_started_time__isnull=True).update(rollover_started_time=now)
+    if not claimed:
+        return
+
+    reason, planned_time = boundary
+    run_boundary = RunBoundary.objects.create(sequence=sequence, run=run, reason=reason, planned_time=planned_time)
+    run_sequence_boundary_task.delay(run_boundary.pk)
+
+
+@shared_task(soft_time_limit=5, time_limit=10)
+def run_sequencer_task():
+    """Check each active run sequence, and start a rollover for any that have reached a limit.
+
+    This calls :func:`check_run_sequence` for each active :class:`~attpcdaq.daq.models.RunSequence`. It is run
+    periodically by Celery beat.
+
+    """
+    try:
+        for sequence in RunSequence.objects.filter(state=RunSequence.ACTIVE).select_related('experiment'):
+            check_run_sequence(sequence)
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while checking run sequences')
+    except Exception:
+        logger.exception('Failed to check run sequences')
+
+
+@shared_task(soft_time_limit=300, time_limit=330)
+def run_sequence_boundary_task(boundary_pk):
+    """End a run of a sequence and start the next one.
+
+    The rollover is performed by :func:`roll_over_run`. If this is the last run of the sequence, the DAQ is left
+    stopped and the sequence is finished. The actual stop and start times are recorded in the
+    :class:`~attpcdaq.daq.models.RunBoundary`.
+
+    Parameters
+    ----------
+    boundary_pk : int
+        The primary key of the boundary, which was created by :func:`check_run_sequence`.
+
+    """
+    try:
+        boundary = RunBoundary.objects.select_related('sequence__experiment', 'run').get(pk=boundary_pk)
+    except RunBoundary.DoesNotExist:
+        logger.error('No run boundary exists with pk %d', boundary_pk)
+        return
+
+    sequence = boundary.sequence
+    experiment = sequence.experiment
+    is_last_run = sequence.is_last_run
+    error = None
+
+    try:
+        sequence.refresh_from_db(fields=['state'])
+        if sequence.state != RunSequence.ACTIVE:
+            logger.info('%s was cancelled before the rollover started', sequence)
+            boundary.delete()
+            return
+
+        roll_over_run(experiment, start_next=not is_last_run)
+    except RunControlError as err:
+        error = str(err)
+        logger.error('Run rollover for %s failed: %s', sequence, err)
+    except SoftTimeLimitExceeded:
+        error = 'Time limit exceeded'
+        logger.error('Time limit exceeded while rolling over runs for %s', sequence)
+    except Exception as err:
+        error = str(err)
+        logger.exception('Run rollover for %s failed', sequence)
+    finally:
+        try:
+            record_run_boundary(boundary, failed=error is not None, is_last_run=is_last_run, message=error)
+        except Exception:
+            logger.exception('Failed to record the result of the rollover for %s', sequence)
+
+
+def record_run_boundary(boundary, failed, is_last_run, message=None):
+    """Store the result of a rollover and update the sequence.
+
+    Parameters
+    ----------
+    boundary : RunBoundary
+        The boundary.
+    failed : bool
+        Whether the rollover failed.
+    is_last_run : bool
+        Whether the run that ended was the last in the sequence.
+    message : str, optional
+        A description of the failure.
+
+    """
+    if boundary.pk is None:
+        # The sequence was cancelled before the rollover started
+        RunSequence.objects.filter(pk=boundary.sequence.pk).update(rollover_started_time=None)
+        return
+
+    now = datetime.now()
+    experiment = boundary.sequence.experiment
+
+    if boundary.run is not None:
+        boundary.run.refresh_from_db()
+        boundary.stop_time = boundary.run.stop_datetime
+
+    latest_run = experiment.latest_run
+    if latest_run is not None and latest_run != boundary.run:
+        boundary.next_run = latest_run
+        boundary.start_time = latest_run.start_datetime
+
+    boundary.failed = failed
+    boundary.save()
+
+    update = {'rollover_started_time': None}
+    if boundary.stop_time is not None:
+        update['runs_completed'] = F('runs_completed') + 1
+    RunSequence.objects.filter(pk=boundary.sequence.pk).update(**update)
+
+    active = RunSequence.objects.filter(pk=boundary.sequence.pk, state=RunSequence.ACTIVE)
+    if failed:
+        active.update(state=RunSequence.FAILED, finished_time=now, message=(message or '')[:200])
+    elif is_last_run:
+        active.update(state=RunSequence.FINISHED, finished_time=now)
@@ -0,0 +1,153 @@
+"""Tests for the circuit breakers on the status checks"""
+
+from django.test import TestCase, override_settings
+from datetime import datetime, timedelta
+
+from ..models import CircuitBreaker, ECCServer, DataRouter, Experiment, ECCError
+from ..circuitbreakers import circuit_breaker, circuit_breaker_states, probe_interval, CircuitOpenError
+from ..hostlimits import HostBusyError
+from ... import metrics
+
+
+@override_settings(CIRCUIT_BREAKER_THRESHOLD=3, CIRCUIT_BREAKER_BACKOFF=5, CIRCUIT_BREAKER_MAX_BACKOFF=60)
+class CircuitBreakerTestCase(TestCase):
+    endpoint = 'ssh:10.0.0.1'
+
+    def run_failing_check(self, error=TimeoutError('timed out')):
+        """Run a failing check, and return the exception that came out of the breaker."""
+        try:
+            with circuit_breaker(self.endpoint):
+                raise error
+        except Exception as err:
+            return err
+
+    def run_check(self):
+        with circuit_breaker(self.endpoint):
+            pass
+
+    def open_breaker(self, next_probe_time, failed_probes=0):
+        return CircuitBreaker.objects.create(endpoint=self.endpoint, state=CircuitBreaker.OPEN, failures=3,
+                                             failed_probes=failed_probes, next_probe_time=next_probe_time)
+
+    def test_probe_interval(self):
+        self.assertEqual([probe_interval(n) for n in range(6)], [5, 10, 20, 40, 60, 60])
+
+    def test_success_creates_nothing(self):
+        self.run_check()
+        self.assertFalse(CircuitBreaker.objects.exists())
+
+    def test_failures_counted(self):
+        err = self.run_failing_check()
+        self.assertIsInstance(err, TimeoutError)
+
+        breaker = CircuitBreaker.objects.get()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.failures, 1)
+        self.assertEqual(breaker.last_error, 'TimeoutError: timed out')
+
+    def test_opens_after_threshold(self):
+        self.run_failing_check()
+        self.run_failing_check()
+        err = self.run_failing_check()
+
+        self.assertIsInstance(err, CircuitOpenError)
+        self.assertIsInstance(err.__cause__, TimeoutError)
+
+        breaker = CircuitBreaker.objects.get()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertAlmostEqual((breaker.next_probe_time - breaker.opened_time).total_seconds(), 5)
+        self.assertEqual(metrics.CIRCUIT_BREAKER_OPEN.get(endpoint=self.endpoint), 1)
+
+    def test_success_resets_count(self):
+        self.run_failing_check()
+        self.run_failing_check()
+        self.run_check()
+        self.assertIsInstance(self.run_failing_check(), TimeoutError)
+        self.assertEqual(CircuitBreaker.objects.get().failures, 1)
+
+    def test_ignored_errors(self):
+        self.assertIsInstance(self.run_failing_check(HostBusyError(self.endpoint, 2)), HostBusyError)
+        self.assertIsInstance(self.run_failing_check(ECCError('bad state')), ECCError)
+        self.assertFalse(CircuitBreaker.objects.exists())
+
+    def test_open_breaker_refuses_checks(self):
+        retry_time = datetime.now() + timedelta(seconds=30)
+        self.open_breaker(retry_time)
+        before = metrics.CIRCUIT_BREAKER_REJECTED.get(endpoint=self.endpoint) or 0
+
+        ran = []
+        with self.assertRaises(CircuitOpenError) as cm:
+            with circuit_breaker(self.endpoint):
+                ran.append(True)
+
+        self.assertEqual(ran, [])
+        self.assertEqual(cm.exception.retry_time, retry_time)
+        self.assertEqual(metrics.CIRCUIT_BREAKER_REJECTED.get(endpoint=self.endpoint), before + 1)
+
+    def test_probe_success_closes(self):
+        self.open_breaker(datetime.now() - timedelta(seconds=1), failed_probes=2)
+        self.run_check()
+
+        breaker = CircuitBreaker.objects.get()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(breaker.failures, 0)
+        self.assertEqual(breaker.failed_probes, 0)
+        self.assertIsNone(breaker.next_probe_time)
+
+    def test_probe_failure_backs_off(self):
+        self.open_breaker(datetime.now() - timedelta(seconds=1), failed_probes=1)
+
+        err = self.run_failing_check()
+        self.assertIsInstance(err, TimeoutError)
+
+        breaker = CircuitBreaker.objects.get()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.failed_probes, 2)
+        self.assertAlmostEqual((breaker.next_probe_time - breaker.last_failure_time).total_seconds(), 20)
+
+    def test_one_probe_at_a_time(self):
+        self.open_breaker(datetime.now() - timedelta(seconds=1))
+
+        with circuit_breaker(self.endpoint):
+            self.assertEqual(CircuitBreaker.objects.get().state, CircuitBreaker.HALF_OPEN)
+            with self.assertRaises(CircuitOpenError):
+                with circuit_breaker(self.endpoint):
+                    pass
+
+    def test_endpoints_are_separate(self):
+        self.open_breaker(datetime.now() + timedelta(seconds=30))
+        with circuit_breaker('ssh:10.0.0.2'):
+            pass
+
+
+class CircuitBreakerStatesTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.ecc_server = ECCServer.objects.create(name='CoBo[0]', ip_address='10.0.0.1', port=8083,
+                                                   experiment=self.experiment)
+        self.data_router = DataRouter.objects.create(name='DataRouter[0]', ip_address='10.0.0.1',
+                                                     experiment=self.experiment)
+
+    def test_states(self):
+        now = datetime.now()
+        CircuitBreaker.objects.create(endpoint='ssh:10.0.0.1', state=CircuitBreaker.OPEN, failures=5,
+                                      next_probe_time=now + timedelta(seconds=10), last_error='OSError')
+        CircuitBreaker.objects.create(endpoint='ecc:10.0.0.1:8083', failures=1)
+        CircuitBreaker.objects.create(endpoint='ecc:10.0.0.2:8083')
+
+        ecc, ssh = circuit_breaker_states([self.ecc_server], [self.data_router])
+
+        self.assertEqual(ssh['state'], 'Open')
+        self.assertTrue(ssh['is_open'])
+        self.assertEqual(ssh['targets'], ['CoBo[0]', 'DataRouter[0]'])
+        self.assertAlmostEqual(ssh['next_probe'], 10, delta=1)
+        self.assertEqual(ssh['last_error'], 'OSError')
+
+        self.assertEqual(ecc['state'], 'Closed')
+        self.assertFalse(ecc['is_open'])
+        self.assertEqual(ecc['targets'], ['CoBo[0]'])
+        self.assertIsNone(ecc['next_probe'])
+
+    def test_nothing_to_list(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(circuit_breaker_states(ECCServer.objects.all()), [])
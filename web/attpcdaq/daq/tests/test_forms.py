@@ -4,7 +4,9 @@ from django.test import TestCase
 from django import forms
 
 from ..forms import RunMetadataForm, DataSourceForm, ECCServerForm, DataRouterForm, ConfigSelectionForm, ObservableForm
+from ..forms import PollScheduleForm
 from ..models import RunMetadata, Observable, Measurement, Experiment, DataSource, ECCServer, DataRouter
+from ..models import PollSchedule
 
 
 class TestModelFormFieldsMixin(object):
@@ -34,7 +36,7 @@ class ECCServerFormTestCase(TestModelFormFieldsMixin, TestCase):
         self.form = ECCServerForm
 
     def get_excluded_fields(self):
-        return {'is_online', 'state', 'selected_config', 'is_transitioning', 'experiment'}
+        return {'is_online', 'state', 'selected_config', 'is_transitioning', 'transition_started_time', 'experiment'}
 
 
 class DataRouterFormTestCase(TestModelFormFieldsMixin, TestCase):
@@ -43,7 +45,8 @@ class DataRouterFormTestCase(TestModelFormFieldsMixin, TestCase):
         self.form = DataRouterForm
 
     def get_excluded_fields(self):
-        return {'is_online', 'staging_directory_is_clean', 'experiment'}
+        return {'is_online', 'staging_directory_is_clean', 'experiment', 'staging_bytes', 'data_rate', 'is_stalled',
+                'last_sample_time', 'last_growth_time', 'disk_total_bytes', 'disk_free_bytes'}
 
 
 class ConfigSelectionFormTestCase(TestModelFormFieldsMixin, TestCase):
@@ -134,3 +137,30 @@ class ObservableFormTestCase(TestModelFormFieldsMixin, TestCase):
 
     def get_excluded_fields(self):
         return {'experiment', 'order'}
+
+
+class PollScheduleFormTestCase(TestModelFormFieldsMixin, TestCase):
+    def setUp(self):
+        self.model = PollSchedule
+        self.form = PollScheduleForm
+
+    def get_excluded_fields(self):
+        return {'experiment'}
+
+    def get_data(self, **kwargs):
+        data = {name: PollSchedule._meta.get_field(name).default for name in self.form.Meta.fields}
+        data.update(kwargs)
+        return data
+
+    def test_valid(self):
+        self.assertTrue(self.form(data=self.get_data(transition_interval=0.25)).is_valid())
+
+    def test_interval_must_be_positive(self):
+        form = self.form(data=self.get_data(state_interval=0))
+        self.assertFalse(form.is_valid())
+        self.assertIn('state_interval', form.errors)
+
+    def test_factor_must_be_at_least_one(self):
+        form = self.form(data=self.get_data(idle_factor=0.5))
+        self.assertFalse(form.is_valid())
+        self.assertIn('idle_factor', form.errors)
@@ -0,0 +1,129 @@
+"""Tests for the per-host concurrency limits"""
+
+from django.test import TestCase, override_settings
+from datetime import datetime, timedelta
+
+from ..models import HostSlot, ECCServer, Experiment
+from ..hostlimits import host_slot, host_slots, host_usage, host_limit, ssh_host, ecc_host, HostBusyError
+
+
+@override_settings(HOST_CONCURRENCY={'ssh': 2, 'ecc': 1}, HOST_SLOT_RETRY_INTERVAL=0.01)
+class HostSlotTestCase(TestCase):
+    host = 'ssh:123.45.67.89'
+
+    def add_slot(self, is_running=True, priority=HostSlot.NORMAL, expires_in=60, host=None):
+        now = datetime.now()
+        return HostSlot.objects.create(host=host or self.host, operation='other', priority=priority,
+                                       is_running=is_running, created_time=now,
+                                       acquired_time=now if is_running else None,
+                                       expires_time=now + timedelta(seconds=expires_in))
+
+    def test_host_names(self):
+        experiment = Experiment.objects.create(name='Test')
+        ecc_server = ECCServer.objects.create(name='CoBo', ip_address='123.45.67.89', port=8083,
+                                              experiment=experiment)
+        self.assertEqual(ssh_host('123.45.67.89'), 'ssh:123.45.67.89')
+        self.assertEqual(ecc_host(ecc_server), 'ecc:123.45.67.89:8083')
+        self.assertEqual(host_limit(ecc_host(ecc_server)), 1)
+        self.assertEqual(host_limit(self.host), 2)
+
+    def test_slot_held_during_block(self):
+        with host_slot(self.host, 'organize_files'):
+            slot = HostSlot.objects.get()
+            self.assertEqual(slot.operation, 'organize_files')
+            self.assertTrue(slot.is_running)
+            self.assertIsNotNone(slot.acquired_time)
+
+        self.assertFalse(HostSlot.objects.exists())
+
+    def test_released_after_exception(self):
+        with self.assertRaises(RuntimeError):
+            with host_slot(self.host, 'organize_files'):
+                raise RuntimeError('Failed')
+
+        self.assertFalse(HostSlot.objects.exists())
+
+    def test_limit(self):
+        self.add_slot()
+        with host_slot(self.host, 'second'):
+            pass
+
+        self.add_slot()
+        with self.assertRaises(HostBusyError) as cm:
+            with host_slot(self.host, 'third', timeout=0.05):
+                self.fail('Got a slot over the limit')
+
+        self.assertEqual(cm.exception.host, self.host)
+        self.assertEqual(HostSlot.objects.count(), 2)  # The queued slot was removed
+
+    def test_other_hosts_not_limited(self):
+        self.add_slot()
+        self.add_slot()
+        with host_slot('ssh:123.45.67.90', 'other host', timeout=0):
+            pass
+
+    def test_transition_goes_ahead_of_poll(self):
+        self.add_slot(is_running=False, priority=HostSlot.POLL)
+        with host_slot(self.host, 'Start', HostSlot.TRANSITION, timeout=0):
+            pass
+
+    def test_poll_waits_behind_transition(self):
+        self.add_slot(is_running=False, priority=HostSlot.TRANSITION)
+        with self.assertRaises(HostBusyError):
+            with host_slot(self.host, 'GetState', HostSlot.POLL, timeout=0.05):
+                self.fail('Went ahead of a queued transition')
+
+    def test_first_come_first_served(self):
+        self.add_slot(is_running=False, priority=HostSlot.NORMAL)
+        with self.assertRaises(HostBusyError):
+            with host_slot(self.host, 'organize_files', timeout=0.05):
+                self.fail('Went ahead of an earlier operation')
+
+    def test_expired_slots_cleared(self):
+        self.add_slot(expires_in=-1)
+        self.add_slot(expires_in=-1)
+        with host_slot(self.host, 'organize_files', timeout=0):
+            self.assertEqual(HostSlot.objects.count(), 1)
+
+    def test_waits_for_free_slot(self):
+        self.add_slot()
+        self.add_slot(expires_in=0.1)
+        with host_slot(self.host, 'organize_files', timeout=2):
+            pass
+
+    @override_settings(HOST_CONCURRENCY=None)
+    def test_no_limit(self):
+        with host_slot(self.host, 'organize_files'):
+            self.assertFalse(HostSlot.objects.exists())
+
+    def test_host_slots(self):
+        hosts = [self.host, 'ssh:123.45.67.90', self.host]
+        with host_slots(hosts, 'organize_files', HostSlot.TRANSITION):
+            self.assertEqual(sorted(HostSlot.objects.values_list('host', flat=True)),
+                             ['ssh:123.45.67.89', 'ssh:123.45.67.90'])
+
+        self.assertFalse(HostSlot.objects.exists())
+
+    def test_host_slots_busy(self):
+        self.add_slot(host='ssh:123.45.67.90')
+        self.add_slot(host='ssh:123.45.67.90')
+        with self.assertRaises(HostBusyError) as cm:
+            with host_slots([self.host, 'ssh:123.45.67.90'], 'organize_files', timeout=0.05):
+                self.fail('Got a slot over the limit')
+
+        self.assertEqual(cm.exception.host, 'ssh:123.45.67.90')
+        self.assertEqual(HostSlot.objects.count(), 2)  # The slot on the first host was released
+
+    def test_host_usage(self):
+        self.add_slot()
+        self.add_slot(is_running=False, priority=HostSlot.POLL)
+        self.add_slot(is_running=False, priority=HostSlot.TRANSITION)
+        self.add_slot(expires_in=-1, host='ecc:123.45.67.89:8083')
+
+        usage = host_usage()
+        self.assertEqual(len(usage), 1)
+        self.assertEqual(usage[0]['host'], self.host)
+        self.assertEqual(usage[0]['limit'], 2)
+        self.assertEqual(usage[0]['running'], 1)
+        self.assertEqual(usage[0]['queued'], 2)
+        self.assertEqual([s['priority'] for s in usage[0]['slots']], ['Normal', 'Transition', 'Poll'])
@@ -0,0 +1,160 @@
+"""Tests for the Celery task instrumentation"""
+
+from django.test import TestCase, override_settings
+from unittest.mock import patch, MagicMock
+from datetime import datetime
+from celery import shared_task
+
+from ..models import ECCServer, DataRouter, Experiment, TaskTiming
+from ..tasks import eccserver_refresh_state_task, check_data_router_status_task, eccserver_refresh_all_task
+from ..tasks import prune_trace_spans_task
+from .. import instrumentation
+
+
+@shared_task
+def failing_task(eccserver_pk):
+    raise ValueError('Failed')
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.ecc_server = ECCServer.objects.create(name='CoBo[7]', ip_address='123.45.67.89',
+                                                   experiment=self.experiment)
+        self.data_router = DataRouter.objects.create(name='DataRouter[7]', ip_address='123.45.67.90',
+                                                     experiment=self.experiment)
+
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_records_task(self, mock_refresh):
+        eccserver_refresh_state_task.apply(args=(self.ecc_server.pk,))
+
+        timing = TaskTiming.objects.get()
+        self.assertEqual(timing.task_name, 'attpcdaq.daq.tasks.eccserver_refresh_state_task')
+        self.assertEqual(timing.target_type, TaskTiming.ECC_SERVER)
+        self.assertEqual(timing.target_pk, self.ecc_server.pk)
+        self.assertEqual(timing.target_name, 'CoBo[7]')
+        self.assertEqual(timing.outcome, TaskTiming.SUCCESS)
+        self.assertGreaterEqual(timing.duration, 0)
+        self.assertIsNone(timing.queue_wait)
+
+    @patch('attpcdaq.daq.tasks.WorkerInterface')
+    def test_data_router_target(self, mock_wint):
+        check_data_router_status_task.apply(kwargs={'datarouter_pk': self.data_router.pk})
+
+        timing = TaskTiming.objects.get()
+        self.assertEqual(timing.target_type, TaskTiming.DATA_ROUTER)
+        self.assertEqual(timing.target_name, 'DataRouter[7]')
+
+    def test_no_target(self):
+        prune_trace_spans_task.apply()
+
+        timing = TaskTiming.objects.get()
+        self.assertIsNone(timing.target_type)
+        self.assertIsNone(timing.target_pk)
+
+    def test_skipped_poll_cycle(self):
+        eccserver_refresh_all_task.apply()  # There's no active experiment, so nothing is queued
+
+        self.assertFalse(TaskTiming.objects.exists())
+
+    def test_failure(self):
+        failing_task.apply(args=(self.ecc_server.pk,))
+
+        timing = TaskTiming.objects.get()
+        self.assertEqual(timing.outcome, TaskTiming.FAILURE)
+
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_soft_time_limit(self, mock_refresh):
+        with patch.object(eccserver_refresh_state_task, 'soft_time_limit', 0):
+            eccserver_refresh_state_task.apply(args=(self.ecc_server.pk,))
+
+        self.assertEqual(TaskTiming.objects.get().outcome, TaskTiming.TIMEOUT)
+
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_queue_wait(self, mock_refresh):
+        headers = {}
+        instrumentation.add_publish_time(headers=headers)
+        headers[instrumentation.PUBLISH_TIME_HEADER] -= 2
+
+        eccserver_refresh_state_task.apply(args=(self.ecc_server.pk,), headers=headers)
+
+        self.assertAlmostEqual(TaskTiming.objects.get().queue_wait, 2, delta=0.5)
+
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_queue(self, mock_refresh):
+        eccserver_refresh_state_task.apply(args=(self.ecc_server.pk,))
+        self.assertEqual(TaskTiming.objects.get().queue, 'polling')
+
+    def test_queue_from_delivery_info(self):
+        task = MagicMock()
+        task.request.delivery_info = {'routing_key': 'control'}
+        self.assertEqual(instrumentation.find_queue(task), 'control')
+
+    @override_settings(TASK_TIMING_ENABLED=False)
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_disabled(self, mock_refresh):
+        eccserver_refresh_state_task.apply(args=(self.ecc_server.pk,))
+        self.assertFalse(TaskTiming.objects.exists())
+
+
+class SummarizeTestCase(TestCase):
+    def make_timing(self, duration, target_pk=1, outcome=TaskTiming.SUCCESS, queue_wait=None, queue=None):
+        return TaskTiming.objects.create(
+            task_name='task',
+            target_type=TaskTiming.ECC_SERVER,
+            target_pk=target_pk,
+            target_name='ECC{}'.format(target_pk),
+            start_time=datetime.now(),
+            duration=duration,
+            queue_wait=queue_wait,
+            queue=queue,
+            outcome=outcome,
+        )
+
+    def test_percentiles(self):
+        for i in range(1, 101):
+            self.make_timing(i / 100, queue_wait=1)
+
+        summary, = instrumentation.summarize(TaskTiming.objects.all())
+        self.assertEqual(summary['count'], 100)
+        self.assertEqual(summary['target'], 'ECC1')
+        self.assertAlmostEqual(summary['p50'], 0.5)
+        self.assertAlmostEqual(summary['p90'], 0.9)
+        self.assertAlmostEqual(summary['p99'], 0.99)
+        self.assertAlmostEqual(summary['max'], 1)
+        self.assertAlmostEqual(summary['mean_queue_wait'], 1)
+        self.assertEqual(sum(summary['histogram']), 100)
+
+    def test_groups_by_target(self):
+        self.make_timing(1, target_pk=1)
+        self.make_timing(2, target_pk=2, outcome=TaskTiming.TIMEOUT)
+        self.make_timing(3, target_pk=2, outcome=TaskTiming.FAILURE)
+
+        summaries = instrumentation.summarize(TaskTiming.objects.all())
+        self.assertEqual([s['target'] for s in summaries], ['ECC1', 'ECC2'])
+        self.assertEqual(summaries[1]['count'], 2)
+        self.assertEqual(summaries[1]['timeouts'], 1)
+        self.assertEqual(summaries[1]['failures'], 1)
+        self.assertIsNone(summaries[1]['mean_queue_wait'])
+
+    def test_histogram(self):
+        counts = instrumentation.histogram([0.001, 0.01, 0.02, 1000])
+        self.assertEqual(counts[0], 2)
+        self.assertEqual(counts[1], 1)
+        self.assertEqual(counts[-1], 1)
+        self.assertEqual(len(counts), len(instrumentation.HISTOGRAM_EDGES) + 1)
+
+    def test_summarize_queues(self):
+        for i in range(1, 11):
+            self.make_timing(1, queue_wait=i / 10, queue='polling')
+        self.make_timing(1, queue_wait=None, queue='control')
+        self.make_timing(1, queue_wait=5)  # Queue unknown
+
+        control, polling = instrumentation.summarize_queues(TaskTiming.objects.all())
+        self.assertEqual(control['queue'], 'control')
+        self.assertEqual(control['count'], 1)
+        self.assertIsNone(control['p50'])
+        self.assertEqual(polling['count'], 10)
+        self.assertAlmostEqual(polling['p50'], 0.5)
+        self.assertAlmostEqual(polling['p90'], 0.9)
+        self.assertAlmostEqual(polling['max'], 1)
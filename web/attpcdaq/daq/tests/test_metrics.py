@@ -0,0 +1,234 @@
+"""Tests for the in-memory metrics and their exposition format"""
+
+from django.test import TestCase
+from unittest.mock import patch
+from datetime import datetime
+import json
+import os
+import tempfile
+import time
+
+from ... import metrics
+from ..models import ECCServer, DataRouter, Experiment, RunMetadata
+from ..tasks import eccserver_refresh_state_task, eccserver_refresh_all_task, check_data_router_status_task
+
+
+class MetricTypesTestCase(TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        counter = metrics.Counter('test_requests', 'Requests', ['host'], registry=self.registry)
+        counter.inc(host='a')
+        counter.inc(2, host='a')
+        self.assertEqual(counter.get(host='a'), 3)
+        with self.assertRaises(ValueError):
+            counter.inc(-1, host='a')
+
+    def test_wrong_labels(self):
+        gauge = metrics.Gauge('test_gauge', 'Gauge', ['host'], registry=self.registry)
+        with self.assertRaises(ValueError):
+            gauge.set(1, server='a')
+
+    def test_duplicate_name(self):
+        metrics.Gauge('test_gauge', 'Gauge', registry=self.registry)
+        with self.assertRaises(ValueError):
+            metrics.Gauge('test_gauge', 'Gauge', registry=self.registry)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_latency', 'Latency', buckets=(0.1, 1), registry=self.registry)
+        for value in (0.05, 0.5, 0.7, 5):
+            histogram.observe(value)
+
+        value = histogram.get()
+        self.assertEqual(value['buckets'], [1, 2, 1])
+        self.assertEqual(value['count'], 4)
+        self.assertAlmostEqual(value['sum'], 6.25)
+
+    def test_reset_after_fork(self):
+        counter = metrics.Counter('test_counter', 'Counter', registry=self.registry)
+        gauge = metrics.Gauge('test_gauge', 'Gauge', registry=self.registry)
+        counter.inc(5)
+        gauge.set(3)
+
+        self.registry._pid = -1  # As if this process were forked from another
+        counter.inc()
+        self.assertEqual(counter.get(), 1)
+        self.assertEqual(gauge.get(), 3)
+
+
+class RenderTestCase(TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_format(self):
+        metrics.Counter('test_calls', 'Number of calls', ['host'], registry=self.registry).inc(host='a"b')
+        metrics.Gauge('test_state', 'State', registry=self.registry).set(2)
+        metrics.Histogram('test_latency', 'Latency', buckets=(0.5,), registry=self.registry).observe(0.25)
+
+        text = metrics.render(self.registry.collect())
+        self.assertEqual(text, '\n'.join([
+            '# TYPE test_calls counter',
+            '# HELP test_calls Number of calls',
+            'test_calls_total{host="a\\"b"} 1',
+            '# TYPE test_state gauge',
+            '# HELP test_state State',
+            'test_state 2',
+            '# TYPE test_latency histogram',
+            '# HELP test_latency Latency',
+            'test_latency_bucket{le="0.5"} 1',
+            'test_latency_bucket{le="+Inf"} 1',
+            'test_latency_count 1',
+            'test_latency_sum 0.25',
+            '# EOF',
+        ]) + '\n')
+
+
+class MergeTestCase(TestCase):
+    def make_snapshot(self, counter_value, gauge_value, sum_value, observation):
+        registry = metrics.Registry()
+        metrics.Counter('test_counter', 'Counter', registry=registry).inc(counter_value)
+        metrics.Gauge('test_gauge', 'Gauge', registry=registry).set(gauge_value)
+        metrics.Gauge('test_sum', 'Sum', registry=registry, merge='sum').set(sum_value)
+        metrics.Histogram('test_hist', 'Hist', buckets=(1,), registry=registry).observe(observation)
+        return registry.collect()
+
+    def test_merge(self):
+        first = self.make_snapshot(1, 10, 1, 0.5)
+        time.sleep(0.01)
+        second = self.make_snapshot(2, 20, 2, 5)
+
+        merged = {family['name']: family['samples'][0]['value'] for family in metrics.merge([second, first])}
+        self.assertEqual(merged['test_counter'], 3)
+        self.assertEqual(merged['test_gauge'], 20)
+        self.assertEqual(merged['test_sum'], 3)
+        self.assertEqual(merged['test_hist']['buckets'], [1, 1])
+        self.assertEqual(merged['test_hist']['count'], 2)
+
+    def test_collect_all_reads_snapshots(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'other-1.json'), 'w') as f:
+                json.dump(self.make_snapshot(5, 0, 0, 0), f)
+
+            registry = metrics.Registry(directory=directory)
+            self.addCleanup(registry.close)
+            counter = metrics.Counter('test_counter', 'Counter', registry=registry)
+            counter.inc()
+            registry.write_snapshot()  # This process's own file must not be counted twice
+
+            families = registry.collect_all()
+
+        counter_family = next(f for f in families if f['name'] == 'test_counter')
+        self.assertEqual(counter_family['samples'][0]['value'], 6)
+
+    def test_collect_all_retires_stale_snapshots(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stale_time = time.time() - 4 * 5
+            for name in ('other-1.json', 'other-2.json'):
+                path = os.path.join(directory, name)
+                with open(path, 'w') as f:
+                    json.dump(self.make_snapshot(5, 7, 5, 0.5), f)
+                os.utime(path, (stale_time, stale_time))
+
+            registry = metrics.Registry(directory=directory, interval=5)
+            self.addCleanup(registry.close)
+            metrics.Counter('test_counter', 'Counter', registry=registry).inc()
+
+            families = registry.collect_all()
+            self.assertEqual(sorted(os.listdir(directory)), [metrics.ACCUMULATED_SNAPSHOT,
+                                                             metrics.ACCUMULATED_SNAPSHOT + '.lock'])
+
+            # The accumulated totals are still merged once the snapshots are gone
+            self.assertEqual(registry.collect_all(), families)
+
+        merged = {family['name']: family['samples'] for family in families}
+        self.assertEqual(merged['test_counter'][0]['value'], 11)
+        self.assertEqual(merged['test_hist'][0]['value']['count'], 2)
+        self.assertNotIn('test_gauge', merged)  # The gauges of dead processes are dropped
+        self.assertNotIn('test_sum', merged)
+
+    def test_close(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = metrics.Registry(directory=directory, interval=0.01)
+            metrics.Counter('test_counter', 'Counter', registry=registry).inc()
+            writer = registry._writer
+
+            registry.close()
+            writer.join(1)
+
+            self.assertFalse(writer.is_alive())
+            metrics.Counter('test_other', 'Counter', registry=registry).inc()
+            self.assertIsNone(registry._writer)
+
+    def test_touch_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = metrics.Registry(directory=directory)
+            self.addCleanup(registry.close)
+            registry.touch_snapshot()  # Writes the snapshot if there isn't one yet
+            self.assertTrue(os.path.exists(registry.snapshot_path))
+
+            old_time = time.time() - 60
+            os.utime(registry.snapshot_path, (old_time, old_time))
+            registry.touch_snapshot()
+            self.assertGreater(os.path.getmtime(registry.snapshot_path), old_time + 30)
+
+
+class DerivedMetricsTestCase(TestCase):
+    def test_poll_age_and_run_duration(self):
+        families = [
+            {'name': metrics.LAST_POLL_TIME.name, 'type': 'gauge', 'help': '',
+             'samples': [{'labels': {'host': 'a', 'poll': 'ecc_state'}, 'value': 100, 'time': 100}]},
+            {'name': metrics.RUN_RUNNING.name, 'type': 'gauge', 'help': '',
+             'samples': [{'labels': {'experiment': 'e'}, 'value': 1, 'time': 100}]},
+            {'name': metrics.RUN_START_TIME.name, 'type': 'gauge', 'help': '',
+             'samples': [{'labels': {'experiment': 'e'}, 'value': 50, 'time': 100}]},
+            {'name': metrics.RUN_DURATION.name, 'type': 'gauge', 'help': '',
+             'samples': [{'labels': {'experiment': 'e'}, 'value': 10, 'time': 100}]},
+        ]
+        metrics.add_derived_metrics(families, now=130)
+
+        by_name = {f['name']: f['samples'][0]['value'] for f in families}
+        self.assertEqual(by_name['attpcdaq_last_poll_age_seconds'], 30)
+        self.assertEqual(by_name[metrics.RUN_DURATION.name], 80)
+
+
+class TaskMetricsTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Metrics test', is_active=True)
+        self.ecc_server = ECCServer.objects.create(name='CoBo[metrics]', ip_address='123.45.67.89',
+                                                   experiment=self.experiment)
+        self.data_router = DataRouter.objects.create(name='DataRouter[metrics]', ip_address='123.45.67.90',
+                                                     experiment=self.experiment)
+
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_refresh_state(self, mock_refresh):
+        self.ecc_server.state = ECCServer.READY
+        self.ecc_server.save()
+
+        eccserver_refresh_state_task(self.ecc_server.pk)
+
+        self.assertEqual(metrics.ECC_STATE.get(ecc_server='CoBo[metrics]'), ECCServer.READY)
+        self.assertEqual(metrics.ECC_TRANSITIONING.get(ecc_server='CoBo[metrics]'), 0)
+        self.assertAlmostEqual(metrics.LAST_POLL_TIME.get(host='CoBo[metrics]', poll='ecc_state'),
+                               time.time(), delta=5)
+
+    @patch('attpcdaq.daq.tasks.WorkerInterface')
+    def test_data_router_status(self, mock_wint):
+        wint = mock_wint.return_value.__enter__.return_value
+        wint.check_data_router_status.return_value = True
+        wint.working_dir_is_clean.return_value = False
+        wint.get_disk_usage.return_value = (100, 50)
+
+        check_data_router_status_task(self.data_router.pk)
+
+        self.assertEqual(metrics.DATA_ROUTER_ONLINE.get(data_router='DataRouter[metrics]'), 1)
+        self.assertEqual(metrics.DATA_ROUTER_CLEAN.get(data_router='DataRouter[metrics]'), 0)
+
+    @patch('attpcdaq.daq.tasks.group')
+    def test_run_metrics(self, mock_group):
+        RunMetadata.objects.create(experiment=self.experiment, run_number=3, start_datetime=datetime.now())
+
+        eccserver_refresh_all_task()
+
+        self.assertEqual(metrics.RUN_NUMBER.get(experiment='Metrics test'), 3)
+        self.assertEqual(metrics.RUN_RUNNING.get(experiment='Metrics test'), 1)
@@ -1,12 +1,14 @@
-from django.test import TestCase
-from unittest.mock import patch
+from django.test import TestCase, override_settings
+from unittest.mock import patch, MagicMock
 from .utilities import FakeResponseState, FakeResponseText
 from ..models import DataSource, ECCServer, DataRouter, ConfigId, Experiment, RunMetadata, Observable, Measurement
-from ..models import ECCError
+from ..models import ECCError, DataRateSample, DiskUsageSample, RunFile, EccStateClient, TransitionEvent
+from ..models import RunSequence, RunBoundary
 import xml.etree.ElementTree as ET
 import os
+import io
 from itertools import permutations, product
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class FakeTransitionResult(object):
@@ -246,6 +248,7 @@ class ECCServerModelTestCase(TestCase):
             msg='Removed config was still present in database.'
         )
 
+    @override_settings(ECC_FAST_GET_STATE=False)
     def test_refresh_state(self):
         for (state, trans) in product(ECCServer.STATE_DICT.keys(), [False, True]):
             with patch('attpcdaq.daq.models.EccClient') as mock_client:
@@ -260,6 +263,19 @@ class ECCServerModelTestCase(TestCase):
             self.assertEqual(self.ecc_server.state, state)
             self.assertEqual(self.ecc_server.is_transitioning, trans)
 
+    def test_refresh_state_fast_path(self):
+        with patch('attpcdaq.daq.models.EccStateClient') as mock_client:
+            mock_inst = mock_client.return_value
+            mock_inst.GetState.return_value = FakeResponseState(state=ECCServer.READY, trans=True)
+
+            self.ecc_server.refresh_state()
+
+            mock_client.assert_called_once_with(self.ecc_server.ecc_url)
+            mock_inst.GetState.assert_called_once_with()
+
+        self.assertEqual(self.ecc_server.state, ECCServer.READY)
+        self.assertTrue(self.ecc_server.is_transitioning)
+
     def _transition_test_helper(self, trans_func_name, initial_state, final_state,
                                 error_code=0, error_msg=""):
         with patch('attpcdaq.daq.models.EccClient') as mock_client:
@@ -304,6 +320,75 @@ class ECCServerModelTestCase(TestCase):
         with self.assertRaisesRegex(RuntimeError, 'Data source has no config associated with it.'):
             self._transition_test_helper('Describe', ECCServer.IDLE, ECCServer.DESCRIBED)
 
+    def test_change_state_records_request(self):
+        self._transition_test_helper('Configure', ECCServer.PREPARED, ECCServer.READY)
+
+        event = TransitionEvent.objects.get()
+        self.assertEqual(event.ecc_server, self.ecc_server)
+        self.assertEqual(event.event, TransitionEvent.REQUESTED)
+        self.assertEqual(event.transition, 'Configure')
+        self.assertEqual((event.from_state, event.to_state), (ECCServer.PREPARED, ECCServer.READY))
+
+        self.ecc_server.refresh_from_db()
+        self.assertTrue(self.ecc_server.is_transitioning)
+
+    def test_change_state_records_failure(self):
+        with self.assertRaises(ECCError):
+            self._transition_test_helper('Describe', ECCServer.IDLE, ECCServer.DESCRIBED, 1, 'Error')
+
+        self.assertEqual(TransitionEvent.objects.get().event, TransitionEvent.FAILED)
+
+    def test_refresh_state_records_finished_transition(self):
+        self._transition_test_helper('Configure', ECCServer.PREPARED, ECCServer.READY)
+        requested = TransitionEvent.objects.get()
+        requested.time -= timedelta(seconds=30)
+        requested.save()
+
+        with patch('attpcdaq.daq.models.EccStateClient') as mock_client:
+            mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.READY, trans=False)
+            self.ecc_server.refresh_state()
+            self.ecc_server.refresh_state()  # The finished transition must only be recorded once
+
+        finished = TransitionEvent.objects.get(event=TransitionEvent.FINISHED)
+        self.assertEqual(finished.transition, 'Configure')
+        self.assertAlmostEqual(finished.latency, 30, delta=5)
+
+    def test_refresh_state_records_aborted_transition(self):
+        self._transition_test_helper('Configure', ECCServer.PREPARED, ECCServer.READY)
+
+        with patch('attpcdaq.daq.models.EccStateClient') as mock_client:
+            mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.PREPARED, trans=False)
+            with self.assertLogs(level='WARNING'):
+                self.ecc_server.refresh_state()
+
+        self.assertFalse(TransitionEvent.objects.filter(event=TransitionEvent.FINISHED).exists())
+        failed = TransitionEvent.objects.get(event=TransitionEvent.FAILED)
+        self.assertEqual(failed.transition, 'Configure')
+        self.assertIsNone(failed.latency)
+
+    def test_refresh_state_ignores_unrequested_transition(self):
+        self.ecc_server.is_transitioning = True
+        with patch('attpcdaq.daq.models.EccStateClient') as mock_client:
+            mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.READY, trans=False)
+            self.ecc_server.refresh_state()
+
+        self.assertFalse(TransitionEvent.objects.exists())
+
+    def test_transition_started_time(self):
+        self.assertIsNone(self.ecc_server.transition_started_time)
+
+        self.ecc_server.is_transitioning = True
+        self.ecc_server.save(update_fields=['is_transitioning'])
+        started = ECCServer.objects.get(pk=self.ecc_server.pk).transition_started_time
+        self.assertIsNotNone(started)
+
+        self.ecc_server.save()  # Still transitioning, so the start time is kept
+        self.assertEqual(ECCServer.objects.get(pk=self.ecc_server.pk).transition_started_time, started)
+
+        self.ecc_server.is_transitioning = False
+        self.ecc_server.save(update_fields=['is_transitioning'])
+        self.assertIsNone(ECCServer.objects.get(pk=self.ecc_server.pk).transition_started_time)
+
 
 def check_data_link_xml_helper(testcase, datasource, link_xml):
     data_router = datasource.data_router
@@ -327,6 +412,254 @@ def check_data_link_xml_helper(testcase, datasource, link_xml):
     )
 
 
+def make_state_response(body, status=200, will_close=False):
+    """Make a fake HTTP response containing a GetState response body."""
+    response = io.BytesIO(body)
+    response.status = status
+    response.will_close = will_close
+    return response
+
+
+class EccStateClientTestCase(TestCase):
+    response_xml = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                    b'<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+                    b'xmlns:ecc="urn:ecc"><SOAP-ENV:Body><ecc:ResponseState>'
+                    b'<ErrorCode>0</ErrorCode><ErrorMessage></ErrorMessage><State>4</State>'
+                    b'<Transition>1</Transition></ecc:ResponseState></SOAP-ENV:Body></SOAP-ENV:Envelope>')
+
+    fault_xml = (b'<?xml version="1.0" encoding="UTF-8"?>'
+                 b'<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+                 b'<SOAP-ENV:Body><SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode>'
+                 b'<faultstring>Method not implemented</faultstring></SOAP-ENV:Fault></SOAP-ENV:Body>'
+                 b'</SOAP-ENV:Envelope>')
+
+    def setUp(self):
+        self.url = 'http://123.45.67.8:8083/'
+        EccStateClient._connections.clear()
+        self.addCleanup(EccStateClient._connections.clear)
+
+    def test_parse_response(self):
+        result = EccStateClient.parse_response(io.BytesIO(self.response_xml))
+        self.assertEqual(result.ErrorCode, '0')
+        self.assertEqual(result.ErrorMessage, '')
+        self.assertEqual(result.State, '4')
+        self.assertEqual(result.Transition, '1')
+
+    def test_parse_response_reads_to_end(self):
+        body = self.response_xml + b' ' * 10000
+        response = io.BytesIO(body)
+        EccStateClient.parse_response(response)
+        self.assertEqual(response.tell(), len(body))
+
+    def test_parse_fault(self):
+        with self.assertRaisesRegex(ECCError, 'Method not implemented'):
+            EccStateClient.parse_response(io.BytesIO(self.fault_xml))
+
+    def test_parse_missing_field(self):
+        body = self.response_xml.replace(b'<State>4</State>', b'')
+        with self.assertRaisesRegex(ECCError, 'State'):
+            EccStateClient.parse_response(io.BytesIO(body))
+
+    @patch('attpcdaq.daq.models.HTTPConnection')
+    def test_get_state(self, mock_conn_class):
+        conn = mock_conn_class.return_value
+        conn.getresponse.return_value = make_state_response(self.response_xml)
+
+        client = EccStateClient(self.url)
+        result = client.GetState()
+
+        mock_conn_class.assert_called_once_with('123.45.67.8', 8083, timeout=client.timeout)
+        conn.request.assert_called_once_with('POST', '/', body=EccStateClient.request_body,
+                                             headers=EccStateClient.request_headers)
+        self.assertEqual(result.State, '4')
+
+    @patch('attpcdaq.daq.models.HTTPConnection')
+    def test_connection_is_reused(self, mock_conn_class):
+        conn = mock_conn_class.return_value
+        conn.getresponse.side_effect = lambda: make_state_response(self.response_xml)
+
+        EccStateClient(self.url).GetState()
+        EccStateClient(self.url).GetState()
+
+        mock_conn_class.assert_called_once_with('123.45.67.8', 8083, timeout=5)
+        self.assertEqual(conn.request.call_count, 2)
+        conn.close.assert_not_called()
+
+    @patch('attpcdaq.daq.models.HTTPConnection')
+    def test_connection_closed_if_server_closes(self, mock_conn_class):
+        conn = mock_conn_class.return_value
+        conn.getresponse.return_value = make_state_response(self.response_xml, will_close=True)
+
+        EccStateClient(self.url).GetState()
+
+        conn.close.assert_called_once_with()
+        self.assertEqual(EccStateClient._connections, {})
+
+    @patch('attpcdaq.daq.models.HTTPConnection')
+    def test_retry_on_stale_connection(self, mock_conn_class):
+        stale_conn = MagicMock()
+        stale_conn.request.side_effect = ConnectionResetError
+        EccStateClient._connections[('123.45.67.8', 8083)] = stale_conn
+
+        conn = mock_conn_class.return_value
+        conn.getresponse.return_value = make_state_response(self.response_xml)
+
+        result = EccStateClient(self.url).GetState()
+
+        stale_conn.close.assert_called_once_with()
+        mock_conn_class.assert_called_once_with('123.45.67.8', 8083, timeout=5)
+        self.assertEqual(result.State, '4')
+
+    @patch('attpcdaq.daq.models.HTTPConnection')
+    def test_no_retry_on_new_connection(self, mock_conn_class):
+        conn = mock_conn_class.return_value
+        conn.request.side_effect = ConnectionRefusedError
+
+        with self.assertRaises(ConnectionRefusedError):
+            EccStateClient(self.url).GetState()
+
+        mock_conn_class.assert_called_once_with('123.45.67.8', 8083, timeout=5)
+
+
+@override_settings(DATA_RATE_STALL_SECONDS=60)
+class DataRouterModelTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(
+            name='Test',
+        )
+        self.data_router = DataRouter.objects.create(
+            name='Router0',
+            ip_address='111.111.111.111',
+            experiment=self.experiment,
+        )
+        self.start = datetime(2017, 1, 1, 12, 0, 0)
+
+    def test_first_sample_sets_baseline(self):
+        self.data_router.record_data_sample(1000, self.start)
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.staging_bytes, 1000)
+        self.assertEqual(self.data_router.last_sample_time, self.start)
+        self.assertEqual(self.data_router.data_rate, 0)
+        self.assertFalse(self.data_router.is_stalled)
+        self.assertEqual(DataRateSample.objects.count(), 0)
+
+    def test_rate(self):
+        self.data_router.record_data_sample(1000, self.start)
+        self.data_router.record_data_sample(6000, self.start + timedelta(seconds=5))
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.data_rate, 1000)
+        self.assertEqual(self.data_router.staging_bytes, 6000)
+
+        sample = DataRateSample.objects.get()
+        self.assertEqual(sample.data_router, self.data_router)
+        self.assertEqual(sample.bytes_written, 5000)
+        self.assertEqual(sample.interval, 5)
+        self.assertEqual(sample.rate, 1000)
+
+    def test_shrinking_directory(self):
+        self.data_router.record_data_sample(10000, self.start)
+        self.data_router.record_data_sample(2000, self.start + timedelta(seconds=2))
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.data_rate, 1000)
+
+    def test_stall(self):
+        self.data_router.record_data_sample(1000, self.start)
+        self.data_router.record_data_sample(1000, self.start + timedelta(seconds=30))
+        self.assertFalse(self.data_router.is_stalled)
+
+        with self.assertLogs(level='WARNING'):
+            self.data_router.record_data_sample(1000, self.start + timedelta(seconds=61))
+        self.assertTrue(self.data_router.is_stalled)
+        self.assertEqual(self.data_router.data_rate, 0)
+
+        self.data_router.record_data_sample(2000, self.start + timedelta(seconds=62))
+        self.assertFalse(self.data_router.is_stalled)
+
+    def test_sample_keeps_other_fields(self):
+        DataRouter.objects.filter(pk=self.data_router.pk).update(is_online=True, staging_directory_is_clean=False)
+
+        self.data_router.record_data_sample(1000, self.start)  # With the old values still on the object
+
+        self.data_router.refresh_from_db()
+        self.assertTrue(self.data_router.is_online)
+        self.assertFalse(self.data_router.staging_directory_is_clean)
+
+    @override_settings(DATA_RATE_STALL_SECONDS=None)
+    def test_stall_alarm_disabled(self):
+        self.data_router.record_data_sample(1000, self.start)
+        self.data_router.record_data_sample(1000, self.start + timedelta(hours=1))
+        self.assertFalse(self.data_router.is_stalled)
+
+    def test_time_to_full(self):
+        self.assertIsNone(self.data_router.time_to_full)
+
+        self.data_router.disk_free_bytes = 6000
+        self.assertIsNone(self.data_router.time_to_full)
+
+        self.data_router.data_rate = 100
+        self.assertEqual(self.data_router.time_to_full, timedelta(minutes=1))
+
+    def test_record_disk_usage(self):
+        self.data_router.record_disk_usage(10000, 4000, self.start)
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.disk_total_bytes, 10000)
+        self.assertEqual(self.data_router.disk_free_bytes, 4000)
+
+        sample = DiskUsageSample.objects.get()
+        self.assertEqual(sample.time, self.start)
+        self.assertEqual(sample.free_bytes, 4000)
+
+    def test_record_disk_usage_keeps_other_fields(self):
+        DataRouter.objects.filter(pk=self.data_router.pk).update(staging_bytes=5000)
+
+        self.data_router.record_disk_usage(10000, 4000, self.start)
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.staging_bytes, 5000)
+
+    @override_settings(DISK_FULL_WARNING_TIME=timedelta(minutes=30))
+    def test_record_disk_usage_warns_once(self):
+        self.data_router.data_rate = 1e6
+        self.data_router.record_disk_usage(1e12, 1e10)
+
+        with self.assertLogs(level='WARNING') as cm:
+            self.data_router.record_disk_usage(1e12, 1e9)
+            self.data_router.record_disk_usage(1e12, 9e8)
+        self.assertEqual(len(cm.output), 1)
+
+    def _make_previous_run(self, size):
+        run = RunMetadata.objects.create(
+            experiment=self.experiment,
+            run_number=0,
+            start_datetime=self.start,
+            stop_datetime=self.start + timedelta(seconds=100),
+        )
+        RunFile.objects.create(run=run, data_router=self.data_router, path='/a.graw', size=size, mtime=self.start)
+
+    def test_forecast_run_bytes(self):
+        self.assertIsNone(self.data_router.forecast_run_bytes(timedelta(hours=1)))
+
+        self._make_previous_run(1000)
+        self.assertEqual(self.data_router.forecast_run_bytes(timedelta(seconds=500)), 5000)
+
+    def test_check_disk_space(self):
+        self._make_previous_run(1000)
+
+        self.data_router.disk_free_bytes = 10000
+        self.data_router.save()
+        self.assertEqual(self.experiment.check_disk_space(timedelta(seconds=500)), [])
+
+        self.data_router.disk_free_bytes = 4000
+        self.data_router.save()
+        with self.assertLogs(level='WARNING'):
+            short = self.experiment.check_disk_space(timedelta(seconds=500))
+        self.assertEqual(short, [self.data_router])
+
+
 class DataSourceModelTestCase(TestCase):
     def setUp(self):
         self.name = 'CoBo[0]'
@@ -533,6 +866,43 @@ class RunMetadataModelTestCase(TestCase):
         self.assertLess(dur, after)
 
 
+class RunSequenceModelTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.start = datetime(2016, 1, 1)
+        self.run = RunMetadata(experiment=self.experiment, run_number=0, start_datetime=self.start)
+        self.router = DataRouter(name='DataRouter0', ip_address='123.45.67.89', experiment=self.experiment,
+                                 staging_bytes=2000, last_sample_time=self.start + timedelta(minutes=5))
+        self.sequence = RunSequence(experiment=self.experiment, max_duration=timedelta(hours=1), max_bytes=1000)
+
+    def test_within_limits(self):
+        self.sequence.max_bytes = 3000
+        now = self.start + timedelta(minutes=30)
+        self.assertIsNone(self.sequence.find_boundary(self.run, [self.router], now))
+
+    def test_duration(self):
+        self.sequence.max_bytes = None
+        now = self.start + timedelta(minutes=61)
+        self.assertEqual(self.sequence.find_boundary(self.run, [self.router], now),
+                         (RunBoundary.DURATION, self.start + timedelta(hours=1)))
+
+    def test_bytes(self):
+        now = self.start + timedelta(minutes=30)
+        self.assertEqual(self.sequence.find_boundary(self.run, [self.router], now),
+                         (RunBoundary.BYTES, self.router.last_sample_time))
+
+    def test_bytes_sampled_before_run(self):
+        self.router.last_sample_time = self.start - timedelta(seconds=1)
+        now = self.start + timedelta(minutes=30)
+        self.assertIsNone(self.sequence.find_boundary(self.run, [self.router], now))
+
+    def test_is_last_run(self):
+        self.assertFalse(self.sequence.is_last_run)
+        self.sequence.run_count = 2
+        self.sequence.runs_completed = 1
+        self.assertTrue(self.sequence.is_last_run)
+
+
 class MeasurementModelTestCase(TestCase):
     def setUp(self):
         self.experiment = Experiment.objects.create(
@@ -0,0 +1,82 @@
+"""Tests for the poll cycle leases"""
+
+from django.test import TestCase, override_settings
+from datetime import datetime, timedelta
+
+from ..models import PollLease, ECCServer, Experiment
+from ..pollleases import acquire_poll_leases, release_poll_lease, poll_lease_usage
+from ... import metrics
+
+
+class PollLeaseTestCase(TestCase):
+    def add_lease(self, target_pk, poll='ecc_state', expires_in=60, token='earlier'):
+        now = datetime.now()
+        return PollLease.objects.create(poll=poll, target_pk=target_pk, token=token, created_time=now,
+                                        expires_time=now + timedelta(seconds=expires_in))
+
+    def test_acquire(self):
+        token, acquired = acquire_poll_leases('ecc_state', [3, 1, 2])
+        self.assertEqual(acquired, [3, 1, 2])
+        self.assertEqual(sorted(PollLease.objects.filter(token=token).values_list('target_pk', flat=True)), [1, 2, 3])
+
+    def test_skips_held_leases(self):
+        self.add_lease(2)
+        before = metrics.POLL_TARGETS_SKIPPED.get(poll='ecc_state') or 0
+
+        token, acquired = acquire_poll_leases('ecc_state', [1, 2, 3])
+
+        self.assertEqual(acquired, [1, 3])
+        self.assertEqual(PollLease.objects.get(target_pk=2).token, 'earlier')
+        self.assertEqual(PollLease.objects.get(target_pk=2).skipped, 1)
+        self.assertEqual(metrics.POLL_TARGETS_SKIPPED.get(poll='ecc_state'), before + 1)
+
+    def test_whole_cycle_skipped(self):
+        self.add_lease(1)
+        before = metrics.POLL_CYCLES_SKIPPED.get(poll='ecc_state') or 0
+
+        token, acquired = acquire_poll_leases('ecc_state', [1])
+
+        self.assertEqual(acquired, [])
+        self.assertEqual(metrics.POLL_CYCLES_SKIPPED.get(poll='ecc_state'), before + 1)
+
+    def test_polls_are_separate(self):
+        self.add_lease(1, poll='ecc_online')
+        token, acquired = acquire_poll_leases('ecc_state', [1])
+        self.assertEqual(acquired, [1])
+
+    def test_expired_lease_replaced(self):
+        self.add_lease(1, expires_in=-1)
+        token, acquired = acquire_poll_leases('ecc_state', [1])
+        self.assertEqual(acquired, [1])
+        self.assertEqual(PollLease.objects.get().token, token)
+
+    @override_settings(POLL_LEASE_TIMEOUT=5)
+    def test_lease_length(self):
+        acquire_poll_leases('ecc_state', [1])
+        lease = PollLease.objects.get()
+        self.assertEqual(lease.expires_time - lease.created_time, timedelta(seconds=5))
+
+    def test_release(self):
+        self.add_lease(1, token='abc')
+        release_poll_lease('ecc_state', 1, 'abc')
+        self.assertFalse(PollLease.objects.exists())
+
+    def test_release_only_own_lease(self):
+        self.add_lease(1, token='newer')
+        release_poll_lease('ecc_state', 1, 'older')
+        release_poll_lease('ecc_state', 1, None)
+        self.assertTrue(PollLease.objects.exists())
+
+    def test_usage(self):
+        experiment = Experiment.objects.create(name='Test')
+        ecc_server = ECCServer.objects.create(name='CoBo[3]', ip_address='123.45.67.89', experiment=experiment)
+        lease = self.add_lease(ecc_server.pk)
+        lease.skipped = 4
+        lease.save()
+        self.add_lease(ecc_server.pk, poll='ecc_online', expires_in=-1)
+
+        usage, = poll_lease_usage()
+        self.assertEqual(usage['poll'], 'ecc_state')
+        self.assertEqual(usage['target'], 'CoBo[3]')
+        self.assertEqual(usage['skipped'], 4)
+        self.assertGreaterEqual(usage['age'], 0)
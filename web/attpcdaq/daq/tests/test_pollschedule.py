@@ -0,0 +1,204 @@
+"""Tests for the adaptive poll intervals"""
+
+from django.test import TestCase
+from datetime import datetime, timedelta
+
+from ..models import PollSchedule, PollRecord, PollLease, ECCServer, DataRouter, Experiment, RunMetadata
+from ..pollschedule import poll_interval, start_poll_cycle, get_poll_schedule, shortest_interval
+from ..pollschedule import poll_cycle_is_due, postpone_poll_cycle, clear_poll_cycle_times
+
+
+class PollIntervalTestCase(TestCase):
+    def setUp(self):
+        self.schedule = PollSchedule(state_interval=5, status_interval=15, data_rate_interval=2,
+                                     transition_interval=0.5, idle_factor=6, offline_factor=12, offline_cycles=3,
+                                     max_interval=120)
+
+    def test_running(self):
+        self.assertEqual(poll_interval(self.schedule, 'ecc_state', is_running=True), 5)
+        self.assertEqual(poll_interval(self.schedule, 'ecc_online', is_running=True), 15)
+        self.assertEqual(poll_interval(self.schedule, 'data_router_status', is_running=True), 15)
+        self.assertEqual(poll_interval(self.schedule, 'data_rate', is_running=True), 2)
+
+    def test_transitioning(self):
+        self.assertEqual(poll_interval(self.schedule, 'ecc_state', False, is_transitioning=True), 0.5)
+        self.assertEqual(poll_interval(self.schedule, 'ecc_online', False, is_transitioning=True), 90)
+
+    def test_idle(self):
+        self.assertEqual(poll_interval(self.schedule, 'ecc_state', is_running=False), 30)
+
+    def test_offline(self):
+        self.assertEqual(poll_interval(self.schedule, 'ecc_state', True, offline_cycles=2), 5)
+        self.assertEqual(poll_interval(self.schedule, 'ecc_state', True, offline_cycles=3), 60)
+
+    def test_max_interval(self):
+        self.assertEqual(poll_interval(self.schedule, 'ecc_online', False, offline_cycles=3), 120)
+
+    def test_shortest_interval(self):
+        self.assertEqual(shortest_interval(self.schedule, 'ecc_state'), 5)
+        self.assertEqual(shortest_interval(self.schedule, 'ecc_online'), 15)
+
+        self.schedule.max_interval = 10
+        self.assertEqual(shortest_interval(self.schedule, 'ecc_online'), 10)
+
+    def test_default_schedule(self):
+        experiment = Experiment.objects.create(name='Test')
+        self.assertEqual(get_poll_schedule(experiment).state_interval, 5)
+        self.assertIsNone(get_poll_schedule(experiment).pk)
+
+        schedule = PollSchedule.objects.create(experiment=experiment, state_interval=1)
+        experiment = Experiment.objects.get(pk=experiment.pk)
+        self.assertEqual(get_poll_schedule(experiment), schedule)
+
+
+class StartPollCycleTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test', is_active=True)
+        self.schedule = PollSchedule.objects.create(experiment=self.experiment)
+        self.ecc_servers = [ECCServer.objects.create(name='CoBo[{}]'.format(i), ip_address='123.45.67.89',
+                                                     experiment=self.experiment, is_online=True)
+                            for i in range(3)]
+        self.targets = ECCServer.objects.filter(experiment=self.experiment)
+
+    def add_record(self, ecc_server, seconds_ago, offline_cycles=0, poll='ecc_state'):
+        return PollRecord.objects.create(poll=poll, target_pk=ecc_server.pk, offline_cycles=offline_cycles,
+                                         last_time=datetime.now() - timedelta(seconds=seconds_ago))
+
+    def start(self, is_running=True, poll='ecc_state'):
+        token, pks = start_poll_cycle(poll, self.experiment, self.targets, is_running=is_running)
+        return pks
+
+    def test_first_cycle_checks_everything(self):
+        self.assertEqual(self.start(), [s.pk for s in self.ecc_servers])
+        self.assertEqual(PollRecord.objects.count(), 3)
+        self.assertEqual(PollLease.objects.count(), 3)
+
+    def test_only_due_targets(self):
+        self.add_record(self.ecc_servers[0], 1)
+        self.add_record(self.ecc_servers[1], 6)
+
+        self.assertEqual(self.start(), [self.ecc_servers[1].pk, self.ecc_servers[2].pk])
+        self.assertEqual(PollRecord.objects.get(target_pk=self.ecc_servers[0].pk).offline_cycles, 0)
+        self.assertFalse(PollLease.objects.filter(target_pk=self.ecc_servers[0].pk).exists())
+
+    def test_transitioning_checked_quickly(self):
+        self.ecc_servers[0].is_transitioning = True
+        self.ecc_servers[0].save()
+        for ecc_server in self.ecc_servers:
+            self.add_record(ecc_server, 1)
+
+        self.assertEqual(self.start(), [self.ecc_servers[0].pk])
+
+    def test_idle_backoff(self):
+        for ecc_server in self.ecc_servers:
+            self.add_record(ecc_server, 10)
+
+        self.assertEqual(self.start(is_running=False), [])
+        self.assertEqual(len(self.start(is_running=True)), 3)
+
+    def test_is_running_from_experiment(self):
+        self.add_record(self.ecc_servers[0], 10)
+        self.targets = self.targets.filter(pk=self.ecc_servers[0].pk)
+
+        token, pks = start_poll_cycle('ecc_state', self.experiment, self.targets)
+        self.assertEqual(pks, [])
+
+        RunMetadata.objects.create(experiment=self.experiment, run_number=1, start_datetime=datetime.now())
+        token, pks = start_poll_cycle('ecc_state', self.experiment, self.targets)
+        self.assertEqual(pks, [self.ecc_servers[0].pk])
+
+    def test_offline_cycles_counted(self):
+        ECCServer.objects.filter(pk=self.ecc_servers[0].pk).update(is_online=False)
+        self.add_record(self.ecc_servers[0], 10, offline_cycles=1)
+        self.add_record(self.ecc_servers[1], 10, offline_cycles=2)
+
+        self.start()
+
+        offline_cycles = dict(PollRecord.objects.values_list('target_pk', 'offline_cycles'))
+        self.assertEqual(offline_cycles[self.ecc_servers[0].pk], 2)
+        self.assertEqual(offline_cycles[self.ecc_servers[1].pk], 0)  # Back online
+        self.assertEqual(offline_cycles[self.ecc_servers[2].pk], 0)
+
+    def test_offline_backoff(self):
+        ECCServer.objects.filter(pk=self.ecc_servers[0].pk).update(is_online=False)
+        self.add_record(self.ecc_servers[0], 10, offline_cycles=3)
+        self.add_record(self.ecc_servers[1], 10, offline_cycles=3)  # Online again, so not backed off
+
+        self.assertEqual(self.start(), [self.ecc_servers[1].pk, self.ecc_servers[2].pk])
+
+    def test_skips_leased_targets(self):
+        now = datetime.now()
+        PollLease.objects.create(poll='ecc_state', target_pk=self.ecc_servers[0].pk, token='earlier',
+                                 created_time=now, expires_time=now + timedelta(minutes=1))
+
+        self.assertEqual(self.start(), [self.ecc_servers[1].pk, self.ecc_servers[2].pk])
+        self.assertFalse(PollRecord.objects.filter(target_pk=self.ecc_servers[0].pk).exists())
+
+    def test_polls_are_separate(self):
+        for ecc_server in self.ecc_servers:
+            self.add_record(ecc_server, 1, poll='ecc_online')
+
+        self.assertEqual(len(self.start()), 3)
+
+    def test_data_routers(self):
+        DataRouter.objects.create(name='DataRouter[0]', ip_address='123.45.67.90', experiment=self.experiment)
+        token, pks = start_poll_cycle('data_router_status', self.experiment,
+                                      DataRouter.objects.filter(experiment=self.experiment), is_running=True)
+        self.assertEqual(len(pks), 1)
+        self.assertEqual(PollRecord.objects.get(poll='data_router_status').offline_cycles, 1)
+
+    def test_no_experiment(self):
+        self.assertEqual(start_poll_cycle('ecc_state', None, ECCServer.objects.none()), (None, []))
+        self.assertTrue(poll_cycle_is_due('ecc_state'))
+
+    def test_due_before_first_cycle(self):
+        self.assertTrue(poll_cycle_is_due('ecc_state'))
+
+    def test_not_due_until_shortest_interval(self):
+        self.start(is_running=False)
+        now = datetime.now()
+
+        self.assertFalse(poll_cycle_is_due('ecc_state', now))
+        self.assertTrue(poll_cycle_is_due('ecc_state', now + timedelta(seconds=self.schedule.state_interval)))
+        self.assertTrue(poll_cycle_is_due('ecc_online', now))
+
+    def test_due_with_earliest_target(self):
+        for ecc_server in self.ecc_servers:
+            self.add_record(ecc_server, 29)
+
+        self.assertEqual(self.start(is_running=False), [])
+        self.assertTrue(poll_cycle_is_due('ecc_state', datetime.now() + timedelta(seconds=1)))
+
+    def test_due_after_leased_target(self):
+        now = datetime.now()
+        PollLease.objects.create(poll='ecc_state', target_pk=self.ecc_servers[0].pk, token='earlier',
+                                 created_time=now, expires_time=now + timedelta(minutes=1))
+
+        self.start()
+        self.assertTrue(poll_cycle_is_due('ecc_state'))
+
+    def test_due_soon_when_transitioning(self):
+        ECCServer.objects.filter(pk=self.ecc_servers[0].pk).update(is_transitioning=True)
+
+        self.start()
+        self.assertTrue(poll_cycle_is_due('ecc_state', datetime.now() + timedelta(seconds=0.5)))
+
+    def test_due_when_transition_starts(self):
+        self.start()
+        self.assertFalse(poll_cycle_is_due('ecc_state'))
+
+        self.ecc_servers[0].is_transitioning = True
+        self.ecc_servers[0].save()
+        self.assertTrue(poll_cycle_is_due('ecc_state'))
+
+    def test_clear_cycle_times(self):
+        self.start()
+        clear_poll_cycle_times()
+        self.assertTrue(poll_cycle_is_due('ecc_state'))
+
+    def test_postpone_cycle(self):
+        postpone_poll_cycle('data_rate', self.experiment)
+        now = datetime.now()
+
+        self.assertFalse(poll_cycle_is_due('data_rate', now))
+        self.assertTrue(poll_cycle_is_due('data_rate', now + timedelta(seconds=self.schedule.data_rate_interval)))
@@ -0,0 +1,192 @@
+"""Tests for the pre-flight check"""
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from unittest.mock import patch
+from datetime import datetime, timedelta
+import threading
+import time
+
+from ..models import ECCServer, DataRouter, Experiment, ConfigId, RunMetadata, RunFile, StateResult, HostSlot
+from ..preflight import run_preflight, forecast_run_bytes
+
+
+class PreflightTestMixin(object):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test', is_active=True)
+        config = ConfigId.objects.create(describe='describe', prepare='prepare', configure='configure')
+        self.ecc_servers = [
+            ECCServer.objects.create(name='CoBo[{}]'.format(i), ip_address='123.45.67.8{}'.format(i),
+                                     experiment=self.experiment, selected_config=config)
+            for i in range(2)
+        ]
+        self.routers = [
+            DataRouter.objects.create(name='DataRouter{}'.format(i), ip_address='123.45.67.9{}'.format(i),
+                                      experiment=self.experiment)
+            for i in range(2)
+        ]
+
+        patchers = {
+            'ecc': patch('attpcdaq.daq.preflight.EccStateClient'),
+            'wint': patch('attpcdaq.daq.preflight.WorkerInterface'),
+        }
+        self.mocks = {}
+        for name, patcher in patchers.items():
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.mocks['ecc'].return_value.GetState.return_value = StateResult('0', '', str(ECCServer.READY), '0')
+        self.wint = self.mocks['wint'].return_value.__enter__.return_value
+        self.wint.check_data_router_status.return_value = True
+        self.wint.working_dir_is_clean.return_value = True
+        self.wint.get_disk_usage.return_value = (100e9, 50e9)
+
+    def failures(self, report):
+        return [(c['target'], c['check']) for c in report['checks'] if not c['passed']]
+
+
+class PreflightTestCase(PreflightTestMixin, TestCase):
+
+    def test_all_pass(self):
+        report = run_preflight(self.experiment)
+
+        self.assertTrue(report['passed'])
+        self.assertEqual(len(report['checks']), 2 * 2 + 2 * 4)
+        for check in report['checks']:
+            self.assertGreaterEqual(check['duration'], 0)
+
+        ecc_check = next(c for c in report['checks'] if c['check'] == 'ecc_reachable')
+        self.assertEqual(ecc_check['message'], 'Ready')
+
+    def test_no_config(self):
+        ECCServer.objects.filter(pk=self.ecc_servers[1].pk).update(selected_config=None)
+
+        report = run_preflight(self.experiment)
+
+        self.assertFalse(report['passed'])
+        self.assertEqual(self.failures(report), [('CoBo[1]', 'config_selected')])
+
+    def test_ecc_server_error(self):
+        self.mocks['ecc'].return_value.GetState.side_effect = ConnectionRefusedError('Connection refused')
+
+        report = run_preflight(self.experiment)
+
+        self.assertEqual(self.failures(report), [('CoBo[0]', 'ecc_reachable'), ('CoBo[1]', 'ecc_reachable')])
+        self.assertIn('refused', report['checks'][2]['message'])
+
+    def test_data_router_not_running(self):
+        self.wint.check_data_router_status.return_value = False
+
+        report = run_preflight(self.experiment)
+
+        self.assertEqual(self.failures(report), [('DataRouter0', 'data_router_alive'),
+                                                 ('DataRouter1', 'data_router_alive')])
+        self.wint.working_dir_is_clean.assert_not_called()
+
+    def test_not_clean_and_low_disk(self):
+        self.wint.working_dir_is_clean.return_value = False
+        report = run_preflight(self.experiment)
+        self.assertIn(('DataRouter0', 'staging_clean'), self.failures(report))
+
+        self.wint.working_dir_is_clean.return_value = True
+        self.wint.get_disk_usage.return_value = (100e9, 0.5e9)
+        report = run_preflight(self.experiment)
+        self.assertIn(('DataRouter0', 'disk_space'), self.failures(report))
+
+    @override_settings(HOST_CONCURRENCY={'ssh': 1, 'ecc': 1})
+    def test_host_busy(self):
+        now = datetime.now()
+        HostSlot.objects.create(host='ssh:123.45.67.91', operation='organize_files', is_running=True,
+                                created_time=now, expires_time=now + timedelta(minutes=1))
+
+        report = run_preflight(self.experiment, deadline=0.1)
+
+        self.assertEqual(self.failures(report), [('DataRouter1', 'host_slot')])
+        self.mocks['wint'].assert_not_called()
+        self.assertEqual(HostSlot.objects.count(), 1)  # The slots taken on the other hosts were released
+
+
+class PreflightDeadlineTestCase(PreflightTestMixin, TransactionTestCase):
+    """The late checks leave their slots to another thread, which uses its own database connection."""
+
+    def wait_for_slots_released(self):
+        for _ in range(100):
+            if not HostSlot.objects.exists():
+                return
+            time.sleep(0.05)
+        self.fail('The host slots were not released')
+
+    def test_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        stopped = []
+
+        def connect(ip_address, timeout=None):
+            if ip_address == '123.45.67.91':
+                # Like a host that doesn't answer until long after the deadline
+                release.wait(5)
+                stopped.append(ip_address)
+                raise TimeoutError('timed out')
+            return self.mocks['wint'].return_value
+
+        self.mocks['wint'].side_effect = connect
+
+        report = run_preflight(self.experiment, deadline=0.2)
+
+        self.assertFalse(report['passed'])
+        self.assertLess(report['duration'], 1)  # It didn't wait for the late thread
+        self.assertEqual(self.failures(report), [('DataRouter1', 'ssh_connect')])
+        timed_out = next(c for c in report['checks'] if not c['passed'])
+        self.assertIsNone(timed_out['duration'])
+
+        self.assertEqual(stopped, [])
+        self.assertTrue(HostSlot.objects.exists())  # The slots are kept while the late thread runs
+
+        release.set()
+        self.wait_for_slots_released()
+        self.assertEqual(stopped, ['123.45.67.91'])
+
+    def test_deadline_includes_slot_wait(self):
+        with patch('attpcdaq.daq.preflight.host_slots') as mock_slots:
+            mock_slots.return_value.__enter__.side_effect = lambda *args: time.sleep(0.15)
+            self.wint.check_data_router_status.side_effect = lambda: time.sleep(0.3) or True
+
+            report = run_preflight(self.experiment, deadline=0.2)
+
+        self.assertLess(report['duration'], 0.3)
+        self.assertIn(('DataRouter0', 'data_router_alive'), self.failures(report))
+
+    def test_late_thread_starts_no_more_checks(self):
+        checked = threading.Event()
+
+        def alive():
+            time.sleep(0.3)
+            return True
+
+        self.wint.check_data_router_status.side_effect = alive
+        self.wint.working_dir_is_clean.side_effect = lambda: checked.set() or True
+
+        report = run_preflight(self.experiment, deadline=0.1)
+
+        self.assertIn(('DataRouter0', 'data_router_alive'), self.failures(report))
+        self.assertEqual(self.mocks['wint'].call_args[1]['timeout'], 0.1)
+
+        self.wait_for_slots_released()
+        self.assertFalse(checked.is_set())
+
+
+class ForecastRunBytesTestCase(TestCase):
+    def test_forecast(self):
+        experiment = Experiment.objects.create(name='Test')
+        router = DataRouter.objects.create(name='DataRouter0', ip_address='123.45.67.89', experiment=experiment)
+        self.assertEqual(forecast_run_bytes(experiment, timedelta(hours=1)), {})
+
+        start = datetime(2017, 1, 1)
+        run = RunMetadata.objects.create(experiment=experiment, run_number=0, start_datetime=start,
+                                         stop_datetime=start + timedelta(minutes=30))
+        for i in range(2):
+            RunFile.objects.create(run=run, data_router=router, path='/data/file{}.graw'.format(i), size=500,
+                                   mtime=start)
+
+        self.assertEqual(forecast_run_bytes(experiment, timedelta(hours=1)), {router.pk: 2000})
+        self.assertEqual(forecast_run_bytes(experiment, timedelta(hours=1))[router.pk],
+                         router.forecast_run_bytes(timedelta(hours=1)))
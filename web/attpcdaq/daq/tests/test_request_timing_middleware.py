@@ -0,0 +1,57 @@
+from django.test import TestCase, RequestFactory, override_settings
+from django.http import HttpResponse
+from django.urls import reverse
+from datetime import timedelta
+
+from ..models import Experiment
+from ..middleware import RequestTimingMiddleware, RequestTiming
+from ... import metrics
+
+
+def view_with_queries(request):
+    for i in range(3):
+        list(Experiment.objects.filter(pk=i))
+    metrics.SOAP_CALL_DURATION.observe(0.25, host='ecc:8083', operation='GetState')
+    return HttpResponse('OK')
+
+
+class RequestTimingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.middleware = RequestTimingMiddleware(view_with_queries)
+        self.request = RequestFactory().get('/some/path')
+
+    def test_server_timing_header(self):
+        resp = self.middleware(self.request)
+
+        header = resp['Server-Timing']
+        self.assertRegex(header, r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="3 queries", soap;dur=250\.0$')
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=timedelta(0), SLOW_REQUEST_TOP_QUERIES=1)
+    def test_slow_request_logged(self):
+        with self.assertLogs('attpcdaq.daq.middleware', level='WARNING') as logs:
+            self.middleware(self.request)
+
+        message, = logs.records
+        lines = message.getMessage().splitlines()
+        self.assertIn('GET /some/path', lines[0])
+        self.assertIn('with 3 queries', lines[0])
+        self.assertIn('soap 0.25 s', lines[0])
+        self.assertEqual(len(lines), 2)
+        self.assertIn('in 3 x SELECT', lines[1])
+
+    def test_fast_request_not_logged(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('attpcdaq.daq.middleware', level='WARNING'):
+                self.middleware(self.request)
+
+    def test_installed(self):
+        resp = self.client.get(reverse('metrics'))
+        self.assertIn('Server-Timing', resp)
+
+    def test_top_queries(self):
+        timing = RequestTiming()
+        timing.queries = [('A', 0.1), ('B', 0.3), ('A', 0.1), ('A', 0.15), ('C', 0.01)]
+
+        top = timing.top_queries(2)
+        self.assertEqual([(sql, count) for sql, count, duration in top], [('A', 3), ('B', 1)])
+        self.assertAlmostEqual(top[0][2], 0.35)
@@ -0,0 +1,174 @@
+"""Tests for the multi-step run control operations"""
+
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+
+from ..models import ECCServer, Experiment, ConfigId, HostSlot
+from ..runcontrol import transition_phases, wait_for_state, change_state_in_phases, RunControlError
+from ..runcontrol import plan_transitions, change_state_to
+
+
+class TransitionPhasesTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.mutant = ECCServer(name='Mutant[master]', experiment=self.experiment)
+        self.cobos = [ECCServer(name='CoBo[{}]'.format(i), experiment=self.experiment) for i in range(2)]
+        self.ecc_servers = [self.cobos[0], self.mutant, self.cobos[1]]
+
+    def test_mutants_first(self):
+        for target_state, is_running in ((ECCServer.PREPARED, False), (ECCServer.READY, True)):
+            phases = transition_phases(self.ecc_servers, target_state, is_running)
+            self.assertEqual(phases, [[self.mutant], self.cobos])
+
+    def test_cobos_first(self):
+        for target_state in (ECCServer.DESCRIBED, ECCServer.READY, ECCServer.RUNNING):
+            phases = transition_phases(self.ecc_servers, target_state, is_running=False)
+            self.assertEqual(phases, [self.cobos, [self.mutant]])
+
+    def test_all_at_once(self):
+        phases = transition_phases(self.ecc_servers, ECCServer.IDLE, is_running=False)
+        self.assertEqual(phases, [self.ecc_servers])
+
+    def test_no_mutants(self):
+        phases = transition_phases(self.cobos, ECCServer.RUNNING, is_running=False)
+        self.assertEqual(phases, [self.cobos])
+
+
+@override_settings(RUN_CONTROL_POLL_INTERVAL=0)
+class ChangeStateInPhasesTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        config = ConfigId.objects.create(describe='describe', prepare='prepare', configure='configure')
+        self.ecc_servers = [
+            ECCServer.objects.create(name=name, ip_address='123.45.67.89', experiment=self.experiment,
+                                     selected_config=config, state=ECCServer.READY)
+            for name in ('CoBo[0]', 'CoBo[1]', 'Mutant[master]')
+        ]
+        self.calls = []
+        self.priorities = []
+
+    def fake_change_state(self, ecc_server, target_state):
+        self.calls.append(('change_state', ecc_server.name))
+        ecc_server.is_transitioning = True
+
+    def fake_refresh_state(self, ecc_server, priority=None):
+        self.calls.append(('refresh_state', ecc_server.name))
+        self.priorities.append(priority)
+        ecc_server.state = ECCServer.RUNNING
+        ecc_server.is_transitioning = False
+
+    def test_waits_between_phases(self):
+        with patch.object(ECCServer, 'change_state', autospec=True, side_effect=self.fake_change_state), \
+                patch.object(ECCServer, 'refresh_state', autospec=True, side_effect=self.fake_refresh_state):
+            change_state_in_phases(self.ecc_servers, ECCServer.RUNNING, is_running=False)
+
+        self.assertEqual(self.calls, [
+            ('change_state', 'CoBo[0]'),
+            ('change_state', 'CoBo[1]'),
+            ('refresh_state', 'CoBo[0]'),
+            ('refresh_state', 'CoBo[1]'),
+            ('change_state', 'Mutant[master]'),
+            ('refresh_state', 'Mutant[master]'),
+        ])
+        self.assertEqual(set(self.priorities), {HostSlot.TRANSITION})  # Ahead of the periodic polls
+
+    def test_timeout(self):
+        with patch.object(ECCServer, 'change_state', autospec=True, side_effect=self.fake_change_state), \
+                patch.object(ECCServer, 'refresh_state', autospec=True):
+            with self.assertRaisesRegex(RunControlError, r'CoBo\[0\], CoBo\[1\]'):
+                change_state_in_phases(self.ecc_servers, ECCServer.RUNNING, is_running=False, timeout=0)
+
+    def test_request_fails(self):
+        with patch.object(ECCServer, 'change_state', autospec=True, side_effect=RuntimeError('No config')):
+            with self.assertRaisesRegex(RunControlError, 'No config'):
+                change_state_in_phases(self.ecc_servers, ECCServer.RUNNING, is_running=False)
+
+    def test_wait_for_state_ignores_refresh_errors(self):
+        with patch.object(ECCServer, 'refresh_state', autospec=True, side_effect=RuntimeError()):
+            with self.assertLogs('attpcdaq.daq.runcontrol', level='ERROR'):
+                late = wait_for_state(self.ecc_servers[:1], ECCServer.READY, timeout=0)
+
+        self.assertEqual(late, [])
+
+
+class PlanTransitionsTestCase(TestCase):
+    def test_up(self):
+        self.assertEqual(plan_transitions(ECCServer.IDLE, ECCServer.RUNNING),
+                         [ECCServer.DESCRIBED, ECCServer.PREPARED, ECCServer.READY, ECCServer.RUNNING])
+
+    def test_down(self):
+        self.assertEqual(plan_transitions(ECCServer.RUNNING, ECCServer.PREPARED),
+                         [ECCServer.READY, ECCServer.PREPARED])
+
+    def test_same_state(self):
+        self.assertEqual(plan_transitions(ECCServer.READY, ECCServer.READY), [])
+
+    def test_invalid_state(self):
+        with self.assertRaises(ValueError):
+            plan_transitions(ECCServer.READY, ECCServer.RESET)
+
+
+@override_settings(RUN_CONTROL_POLL_INTERVAL=0)
+class ChangeStateToTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.ecc_servers = [
+            ECCServer.objects.create(name=name, ip_address='123.45.67.89', experiment=self.experiment)
+            for name in ('CoBo[0]', 'CoBo[1]', 'Mutant[master]')
+        ]
+        self.calls = []
+
+    def fake_change_state(self, ecc_server, target_state):
+        self.calls.append((ecc_server.name, ECCServer.STATE_DICT[target_state]))
+        ecc_server.is_transitioning = True
+        ecc_server.next_state = target_state
+
+    def fake_refresh_state(self, ecc_server, priority=None):
+        ecc_server.state = ecc_server.next_state
+        ecc_server.is_transitioning = False
+
+    def change_state_to(self, target_state):
+        with patch.object(ECCServer, 'change_state', autospec=True, side_effect=self.fake_change_state), \
+                patch.object(ECCServer, 'refresh_state', autospec=True, side_effect=self.fake_refresh_state):
+            return change_state_to(self.ecc_servers, target_state)
+
+    def test_cold_start(self):
+        steps = self.change_state_to(ECCServer.RUNNING)
+
+        self.assertEqual([name for name, duration in steps], ['Describe', 'Prepare', 'Configure', 'Start'])
+        self.assertEqual(self.calls, [
+            ('CoBo[0]', 'Described'), ('CoBo[1]', 'Described'), ('Mutant[master]', 'Described'),
+            ('Mutant[master]', 'Prepared'), ('CoBo[0]', 'Prepared'), ('CoBo[1]', 'Prepared'),
+            ('CoBo[0]', 'Ready'), ('CoBo[1]', 'Ready'), ('Mutant[master]', 'Ready'),
+            ('CoBo[0]', 'Running'), ('CoBo[1]', 'Running'), ('Mutant[master]', 'Running'),
+        ])
+        self.assertEqual({e.state for e in self.ecc_servers}, {ECCServer.RUNNING})
+
+    def test_stop_and_reset(self):
+        for ecc_server in self.ecc_servers:
+            ecc_server.state = ECCServer.RUNNING
+
+        self.change_state_to(ECCServer.PREPARED)
+
+        self.assertEqual(self.calls, [
+            ('Mutant[master]', 'Ready'), ('CoBo[0]', 'Ready'), ('CoBo[1]', 'Ready'),
+            ('Mutant[master]', 'Prepared'), ('CoBo[0]', 'Prepared'), ('CoBo[1]', 'Prepared'),
+        ])
+
+    def test_mixed_states(self):
+        self.ecc_servers[0].state = ECCServer.READY
+        self.ecc_servers[1].state = ECCServer.PREPARED
+        self.ecc_servers[2].state = ECCServer.IDLE
+
+        steps = self.change_state_to(ECCServer.PREPARED)
+
+        self.assertEqual([name for name, duration in steps], ['Breakup', 'Describe', 'Prepare'])
+        self.assertEqual(self.calls, [
+            ('CoBo[0]', 'Prepared'), ('Mutant[master]', 'Described'), ('Mutant[master]', 'Prepared'),
+        ])
+
+    def test_already_transitioning(self):
+        self.ecc_servers[1].is_transitioning = True
+        with self.assertRaisesRegex(RunControlError, r'CoBo\[1\]'):
+            self.change_state_to(ECCServer.RUNNING)
+        self.assertEqual(self.calls, [])
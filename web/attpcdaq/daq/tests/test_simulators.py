@@ -0,0 +1,212 @@
+"""Tests for the simulated DAQ components"""
+
+from django.test import TestCase
+from django.core.management import call_command, CommandError
+from unittest.mock import patch
+from http.client import HTTPConnection
+import io
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+import paramiko
+
+from ..models import ECCServer, ConfigId, Experiment, EccStateClient, ECCError
+from ..simulators.ecc import VirtualEccServer, EccSimulator
+from ..simulators.ssh import FakeDaqNode
+from ..workertasks import WorkerInterface
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class VirtualEccServerTestCase(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.ecc = VirtualEccServer('ECC', clock=self.clock)
+
+    def test_full_cycle(self):
+        operations = [('Describe', ECCServer.DESCRIBED), ('Prepare', ECCServer.PREPARED),
+                      ('Configure', ECCServer.READY), ('Start', ECCServer.RUNNING), ('Stop', ECCServer.READY),
+                      ('Breakup', ECCServer.PREPARED), ('Undo', ECCServer.DESCRIBED), ('Undo', ECCServer.IDLE)]
+        for operation, state in operations:
+            result = self.ecc.transition(operation)
+            self.assertEqual(result['ErrorCode'], 0, msg=operation)
+            self.assertEqual(self.ecc.get_state()['State'], state, msg=operation)
+
+    def test_invalid_transition(self):
+        result = self.ecc.transition('Start')
+        self.assertNotEqual(result['ErrorCode'], 0)
+        self.assertEqual(self.ecc.state, ECCServer.IDLE)
+
+    def test_latency(self):
+        self.ecc.latency = 5
+        self.ecc.transition('Describe')
+
+        self.assertEqual(self.ecc.get_state(), dict(ErrorCode=0, ErrorMessage='', State=ECCServer.IDLE,
+                                                    Transition=1))
+        self.assertNotEqual(self.ecc.transition('Prepare')['ErrorCode'], 0)
+
+        self.clock.time = 5
+        self.assertEqual(self.ecc.get_state(), dict(ErrorCode=0, ErrorMessage='', State=ECCServer.DESCRIBED,
+                                                    Transition=0))
+
+    def test_error_injection(self):
+        self.ecc.error_rate = 1
+        self.ecc.state_error_rate = 1
+
+        self.assertNotEqual(self.ecc.transition('Describe')['ErrorCode'], 0)
+        self.assertNotEqual(self.ecc.get_state()['ErrorCode'], 0)
+        self.assertEqual(self.ecc.state, ECCServer.IDLE)
+
+    def test_get_config_ids(self):
+        self.ecc.config_names = ['A', 'B']
+        text = self.ecc.get_config_ids()['Text']
+        configs = [ConfigId.from_xml(node) for node in ET.fromstring(text).findall('ConfigId')]
+        self.assertEqual([c.describe for c in configs], ['A', 'B'])
+
+    def test_unknown_operation(self):
+        with self.assertRaises(KeyError):
+            self.ecc.handle('ServerExit')
+
+
+class EccSimulatorTestCase(TestCase):
+    def setUp(self):
+        self.simulator = EccSimulator(2, initial_state=ECCServer.READY)
+        self.simulator.start()
+        self.addCleanup(self.simulator.stop)
+
+    def test_get_state(self):
+        for url in self.simulator.urls:
+            result = EccStateClient(url).GetState()
+            self.assertEqual(int(result.ErrorCode), 0)
+            self.assertEqual(int(result.State), ECCServer.READY)
+            self.assertEqual(int(result.Transition), 0)
+
+    def test_refresh_state(self):
+        experiment = Experiment.objects.create(name='Test')
+        ecc_server = ECCServer.objects.create(name='ECC', ip_address=self.simulator.host,
+                                              port=self.simulator.ports[0], experiment=experiment)
+        ecc_server.refresh_state()
+        self.assertEqual(ecc_server.state, ECCServer.READY)
+
+    def test_transition_request(self):
+        body = (b'<?xml version="1.0" encoding="utf-8"?>'
+                b'<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/">'
+                b'<soap-env:Body><Start xmlns="urn:ecc"><configID/><table/></Start></soap-env:Body>'
+                b'</soap-env:Envelope>')
+        conn = HTTPConnection(self.simulator.host, self.simulator.ports[0])
+        self.addCleanup(conn.close)
+        conn.request('POST', '/', body=body, headers={'Content-Type': 'text/xml'})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 200)
+        response.read()
+
+        self.assertEqual(self.simulator.ecc_servers[0].state, ECCServer.RUNNING)
+        self.assertEqual(self.simulator.ecc_servers[1].state, ECCServer.READY)
+
+    def test_unknown_operation_is_fault(self):
+        with patch.object(EccStateClient, 'request_body', EccStateClient.request_body.replace(b'GetState',
+                                                                                                b'ServerExit')):
+            with self.assertRaisesRegex(ECCError, 'not implemented'):
+                EccStateClient(self.simulator.urls[0]).GetState()
+
+
+class FakeDaqNodeTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.host_key = paramiko.RSAKey.generate(2048)
+        cls.client_key = paramiko.RSAKey.generate(2048)
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+
+        # WorkerInterface reads the SSH config and key from the home directory
+        home = os.path.join(tmpdir.name, 'home')
+        os.makedirs(os.path.join(home, '.ssh'))
+        self.client_key.write_private_key_file(os.path.join(home, '.ssh', 'id_rsa'))
+        open(os.path.join(home, '.ssh', 'config'), 'w').close()
+        env_patcher = patch.dict(os.environ, {'HOME': home})
+        env_patcher.start()
+        self.addCleanup(env_patcher.stop)
+
+        self.node = FakeDaqNode(os.path.join(tmpdir.name, 'node'), host_key=self.host_key)
+        self.node.start()
+        self.addCleanup(self.node.stop)
+
+    def connect(self):
+        return WorkerInterface(self.node.host, port=self.node.port)
+
+    def test_status_checks(self):
+        with self.connect() as wint:
+            self.assertTrue(wint.check_data_router_status())
+            self.assertTrue(wint.check_ecc_server_status())
+            self.assertEqual(wint.find_data_router(), self.node.staging_dir)
+
+        self.node.processes = ['getEccSoapServer']
+        with self.connect() as wint:
+            self.assertFalse(wint.check_data_router_status())
+            with self.assertRaises(RuntimeError):
+                wint.find_data_router()
+
+    def test_organize_files(self):
+        paths = self.node.create_graw_files(5, 100)
+
+        with self.connect() as wint:
+            self.assertFalse(wint.working_dir_is_clean())
+            self.assertEqual(wint.get_graw_size(), 500)
+            inventory = wint.organize_files('test', 3)
+            self.assertTrue(wint.working_dir_is_clean())
+
+        run_dir = os.path.join(self.node.staging_dir, 'test', 'run_0003')
+        self.assertEqual(sorted(os.listdir(run_dir)), sorted(os.path.basename(p) for p in paths))
+        self.assertEqual(len(inventory), 5)
+
+    def test_tail_file(self):
+        self.node.write_log(100)
+        with open(self.node.log_path) as f:
+            expected = ''.join(f.readlines()[-10:])
+
+        with self.connect() as wint:
+            self.assertEqual(wint.tail_file(self.node.log_path, 11), expected)
+
+    def test_backup_config_files(self):
+        paths = self.node.create_config_files('test', size=1000)
+        backup_root = os.path.join(self.node.root, 'backups')
+
+        with self.connect() as wint:
+            wint.backup_config_files('test', 1, paths, backup_root)
+
+        for path in paths:
+            with open(path) as orig, open(os.path.join(backup_root, 'test', 'run_0001', os.path.basename(path))) as copy:
+                self.assertEqual(orig.read(), copy.read())
+
+    def test_failed_shell_command(self):
+        with self.connect() as wint:
+            with self.assertRaises(RuntimeError):
+                wint.hash_files([os.path.join(self.node.root, 'missing.xcfg')])
+
+
+@patch('attpcdaq.daq.management.commands.run_ecc_simulator.time.sleep', side_effect=KeyboardInterrupt)
+class RunEccSimulatorCommandTestCase(TestCase):
+    def test_register(self, mock_sleep):
+        experiment = Experiment.objects.create(name='Test', is_active=True)
+
+        call_command('run_ecc_simulator', count=3, base_port=0, register=True, config_names=['cfg'],
+                     stdout=io.StringIO())
+
+        ecc_servers = ECCServer.objects.filter(experiment=experiment)
+        self.assertEqual(ecc_servers.count(), 3)
+        for ecc_server in ecc_servers:
+            self.assertEqual(ecc_server.ip_address, '127.0.0.1')
+            self.assertEqual(ecc_server.selected_config.describe, 'cfg')
+
+    def test_register_without_experiment(self, mock_sleep):
+        with self.assertRaises(CommandError):
+            call_command('run_ecc_simulator', base_port=0, register=True, stdout=io.StringIO())
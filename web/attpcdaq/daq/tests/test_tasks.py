@@ -1,15 +1,24 @@
 """Unit tests for Celery tasks"""
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from unittest.mock import patch, MagicMock, call
 import logging
+import os
+from datetime import datetime, timedelta
 from celery.exceptions import SoftTimeLimitExceeded
+from celery import current_app
 
 from ..tasks import organize_files_task, eccserver_refresh_state_task, eccserver_change_state_task
 from ..tasks import check_ecc_server_online_task, check_data_router_status_task, organize_files_all_task
 from ..tasks import eccserver_refresh_all_task, check_ecc_server_online_all_task, check_data_router_status_all_task
-from ..tasks import backup_config_files_task, backup_config_files_all_task
-from ..models import ECCServer, DataRouter, ConfigId, Experiment, RunMetadata
+from ..tasks import backup_config_files_task, backup_config_files_all_task, checksum_run_files_task
+from ..tasks import sample_data_rate_task, sample_data_rate_all_task, prune_task_timings_task, prune_trace_spans_task
+from ..tasks import next_run_task, run_sequencer_task, run_sequence_boundary_task, change_state_all_task
+from ..tasks import reconcile_transitions_task, prune_samples_task
+from ..runcontrol import RunControlError
+from ..models import ECCServer, DataRouter, ConfigId, Experiment, RunMetadata, ConfigBlob, ConfigManifestEntry
+from ..models import RunFile, DataRateSample, DiskUsageSample, TaskTiming, TraceSpan, RunSequence, RunBoundary
+from ..models import HostSlot, PollLease, PollRecord, CircuitBreaker
 
 
 class TaskTestCaseBase(TestCase):
@@ -148,6 +157,71 @@ class TestOkWithoutActiveExperimentMixin(object):
             mock_logger.exception.assert_not_called()
 
 
+class PollLeaseTestMixin(object):
+    """Tests for the poll cycles that take a lease on each target before queueing its task."""
+
+    #: The name of the poll
+    poll = None
+
+    def get_expected_subtask_calls(self: AllTaskTestCaseBase):
+        token = PollLease.objects.values_list('token', flat=True).first()
+        return [call(x.pk, token) for x in self.get_queryset()]
+
+    def add_lease(self, target_pk):
+        now = datetime.now()
+        return PollLease.objects.create(poll=self.poll, target_pk=target_pk, token='earlier', created_time=now,
+                                        expires_time=now + timedelta(minutes=1))
+
+    def test_skips_leased_targets(self: AllTaskTestCaseBase):
+        """Test that a target still being checked by an earlier cycle is skipped."""
+        busy = self.get_queryset().first()
+        self.add_lease(busy.pk)
+
+        self.call_task()
+
+        called_pks = [c[0][0] for c in self.get_callable('subtask').call_args_list]
+        self.assertEqual(called_pks, [x.pk for x in self.get_queryset() if x.pk != busy.pk])
+        self.assertEqual(PollLease.objects.get(token='earlier').skipped, 1)
+
+    def test_skips_targets_not_due(self: AllTaskTestCaseBase):
+        """Test that a target checked a moment ago isn't checked again."""
+        recent = self.get_queryset().first()
+        PollRecord.objects.create(poll=self.poll, target_pk=recent.pk, last_time=datetime.now())
+
+        self.call_task()
+
+        called_pks = [c[0][0] for c in self.get_callable('subtask').call_args_list]
+        self.assertEqual(called_pks, [x.pk for x in self.get_queryset() if x.pk != recent.pk])
+
+    def test_skips_cycles_until_due(self: AllTaskTestCaseBase):
+        """Test that the next cycle only makes one query if no target can be due yet."""
+        self.call_task()
+        with self.assertNumQueries(1):
+            self.call_task()
+
+        self.assertEqual(self.get_callable('group').call_count, 1)
+
+    def test_cycle_after_leased_target_not_skipped(self: AllTaskTestCaseBase):
+        """Test that a target skipped because of its lease is tried again in the next cycle."""
+        busy = self.get_queryset().first()
+        lease = self.add_lease(busy.pk)
+
+        self.call_task()
+        lease.delete()
+        self.call_task()
+
+        self.assertEqual(self.get_callable('subtask').call_args_list[-1][0][0], busy.pk)
+
+    def test_nothing_queued_if_all_leased(self: AllTaskTestCaseBase):
+        """Test that the cycle is skipped if every target is still being checked."""
+        for x in self.get_queryset():
+            self.add_lease(x.pk)
+
+        self.call_task()
+
+        self.get_callable('group').assert_not_called()
+
+
 class ExceptionHandlingTestMixin(object):
     """A mixin with tests for task exception handling."""
 
@@ -193,14 +267,42 @@ class EccServerRefreshStateTaskTestCase(ExceptionHandlingTestMixin, TaskTestCase
         self.call_task()
         self.get_callable().assert_called_once_with()
 
+    def test_releases_poll_lease(self):
+        """Test that the task gives back the lease taken by the poll cycle."""
+        now = datetime.now()
+        PollLease.objects.create(poll='ecc_state', target_pk=self.ecc.pk, token='abc', created_time=now,
+                                 expires_time=now + timedelta(minutes=1))
+        PollLease.objects.create(poll='ecc_online', target_pk=self.ecc.pk, token='abc', created_time=now,
+                                 expires_time=now + timedelta(minutes=1))
+
+        eccserver_refresh_state_task(self.ecc.pk, 'abc')
+
+        self.assertEqual(list(PollLease.objects.values_list('poll', flat=True)), ['ecc_online'])
+
+    def test_circuit_open(self):
+        """Test that the ECC server isn't contacted, and is marked offline, while its circuit breaker is open."""
+        self.ecc.is_online = True
+        self.ecc.save()
+        CircuitBreaker.objects.create(endpoint='ecc:{}:{}'.format(self.ecc.ip_address, self.ecc.port),
+                                      state=CircuitBreaker.OPEN, failures=3,
+                                      next_probe_time=datetime.now() + timedelta(minutes=1))
+
+        self.call_task()
+
+        self.get_callable().assert_not_called()
+        self.ecc.refresh_from_db()
+        self.assertFalse(self.ecc.is_online)
+
     def test_with_invalid_ecc_pk(self):
         """Test that the task logs an error if the pk is invalid."""
         with self.assertLogs(level=logging.ERROR):
             self.call_task(self.ecc.pk + 10)
 
 
-class EccServerRefreshAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForAllMixin,
+class EccServerRefreshAllTaskTestCase(ExceptionHandlingTestMixin, PollLeaseTestMixin, TestCalledForAllMixin,
                                       TestOkWithoutActiveExperimentMixin, AllTaskTestCaseBase):
+    poll = 'ecc_state'
+
     def setUp(self):
         super().setUp()
 
@@ -231,6 +333,21 @@ class EccServerRefreshAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForA
     def call_task(self):
         return eccserver_refresh_all_task()
 
+    def test_transition_not_skipped(self):
+        """Test that a cycle isn't skipped when a server has started a transition since the last one."""
+        self.call_task()
+        transitioning = self.get_queryset().first()
+        transitioning.is_transitioning = True
+        transitioning.save()
+        PollRecord.objects.filter(poll=self.poll, target_pk=transitioning.pk).update(
+            last_time=datetime.now() - timedelta(seconds=1))
+        PollLease.objects.all().delete()  # The checks from the first cycle have finished
+
+        self.call_task()
+
+        called_pks = [c[0][0] for c in self.get_callable('subtask').call_args_list]
+        self.assertEqual(called_pks[-1], transitioning.pk)
+
     def get_queryset(self):
         return ECCServer.objects.filter(experiment=self.experiment)
 
@@ -307,14 +424,37 @@ class CheckEccServerOnlineTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseB
         self.ecc.refresh_from_db()
         self.assertTrue(self.ecc.is_online)
 
+    @override_settings(CIRCUIT_BREAKER_THRESHOLD=2)
+    def test_circuit_opens_after_failures(self):
+        """Test that the ECC server is marked offline as soon as its circuit breaker opens."""
+        self.ecc.is_online = True
+        self.ecc.save()
+        self.set_mock_effect(TimeoutError, side_effect=True)
+
+        with self.assertLogs(level=logging.ERROR):
+            self.call_task()
+        self.ecc.refresh_from_db()
+        self.assertTrue(self.ecc.is_online)
+
+        with self.assertLogs(level=logging.WARNING) as cm:
+            self.call_task()
+        self.assertRegex(cm.output[0], r'Opened circuit breaker for ssh:123\.123\.123\.123')
+        self.ecc.refresh_from_db()
+        self.assertFalse(self.ecc.is_online)
+
+        self.call_task()
+        self.assertEqual(self.get_callable().call_count, 2)
+
     def test_with_invalid_ecc_pk(self):
         """Test that the task logs an error if the pk is invalid."""
         with self.assertLogs(level=logging.ERROR):
             self.call_task(self.ecc.pk + 10)
 
 
-class CheckEccServerOnlineAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForAllMixin,
+class CheckEccServerOnlineAllTaskTestCase(ExceptionHandlingTestMixin, PollLeaseTestMixin, TestCalledForAllMixin,
                                           TestOkWithoutActiveExperimentMixin, AllTaskTestCaseBase):
+    poll = 'ecc_online'
+
     def setUp(self):
         super().setUp()
 
@@ -373,6 +513,8 @@ class CheckDataRouterStatusTaskTestCase(ExceptionHandlingTestMixin, TaskTestCase
             return cm.check_data_router_status
         elif which == 'clean':
             return cm.working_dir_is_clean
+        elif which == 'disk':
+            return cm.get_disk_usage
         else:
             raise ValueError('Unknown method {} requested'.format(which))
 
@@ -389,22 +531,72 @@ class CheckDataRouterStatusTaskTestCase(ExceptionHandlingTestMixin, TaskTestCase
 
         self.set_mock_effect(True, which='status')
         self.set_mock_effect(True, which='clean')
+        self.set_mock_effect((1000, 400), which='disk')
 
         self.call_task()
 
         self.mock.assert_called_once_with(self.data_router.ip_address)
         self.get_callable(which='status').assert_called_once_with()
         self.get_callable(which='clean').assert_called_once_with()
+        self.get_callable(which='disk').assert_called_once_with()
 
         self.data_router.refresh_from_db()
         self.assertTrue(self.data_router.is_online)
         self.assertTrue(self.data_router.staging_directory_is_clean)
+        self.assertEqual(self.data_router.disk_total_bytes, 1000)
+        self.assertEqual(self.data_router.disk_free_bytes, 400)
+        self.assertEqual(DiskUsageSample.objects.filter(data_router=self.data_router).count(), 1)
 
     def test_with_invalid_data_router_pk(self):
         """Test that the task logs an error if the pk is invalid."""
         with self.assertLogs(level=logging.ERROR):
             self.call_task(self.data_router.pk + 10)
 
+    def test_keeps_data_sample_saved_meanwhile(self):
+        """Test that a data rate sample saved during the SSH calls isn't overwritten."""
+        def sample_meanwhile():
+            DataRouter.objects.filter(pk=self.data_router.pk).update(staging_bytes=5000, data_rate=100)
+            return True
+
+        self.set_mock_effect(sample_meanwhile, which='status', side_effect=True)
+        self.set_mock_effect(True, which='clean')
+        self.set_mock_effect((1000, 400), which='disk')
+
+        self.call_task()
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.staging_bytes, 5000)
+        self.assertEqual(self.data_router.data_rate, 100)
+        self.assertTrue(self.data_router.is_online)
+        self.assertEqual(self.data_router.disk_free_bytes, 400)
+
+    def test_circuit_open(self):
+        """Test that the router isn't contacted, and is marked offline, while its circuit breaker is open."""
+        self.data_router.is_online = True
+        self.data_router.save()
+        CircuitBreaker.objects.create(endpoint='ssh:' + self.data_router.ip_address, state=CircuitBreaker.OPEN,
+                                      failures=3, next_probe_time=datetime.now() + timedelta(minutes=1))
+
+        self.call_task()
+
+        self.mock.assert_not_called()
+        self.data_router.refresh_from_db()
+        self.assertFalse(self.data_router.is_online)
+
+    def test_probe_closes_circuit(self):
+        """Test that a successful probe closes the circuit breaker."""
+        CircuitBreaker.objects.create(endpoint='ssh:' + self.data_router.ip_address, state=CircuitBreaker.OPEN,
+                                      failures=3, next_probe_time=datetime.now() - timedelta(seconds=1))
+        self.set_mock_effect(True, which='status')
+        self.set_mock_effect(True, which='clean')
+        self.set_mock_effect((1000, 400), which='disk')
+
+        self.call_task()
+
+        self.assertEqual(CircuitBreaker.objects.get().state, CircuitBreaker.CLOSED)
+        self.data_router.refresh_from_db()
+        self.assertTrue(self.data_router.is_online)
+
     def test_does_not_check_if_clean_if_not_online(self):
         """Test that the staging directory status is not checked if the server is not online."""
         self.set_mock_effect(False, which='status')
@@ -413,10 +605,28 @@ class CheckDataRouterStatusTaskTestCase(ExceptionHandlingTestMixin, TaskTestCase
         self.mock.assert_called_once_with(self.data_router.ip_address)
         self.get_callable(which='status').assert_called_once_with()
         self.get_callable(which='clean').assert_not_called()
+        self.get_callable(which='disk').assert_not_called()
+        self.assertFalse(DiskUsageSample.objects.exists())
+
+    def test_skipped_if_host_busy(self):
+        """Test that the check is skipped with a warning if the host has no free slot."""
+        now = datetime.now()
+        for i in range(2):
+            HostSlot.objects.create(host='ssh:' + self.data_router.ip_address, operation='organize_files',
+                                    is_running=True, created_time=now, expires_time=now + timedelta(minutes=1))
+
+        with override_settings(HOST_CONCURRENCY={'ssh': 2}, HOST_SLOT_POLL_TIMEOUT=0):
+            with self.assertLogs(level=logging.WARNING) as cm:
+                self.call_task()
 
+        self.assertIn('Skipped checking whether DataRouter is online', cm.output[0])
+        self.mock.assert_not_called()
 
-class CheckDataRouterStatusAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForAllMixin,
+
+class CheckDataRouterStatusAllTaskTestCase(ExceptionHandlingTestMixin, PollLeaseTestMixin, TestCalledForAllMixin,
                                            TestOkWithoutActiveExperimentMixin, AllTaskTestCaseBase):
+    poll = 'data_router_status'
+
     def setUp(self):
         super().setUp()
 
@@ -452,10 +662,186 @@ class CheckDataRouterStatusAllTaskTestCase(ExceptionHandlingTestMixin, TestCalle
         return check_data_router_status_all_task()
 
 
+class SampleDataRateTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
+    def setUp(self):
+        super().setUp()
+
+        self.experiment = Experiment.objects.create(
+            name='Test',
+        )
+
+        self.data_router = DataRouter.objects.create(
+            name='DataRouter',
+            ip_address='123.123.123.123',
+            experiment=self.experiment,
+        )
+
+    def get_patch_target(self):
+        return 'attpcdaq.daq.tasks.WorkerInterface'
+
+    def get_callable(self):
+        return self.mock.return_value.__enter__.return_value.get_graw_size
+
+    def call_task(self, pk=None):
+        if pk is None:
+            pk = self.data_router.pk
+        sample_data_rate_task(pk)
+
+    def test_sample_data_rate(self):
+        self.set_mock_effect(1234)
+        self.call_task()
+
+        self.mock.assert_called_once_with(self.data_router.ip_address)
+        self.get_callable().assert_called_once_with()
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.staging_bytes, 1234)
+        self.assertIsNotNone(self.data_router.last_sample_time)
+
+    def test_with_invalid_data_router_pk(self):
+        with self.assertLogs(level=logging.ERROR):
+            self.call_task(self.data_router.pk + 10)
+
+
+class SampleDataRateAllTaskTestCase(ExceptionHandlingTestMixin, PollLeaseTestMixin, TestCalledForAllMixin,
+                                    AllTaskTestCaseBase):
+    poll = 'data_rate'
+
+    def setUp(self):
+        super().setUp()
+
+        self.experiment = Experiment.objects.create(
+            name='Test',
+            is_active=True,
+        )
+        RunMetadata.objects.create(
+            experiment=self.experiment,
+            run_number=0,
+            start_datetime=datetime.now(),
+        )
+
+        for i in range(10):
+            DataRouter.objects.create(
+                name='DataRouter{}'.format(i),
+                ip_address='123.123.123.123',
+                experiment=self.experiment,
+            )
+
+    def get_patch_target(self):
+        return 'attpcdaq.daq.tasks.sample_data_rate_task'
+
+    def get_queryset(self):
+        return DataRouter.objects.filter(experiment=self.experiment)
+
+    def call_task(self):
+        return sample_data_rate_all_task()
+
+    def test_resets_when_not_running(self):
+        latest_run = self.experiment.latest_run
+        latest_run.stop_datetime = datetime.now()
+        latest_run.save()
+
+        self.get_queryset().update(data_rate=100, is_stalled=True, last_sample_time=datetime.now(),
+                                   last_growth_time=datetime.now())
+
+        self.call_task()
+
+        self.get_callable('group').return_value.assert_not_called()
+        for router in self.get_queryset():
+            self.assertEqual(router.data_rate, 0)
+            self.assertFalse(router.is_stalled)
+            self.assertIsNone(router.last_sample_time)
+
+    def test_idle_cycles_skipped(self):
+        """Test that the cycles after one that found no run in progress only make one query."""
+        RunMetadata.objects.filter(experiment=self.experiment).update(stop_datetime=datetime.now())
+
+        self.call_task()
+        with self.assertNumQueries(1):
+            self.call_task()
+
+
+class PruneTaskTimingsTaskTestCase(TestCase):
+    def make_timing(self, start_time):
+        return TaskTiming.objects.create(task_name='task', start_time=start_time, duration=1,
+                                         outcome=TaskTiming.SUCCESS)
+
+    def test_prunes_old_timings(self):
+        now = datetime.now()
+        self.make_timing(now - timedelta(hours=2))
+        recent = self.make_timing(now)
+
+        with self.settings(TASK_TIMING_HISTORY=timedelta(hours=1)):
+            prune_task_timings_task()
+
+        self.assertEqual(list(TaskTiming.objects.all()), [recent])
+
+
+class PruneSamplesTaskTestCase(TestCase):
+    def setUp(self):
+        experiment = Experiment.objects.create(name='Test')
+        self.router = DataRouter.objects.create(name='DataRouter0', ip_address='123.123.123.123',
+                                                experiment=experiment)
+
+    def test_prunes_old_data_rate_samples(self):
+        now = datetime.now()
+        DataRateSample.objects.create(data_router=self.router, time=now - timedelta(hours=2), interval=5,
+                                      bytes_written=10)
+        recent = DataRateSample.objects.create(data_router=self.router, time=now, interval=5, bytes_written=10)
+
+        with self.settings(DATA_RATE_HISTORY=timedelta(hours=1)):
+            prune_samples_task()
+
+        self.assertEqual(list(DataRateSample.objects.all()), [recent])
+
+    def test_prunes_old_disk_usage_samples(self):
+        now = datetime.now()
+        DiskUsageSample.objects.create(data_router=self.router, time=now - timedelta(days=1), total_bytes=10,
+                                       free_bytes=5)
+        recent = DiskUsageSample.objects.create(data_router=self.router, time=now, total_bytes=10, free_bytes=5)
+
+        with self.settings(DISK_USAGE_HISTORY=timedelta(hours=6)):
+            prune_samples_task()
+
+        self.assertEqual(list(DiskUsageSample.objects.all()), [recent])
+
+
+class ReconcileTransitionsTaskTestCase(TestCase):
+    @patch('attpcdaq.daq.tasks.reconcile_transitions')
+    def test_calls_watchdog(self, mock_reconcile):
+        reconcile_transitions_task()
+        mock_reconcile.assert_called_once_with()
+
+    @patch('attpcdaq.daq.tasks.reconcile_transitions', side_effect=RuntimeError('boom'))
+    def test_logs_errors(self, mock_reconcile):
+        with self.assertLogs('attpcdaq.daq.tasks', level='ERROR'):
+            reconcile_transitions_task()
+
+
+class PruneTraceSpansTaskTestCase(TestCase):
+    def make_span(self, start_time):
+        return TraceSpan.objects.create(trace_id='ab' * 16, span_id='1' * 16, name='span', kind=TraceSpan.VIEW,
+                                        start_time=start_time, duration=1)
+
+    def test_prunes_old_spans(self):
+        now = datetime.now()
+        self.make_span(now - timedelta(days=2))
+        recent = self.make_span(now)
+
+        with self.settings(TRACE_HISTORY=timedelta(days=1)):
+            prune_trace_spans_task()
+
+        self.assertEqual(list(TraceSpan.objects.all()), [recent])
+
+
 class OrganizeFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
     def setUp(self):
         super().setUp()
 
+        self.checksum_patcher = patch('attpcdaq.daq.tasks.checksum_run_files_task.delay')
+        self.mock_checksum_delay = self.checksum_patcher.start()
+        self.addCleanup(self.checksum_patcher.stop)
+
         self.experiment = Experiment.objects.create(
             name='Test',
         )
@@ -470,6 +856,8 @@ class OrganizeFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
             experiment=self.experiment,
         )
 
+        self.mock.return_value.__enter__.return_value.working_dir_is_clean.return_value = True
+
     def get_patch_target(self):
         return 'attpcdaq.daq.tasks.WorkerInterface'
 
@@ -494,6 +882,94 @@ class OrganizeFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
         self.data_router.refresh_from_db()
         self.assertTrue(self.data_router.staging_directory_is_clean)
 
+    def test_files_left_behind(self):
+        """Test that the data router isn't marked clean if files are still in the staging directory."""
+        self.mock.return_value.__enter__.return_value.working_dir_is_clean.return_value = False
+
+        self.call_task()
+
+        self.data_router.refresh_from_db()
+        self.assertFalse(self.data_router.staging_directory_is_clean)
+
+    def test_records_run_files(self):
+        """Test that the organized files are recorded in the inventory."""
+        inventory = [{'path': '/data/Test/run_0010/file{}.graw'.format(i), 'size': 1000 * i, 'mtime': 1500000000 + i}
+                     for i in range(3)]
+        self.set_mock_effect(inventory)
+
+        self.call_task()
+        self.call_task()  # Organizing again should replace the old records
+
+        files = RunFile.objects.filter(run=self.run, data_router=self.data_router)
+        self.assertEqual(sorted(f.path for f in files), [f['path'] for f in inventory])
+        self.assertEqual(sum(f.size for f in files), 3000)
+
+    def test_queues_checksums(self):
+        """Test that the checksum task is queued after the files are organized."""
+        self.call_task()
+        self.mock_checksum_delay.assert_called_once_with(self.data_router.pk, self.experiment.pk, self.run.pk)
+
+    def test_with_invalid_data_router_pk(self):
+        """Test that the task logs an error if the pk is invalid."""
+        with self.assertLogs(level=logging.ERROR):
+            self.call_task(self.data_router.pk + 10)
+
+
+@override_settings(GRAW_CHECKSUM_ALGORITHM='sha512', GRAW_CHECKSUM_PARALLELISM=8)
+class ChecksumRunFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
+    def setUp(self):
+        super().setUp()
+
+        self.experiment = Experiment.objects.create(
+            name='Test',
+        )
+
+        self.data_router = DataRouter.objects.create(
+            name='DataRouter',
+            ip_address='123.456.789.0',
+            experiment=self.experiment
+        )
+        self.run = RunMetadata.objects.create(
+            run_number=10,
+            experiment=self.experiment,
+        )
+
+        self.paths = ['/data/Test/run_0010/file{}.graw'.format(i) for i in range(3)]
+        for path in self.paths:
+            RunFile.objects.create(run=self.run, data_router=self.data_router, path=path, size=10,
+                                   mtime=datetime.now())
+
+    def get_patch_target(self):
+        return 'attpcdaq.daq.tasks.WorkerInterface'
+
+    def get_callable(self):
+        return self.mock.return_value.__enter__.return_value.checksum_graw_files
+
+    def call_task(self, pk=None):
+        if pk is None:
+            pk = self.data_router.pk
+        checksum_run_files_task(pk, self.experiment.pk, self.run.pk)
+
+    def test_records_checksums(self):
+        """Test that the checksums are computed with the configured settings and recorded."""
+        self.set_mock_effect({path: 'digest{}'.format(i) for i, path in enumerate(self.paths)})
+
+        self.call_task()
+
+        self.mock.assert_called_once_with(self.data_router.ip_address)
+        self.get_callable().assert_called_once_with(self.experiment.name, self.run.run_number, 'sha512', 8)
+
+        for i, path in enumerate(self.paths):
+            run_file = RunFile.objects.get(path=path)
+            self.assertEqual(run_file.checksum, 'digest{}'.format(i))
+            self.assertEqual(run_file.checksum_algorithm, 'sha512')
+
+    def test_unrecorded_file(self):
+        """Test that a warning is logged for files that aren't in the inventory."""
+        self.set_mock_effect({'/data/Test/run_0010/other.graw': 'digest'})
+        with self.assertLogs(level=logging.WARNING):
+            self.call_task()
+
     def test_with_invalid_data_router_pk(self):
         """Test that the task logs an error if the pk is invalid."""
         with self.assertLogs(level=logging.ERROR):
@@ -544,6 +1020,7 @@ class OrganizeFilesAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForAllM
         return super().get_expected_subtask_calls(self.experiment.pk, self.run.pk)
 
 
+@override_settings(CONFIG_BACKUP_MODE='copy')
 class BackupConfigFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
     def setUp(self):
         super().setUp()
@@ -598,6 +1075,74 @@ class BackupConfigFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase
             self.call_task(self.ecc.pk + 10)
 
 
+@override_settings(CONFIG_BACKUP_MODE='archive')
+class ArchiveConfigFilesTaskTestCase(BackupConfigFilesTaskTestCase):
+    def get_callable(self):
+        return self.mock.return_value.__enter__.return_value.archive_config_files
+
+    def test_backup_files(self):
+        """Test that the task makes an archive and returns the checksums."""
+        checksums = {'describe-describe.xcfg': 'abc123'}
+        self.set_mock_effect(checksums)
+
+        result = self.call_task()
+
+        self.mock.assert_called_once_with(self.ecc.ip_address)
+        self.get_callable().assert_called_once_with(self.experiment.name, self.run.run_number,
+                                                    self.ecc.config_file_paths(), self.ecc.config_backup_root)
+        self.mock.return_value.__enter__.return_value.backup_config_files.assert_not_called()
+        self.assertEqual(result, checksums)
+
+
+@override_settings(CONFIG_BACKUP_MODE='store')
+class StoreConfigBackupTaskTestCase(BackupConfigFilesTaskTestCase):
+    def setUp(self):
+        super().setUp()
+        self.checksums = {path: '{:064x}'.format(i) for i, path in enumerate(self.ecc.config_file_paths())}
+
+    def get_callable(self):
+        return self.mock.return_value.__enter__.return_value.hash_files
+
+    def get_store_blobs(self):
+        return self.mock.return_value.__enter__.return_value.store_blobs
+
+    def test_backup_files(self):
+        """Test that new files are stored and recorded in the manifest."""
+        self.set_mock_effect(self.checksums)
+
+        result = self.call_task()
+
+        self.get_callable().assert_called_once_with(self.ecc.config_file_paths())
+        self.get_store_blobs().assert_called_once_with(self.checksums, self.ecc.config_backup_root)
+
+        self.assertEqual(ConfigBlob.objects.count(), len(self.checksums))
+        manifest = ConfigManifestEntry.objects.filter(run=self.run, ecc_server=self.ecc)
+        self.assertEqual({(e.file_name, e.checksum) for e in manifest},
+                         {(os.path.basename(p), d) for p, d in self.checksums.items()})
+        self.assertEqual(result, {os.path.basename(p): d for p, d in self.checksums.items()})
+
+    def test_unchanged_files_are_not_copied(self):
+        """Test that files already in the store are only compared by checksum."""
+        self.set_mock_effect(self.checksums)
+        self.call_task()
+
+        self.get_store_blobs().reset_mock()
+        next_run = RunMetadata.objects.create(run_number=2, experiment=self.experiment)
+        backup_config_files_task(self.ecc.pk, self.experiment.pk, next_run.pk)
+
+        self.get_store_blobs().assert_not_called()
+        self.assertEqual(ConfigBlob.objects.count(), len(self.checksums))
+        self.assertEqual(ConfigManifestEntry.objects.filter(run=next_run).count(), len(self.checksums))
+
+    def test_repeated_backup_replaces_manifest(self):
+        """Test that backing up the same run twice doesn't duplicate its manifest."""
+        self.set_mock_effect(self.checksums)
+        self.call_task()
+        self.call_task()
+
+        self.assertEqual(ConfigManifestEntry.objects.filter(run=self.run).count(), len(self.checksums))
+
+
 class BackupConfigFilesAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForAllMixin, AllTaskTestCaseBase):
     def setUp(self):
         super().setUp()
@@ -650,3 +1195,278 @@ class BackupConfigFilesAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledFor
 
     def get_expected_subtask_calls(self):
         return super().get_expected_subtask_calls(self.experiment.pk, self.run.pk)
+
+
+class NextRunTaskTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test', is_active=True)
+        config = ConfigId.objects.create(describe='describe', prepare='prepare', configure='configure')
+        for name in ('CoBo[0]', 'Mutant[master]'):
+            ECCServer.objects.create(name=name, ip_address='123.45.67.89', experiment=self.experiment,
+                                     selected_config=config, state=ECCServer.RUNNING)
+        for i in range(2):
+            DataRouter.objects.create(name='DataRouter{}'.format(i), ip_address='123.45.67.9{}'.format(i),
+                                      experiment=self.experiment, staging_directory_is_clean=False)
+        self.experiment.start_run()
+        self.run = self.experiment.latest_run
+
+        patchers = {
+            'change_state': patch('attpcdaq.daq.tasks.change_state_in_phases'),
+            'wint': patch('attpcdaq.daq.tasks.WorkerInterface'),
+            'backup': patch('attpcdaq.daq.tasks.backup_config_files_all_task.delay'),
+            'organize_all': patch('attpcdaq.daq.tasks.organize_files_all_task.delay'),
+            'checksum': patch('attpcdaq.daq.tasks.checksum_run_files_task.delay'),
+        }
+        self.mocks = {}
+        for name, patcher in patchers.items():
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.wint = self.mocks['wint'].return_value.__enter__.return_value
+        self.wint.organize_files.return_value = [{'path': '/data/Test/run_0000/file.graw', 'size': 10,
+                                                  'mtime': 1500000000}]
+        self.wint.working_dir_is_clean.return_value = True
+
+    def test_rollover(self):
+        next_run_task(self.experiment.pk)
+
+        self.assertEqual([c[0][1] for c in self.mocks['change_state'].call_args_list],
+                         [ECCServer.READY, ECCServer.RUNNING])
+        self.mocks['backup'].assert_called_once_with(self.experiment.pk, self.run.pk)
+        self.mocks['organize_all'].assert_not_called()
+
+        self.assertEqual(self.wint.organize_files.call_count, 2)
+        self.assertFalse(DataRouter.objects.filter(staging_directory_is_clean=False).exists())
+        self.assertEqual(RunFile.objects.filter(run=self.run).count(), 2)
+
+        self.run.refresh_from_db()
+        self.assertIsNotNone(self.run.stop_datetime)
+        self.assertEqual(self.experiment.latest_run.run_number, self.run.run_number + 1)
+        self.assertTrue(self.experiment.is_running)
+
+    def test_not_running(self):
+        self.experiment.stop_run()
+
+        with self.assertLogs('attpcdaq.daq.tasks', level='ERROR'):
+            next_run_task(self.experiment.pk)
+
+        self.mocks['change_state'].assert_not_called()
+
+    def test_stop_fails(self):
+        self.mocks['change_state'].side_effect = RunControlError('Timed out')
+
+        with self.assertLogs('attpcdaq.daq.tasks', level='ERROR'):
+            next_run_task(self.experiment.pk)
+
+        self.assertFalse(self.experiment.is_running)
+        self.mocks['organize_all'].assert_called_once_with(self.experiment.pk, self.run.pk)
+        self.wint.organize_files.assert_not_called()
+
+    def test_staging_directory_not_clean(self):
+        self.wint.working_dir_is_clean.return_value = False
+
+        with self.assertLogs('attpcdaq.daq.tasks', level='ERROR') as logs:
+            next_run_task(self.experiment.pk)
+
+        self.assertIn('DataRouter0', logs.output[0])
+        self.assertEqual(self.mocks['change_state'].call_count, 1)
+        self.assertFalse(self.experiment.is_running)
+        self.assertEqual(self.experiment.latest_run, self.run)
+
+
+class ChangeStateAllTaskTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test', is_active=True)
+        config = ConfigId.objects.create(describe='describe', prepare='prepare', configure='configure')
+        for name in ('CoBo[0]', 'Mutant[master]'):
+            ECCServer.objects.create(name=name, ip_address='123.45.67.89', experiment=self.experiment,
+                                     selected_config=config)
+
+        patchers = {
+            'change_state_to': patch('attpcdaq.daq.tasks.change_state_to', return_value=[('Describe', 1.0)]),
+            'organize_all': patch('attpcdaq.daq.tasks.organize_files_all_task.delay'),
+            'backup': patch('attpcdaq.daq.tasks.backup_config_files_all_task.delay'),
+        }
+        self.mocks = {}
+        for name, patcher in patchers.items():
+            self.mocks[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cold_start(self):
+        with self.assertLogs('attpcdaq.daq.tasks', level='INFO') as logs:
+            change_state_all_task(self.experiment.pk, ECCServer.RUNNING)
+
+        self.mocks['change_state_to'].assert_called_once()
+        self.assertEqual(self.mocks['change_state_to'].call_args[0][1], ECCServer.RUNNING)
+        self.assertTrue(self.experiment.is_running)
+        self.assertIn('Describe 1.0 s', logs.output[0])
+
+    def test_stop_and_reset(self):
+        self.experiment.start_run()
+        run = self.experiment.latest_run
+
+        change_state_all_task(self.experiment.pk, ECCServer.IDLE)
+
+        self.assertEqual([c[0][1] for c in self.mocks['change_state_to'].call_args_list],
+                         [ECCServer.READY, ECCServer.IDLE])
+        self.assertFalse(self.experiment.is_running)
+        self.mocks['organize_all'].assert_called_once_with(self.experiment.pk, run.pk)
+        self.mocks['backup'].assert_called_once_with(self.experiment.pk, run.pk)
+
+    def test_step_fails(self):
+        self.mocks['change_state_to'].side_effect = RunControlError('Timed out')
+
+        with self.assertLogs('attpcdaq.daq.tasks', level='ERROR'):
+            change_state_all_task(self.experiment.pk, ECCServer.RUNNING)
+
+        self.assertFalse(self.experiment.is_running)
+
+
+class RunSequenceTaskTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test', is_active=True)
+        self.router = DataRouter.objects.create(name='DataRouter0', ip_address='123.45.67.90',
+                                                experiment=self.experiment)
+        self.experiment.start_run()
+        self.run = self.experiment.latest_run
+        self.run.start_datetime = datetime.now() - timedelta(minutes=30)
+        self.run.save()
+
+        self.sequence = RunSequence.objects.create(experiment=self.experiment, max_duration=timedelta(minutes=20),
+                                                   run_count=2)
+
+        patcher = patch('attpcdaq.daq.tasks.run_sequence_boundary_task.delay')
+        self.mock_delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_starts_rollover(self):
+        run_sequencer_task()
+
+        boundary = RunBoundary.objects.get()
+        self.assertEqual(boundary.run, self.run)
+        self.assertEqual(boundary.reason, RunBoundary.DURATION)
+        self.assertEqual(boundary.planned_time, self.run.start_datetime + timedelta(minutes=20))
+        self.mock_delay.assert_called_once_with(boundary.pk)
+
+        self.sequence.refresh_from_db()
+        self.assertIsNotNone(self.sequence.rollover_started_time)
+
+    def test_no_second_rollover(self):
+        run_sequencer_task()
+        run_sequencer_task()
+
+        self.assertEqual(RunBoundary.objects.count(), 1)
+        self.assertEqual(self.mock_delay.call_count, 1)
+
+    def test_abandoned_rollover(self):
+        self.sequence.rollover_started_time = datetime.now() - timedelta(hours=1)
+        self.sequence.save()
+
+        with self.assertLogs('attpcdaq.daq.tasks', level='WARNING'):
+            run_sequencer_task()
+
+        self.mock_delay.assert_called_once()
+
+    def test_before_limit(self):
+        self.sequence.max_duration = timedelta(hours=1)
+        self.sequence.save()
+
+        run_sequencer_task()
+
+        self.assertFalse(RunBoundary.objects.exists())
+        self.mock_delay.assert_not_called()
+
+    def test_run_stopped_by_hand(self):
+        self.experiment.stop_run()
+
+        with self.assertLogs('attpcdaq.daq.tasks', level='WARNING'):
+            run_sequencer_task()
+
+        self.sequence.refresh_from_db()
+        self.assertEqual(self.sequence.state, RunSequence.CANCELLED)
+        self.mock_delay.assert_not_called()
+
+    def rollover(self):
+        self.experiment.stop_run()
+        self.experiment.start_run()
+
+    @patch('attpcdaq.daq.tasks.roll_over_run')
+    def test_boundary(self, mock_roll_over):
+        mock_roll_over.side_effect = lambda experiment, start_next: self.rollover()
+        run_sequencer_task()
+
+        run_sequence_boundary_task(RunBoundary.objects.get().pk)
+
+        mock_roll_over.assert_called_once_with(self.experiment, start_next=True)
+        boundary = RunBoundary.objects.get()
+        self.assertIsNotNone(boundary.stop_time)
+        self.assertEqual(boundary.next_run, self.experiment.latest_run)
+        self.assertIsNotNone(boundary.dead_time)
+        self.assertFalse(boundary.failed)
+
+        self.sequence.refresh_from_db()
+        self.assertEqual(self.sequence.state, RunSequence.ACTIVE)
+        self.assertEqual(self.sequence.runs_completed, 1)
+        self.assertIsNone(self.sequence.rollover_started_time)
+
+    @patch('attpcdaq.daq.tasks.roll_over_run')
+    def test_last_run(self, mock_roll_over):
+        mock_roll_over.side_effect = lambda experiment, start_next: experiment.stop_run()
+        self.sequence.runs_completed = 1
+        self.sequence.save()
+        run_sequencer_task()
+
+        run_sequence_boundary_task(RunBoundary.objects.get().pk)
+
+        mock_roll_over.assert_called_once_with(self.experiment, start_next=False)
+        self.assertIsNone(RunBoundary.objects.get().next_run)
+        self.sequence.refresh_from_db()
+        self.assertEqual(self.sequence.state, RunSequence.FINISHED)
+        self.assertEqual(self.sequence.runs_completed, 2)
+
+    @patch('attpcdaq.daq.tasks.roll_over_run')
+    def test_rollover_fails(self, mock_roll_over):
+        mock_roll_over.side_effect = RunControlError('Timed out')
+        run_sequencer_task()
+
+        with self.assertLogs('attpcdaq.daq.tasks', level='ERROR'):
+            run_sequence_boundary_task(RunBoundary.objects.get().pk)
+
+        self.assertTrue(RunBoundary.objects.get().failed)
+        self.sequence.refresh_from_db()
+        self.assertEqual(self.sequence.state, RunSequence.FAILED)
+        self.assertEqual(self.sequence.message, 'Timed out')
+
+    @patch('attpcdaq.daq.tasks.roll_over_run')
+    def test_cancelled_before_rollover(self, mock_roll_over):
+        run_sequencer_task()
+        RunSequence.objects.update(state=RunSequence.CANCELLED)
+
+        run_sequence_boundary_task(RunBoundary.objects.get().pk)
+
+        mock_roll_over.assert_not_called()
+        self.assertFalse(RunBoundary.objects.exists())
+        self.sequence.refresh_from_db()
+        self.assertIsNone(self.sequence.rollover_started_time)
+
+
+class TaskRoutingTestCase(TestCase):
+    def get_queue(self, task):
+        return current_app.amqp.router.route({}, task.name)['queue'].name
+
+    def test_control_tasks(self):
+        for task in (eccserver_change_state_task, change_state_all_task, next_run_task, run_sequencer_task,
+                     run_sequence_boundary_task, reconcile_transitions_task):
+            self.assertEqual(self.get_queue(task), 'control', task.name)
+
+    def test_polling_tasks(self):
+        for task in (eccserver_refresh_state_task, eccserver_refresh_all_task, check_ecc_server_online_task,
+                     check_ecc_server_online_all_task, check_data_router_status_task,
+                     check_data_router_status_all_task, sample_data_rate_task, sample_data_rate_all_task):
+            self.assertEqual(self.get_queue(task), 'polling', task.name)
+
+    def test_bulk_tasks(self):
+        for task in (organize_files_task, organize_files_all_task, checksum_run_files_task, backup_config_files_task,
+                     backup_config_files_all_task, prune_task_timings_task, prune_samples_task,
+                     prune_trace_spans_task):
+            self.assertEqual(self.get_queue(task), 'bulk', task.name)
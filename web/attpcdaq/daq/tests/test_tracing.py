@@ -0,0 +1,159 @@
+"""Tests for tracing requests through the Celery tasks"""
+
+from django.test import TestCase, RequestFactory, override_settings
+from django.http import HttpResponse
+from unittest.mock import patch, MagicMock
+from datetime import datetime, timedelta
+
+from ..models import ECCServer, Experiment, TraceSpan, StateResult
+from ..tasks import eccserver_refresh_state_task
+from .. import tracing
+
+
+class SpanTestCase(TestCase):
+    def test_no_trace(self):
+        with tracing.span('step', TraceSpan.WAIT):
+            pass
+        self.assertFalse(TraceSpan.objects.exists())
+
+    def test_nested_spans(self):
+        with tracing.trace('root', TraceSpan.VIEW) as trace_id:
+            with tracing.span('child', TraceSpan.SOAP, target='ecc'):
+                with tracing.span('grandchild', TraceSpan.WAIT):
+                    pass
+
+        self.assertIsNone(tracing.current_trace_id())
+
+        root = TraceSpan.objects.get(name='root')
+        child = TraceSpan.objects.get(name='child')
+        grandchild = TraceSpan.objects.get(name='grandchild')
+        self.assertEqual({s.trace_id for s in (root, child, grandchild)}, {trace_id})
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(child.parent_id, root.span_id)
+        self.assertEqual(grandchild.parent_id, child.span_id)
+        self.assertEqual(child.target, 'ecc')
+        self.assertGreaterEqual(root.duration, child.duration)
+
+    def test_failed_span(self):
+        with self.assertRaises(ValueError):
+            with tracing.trace('root', TraceSpan.VIEW):
+                raise ValueError()
+
+        self.assertTrue(TraceSpan.objects.get().failed)
+
+    @override_settings(TRACING_ENABLED=False)
+    def test_disabled(self):
+        with tracing.trace('root', TraceSpan.VIEW) as trace_id:
+            with tracing.span('child', TraceSpan.SOAP):
+                pass
+
+        self.assertIsNone(trace_id)
+        self.assertFalse(TraceSpan.objects.exists())
+
+    def test_traced_view(self):
+        def view(request):
+            self.assertIsNotNone(tracing.current_trace_id())
+            return HttpResponse()
+
+        tracing.traced_view(view)(RequestFactory().post('/daq/sources/change_state_all/'))
+
+        root = TraceSpan.objects.get()
+        self.assertEqual(root.name, 'view')
+        self.assertEqual(root.kind, TraceSpan.VIEW)
+        self.assertEqual(root.target, '/daq/sources/change_state_all/')
+
+
+class TaskPropagationTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.ecc_server = ECCServer.objects.create(name='CoBo[7]', ip_address='123.45.67.89',
+                                                   experiment=self.experiment)
+
+    def test_adds_headers_in_trace(self):
+        headers = {}
+        tracing.add_trace_headers(headers=headers)
+        self.assertEqual(headers, {})
+
+        with tracing.trace('root', TraceSpan.VIEW) as trace_id:
+            tracing.add_trace_headers(headers=headers)
+            parent_id = tracing.current_span_id()
+
+        self.assertEqual(headers[tracing.TRACE_ID_HEADER], trace_id)
+        self.assertEqual(headers[tracing.PARENT_SPAN_HEADER], parent_id)
+
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_task_continues_trace(self, mock_refresh):
+        headers = {tracing.TRACE_ID_HEADER: 'ab' * 16, tracing.PARENT_SPAN_HEADER: '1' * 16}
+
+        def refresh():
+            with tracing.span('GetState', TraceSpan.SOAP):
+                pass
+
+        mock_refresh.side_effect = refresh
+
+        eccserver_refresh_state_task.apply(args=(self.ecc_server.pk,), headers=headers)
+
+        task_span = TraceSpan.objects.get(kind=TraceSpan.TASK)
+        self.assertEqual(task_span.trace_id, 'ab' * 16)
+        self.assertEqual(task_span.parent_id, '1' * 16)
+        self.assertEqual(task_span.name, 'eccserver_refresh_state_task')
+        self.assertEqual(task_span.target, 'CoBo[7]')
+        self.assertFalse(task_span.failed)
+
+        soap_span = TraceSpan.objects.get(kind=TraceSpan.SOAP)
+        self.assertEqual(soap_span.parent_id, task_span.span_id)
+        self.assertIsNone(tracing.current_trace_id())
+
+    @patch('attpcdaq.daq.models.ECCServer.refresh_state')
+    def test_untraced_task(self, mock_refresh):
+        eccserver_refresh_state_task.apply(args=(self.ecc_server.pk,))
+        self.assertFalse(TraceSpan.objects.exists())
+
+
+class TransitionSpanTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.ecc_server = ECCServer.objects.create(name='CoBo[7]', ip_address='123.45.67.89',
+                                                   experiment=self.experiment, is_transitioning=True)
+
+    def test_closed_by_refresh_state(self):
+        with tracing.trace('root', TraceSpan.VIEW):
+            tracing.open_span('Transition to Ready', TraceSpan.TRANSITION, target='CoBo[7]')
+
+        transition = TraceSpan.objects.get(kind=TraceSpan.TRANSITION)
+        self.assertIsNone(transition.duration)
+
+        client = MagicMock()
+        with patch.object(ECCServer, '_get_state_client', return_value=client):
+            client.GetState.return_value = StateResult('0', '', str(ECCServer.PREPARED), '1')
+            self.ecc_server.refresh_state()
+            transition.refresh_from_db()
+            self.assertIsNone(transition.duration)
+
+            client.GetState.return_value = StateResult('0', '', str(ECCServer.READY), '0')
+            self.ecc_server.refresh_state()
+            transition.refresh_from_db()
+            self.assertIsNotNone(transition.duration)
+
+
+class TimelineTestCase(TestCase):
+    def make_span(self, span_id, parent_id, offset, duration):
+        return TraceSpan(trace_id='ab' * 16, span_id=span_id, parent_id=parent_id, name=span_id,
+                         kind=TraceSpan.TASK, start_time=self.start + timedelta(seconds=offset), duration=duration)
+
+    def test_order_and_layout(self):
+        self.start = datetime(2017, 1, 1)
+        spans = [
+            self.make_span('b', 'root', 5, 5),
+            self.make_span('root', None, 0, 10),
+            self.make_span('a', 'root', 1, 2),
+            self.make_span('a1', 'a', 1.5, None),
+        ]
+
+        rows = tracing.timeline(spans, now=self.start + timedelta(seconds=8))
+        self.assertEqual([(r['span'].span_id, r['depth']) for r in rows],
+                         [('root', 0), ('a', 1), ('a1', 2), ('b', 1)])
+        self.assertAlmostEqual(rows[3]['left'], 50)
+        self.assertAlmostEqual(rows[3]['width'], 50)
+        self.assertTrue(rows[2]['is_open'])
+        self.assertAlmostEqual(rows[2]['duration'], 6.5)
@@ -0,0 +1,102 @@
+"""Tests for the transition latency and dead time reports"""
+
+from django.test import TestCase
+from datetime import datetime, timedelta
+
+from ..models import ECCServer, Experiment, RunMetadata, TransitionEvent
+from ..transitions import summarize_by_server, summarize_by_transition, slowest_servers, dead_times
+
+
+class TransitionReportTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.servers = [ECCServer.objects.create(name='CoBo[{}]'.format(i), ip_address='123.45.67.{}'.format(i),
+                                                 experiment=self.experiment) for i in range(3)]
+        self.time = datetime(2017, 1, 1)
+
+    def make_event(self, server, transition, event, latency=None):
+        self.time += timedelta(seconds=1)
+        return TransitionEvent.objects.create(ecc_server=server, ecc_server_name=server.name, transition=transition,
+                                              event=event, from_state=ECCServer.PREPARED, to_state=ECCServer.READY,
+                                              time=self.time, latency=latency)
+
+    def add_finished(self, server, transition, latencies):
+        for latency in latencies:
+            self.make_event(server, transition, TransitionEvent.REQUESTED)
+            self.make_event(server, transition, TransitionEvent.FINISHED, latency)
+
+    def test_summarize_by_server(self):
+        self.add_finished(self.servers[0], 'Configure', [10, 20, 30])
+        self.add_finished(self.servers[0], 'Start', [1])
+        self.make_event(self.servers[1], 'Configure', TransitionEvent.FAILED)
+
+        summaries = summarize_by_server(TransitionEvent.objects.all())
+        self.assertEqual([(s['ecc_server'], s['transition']) for s in summaries],
+                         [('CoBo[0]', 'Configure'), ('CoBo[0]', 'Start'), ('CoBo[1]', 'Configure')])
+
+        configure = summaries[0]
+        self.assertEqual(configure['count'], 3)
+        self.assertEqual(configure['p50'], 20)
+        self.assertEqual(configure['max'], 30)
+        self.assertEqual(configure['failures'], 0)
+
+        failed = summaries[2]
+        self.assertEqual(failed['count'], 0)
+        self.assertIsNone(failed['p90'])
+        self.assertEqual(failed['failures'], 1)
+
+    def test_summarize_by_transition(self):
+        self.add_finished(self.servers[0], 'Configure', [10])
+        self.add_finished(self.servers[1], 'Configure', [40])
+        self.add_finished(self.servers[1], 'Describe', [2])
+
+        summaries = summarize_by_transition(TransitionEvent.objects.all())
+        self.assertEqual([(s['transition'], s['count'], s['max']) for s in summaries],
+                         [('Configure', 2, 40), ('Describe', 1, 2)])
+
+    def test_slowest_servers(self):
+        self.add_finished(self.servers[0], 'Configure', [10, 12])
+        self.add_finished(self.servers[1], 'Configure', [50, 60])
+        self.add_finished(self.servers[2], 'Configure', [20])
+        self.add_finished(self.servers[2], 'Start', [100])
+
+        ranked = slowest_servers(TransitionEvent.objects.all(), transition='Configure', count=2)
+        self.assertEqual([s['ecc_server'] for s in ranked], ['CoBo[1]', 'CoBo[2]'])
+
+        ranked = slowest_servers(TransitionEvent.objects.all())
+        self.assertEqual(ranked[0]['ecc_server'], 'CoBo[2]')
+
+
+class DeadTimeTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.start = datetime(2017, 1, 1)
+
+    def make_run(self, run_number, start, stop):
+        return RunMetadata.objects.create(
+            experiment=self.experiment,
+            run_number=run_number,
+            start_datetime=self.start + timedelta(seconds=start),
+            stop_datetime=self.start + timedelta(seconds=stop) if stop is not None else None,
+        )
+
+    def test_gaps(self):
+        self.make_run(0, 0, 100)
+        self.make_run(1, 130, 200)
+        self.make_run(2, 210, None)  # Never stopped
+        self.make_run(3, 400, 500)
+        self.make_run(4, 590, None)  # Still running
+
+        result = dead_times(RunMetadata.objects.all())
+
+        self.assertEqual([(g['run_number'], g['next_run_number'], g['dead_time']) for g in result['gaps']],
+                         [(0, 1, 30), (1, 2, 10), (3, 4, 90)])
+        self.assertEqual(result['count'], 3)
+        self.assertEqual(result['total'], 130)
+        self.assertEqual(result['median'], 30)
+        self.assertEqual(result['max'], 90)
+
+    def test_no_runs(self):
+        result = dead_times(RunMetadata.objects.all())
+        self.assertEqual(result['gaps'], [])
+        self.assertIsNone(result['mean'])
@@ -0,0 +1,182 @@
+"""Tests for the watchdog for stuck transitions"""
+
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+from datetime import datetime, timedelta
+
+from ..models import ECCServer, Experiment, TransitionEvent, TransitionIncident, HostSlot
+from ..hostlimits import ecc_host
+from ..watchdog import transition_timeout, find_stuck_transitions, reconcile_transitions, recent_incidents
+from .utilities import FakeResponseState
+
+
+@override_settings(TRANSITION_TIMEOUTS={'Configure': 120, 'Start': 30}, TRANSITION_TIMEOUT=60)
+class WatchdogTestCaseBase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.ecc_servers = [ECCServer.objects.create(name='CoBo[{}]'.format(i), ip_address='10.0.0.{}'.format(i),
+                                                     experiment=self.experiment, state=ECCServer.PREPARED,
+                                                     is_online=True)
+                            for i in range(3)]
+
+        patcher = patch('attpcdaq.daq.watchdog.EccStateClient')
+        self.mock_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.READY, trans=False)
+
+    def start_transition(self, ecc_server, seconds_ago, transition='Configure'):
+        """Make the ECC server look like it was asked to do a transition some time ago."""
+        started = datetime.now() - timedelta(seconds=seconds_ago)
+        ecc_server.is_transitioning = True
+        ecc_server.transition_started_time = started
+        ecc_server.save()
+        if transition is not None:
+            TransitionEvent.objects.create(ecc_server=ecc_server, ecc_server_name=ecc_server.name,
+                                           transition=transition, event=TransitionEvent.REQUESTED,
+                                           from_state=ECCServer.PREPARED, to_state=ECCServer.READY,
+                                           time=started + timedelta(seconds=0.1))
+
+    def reload(self, ecc_server):
+        return ECCServer.objects.get(pk=ecc_server.pk)
+
+
+class FindStuckTransitionsTestCase(WatchdogTestCaseBase):
+    def test_timeouts(self):
+        self.assertEqual(transition_timeout('Configure'), 120)
+        self.assertEqual(transition_timeout('Undo'), 60)
+        self.assertEqual(transition_timeout(''), 60)
+
+    def test_uses_timeout_of_transition(self):
+        self.start_transition(self.ecc_servers[0], 100, 'Configure')
+        self.start_transition(self.ecc_servers[1], 100, 'Start')
+        self.start_transition(self.ecc_servers[2], 100, None)
+
+        stuck = find_stuck_transitions(datetime.now())
+
+        self.assertEqual([e.name for e, _ in stuck], ['CoBo[1]', 'CoBo[2]'])
+        self.assertEqual(stuck[0][1].transition, 'Start')
+        self.assertIsNone(stuck[1][1])
+
+    def test_ignores_earlier_requests(self):
+        self.start_transition(self.ecc_servers[0], 100, 'Start')
+        self.start_transition(self.ecc_servers[0], 0, None)
+        self.ecc_servers[0].transition_started_time = datetime.now() - timedelta(seconds=90)
+        self.ecc_servers[0].save()
+
+        (ecc_server, request), = find_stuck_transitions(datetime.now())
+        self.assertIsNone(request)
+
+    def test_missing_start_time(self):
+        ECCServer.objects.filter(pk=self.ecc_servers[0].pk).update(is_transitioning=True)
+
+        now = datetime.now()
+        self.assertEqual(find_stuck_transitions(now), [])
+        self.assertEqual(self.reload(self.ecc_servers[0]).transition_started_time, now)
+
+    def test_nothing_transitioning(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(find_stuck_transitions(datetime.now()), [])
+
+
+class ReconcileTransitionsTestCase(WatchdogTestCaseBase):
+    def test_clears_stale_flag(self):
+        self.start_transition(self.ecc_servers[0], 150)
+        self.start_transition(self.ecc_servers[1], 10)
+
+        with self.assertLogs('attpcdaq.daq.watchdog', level='WARNING'):
+            incident, = reconcile_transitions()
+
+        ecc_server = self.reload(self.ecc_servers[0])
+        self.assertFalse(ecc_server.is_transitioning)
+        self.assertEqual(ecc_server.state, ECCServer.READY)
+        self.assertTrue(self.reload(self.ecc_servers[1]).is_transitioning)
+        self.mock_client.assert_called_once_with(self.ecc_servers[0].ecc_url, timeout=5)
+
+        self.assertEqual(incident.resolution, TransitionIncident.CLEARED)
+        self.assertEqual(incident.transition, 'Configure')
+        self.assertIsNotNone(incident.resolved_time)
+        self.assertAlmostEqual(incident.time_lost, 30, delta=1)
+        self.assertTrue(TransitionEvent.objects.filter(event=TransitionEvent.FINISHED).exists())
+
+    def test_unreachable(self):
+        self.start_transition(self.ecc_servers[0], 150)
+        self.mock_client.return_value.GetState.side_effect = TimeoutError('timed out')
+
+        with self.assertLogs('attpcdaq.daq.watchdog', level='WARNING'):
+            incident, = reconcile_transitions()
+
+        ecc_server = self.reload(self.ecc_servers[0])
+        self.assertFalse(ecc_server.is_transitioning)
+        self.assertFalse(ecc_server.is_online)
+        self.assertEqual(ecc_server.state, ECCServer.PREPARED)
+        self.assertEqual(incident.resolution, TransitionIncident.UNREACHABLE)
+        self.assertEqual(incident.message, 'TimeoutError: timed out')
+        self.assertTrue(TransitionEvent.objects.filter(event=TransitionEvent.FAILED).exists())
+
+    def test_ecc_error_clears_flag(self):
+        self.start_transition(self.ecc_servers[0], 150)
+        self.mock_client.return_value.GetState.return_value = FakeResponseState(error_code=1, error_message='Bad')
+
+        with self.assertLogs('attpcdaq.daq.watchdog', level='WARNING'):
+            incident, = reconcile_transitions()
+
+        self.assertFalse(self.reload(self.ecc_servers[0]).is_transitioning)
+        self.assertEqual(incident.message, 'ECCError: Bad')
+
+    def test_escalates_once(self):
+        self.start_transition(self.ecc_servers[0], 150)
+        self.mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.PREPARED, trans=True)
+
+        now = datetime.now()
+        with self.assertLogs('attpcdaq.daq.watchdog', level='ERROR'):
+            incident, = reconcile_transitions(now)
+
+        self.assertTrue(self.reload(self.ecc_servers[0]).is_transitioning)
+        self.assertEqual(incident.resolution, TransitionIncident.ESCALATED)
+        self.assertIsNone(incident.resolved_time)
+
+        with patch('attpcdaq.daq.watchdog.logger') as mock_logger:
+            incident, = reconcile_transitions(now + timedelta(seconds=10))
+        mock_logger.error.assert_not_called()
+
+        self.assertEqual(TransitionIncident.objects.count(), 1)
+        self.assertAlmostEqual(incident.time_lost, 40, delta=1)
+
+    def test_escalated_incident_closed_when_transition_ends(self):
+        self.start_transition(self.ecc_servers[0], 150)
+        self.mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.PREPARED, trans=True)
+        with self.assertLogs('attpcdaq.daq.watchdog', level='ERROR'):
+            reconcile_transitions()
+
+        # The state poll sees the end of the transition
+        ecc_server = self.reload(self.ecc_servers[0])
+        ecc_server.update_state(FakeResponseState(state=ECCServer.READY, trans=False))
+
+        incident, = reconcile_transitions()
+        self.assertEqual(incident.resolution, TransitionIncident.ESCALATED)
+        self.assertIsNotNone(incident.resolved_time)
+        self.mock_client.return_value.GetState.assert_called_once_with()
+
+    def test_host_busy(self):
+        self.start_transition(self.ecc_servers[0], 150)
+        now = datetime.now()
+        HostSlot.objects.create(host=ecc_host(self.ecc_servers[0]), operation='Configure',
+                                priority=HostSlot.TRANSITION, is_running=True, created_time=now, acquired_time=now,
+                                expires_time=now + timedelta(minutes=1))
+
+        with self.settings(TRANSITION_WATCHDOG_REQUEST_TIMEOUT=0.1), \
+                self.assertLogs('attpcdaq.daq.watchdog', level='WARNING'):
+            self.assertEqual(reconcile_transitions(), [])
+
+        self.assertTrue(self.reload(self.ecc_servers[0]).is_transitioning)
+        self.assertFalse(TransitionIncident.objects.exists())
+
+    def test_recent_incidents(self):
+        self.start_transition(self.ecc_servers[0], 150)
+        with self.assertLogs('attpcdaq.daq.watchdog', level='WARNING'):
+            reconcile_transitions()
+
+        incident, = recent_incidents(TransitionIncident.objects.all())
+        self.assertEqual(incident['ecc_server'], 'CoBo[0]')
+        self.assertEqual(incident['resolution'], 'Cleared')
+        self.assertFalse(incident['is_open'])
@@ -4,7 +4,8 @@ import os
 from itertools import chain
 from io import BytesIO
 
-from ..workertasks import WorkerInterface, mkdir_recursive
+from ..workertasks import WorkerInterface, mkdir_recursive, quote_remote_path
+from ... import metrics
 
 
 class MkdirRecursiveTestCase(TestCase):
@@ -91,6 +92,27 @@ class MkdirRecursiveTestCase(TestCase):
         mock.chdir.assert_not_called()
 
 
+class QuoteRemotePathTestCase(TestCase):
+    def test_plain_path(self):
+        self.assertEqual(quote_remote_path('/some/path'), '/some/path')
+
+    def test_path_with_spaces(self):
+        self.assertEqual(quote_remote_path('/some/long path'), "'/some/long path'")
+
+    def test_home_dir_is_not_quoted(self):
+        self.assertEqual(quote_remote_path('~/config backups'), "~/'config backups'")
+
+
+def make_exec_result(lines, exit_status=0, error=b''):
+    """Build a fake return value for ``SSHClient.exec_command``."""
+    stdout = MagicMock()
+    stdout.__iter__.return_value = iter(lines)
+    stdout.channel.recv_exit_status.return_value = exit_status
+    stderr = MagicMock()
+    stderr.read.return_value = error
+    return MagicMock(), stdout, stderr
+
+
 @patch('attpcdaq.daq.workertasks.SSHConfig')
 @patch('attpcdaq.daq.workertasks.SSHClient')
 class WorkerInterfaceTestCase(TestCase):
@@ -144,6 +166,24 @@ class WorkerInterfaceTestCase(TestCase):
 
         client.close.assert_called_once_with()
 
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_timeout(self, mock_find_data_router, mock_client, mock_config):
+        mock_find_data_router.return_value = self.router_path
+        client = mock_client.return_value
+        client.exec_command.return_value = make_exec_result([
+            'Filesystem   1024-blocks      Used Available Capacity  Mounted on\n',
+            '/dev/disk1s1   488245288 400000000  88245288      82%    /\n',
+        ])
+
+        with WorkerInterface(self.hostname, timeout=2) as wint:
+            wint.get_disk_usage()
+            wint.get_graw_size()
+
+        self.assertEqual(client.connect.call_args[1]['timeout'], 2)
+        self.assertEqual(client.connect.call_args[1]['auth_timeout'], 2)
+        client.exec_command.assert_called_once_with("df -Pk /path/to/router", timeout=2)
+        client.open_sftp.return_value.get_channel.return_value.settimeout.assert_called_once_with(2)
+
     def test_find_data_router(self, mock_client, mock_config):
         true_drpath = '/path/to/router'
         client = mock_client.return_value
@@ -155,6 +195,19 @@ class WorkerInterfaceTestCase(TestCase):
 
         self.assertEqual(drpath, true_drpath)
 
+    def test_remote_calls_are_timed(self, mock_client, mock_config):
+        client = mock_client.return_value
+        client.exec_command.return_value = ([], ('p1234\n', 'cdataRouter\n', 'n/path\n'), [])
+        before = metrics.SSH_CALL_DURATION.get(host=self.hostname, operation='find_data_router')
+        before_count = before['count'] if before is not None else 0
+
+        with WorkerInterface(self.hostname) as wint:
+            wint.find_data_router()
+
+        after = metrics.SSH_CALL_DURATION.get(host=self.hostname, operation='find_data_router')
+        self.assertEqual(after['count'], before_count + 1)
+        self.assertIsNotNone(metrics.SSH_CALL_DURATION.get(host=self.hostname, operation='connect'))
+
     def test_find_data_router_not_running(self, mock_client, mock_config):
         client = mock_client.return_value
         client.exec_command.return_value = ([], [], [])
@@ -252,6 +305,48 @@ class WorkerInterfaceTestCase(TestCase):
         expect = [os.path.join(self.router_path, f) for f in file_list[:3]]
         self.assertEqual(result, expect)
 
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_get_graw_size(self, mock_find_data_router, mock_client, mock_config):
+        mock_sftp = mock_client.return_value.open_sftp.return_value.__enter__.return_value
+
+        mock_find_data_router.return_value = self.router_path
+
+        listing = []
+        for name, size in [('file1.graw', 100), ('file2.graw', 250), ('file3.txt', 1000)]:
+            attrs = MagicMock()
+            attrs.filename = name
+            attrs.st_size = size
+            listing.append(attrs)
+        mock_sftp.listdir_attr.return_value = listing
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.get_graw_size()
+
+        mock_sftp.listdir_attr.assert_called_once_with(self.router_path)
+        self.assertEqual(result, 350)
+
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_get_disk_usage(self, mock_find_data_router, mock_client, mock_config):
+        mock_find_data_router.return_value = self.router_path
+        mock_client.return_value.exec_command.return_value = make_exec_result([
+            'Filesystem   1024-blocks      Used Available Capacity  Mounted on\n',
+            '/dev/disk1s1   488245288 400000000  88245288      82%    /Volumes/Data Disk\n',
+        ])
+
+        with WorkerInterface(self.hostname) as wint:
+            total, free = wint.get_disk_usage()
+
+        mock_client.return_value.exec_command.assert_called_once_with("df -Pk /path/to/router")
+        self.assertEqual(total, 488245288 * 1024)
+        self.assertEqual(free, 88245288 * 1024)
+
+    def test_get_disk_usage_bad_output(self, mock_client, mock_config):
+        mock_client.return_value.exec_command.return_value = make_exec_result(['garbage\n'])
+
+        with WorkerInterface(self.hostname) as wint:
+            with self.assertRaises(RuntimeError):
+                wint.get_disk_usage('/some/path')
+
     @patch('attpcdaq.daq.workertasks.mkdir_recursive')
     @patch('attpcdaq.daq.workertasks.WorkerInterface.get_graw_list')
     @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
@@ -283,6 +378,35 @@ class WorkerInterfaceTestCase(TestCase):
         expected_calls = [call(s, d) for s, d in zip(full_src_graws, full_dest_graws)]
         self.assertEqual(mock_sftp.rename.call_args_list, expected_calls)
 
+    @patch('attpcdaq.daq.workertasks.mkdir_recursive')
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.get_graw_list')
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_organize_files_returns_inventory(self, mock_find_data_router, mock_get_graw_list, mock_mkdir,
+                                              mock_client, mock_config):
+        mock_sftp = mock_client.return_value.open_sftp.return_value.__enter__.return_value
+
+        exp_name = 'experiment name'
+        run_number = 1
+        dest_dir = os.path.join(self.router_path, exp_name, 'run_{:04d}'.format(run_number))
+
+        mock_find_data_router.return_value = self.router_path
+        mock_get_graw_list.return_value = [os.path.join(self.router_path, g) for g in self.graw_list]
+
+        listing = []
+        for i, name in enumerate(self.graw_list + ['notes.txt']):
+            attrs = MagicMock(st_size=100 * i, st_mtime=1000 + i)
+            attrs.filename = name
+            listing.append(attrs)
+        mock_sftp.listdir_attr.return_value = listing
+
+        with WorkerInterface(self.hostname) as wint:
+            inventory = wint.organize_files(exp_name, run_number)
+
+        mock_sftp.listdir_attr.assert_called_once_with(dest_dir)
+        expect = [{'path': os.path.join(dest_dir, name), 'size': 100 * i, 'mtime': 1000 + i}
+                  for i, name in enumerate(self.graw_list)]
+        self.assertEqual(inventory, expect)
+
     @patch('attpcdaq.daq.workertasks.mkdir_recursive')
     @patch('attpcdaq.daq.workertasks.WorkerInterface.get_graw_list')
     @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
@@ -353,6 +477,105 @@ class WorkerInterfaceTestCase(TestCase):
         self.assertEqual(mock_file.read.call_count, len(src_paths))
         self.assertEqual(mock_file.write.call_args_list, [call(sample_contents)] * len(dest_paths))
 
+    def test_archive_config_files(self, mock_client, mock_config):
+        client = mock_client.return_value
+
+        src_paths = ['/some/config/describe-a.xcfg', '/some/config/prepare-a.xcfg']
+        client.exec_command.return_value = make_exec_result([
+            'aaaa  /some/config/describe-a.xcfg\n',
+            'bbbb  /some/config/prepare-a.xcfg\n',
+        ])
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.archive_config_files('experiment', 4, src_paths, '~/backups')
+
+        self.assertEqual(result, {'describe-a.xcfg': 'aaaa', 'prepare-a.xcfg': 'bbbb'})
+
+        client.exec_command.assert_called_once()
+        command = client.exec_command.call_args[0][0]
+        self.assertIn('mkdir -p ~/backups/experiment', command)
+        self.assertIn('tar -czf ~/backups/experiment/run_0004.tar.gz', command)
+        self.assertIn('-C /some/config describe-a.xcfg -C /some/config prepare-a.xcfg', command)
+
+    def test_archive_config_files_failure(self, mock_client, mock_config):
+        client = mock_client.return_value
+        client.exec_command.return_value = make_exec_result([], exit_status=1, error=b'No such file')
+
+        with WorkerInterface(self.hostname) as wint:
+            with self.assertRaisesRegex(RuntimeError, r'No such file'):
+                wint.archive_config_files('experiment', 4, ['/missing.xcfg'], '/backups')
+
+    def test_hash_files(self, mock_client, mock_config):
+        client = mock_client.return_value
+        client.exec_command.return_value = make_exec_result(['aaaa  /some/config file.xcfg\n'])
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.hash_files(['/some/config file.xcfg'])
+
+        client.exec_command.assert_called_once_with("shasum -a 256 '/some/config file.xcfg'")
+        self.assertEqual(result, {'/some/config file.xcfg': 'aaaa'})
+
+    def test_store_blobs(self, mock_client, mock_config):
+        client = mock_client.return_value
+        client.exec_command.return_value = make_exec_result([])
+
+        checksum = 'ab' + '0' * 62
+        with WorkerInterface(self.hostname) as wint:
+            wint.store_blobs({'/some/config/file.xcfg': checksum}, '/store')
+
+        command = client.exec_command.call_args[0][0]
+        dest = '/store/objects/ab/' + checksum
+        self.assertIn('mkdir -p /store/objects/ab', command)
+        self.assertIn('[ -e {} ]'.format(dest), command)
+        self.assertIn('cp /some/config/file.xcfg {}.tmp && mv {}.tmp {}'.format(dest, dest, dest), command)
+
+    def test_store_blobs_with_nothing_to_store(self, mock_client, mock_config):
+        client = mock_client.return_value
+
+        with WorkerInterface(self.hostname) as wint:
+            wint.store_blobs({}, '/store')
+
+        client.exec_command.assert_not_called()
+
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_checksum_graw_files(self, mock_find_data_router, mock_client, mock_config):
+        client = mock_client.return_value
+        mock_find_data_router.return_value = self.router_path
+        client.exec_command.return_value = make_exec_result([
+            'aaaa  run_0004/test1.graw\n',
+            'bbbb  run_0004/test2.graw\n',
+        ])
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.checksum_graw_files('experiment', 4, algorithm='sha512', parallelism=6)
+
+        exp_dir = os.path.join(self.router_path, 'experiment')
+        self.assertEqual(result, {
+            os.path.join(exp_dir, 'run_0004', 'test1.graw'): 'aaaa',
+            os.path.join(exp_dir, 'run_0004', 'test2.graw'): 'bbbb',
+        })
+
+        command = client.exec_command.call_args[0][0]
+        self.assertIn('cd {}'.format(exp_dir), command)
+        self.assertIn('xargs -0 -n 1 -P 6 shasum -a 512', command)
+        self.assertIn('mv run_0004.sha512.tmp run_0004.sha512', command)
+
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_checksum_graw_files_with_no_files(self, mock_find_data_router, mock_client, mock_config):
+        client = mock_client.return_value
+        mock_find_data_router.return_value = self.router_path
+        client.exec_command.return_value = make_exec_result(['e3b0  -\n'])
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.checksum_graw_files('experiment', 4)
+
+        self.assertEqual(result, {})
+
+    def test_checksum_graw_files_bad_algorithm(self, mock_client, mock_config):
+        with WorkerInterface(self.hostname) as wint:
+            with self.assertRaisesRegex(ValueError, r'Unsupported'):
+                wint.checksum_graw_files('experiment', 4, algorithm='crc32')
+
     def test_tail_file(self, mock_client, mock_config):
         path = '/path/to/file'
         contents = 'Sample\nfile\ncontents\nwith\nfive\nlines'
@@ -2,13 +2,15 @@ from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 from unittest.mock import patch, call
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import tempfile
 import logging
 
 from .helpers import RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase
 from ...models import ECCServer, DataRouter, DataSource, RunMetadata, Experiment, Observable, Measurement
+from ...models import ConfigBlob, ConfigManifestEntry, RunFile, TaskTiming, TransitionEvent, RunSequence, HostSlot
+from ...models import CircuitBreaker, TransitionIncident
 from ... import views
 from ...views import UpdateRunMetadataView
 from ...forms import RunMetadataForm
@@ -51,8 +53,15 @@ class RefreshStateAllViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
             router = DataRouter.objects.get(pk=pk)
             self.assertEqual(res['is_online'], router.is_online)
             self.assertEqual(res['is_clean'], router.staging_directory_is_clean)
+            self.assertEqual(res['data_rate'], router.data_rate)
+            self.assertEqual(res['is_stalled'], router.is_stalled)
+            self.assertEqual(res['disk_free'], router.disk_free_bytes)
+            self.assertIsNone(res['time_to_full'])
             self.assertTrue(res['success'])
 
+        total_rate = sum(r.data_rate for r in DataRouter.objects.filter(experiment=self.experiment))
+        self.assertEqual(response_json['total_data_rate'], total_rate)
+
     def test_response_contains_run_info(self):
         self.client.force_login(self.user)
 
@@ -97,6 +106,19 @@ class RefreshStateAllViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
         resp = self.client.get(reverse(self.view_name))
         self.assertNotIn(other_router.pk, [int(e['pk']) for e in resp.json()['data_router_status_list']])
 
+    def test_circuit_breakers(self):
+        self.client.force_login(self.user)
+
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.json()['circuit_breakers'], [])
+
+        CircuitBreaker.objects.create(endpoint='ecc:{}:{}'.format(self.ecc_ip_address, self.ecc_port),
+                                      state=CircuitBreaker.OPEN, failures=4)
+        resp = self.client.get(reverse(self.view_name))
+        breaker, = resp.json()['circuit_breakers']
+        self.assertEqual(breaker['state'], 'Open')
+        self.assertEqual(breaker['targets'], [e.name for e in self.ecc_servers])
+
 
 class SourceChangeStateTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
     def setUp(self):
@@ -169,6 +191,11 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
         super().setUp()
         self.view_name = 'daq/source_change_state_all'
 
+        patcher = patch('attpcdaq.daq.views.api.run_preflight', return_value={'passed': True, 'duration': 0.1,
+                                                                             'checks': []})
+        self.mock_preflight = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_get(self, _):
         self.client.force_login(self.user)
         resp = self.client.get(reverse(self.view_name))
@@ -252,6 +279,22 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
 
         self.experiment.refresh_from_db()
         self.assertTrue(self.experiment.is_running)
+        self.mock_preflight.assert_called_once_with(self.experiment)
+
+    def test_start_refused(self, mock_change_state_task_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.all().update(state=ECCServer.READY)
+        failed_check = {'target': 'DataRouter0', 'check': 'staging_clean', 'passed': False,
+                        'message': 'The staging directory contains GRAW files', 'duration': 0.5}
+        self.mock_preflight.return_value = {'passed': False, 'duration': 0.6, 'checks': [failed_check]}
+
+        with self.assertLogs('attpcdaq.daq.views.api', level='ERROR'):
+            resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.RUNNING})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json()['preflight']['checks'], [failed_check])
+        mock_change_state_task_delay.assert_not_called()
+        self.assertFalse(self.experiment.is_running)
 
     def test_stop(self, mock_change_state_task_delay):
         self.client.force_login(self.user)
@@ -267,6 +310,82 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
                 mock_organize.assert_called_once_with(self.experiment.pk, self.experiment.latest_run.pk)
                 mock_backup.assert_called_once_with(self.experiment.pk, self.experiment.latest_run.pk)
 
+    @patch('attpcdaq.daq.views.api.change_state_all_task.delay')
+    def test_multi_step(self, mock_plan_delay, mock_change_state_task_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.all().update(state=ECCServer.IDLE)
+
+        resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.RUNNING})
+
+        self.assertEqual(resp.status_code, 200)
+        mock_plan_delay.assert_called_once_with(self.experiment.pk, ECCServer.RUNNING)
+        mock_change_state_task_delay.assert_not_called()
+        self.assertFalse(self.experiment.is_running)
+
+    @patch('attpcdaq.daq.views.api.change_state_all_task.delay')
+    def test_mixed_states(self, mock_plan_delay, mock_change_state_task_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.filter(pk=ECCServer.objects.first().pk).update(state=ECCServer.PREPARED)
+
+        resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.DESCRIBED})
+
+        self.assertEqual(resp.status_code, 200)
+        mock_plan_delay.assert_called_once_with(self.experiment.pk, ECCServer.DESCRIBED)
+
+    @patch('attpcdaq.daq.views.api.change_state_all_task.delay')
+    def test_multi_step_while_transitioning(self, mock_plan_delay, mock_change_state_task_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.all().update(state=ECCServer.IDLE)
+        ECCServer.objects.filter(pk=ECCServer.objects.first().pk).update(is_transitioning=True)
+
+        with self.assertLogs('attpcdaq.daq.views.api', level='ERROR'):
+            resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.RUNNING})
+
+        self.assertEqual(resp.status_code, 400)
+        mock_plan_delay.assert_not_called()
+
+
+@patch('attpcdaq.daq.views.api.next_run_task.delay')
+class SourceNextRunTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/source_next_run'
+
+    def test_get(self, _):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+    def test_next_run(self, mock_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.all().update(state=ECCServer.RUNNING)
+        self.experiment.start_run()
+
+        resp = self.client.post(reverse(self.view_name))
+
+        self.assertEqual(resp.status_code, 200)
+        mock_delay.assert_called_once_with(self.experiment.pk)
+
+    def test_not_running(self, mock_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.all().update(state=ECCServer.READY)
+
+        resp = self.client.post(reverse(self.view_name))
+
+        self.assertEqual(resp.status_code, 400)
+        mock_delay.assert_not_called()
+
+    def test_transitioning(self, mock_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.all().update(state=ECCServer.RUNNING)
+        ECCServer.objects.filter(pk=ECCServer.objects.first().pk).update(is_transitioning=True)
+        self.experiment.start_run()
+
+        resp = self.client.post(reverse(self.view_name))
+
+        self.assertEqual(resp.status_code, 400)
+        mock_delay.assert_not_called()
+
 
 class AddDataSourceViewTestCase(RequiresLoginTestMixin, TestCase):
     def setUp(self):
@@ -317,6 +436,20 @@ class ListRunMetadataViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
         run_nums = [run.run_number for run in run_list]
         self.assertEqual(sorted(run_nums), run_nums)
 
+    def test_runs_have_file_totals(self):
+        for i in range(3):
+            RunFile.objects.create(run=self.runs[0], path='/data/file{}.graw'.format(i), size=10,
+                                   mtime=datetime.now())
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+
+        run_list = {run.run_number: run for run in resp.context['runmetadata_list']}
+        self.assertEqual(run_list[0].file_count, 3)
+        self.assertEqual(run_list[0].total_bytes, 30)
+        self.assertEqual(run_list[1].file_count, 0)
+        self.assertIsNone(run_list[1].total_bytes)
+
     def test_runs_are_only_for_this_experiment(self):
         self.client.force_login(self.user)
 
@@ -574,3 +707,248 @@ class ListDataSourcesViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
         self.client.force_login(self.user)
         resp = self.client.get(reverse(self.view_name))
         self.assertNotIn(bad_source, resp.context['datasource_list'])
+
+
+class RunsWithConfigViewTestCase(RequiresLoginTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/runs_with_config'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+        self.ecc = ECCServer.objects.create(name='ECC', ip_address='123.123.123.123', experiment=self.experiment)
+
+        self.checksum = 'a' * 64
+        other_checksum = 'b' * 64
+        blobs = {c: ConfigBlob.objects.create(checksum=c, host=self.ecc.ip_address, store_root='/store')
+                 for c in (self.checksum, other_checksum)}
+
+        for run_number, checksum in enumerate((self.checksum, other_checksum, self.checksum)):
+            run = RunMetadata.objects.create(run_number=run_number, experiment=self.experiment)
+            ConfigManifestEntry.objects.create(run=run, ecc_server=self.ecc, file_name='describe-test.xcfg',
+                                               checksum=checksum, blob=blobs[checksum])
+
+    def test_no_login(self):
+        super().test_no_login(rev_args=(self.checksum,))
+
+    def test_finds_runs(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name, args=(self.checksum,)))
+        self.assertEqual(resp.status_code, 200)
+
+        runs = resp.json()['runs']
+        self.assertEqual([r['run_number'] for r in runs], [0, 2])
+        self.assertTrue(all(r['ecc_server'] == self.ecc.name for r in runs))
+
+    def test_post(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name, args=(self.checksum,)))
+        self.assertEqual(resp.status_code, 405)
+
+
+class RunFileSummaryViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/run_file_summary'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+        self.router = DataRouter.objects.create(name='router', ip_address='123.123.123.123',
+                                                experiment=self.experiment)
+
+        for run_number in range(2):
+            run = RunMetadata.objects.create(run_number=run_number, experiment=self.experiment)
+            for i in range(run_number * 2):
+                RunFile.objects.create(run=run, data_router=self.router, path='/data/file{}.graw'.format(i),
+                                       size=1000, mtime=datetime.now())
+
+    def test_summary(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(resp.json()['runs'], [
+            {'run_number': 0, 'file_count': 0, 'total_bytes': 0},
+            {'run_number': 1, 'file_count': 2, 'total_bytes': 2000},
+        ])
+
+    def test_post(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+
+class TaskTimingDataViewTestCase(RequiresLoginTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/task_timing_data'
+        self.user = User.objects.create(username='test', password='test1234')
+
+        for task_name in ('task1', 'task2'):
+            for duration in (1, 2, 3):
+                TaskTiming.objects.create(task_name=task_name, target_type=TaskTiming.ECC_SERVER, target_pk=1,
+                                          target_name='ECC', start_time=datetime.now(), duration=duration,
+                                          queue_wait=duration / 10, queue='polling', outcome=TaskTiming.SUCCESS)
+
+    def test_summary(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+
+        data = resp.json()
+        self.assertEqual([t['task'] for t in data['tasks']], ['task1', 'task2'])
+        self.assertEqual(data['tasks'][0]['count'], 3)
+        self.assertEqual(data['tasks'][0]['p50'], 2)
+        self.assertEqual(len(data['tasks'][0]['histogram']), len(data['histogram_edges']) + 1)
+        self.assertEqual([q['queue'] for q in data['queues']], ['polling'])
+        self.assertEqual(data['queues'][0]['count'], 6)
+
+    def test_filter_by_task(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name), {'task': 'task2'})
+        self.assertEqual([t['task'] for t in resp.json()['tasks']], ['task2'])
+
+    def test_post(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+
+class HostUsageDataViewTestCase(RequiresLoginTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/host_usage_data'
+        self.user = User.objects.create(username='test', password='test1234')
+
+    def test_usage(self):
+        now = datetime.now()
+        for is_running in (True, False, False):
+            HostSlot.objects.create(host='ssh:123.45.67.89', operation='organize_files', is_running=is_running,
+                                    created_time=now, expires_time=now + timedelta(minutes=1))
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+
+        hosts = resp.json()['hosts']
+        self.assertEqual(len(hosts), 1)
+        self.assertEqual((hosts[0]['host'], hosts[0]['running'], hosts[0]['queued']), ('ssh:123.45.67.89', 1, 2))
+
+    def test_post(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+
+class TransitionReportDataViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/transition_report_data'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+        other_experiment = Experiment.objects.create(name='other')
+
+        for name, experiment, latency in (('CoBo[0]', self.experiment, 10), ('CoBo[1]', other_experiment, 20)):
+            ecc_server = ECCServer.objects.create(name=name, ip_address='123.45.67.89', experiment=experiment)
+            TransitionEvent.objects.create(ecc_server=ecc_server, ecc_server_name=name, transition='Configure',
+                                           event=TransitionEvent.FINISHED, from_state=ECCServer.PREPARED,
+                                           to_state=ECCServer.READY, time=datetime.now(), latency=latency)
+
+    def test_report(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+
+        data = resp.json()
+        self.assertEqual([s['ecc_server'] for s in data['by_server']], ['CoBo[0]'])
+        self.assertEqual(data['by_transition'][0]['max'], 10)
+        self.assertEqual([s['ecc_server'] for s in data['slowest']], ['CoBo[0]'])
+        self.assertEqual(data['dead_times']['gaps'], [])
+
+    def test_incidents(self):
+        now = datetime.now()
+        for ecc_server in ECCServer.objects.all():
+            TransitionIncident.objects.create(ecc_server=ecc_server, ecc_server_name=ecc_server.name,
+                                              resolution=TransitionIncident.CLEARED, started_time=now,
+                                              detected_time=now, resolved_time=now, time_lost=3)
+
+        self.client.force_login(self.user)
+        incidents = self.client.get(reverse(self.view_name)).json()['incidents']
+        self.assertEqual([i['ecc_server'] for i in incidents], ['CoBo[0]'])
+        self.assertEqual(incidents[0]['time_lost'], 3)
+        self.assertFalse(incidents[0]['is_open'])
+
+    def test_filter_slowest_by_transition(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name), {'transition': 'Start'})
+        self.assertEqual(resp.json()['slowest'], [])
+
+    def test_post(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+
+class CancelRunSequenceViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/cancel_run_sequence'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+        self.sequence = RunSequence.objects.create(experiment=self.experiment, run_count=3)
+
+    def test_cancel(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name))
+        self.assertRedirects(resp, reverse('daq/run_sequencer'))
+
+        self.sequence.refresh_from_db()
+        self.assertEqual(self.sequence.state, RunSequence.CANCELLED)
+        self.assertIsNotNone(self.sequence.finished_time)
+        self.assertIn('test', self.sequence.message)
+
+    def test_get(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('attpcdaq.daq.views.api', level='ERROR'):
+            resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+
+class PreflightCheckViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/preflight_check'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+
+    @patch('attpcdaq.daq.views.api.run_preflight', return_value={'passed': True, 'duration': 0.1, 'checks': []})
+    def test_report(self, mock_preflight):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()['passed'])
+        mock_preflight.assert_called_once_with(self.experiment)
+
+    def test_post(self):
+        self.client.force_login(self.user)
+        with self.assertLogs('attpcdaq.daq.views.api', level='ERROR'):
+            resp = self.client.post(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+
+class ExportMetricsViewTestCase(TestCase):
+    def setUp(self):
+        self.view_name = 'metrics'
+
+    def test_no_login_or_queries(self):
+        with self.assertNumQueries(0):
+            resp = self.client.get(reverse(self.view_name))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp['Content-Type'].startswith('application/openmetrics-text'))
+
+        text = resp.content.decode()
+        self.assertIn('# TYPE attpcdaq_soap_call_duration_seconds histogram', text)
+        self.assertTrue(text.endswith('# EOF\n'))
+
+    def test_post(self):
+        resp = self.client.post(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
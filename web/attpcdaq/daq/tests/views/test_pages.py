@@ -2,9 +2,12 @@ from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 from unittest.mock import patch
+from datetime import datetime, timedelta
 
-from .helpers import RequiresLoginTestMixin, ManySourcesTestCaseBase
-from ...models import ECCServer, DataRouter, DataSource, Experiment
+from .helpers import RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase
+from ...models import ECCServer, DataRouter, DataSource, Experiment, TaskTiming, TraceSpan, TransitionEvent
+from ...models import RunMetadata, RunSequence, RunBoundary, HostSlot, PollLease, PollSchedule, CircuitBreaker
+from ...models import TransitionIncident
 from ...views.pages import easy_setup
 
 
@@ -56,6 +59,37 @@ class StatusTestCase(RequiresLoginTestMixin, ManySourcesTestCaseBase):
     def test_data_router_list_excludes_other_experiments(self):
         self._excludes_other_experiment_impl(DataRouter, 'data_routers')
 
+    def test_circuit_breakers(self):
+        self.client.force_login(self.user)
+        CircuitBreaker.objects.create(endpoint='ssh:' + self.data_router_ip_address, state=CircuitBreaker.OPEN,
+                                      failures=3, next_probe_time=datetime.now() + timedelta(seconds=20),
+                                      last_error='TimeoutError: timed out')
+        CircuitBreaker.objects.create(endpoint='ssh:10.0.0.1')  # Closed, so not listed
+
+        resp = self.client.get(reverse(self.view_name))
+
+        breaker, = resp.context['circuit_breakers']
+        self.assertEqual(breaker['endpoint'], 'ssh:' + self.data_router_ip_address)
+        self.assertTrue(breaker['is_open'])
+        self.assertEqual(breaker['targets'], [r.name for r in self.data_routers])
+        self.assertContains(resp, 'TimeoutError: timed out')
+
+    def test_data_rate_units(self):
+        self.client.force_login(self.user)
+        DataRouter.objects.filter(pk=self.data_routers[0].pk).update(data_rate=2.5e6)
+
+        resp = self.client.get(reverse(self.view_name))
+
+        self.assertContains(resp, '2.50 MB/s')  # The same units as the refresh script
+
+    def test_disk_free_units(self):
+        self.client.force_login(self.user)
+        DataRouter.objects.filter(pk=self.data_routers[0].pk).update(disk_free_bytes=int(12.34e9))
+
+        resp = self.client.get(reverse(self.view_name))
+
+        self.assertContains(resp, '12.3 GB')
+
 
 class ChooseConfigTestCase(RequiresLoginTestMixin, TestCase):
     def setUp(self):
@@ -72,6 +106,240 @@ class ExperimentSettingsTestCase(RequiresLoginTestMixin, TestCase):
         self.view_name = 'daq/experiment_settings'
 
 
+class PollScheduleSettingsTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/poll_schedule_settings'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+
+    def get_data(self, **kwargs):
+        data = {'state_interval': 5, 'status_interval': 15, 'data_rate_interval': 5, 'transition_interval': 0.5,
+                'idle_factor': 6, 'offline_factor': 12, 'offline_cycles': 3, 'max_interval': 300}
+        data.update(kwargs)
+        return data
+
+    def test_settings_page_shows_defaults(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse('daq/experiment_settings'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context['poll_form'].initial['transition_interval'], 0.5)
+        self.assertContains(resp, reverse(self.view_name))
+
+    def test_create_schedule(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name), self.get_data(state_interval=2))
+        self.assertRedirects(resp, reverse('daq/experiment_settings'))
+
+        schedule = PollSchedule.objects.get(experiment=self.experiment)
+        self.assertEqual(schedule.state_interval, 2)
+
+    def test_update_schedule(self):
+        PollSchedule.objects.create(experiment=self.experiment)
+
+        self.client.force_login(self.user)
+        self.client.post(reverse(self.view_name), self.get_data(idle_factor=10))
+
+        self.assertEqual(PollSchedule.objects.get().idle_factor, 10)
+
+    def test_invalid(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name), self.get_data(state_interval=-1))
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(PollSchedule.objects.exists())
+
+    def test_get(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+
+class TaskTimingTestCase(RequiresLoginTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/task_timing'
+        self.user = User.objects.create(username='test', password='test1234')
+
+    def test_page(self):
+        TaskTiming.objects.create(task_name='attpcdaq.daq.tasks.eccserver_refresh_state_task',
+                                  target_type=TaskTiming.ECC_SERVER, target_pk=1, target_name='CoBo[7]',
+                                  start_time=datetime.now(), duration=0.5, queue_wait=0.25, queue='polling',
+                                  outcome=TaskTiming.TIMEOUT)
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'eccserver_refresh_state_task')
+        self.assertContains(resp, 'CoBo[7]')
+        self.assertContains(resp, '<td>polling</td>', html=True)
+        self.assertContains(resp, 'No remote operations are running')
+
+    def test_host_usage(self):
+        now = datetime.now()
+        HostSlot.objects.create(host='ecc:123.45.67.89:8083', operation='Configure', priority=HostSlot.TRANSITION,
+                                is_running=True, created_time=now, expires_time=now + timedelta(minutes=1))
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertContains(resp, 'ecc:123.45.67.89:8083')
+        self.assertContains(resp, 'Configure')
+
+    def test_poll_leases(self):
+        now = datetime.now()
+        PollLease.objects.create(poll='data_rate', target_pk=1, token='abc', created_time=now,
+                                 expires_time=now + timedelta(minutes=1), skipped=3)
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertContains(resp, 'data_rate')
+        self.assertNotContains(resp, 'No status checks are in progress')
+
+
+class TraceListTestCase(RequiresLoginTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/trace_list'
+        self.user = User.objects.create(username='test', password='test1234')
+
+    def test_page(self):
+        TraceSpan.objects.create(trace_id='ab' * 16, span_id='1' * 16, name='source_change_state_all',
+                                 kind=TraceSpan.VIEW, start_time=datetime.now(), duration=2)
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'source_change_state_all')
+        self.assertContains(resp, reverse('daq/trace_detail', args=('ab' * 16,)))
+
+
+class TraceDetailTestCase(RequiresLoginTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/trace_detail'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.trace_id = 'ab' * 16
+
+        start = datetime.now()
+        TraceSpan.objects.create(trace_id=self.trace_id, span_id='1' * 16, name='source_change_state_all',
+                                 kind=TraceSpan.VIEW, start_time=start, duration=2)
+        TraceSpan.objects.create(trace_id=self.trace_id, span_id='2' * 16, parent_id='1' * 16,
+                                 name='Transition to Ready', kind=TraceSpan.TRANSITION, target='CoBo[7]',
+                                 start_time=start, duration=None)
+
+    def test_no_login(self):
+        super().test_no_login(rev_args=(self.trace_id,))
+
+    def test_page(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name, args=(self.trace_id,)))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'Transition to Ready')
+        self.assertContains(resp, 'in progress')
+
+    def test_missing_trace(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name, args=('cd' * 16,)))
+        self.assertEqual(resp.status_code, 404)
+
+
+class TransitionReportTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/transition_report'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+        ecc_server = ECCServer.objects.create(name='CoBo[3]', ip_address='123.45.67.89', experiment=self.experiment)
+
+        TransitionEvent.objects.create(ecc_server=ecc_server, ecc_server_name='CoBo[3]', transition='Configure',
+                                       event=TransitionEvent.FINISHED, from_state=ECCServer.PREPARED,
+                                       to_state=ECCServer.READY, time=datetime.now(), latency=42)
+
+        start = datetime(2017, 1, 1)
+        RunMetadata.objects.create(experiment=self.experiment, run_number=0, start_datetime=start,
+                                   stop_datetime=start + timedelta(seconds=60))
+        RunMetadata.objects.create(experiment=self.experiment, run_number=1,
+                                   start_datetime=start + timedelta(seconds=75))
+
+    def test_page(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'CoBo[3]')
+        self.assertEqual(resp.context['by_transition'][0]['p50'], 42)
+        self.assertEqual(resp.context['dead_times']['total'], 15)
+
+    def test_incidents(self):
+        ecc_server = ECCServer.objects.get(name='CoBo[3]')
+        now = datetime.now()
+        TransitionIncident.objects.create(ecc_server=ecc_server, ecc_server_name='CoBo[3]', transition='Start',
+                                          resolution=TransitionIncident.ESCALATED, started_time=now,
+                                          detected_time=now, time_lost=12.5, message='Still transitioning')
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertContains(resp, 'Still transitioning')
+        self.assertEqual(resp.context['incidents'][0]['resolution'], 'Escalated')
+        self.assertTrue(resp.context['incidents'][0]['is_open'])
+
+
+class RunSequencerTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/run_sequencer'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='experiment', is_active=True)
+
+    def test_page(self):
+        self.experiment.start_run()
+        sequence = RunSequence.objects.create(experiment=self.experiment, max_duration=timedelta(hours=1),
+                                              state=RunSequence.FINISHED)
+        RunBoundary.objects.create(sequence=sequence, run=self.experiment.latest_run, reason=RunBoundary.DURATION,
+                                   planned_time=datetime.now())
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(resp.context['active_sequence'])
+        self.assertEqual(list(resp.context['sequences']), [sequence])
+
+    def test_active_sequence(self):
+        self.experiment.start_run()
+        sequence = RunSequence.objects.create(experiment=self.experiment, max_bytes=1000000, run_count=3)
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.context['active_sequence'], sequence)
+        self.assertContains(resp, reverse('daq/cancel_run_sequence'))
+
+    def test_start_sequence(self):
+        self.experiment.start_run()
+
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name), {'max_duration': '01:00:00', 'max_gigabytes': '2.5'})
+        self.assertRedirects(resp, reverse(self.view_name))
+
+        sequence = RunSequence.objects.get()
+        self.assertEqual(sequence.experiment, self.experiment)
+        self.assertEqual(sequence.max_duration, timedelta(hours=1))
+        self.assertEqual(sequence.max_bytes, 2500000000)
+        self.assertEqual(sequence.state, RunSequence.ACTIVE)
+
+    def test_start_sequence_not_running(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name), {'max_duration': '01:00:00'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.context['form'].errors)
+        self.assertFalse(RunSequence.objects.exists())
+
+    def test_start_sequence_without_limit(self):
+        self.experiment.start_run()
+
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name), {'run_count': '3'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse(RunSequence.objects.exists())
+
+
 class EasySetupTestCase(TestCase):
     def setUp(self):
         self.num_cobos = 10
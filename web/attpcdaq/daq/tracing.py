@@ -0,0 +1,322 @@
+"""Trace requests from the web app through the Celery tasks to the ECC servers and DAQ workers.
+
+A trace is started by a view decorated with :func:`traced_view`. While it is active, each call to :func:`span`
+records a :class:`~attpcdaq.daq.models.TraceSpan` linked to the span around it. The trace ID and the current span are
+added to the headers of any Celery task sent during the trace, and the signal handlers in this module continue the
+trace in the worker, so the SOAP calls in :class:`~attpcdaq.daq.models.EccClient` and the SSH operations in
+:class:`~attpcdaq.daq.workertasks.WorkerInterface` show up under the task that made them.
+
+The ECC servers perform transitions in the background, so a transition request is recorded as an open span by
+:func:`open_span`, and the span is closed by :func:`close_spans` when
+:meth:`~attpcdaq.daq.models.ECCServer.refresh_state` sees that the transition has finished.
+
+Nothing is recorded outside of a trace, so the periodic polling tasks don't add any spans.
+
+"""
+
+import binascii
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from celery.signals import before_task_publish, task_prerun, task_postrun
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: The message header holding the ID of the trace that a task is part of
+TRACE_ID_HEADER = 'attpcdaq_trace_id'
+
+#: The message header holding the ID of the span that sent a task
+PARENT_SPAN_HEADER = 'attpcdaq_parent_span'
+
+#: The trace and span that the current thread is in
+_context = threading.local()
+
+#: The spans of the tasks running in this process, and the context to restore when they finish, keyed by task ID
+_running_tasks = {}
+
+
+def _is_enabled():
+    return getattr(settings, 'TRACING_ENABLED', True)
+
+
+def _new_id(length):
+    return binascii.hexlify(os.urandom(length // 2)).decode()
+
+
+def current_trace_id():
+    """Get the ID of the trace that the current thread is in, or None if there isn't one."""
+    return getattr(_context, 'trace_id', None)
+
+
+def current_span_id():
+    """Get the ID of the innermost span in the current thread, or None if there isn't one."""
+    return getattr(_context, 'span_id', None)
+
+
+def _set_context(trace_id, span_id):
+    _context.trace_id = trace_id
+    _context.span_id = span_id
+
+
+def _save_span(**fields):
+    from .models import TraceSpan
+    try:
+        TraceSpan.objects.create(**fields)
+    except Exception:
+        logger.exception('Failed to record trace span %s', fields.get('name'))
+
+
+@contextmanager
+def span(name, kind, target=''):
+    """Record the time taken by the body of the ``with`` block as a span of the current trace.
+
+    If the current thread isn't in a trace, nothing is recorded.
+
+    Parameters
+    ----------
+    name : str
+        A description of the step.
+    kind : str
+        The type of step. Use one of the constants from :class:`~attpcdaq.daq.models.TraceSpan`.
+    target : str, optional
+        The host, ECC server, or data router that the step acts on.
+
+    """
+    trace_id = current_trace_id()
+    if trace_id is None:
+        yield
+        return
+
+    parent_id = current_span_id()
+    span_id = _new_id(16)
+    _set_context(trace_id, span_id)
+
+    start_time = datetime.now()
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        _set_context(trace_id, parent_id)
+        _save_span(trace_id=trace_id, span_id=span_id, parent_id=parent_id, name=name, kind=kind,
+                   target=target, start_time=start_time, duration=time.perf_counter() - start, failed=failed)
+
+
+@contextmanager
+def trace(name, kind, target=''):
+    """Start a new trace with a root span covering the body of the ``with`` block.
+
+    This does nothing if the ``TRACING_ENABLED`` setting is False.
+
+    Parameters
+    ----------
+    name, kind, target
+        The details of the root span. See :func:`span`.
+
+    Yields
+    ------
+    str or None
+        The ID of the new trace, or None if tracing is disabled.
+
+    """
+    if not _is_enabled():
+        yield None
+        return
+
+    previous = current_trace_id(), current_span_id()
+    trace_id = _new_id(32)
+    _set_context(trace_id, None)
+    try:
+        with span(name, kind, target):
+            yield trace_id
+    finally:
+        _set_context(*previous)
+
+
+def traced_view(func):
+    """Decorate a view to start a new trace each time it is called."""
+    @wraps(func)
+    def wrapper(request, *args, **kwargs):
+        from .models import TraceSpan
+        with trace(func.__name__, TraceSpan.VIEW, target=request.path):
+            return func(request, *args, **kwargs)
+
+    return wrapper
+
+
+def open_span(name, kind, target=''):
+    """Record the start of a step that will be finished later, possibly by another process.
+
+    The span stays open until :func:`close_spans` is called with the same kind and target. If the current thread
+    isn't in a trace, nothing is recorded.
+
+    Parameters
+    ----------
+    name, kind, target
+        The details of the span. See :func:`span`.
+
+    """
+    trace_id = current_trace_id()
+    if trace_id is None:
+        return
+
+    _save_span(trace_id=trace_id, span_id=_new_id(16), parent_id=current_span_id(), name=name, kind=kind,
+               target=target, start_time=datetime.now(), duration=None)
+
+
+def close_spans(kind, target):
+    """Finish the open spans with the given kind and target.
+
+    Parameters
+    ----------
+    kind : str
+        The type of span.
+    target : str
+        The target of the span.
+
+    """
+    from .models import TraceSpan
+    now = datetime.now()
+    try:
+        for pending in TraceSpan.objects.filter(kind=kind, target=target, duration__isnull=True):
+            pending.duration = (now - pending.start_time).total_seconds()
+            pending.save(update_fields=['duration'])
+    except Exception:
+        logger.exception('Failed to close %s spans for %s', kind, target)
+
+
+def _get_header(request, name):
+    value = getattr(request, name, None)
+    if value is None:
+        value = (getattr(request, 'headers', None) or {}).get(name)
+    return value
+
+
+@before_task_publish.connect
+def add_trace_headers(sender=None, headers=None, **kwargs):
+    """Pass the current trace on to a task that is being sent."""
+    trace_id = current_trace_id()
+    if headers is not None and trace_id is not None:
+        headers.setdefault(TRACE_ID_HEADER, trace_id)
+        headers.setdefault(PARENT_SPAN_HEADER, current_span_id())
+
+
+@task_prerun.connect
+def start_task_span(sender=None, task_id=None, task=None, args=None, kwargs=None, **extra):
+    """Continue the trace that a task was sent from, if any.
+
+    Tasks that are run eagerly aren't sent through the broker, so they continue the trace of the current thread.
+
+    """
+    trace_id = _get_header(task.request, TRACE_ID_HEADER)
+    if trace_id is not None:
+        parent_id = _get_header(task.request, PARENT_SPAN_HEADER)
+    else:
+        trace_id, parent_id = current_trace_id(), current_span_id()
+
+    if trace_id is None:
+        return
+
+    span_id = _new_id(16)
+    _running_tasks[task_id] = {
+        'previous': (current_trace_id(), current_span_id()),
+        'trace_id': trace_id,
+        'span_id': span_id,
+        'parent_id': parent_id,
+        'start_time': datetime.now(),
+        'start': time.perf_counter(),
+    }
+    _set_context(trace_id, span_id)
+
+
+@task_postrun.connect
+def finish_task_span(sender=None, task_id=None, task=None, args=None, kwargs=None, state=None, **extra):
+    """Record the span of a traced task."""
+    info = _running_tasks.pop(task_id, None)
+    if info is None:
+        return
+
+    _set_context(*info['previous'])
+
+    from .models import TraceSpan
+    from .instrumentation import find_target
+    try:
+        target = find_target(task, args or (), kwargs or {})
+    except Exception:
+        target = None
+
+    _save_span(trace_id=info['trace_id'], span_id=info['span_id'], parent_id=info['parent_id'],
+               name=task.name.rpartition('.')[2], kind=TraceSpan.TASK,
+               target=(target[2] or '') if target is not None else '', start_time=info['start_time'],
+               duration=time.perf_counter() - info['start'], failed=state != 'SUCCESS')
+
+
+def timeline(spans, now=None):
+    """Arrange the spans of a trace for display as a timeline.
+
+    Parameters
+    ----------
+    spans : iterable of TraceSpan
+        The spans in the trace.
+    now : datetime, optional
+        The current time, used as the end of spans that haven't finished.
+
+    Returns
+    -------
+    list[dict]
+        A dictionary for each span, in depth-first order with children sorted by start time. The keys are
+        ``span``, ``depth``, ``offset`` (the start time relative to the start of the trace, in seconds),
+        ``duration`` (in seconds, up to ``now`` for open spans), ``is_open``, and ``left`` and ``width`` (the
+        position of the span as percentages of the length of the trace).
+
+    """
+    if now is None:
+        now = datetime.now()
+
+    spans = sorted(spans, key=lambda s: s.start_time)
+    if not spans:
+        return []
+
+    trace_start = spans[0].start_time
+    ends = [s.start_time.timestamp() + s.duration if s.duration is not None else now.timestamp() for s in spans]
+    length = max(max(ends) - trace_start.timestamp(), 1e-6)
+
+    ids = {s.span_id for s in spans}
+    children = {}
+    roots = []
+    for s in spans:
+        if s.parent_id is not None and s.parent_id in ids:
+            children.setdefault(s.parent_id, []).append(s)
+        else:
+            roots.append(s)
+
+    rows = []
+
+    def visit(s, depth):
+        offset = (s.start_time - trace_start).total_seconds()
+        duration = s.duration if s.duration is not None else max((now - s.start_time).total_seconds(), 0)
+        rows.append({
+            'span': s,
+            'depth': depth,
+            'offset': offset,
+            'duration': duration,
+            'is_open': s.duration is None,
+            'left': 100 * offset / length,
+            'width': max(100 * duration / length, 0.2),
+        })
+        for child in children.get(s.span_id, []):
+            visit(child, depth + 1)
+
+    for root in roots:
+        visit(root, 0)
+
+    return rows
@@ -0,0 +1,184 @@
+"""Reports on the latency of ECC server transitions and the dead time between runs.
+
+The transition latencies come from the :class:`~attpcdaq.daq.models.TransitionEvent` records written by
+:meth:`~attpcdaq.daq.models.ECCServer.change_state` and :meth:`~attpcdaq.daq.models.ECCServer.refresh_state`. Since
+the end of a transition is only noticed when the state is polled, the latencies are rounded up to the polling
+interval.
+
+The dead time is the gap between the end of one run and the start of the next, taken from the
+:class:`~attpcdaq.daq.models.RunMetadata` records.
+
+"""
+
+from collections import defaultdict
+
+from .models import TransitionEvent
+from .instrumentation import percentile
+
+
+def _summarize(latencies, failures):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'p50': percentile(latencies, 50) if latencies else None,
+        'p90': percentile(latencies, 90) if latencies else None,
+        'p99': percentile(latencies, 99) if latencies else None,
+        'max': latencies[-1] if latencies else None,
+        'failures': failures,
+    }
+
+
+def _group_events(events, key):
+    latencies = defaultdict(list)
+    failures = defaultdict(int)
+    names = {}
+    fields = ('ecc_server', 'ecc_server_name', 'transition', 'event', 'latency')
+    for ecc_server, ecc_server_name, transition, event, latency in events.order_by('time').values_list(*fields):
+        group = key(ecc_server, ecc_server_name, transition)
+        names[group] = ecc_server_name
+        latencies[group]  # Make sure that groups with only failures are listed
+        if event == TransitionEvent.FINISHED and latency is not None:
+            latencies[group].append(latency)
+        elif event == TransitionEvent.FAILED:
+            failures[group] += 1
+
+    return latencies, failures, names
+
+
+def summarize_by_server(events):
+    """Summarize the transition latencies for each ECC server and transition.
+
+    Parameters
+    ----------
+    events : QuerySet
+        The :class:`~attpcdaq.daq.models.TransitionEvent` records to summarize.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per combination of ECC server and transition, sorted by server name and then transition. The
+        keys are ``ecc_server_pk``, ``ecc_server``, ``transition``, ``count``, ``p50``, ``p90``, ``p99``, ``max``,
+        and ``failures``. The count is the number of finished transitions, and the latencies are in seconds. The
+        latencies are None if no transitions finished.
+
+    """
+    latencies, failures, names = _group_events(events, lambda pk, name, transition: (pk, transition))
+
+    summaries = []
+    for (pk, transition), values in latencies.items():
+        summary = {
+            'ecc_server_pk': pk,
+            'ecc_server': names[(pk, transition)],  # The most recent name
+            'transition': transition,
+        }
+        summary.update(_summarize(values, failures[(pk, transition)]))
+        summaries.append(summary)
+
+    summaries.sort(key=lambda s: (s['ecc_server'], s['transition']))
+    return summaries
+
+
+def summarize_by_transition(events):
+    """Summarize the transition latencies for each transition, combining all ECC servers.
+
+    Parameters
+    ----------
+    events : QuerySet
+        The :class:`~attpcdaq.daq.models.TransitionEvent` records to summarize.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per transition, sorted by name. The keys are ``transition``, ``count``, ``p50``, ``p90``,
+        ``p99``, ``max``, and ``failures``, as in :func:`summarize_by_server`.
+
+    """
+    latencies, failures, names = _group_events(events, lambda pk, name, transition: transition)
+
+    summaries = []
+    for transition, values in latencies.items():
+        summary = {'transition': transition}
+        summary.update(_summarize(values, failures[transition]))
+        summaries.append(summary)
+
+    summaries.sort(key=lambda s: s['transition'])
+    return summaries
+
+
+def slowest_servers(events, transition=None, count=10):
+    """Rank the ECC servers by their 90th percentile transition latency.
+
+    Parameters
+    ----------
+    events : QuerySet
+        The :class:`~attpcdaq.daq.models.TransitionEvent` records to use.
+    transition : str, optional
+        If given, only this transition is considered, like "Configure". Otherwise, all transitions are combined.
+    count : int, optional
+        The maximum number of servers to return.
+
+    Returns
+    -------
+    list[dict]
+        The summaries of the slowest servers, slowest first, with the same keys as in :func:`summarize_by_server`
+        except ``transition``. Servers with no finished transitions are left out.
+
+    """
+    if transition is not None:
+        events = events.filter(transition=transition)
+
+    latencies, failures, names = _group_events(events, lambda pk, name, transition: pk)
+
+    summaries = []
+    for pk, values in latencies.items():
+        if not values:
+            continue
+        summary = {'ecc_server_pk': pk, 'ecc_server': names[pk]}
+        summary.update(_summarize(values, failures[pk]))
+        summaries.append(summary)
+
+    summaries.sort(key=lambda s: (-s['p90'], s['ecc_server']))
+    return summaries[:count]
+
+
+def dead_times(runs):
+    """Find the dead time between consecutive runs.
+
+    Parameters
+    ----------
+    runs : QuerySet
+        The :class:`~attpcdaq.daq.models.RunMetadata` records, usually for one experiment.
+
+    Returns
+    -------
+    dict
+        The key ``gaps`` holds a list of dictionaries with the keys ``run_number`` (of the run that ended),
+        ``next_run_number``, ``stop_datetime``, ``next_start_datetime``, and ``dead_time`` (in seconds), in
+        order of time. A run that never stopped is skipped. The keys ``count``, ``total``, ``mean``, ``median``,
+        and ``max`` summarize the gaps. These are None if there are no gaps.
+
+    """
+    fields = ('run_number', 'start_datetime', 'stop_datetime')
+    rows = list(runs.exclude(start_datetime__isnull=True).order_by('start_datetime').values_list(*fields))
+
+    gaps = []
+    for (run_number, start, stop), (next_run_number, next_start, next_stop) in zip(rows, rows[1:]):
+        if stop is None:
+            continue
+        gaps.append({
+            'run_number': run_number,
+            'next_run_number': next_run_number,
+            'stop_datetime': stop,
+            'next_start_datetime': next_start,
+            'dead_time': (next_start - stop).total_seconds(),
+        })
+
+    values = sorted(g['dead_time'] for g in gaps)
+    return {
+        'gaps': gaps,
+        'count': len(values),
+        'total': sum(values) if values else None,
+        'mean': sum(values) / len(values) if values else None,
+        'median': percentile(values, 50) if values else None,
+        'max': values[-1] if values else None,
+    }
@@ -19,6 +19,8 @@ urlpatterns = [
     url(r'^sources/refresh_state_all$', views.refresh_state_all, name='daq/source_refresh_state_all'),
     url(r'^sources/change_state/$', views.source_change_state, name='daq/source_change_state'),
     url(r'^sources/change_state_all/$', views.source_change_state_all, name='daq/source_change_state_all'),
+    url(r'^sources/preflight$', views.preflight_check, name='daq/preflight_check'),
+    url(r'^sources/next_run/$', views.source_next_run, name='daq/source_next_run'),
     url(r'^sources/choose_config/(\d+)$', views.choose_config, name='daq/choose_config'),
 
     url(r'^ecc_servers/$', views.ListECCServersView.as_view(), name='daq/ecc_server_list'),
@@ -38,6 +40,10 @@ urlpatterns = [
     url(r'^runs/edit/(?P<pk>\d+)$', views.UpdateRunMetadataView.as_view(), name='daq/update_run_metadata'),
     url(r'^runs/edit/latest$', views.UpdateLatestRunMetadataView.as_view(), name='daq/update_latest_run'),
     url(r'^runs/download$', views.download_run_metadata, name='daq/download_run_metadata'),
+    url(r'^runs/files$', views.run_file_summary, name='daq/run_file_summary'),
+    url(r'^runs/with_config/(?P<checksum>[0-9a-f]{64})$', views.runs_with_config, name='daq/runs_with_config'),
+    url(r'^sequencer/$', views.run_sequencer, name='daq/run_sequencer'),
+    url(r'^sequencer/cancel$', views.cancel_run_sequence, name='daq/cancel_run_sequence'),
 
     url(r'^observables/$', views.ListObservablesView.as_view(), name='daq/observables_list'),
     url(r'^observables/add/$', views.AddObservableView.as_view(), name='daq/add_observable'),
@@ -46,8 +52,16 @@ urlpatterns = [
     url(r'^observables/set_ordering$', views.set_observable_ordering, name='daq/set_observable_ordering'),
 
     url(r'^measurements/$', views.measurement_chart, name='daq/measurement_chart'),
+    url(r'^tasks/timing/$', views.task_timing, name='daq/task_timing'),
+    url(r'^tasks/timing/data$', views.task_timing_data, name='daq/task_timing_data'),
+    url(r'^tasks/hosts$', views.host_usage_data, name='daq/host_usage_data'),
+    url(r'^traces/$', views.trace_list, name='daq/trace_list'),
+    url(r'^traces/(?P<trace_id>[0-9a-f]+)/$', views.trace_detail, name='daq/trace_detail'),
+    url(r'^transitions/$', views.transition_report, name='daq/transition_report'),
+    url(r'^transitions/data$', views.transition_report_data, name='daq/transition_report_data'),
 
     url(r'^experiment_settings/$', views.experiment_settings, name='daq/experiment_settings'),
+    url(r'^experiment_settings/polling$', views.poll_schedule_settings, name='daq/poll_schedule_settings'),
 
     url(r'^status/(?P<program>ecc|data_router)_log/(?P<pk>\d+)/$', views.show_log_page, name='daq/show_log'),
 
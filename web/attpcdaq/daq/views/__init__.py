@@ -1,12 +1,14 @@
-from .api import refresh_state_all, source_change_state, source_change_state_all
+from .api import refresh_state_all, source_change_state, source_change_state_all, source_next_run
 from .api import AddDataSourceView, ListDataSourcesView, UpdateDataSourceView, RemoveDataSourceView
 from .api import AddECCServerView, ListECCServersView, UpdateECCServerView, RemoveECCServerView
 from .api import AddDataRouterView, ListDataRoutersView, UpdateDataRouterView, RemoveDataRouterView
 from .api import ListRunMetadataView, UpdateRunMetadataView, UpdateLatestRunMetadataView
 from .api import ListObservablesView, AddObservableView, UpdateObservableView, RemoveObservableView
-from .api import set_observable_ordering, AddExperimentView
+from .api import set_observable_ordering, AddExperimentView, runs_with_config, run_file_summary, task_timing_data
+from .api import export_metrics, transition_report_data, cancel_run_sequence, preflight_check, host_usage_data
 
 from .io import download_run_metadata, download_datasource_list, upload_datasource_list
 
 from .pages import (status, choose_config, experiment_settings, show_log_page, EasySetupPage,
-                    measurement_chart, ExperimentChoiceView)
+                    measurement_chart, task_timing, trace_list, trace_detail, transition_report,
+                    run_sequencer, ExperimentChoiceView, poll_schedule_settings)
@@ -6,24 +6,34 @@ views that control refreshing the state of the system and changing the state.
 
 """
 
-from django.shortcuts import get_object_or_404
-from django.http import HttpResponseNotAllowed, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseBadRequest, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.views.generic.list import ListView
 from django.views.generic import RedirectView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.db.models import Count, Sum
 
-from ..models import DataSource, ECCServer, DataRouter, RunMetadata, Experiment, Observable
-from ..models import ECCError
+from ..models import DataSource, ECCServer, DataRouter, RunMetadata, Experiment, Observable, ConfigManifestEntry
+from ..models import ECCError, TaskTiming, TraceSpan, TransitionEvent, TransitionIncident, RunSequence
 from ..forms import DataSourceForm, ECCServerForm, RunMetadataForm, DataRouterForm, ObservableForm, NewExperimentForm
 from ..tasks import eccserver_change_state_task, organize_files_all_task, backup_config_files_all_task, eccserver_refresh_state_task
+from ..tasks import next_run_task, change_state_all_task
 from .helpers import get_status, calculate_overall_state
 from ..middleware import needs_experiment, NeedsExperimentMixin
+from ..instrumentation import summarize, summarize_queues, HISTOGRAM_EDGES
+from ..tracing import traced_view, span
+from ..preflight import run_preflight
+from ..hostlimits import host_usage
+from ..transitions import summarize_by_server, summarize_by_transition, slowest_servers, dead_times
+from ..watchdog import recent_incidents
+from ... import metrics
 
 import requests
 import json
+from datetime import datetime
 
 import logging
 logger = logging.getLogger(__name__)
@@ -98,6 +108,7 @@ def refresh_state_all(request):
 
 @login_required
 @needs_experiment
+@traced_view
 def source_change_state(request):
     """Submits a request to tell the ECC server to change a source's state.
 
@@ -147,10 +158,17 @@ def source_change_state(request):
 
 @login_required
 @needs_experiment
+@traced_view
 def source_change_state_all(request):
     """Send requests to change the state of all ECC servers.
 
-    The requests are queued to be performed asynchronously.
+    The requests are queued to be performed asynchronously. If the ECC servers are not all in the same state, or if
+    the target state is more than one step away, the whole change is made by
+    :func:`~attpcdaq.daq.tasks.change_state_all_task` instead, which steps through the intermediate states. This
+    allows the system to be brought from Idle to Running with one request.
+
+    Before a run is started, the system is checked with :func:`~attpcdaq.daq.preflight.run_preflight`, and the run
+    is refused if any check fails. This takes at most about ``PREFLIGHT_DEADLINE`` seconds.
 
     Parameters
     ----------
@@ -160,7 +178,8 @@ def source_change_state_all(request):
     Returns
     -------
     JsonResponse
-        A JSON array containing status information about all ECC servers.
+        A JSON array containing status information about all ECC servers. If the pre-flight check failed, the status
+        code is 400, and the keys are ``error`` and ``preflight``, which holds the report.
 
     """
     if request.method != 'POST':
@@ -176,9 +195,10 @@ def source_change_state_all(request):
 
     experiment = request.experiment
 
+    overall_state, _ = calculate_overall_state(request)
+
     # Handle "reset" case
     if target_state == ECCServer.RESET:
-        overall_state, _ = calculate_overall_state(request)
         if overall_state is not None:
             target_state = max(overall_state - 1, ECCServer.IDLE)
         else:
@@ -186,11 +206,37 @@ def source_change_state_all(request):
             return HttpResponseBadRequest('Cannot perform reset when overall state is inconsistent')
 
     # Handle "start" case
-    if target_state == ECCServer.RUNNING:
-        daq_not_ready = DataRouter.objects.exclude(staging_directory_is_clean=True).exists()
-        if daq_not_ready:
-            logger.error('Data routers are not ready')
-            return HttpResponseBadRequest('Data routers are not ready')
+    if target_state == ECCServer.RUNNING and not experiment.is_running:
+        with span('Pre-flight check', TraceSpan.WAIT):
+            report = run_preflight(experiment)
+
+        if not report['passed']:
+            failures = ['{} {}: {}'.format(c['target'], c['check'], c['message'])
+                        for c in report['checks'] if not c['passed']]
+            logger.error('Pre-flight check failed: %s', '; '.join(failures))
+            return JsonResponse({'error': 'Pre-flight check failed', 'preflight': report}, status=400)
+
+        # This only warns, since the forecast is a rough estimate
+        experiment.check_disk_space()
+
+    # Handle changes of more than one step, or from a mixed state
+    ecc_servers = ECCServer.objects.filter(experiment=experiment)
+    is_multi_step = overall_state is None or abs(target_state - overall_state) > 1
+    if is_multi_step and ecc_servers.exists():
+        if target_state not in ECCServer.STATE_DICT:
+            logger.error('Invalid target state %s', target_state)
+            return HttpResponseBadRequest('Invalid target state')
+
+        if ecc_servers.filter(is_transitioning=True).exists():
+            logger.error('Cannot change state while ECC servers are transitioning')
+            return HttpResponseBadRequest('Cannot change state while ECC servers are transitioning')
+
+        try:
+            change_state_all_task.delay(experiment.pk, target_state)
+        except Exception:
+            logger.exception('Error while submitting change_state_all task')
+
+        return JsonResponse(get_status(request))
 
     # The following code assumes that the ECCServer of the Mutants has been hacked to not perform these transitions on the CoBos
     # Handle "prepare" case: first do the Mutants
@@ -206,18 +252,19 @@ def source_change_state_all(request):
             except (ECCError, ValueError):
                 logger.exception('Failed to submit change_state task for ECC server %s', ecc_server.name)
     # Wait for them to be done (maximum 60 s)
-        t = 0
-        test = 0
-        for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
-            if ecc_server.name.find('Mutant') != -1 and ecc_server.is_transitioning == True:
-                test += 1
-        while test > 0 and t <= 60:
-            time.sleep(1)
-            t += 1
+        with span('Wait for Mutants', TraceSpan.WAIT):
+            t = 0
             test = 0
             for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
                 if ecc_server.name.find('Mutant') != -1 and ecc_server.is_transitioning == True:
                     test += 1
+            while test > 0 and t <= 60:
+                time.sleep(1)
+                t += 1
+                test = 0
+                for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
+                    if ecc_server.name.find('Mutant') != -1 and ecc_server.is_transitioning == True:
+                        test += 1
     # Finally do the CoBos
         for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
             try:
@@ -243,18 +290,19 @@ def source_change_state_all(request):
             except (ECCError, ValueError):
                 logger.exception('Failed to submit change_state task for ECC server %s', ecc_server.name)
     # Wait for them to be done (maximum 60 s)
-        t = 0
-        test = 0
-        for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
-            if ecc_server.name.find('Mutant') == -1 and ecc_server.is_transitioning == True:
-                test += 1
-        while test > 0 and t <= 60:
-            time.sleep(1)
-            t += 1
+        with span('Wait for CoBos', TraceSpan.WAIT):
+            t = 0
             test = 0
             for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
                 if ecc_server.name.find('Mutant') == -1 and ecc_server.is_transitioning == True:
                     test += 1
+            while test > 0 and t <= 60:
+                time.sleep(1)
+                t += 1
+                test = 0
+                for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
+                    if ecc_server.name.find('Mutant') == -1 and ecc_server.is_transitioning == True:
+                        test += 1
     # Finally do the Mutants
         for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
             try:
@@ -292,6 +340,82 @@ def source_change_state_all(request):
     return JsonResponse(output)
 
 
+@login_required
+@needs_experiment
+@traced_view
+def source_next_run(request):
+    """Stop the current run and start the next one in a single operation.
+
+    The rollover is performed by :func:`~attpcdaq.daq.tasks.next_run_task`, which organizes the files between the
+    runs and starts the next run as soon as the data routers are clean.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be POST.
+
+    Returns
+    -------
+    JsonResponse
+        The JSON response includes the items outlined in `_make_status_response`.
+
+    """
+    if request.method != 'POST':
+        logger.error('Received non-POST request %s', request.method)
+        return HttpResponseNotAllowed(['POST'])
+
+    experiment = request.experiment
+
+    overall_state, _ = calculate_overall_state(request)
+    if overall_state != ECCServer.RUNNING or not experiment.is_running:
+        logger.error('Cannot start the next run when no run is in progress')
+        return HttpResponseBadRequest('Cannot start the next run when no run is in progress')
+
+    if ECCServer.objects.filter(experiment=experiment, is_transitioning=True).exists():
+        logger.error('Cannot start the next run while ECC servers are transitioning')
+        return HttpResponseBadRequest('Cannot start the next run while ECC servers are transitioning')
+
+    try:
+        next_run_task.delay(experiment.pk)
+    except Exception:
+        logger.exception('Error while submitting next run task')
+
+    output = get_status(request)
+
+    return JsonResponse(output)
+
+
+@login_required
+@needs_experiment
+def cancel_run_sequence(request):
+    """Cancel the active run sequence of the current experiment.
+
+    The current run is left running. If a rollover is in progress, it is allowed to finish.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be POST.
+
+    Returns
+    -------
+    HttpResponse
+        A redirect to the run sequencer page.
+
+    """
+    if request.method != 'POST':
+        logger.error('Received non-POST request %s', request.method)
+        return HttpResponseNotAllowed(['POST'])
+
+    RunSequence.objects.filter(experiment=request.experiment, state=RunSequence.ACTIVE).update(
+        state=RunSequence.CANCELLED,
+        finished_time=datetime.now(),
+        message='Cancelled by {}'.format(request.user.username),
+    )
+
+    return redirect(reverse('daq/run_sequencer'))
+
+
 @login_required
 @needs_experiment
 def set_observable_ordering(request):
@@ -340,6 +464,227 @@ def set_observable_ordering(request):
     return JsonResponse({'success': True})
 
 
+@login_required
+@needs_experiment
+def run_file_summary(request):
+    """Summarize the GRAW files recorded for each run in the current experiment.
+
+    The summary is computed from the :class:`~attpcdaq.daq.models.RunFile` inventory recorded when the files
+    were organized, so the data routers are not contacted.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET.
+
+    Returns
+    -------
+    JsonResponse
+        A dictionary with the key ``runs`` mapped to a list with one dictionary per run. These have the
+        keys ``run_number``, ``file_count``, and ``total_bytes``.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    runs = RunMetadata.objects.filter(experiment=request.experiment) \
+        .annotate(file_count=Count('files'), total_bytes=Sum('files__size')) \
+        .order_by('run_number') \
+        .values('run_number', 'file_count', 'total_bytes')
+
+    return JsonResponse({'runs': [
+        {'run_number': r['run_number'], 'file_count': r['file_count'], 'total_bytes': r['total_bytes'] or 0}
+        for r in runs
+    ]})
+
+
+@login_required
+def runs_with_config(request, checksum):
+    """Find every run that used a config file with the given checksum.
+
+    This is answered from the config manifests recorded by
+    :func:`~attpcdaq.daq.tasks.store_config_backup`, so no remote hosts are contacted.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET.
+    checksum : str
+        The SHA-256 hex digest of the config file.
+
+    Returns
+    -------
+    JsonResponse
+        A dictionary with the key ``runs`` mapped to a list of dictionaries, one per matching manifest entry,
+        with the keys ``experiment``, ``run_number``, ``ecc_server``, and ``file_name``.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    entries = ConfigManifestEntry.objects.filter(checksum=checksum) \
+        .select_related('run__experiment', 'ecc_server') \
+        .order_by('run__experiment__name', 'run__run_number', 'file_name')
+
+    runs = [{
+        'experiment': entry.run.experiment.name,
+        'run_number': entry.run.run_number,
+        'ecc_server': entry.ecc_server.name if entry.ecc_server is not None else None,
+        'file_name': entry.file_name,
+    } for entry in entries]
+
+    return JsonResponse({'checksum': checksum, 'runs': runs})
+
+
+@login_required
+def task_timing_data(request):
+    """Summarize the timing of recent Celery tasks for each task and target.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET. The optional parameter ``task`` limits the results to the task
+        with that name.
+
+    Returns
+    -------
+    JsonResponse
+        A dictionary with the key ``histogram_edges``, giving the upper edges of the histogram bins in seconds,
+        the key ``tasks``, which is mapped to the list returned by :func:`~attpcdaq.daq.instrumentation.summarize`,
+        and the key ``queues``, which is mapped to the list returned by
+        :func:`~attpcdaq.daq.instrumentation.summarize_queues`.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    timings = TaskTiming.objects.all()
+    task_name = request.GET.get('task')
+    if task_name:
+        timings = timings.filter(task_name=task_name)
+
+    return JsonResponse({
+        'histogram_edges': HISTOGRAM_EDGES,
+        'tasks': summarize(timings),
+        'queues': summarize_queues(timings),
+    })
+
+
+@login_required
+def host_usage_data(request):
+    """List the operations that are using or waiting for a slot on each remote host.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET.
+
+    Returns
+    -------
+    JsonResponse
+        A dictionary with the key ``hosts``, which is mapped to the list returned by
+        :func:`~attpcdaq.daq.hostlimits.host_usage`.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    return JsonResponse({'hosts': host_usage()})
+
+
+@login_required
+@needs_experiment
+def transition_report_data(request):
+    """Report the ECC server transition latencies and the dead time between runs for the current experiment.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET. The optional parameter ``transition`` limits the ranking of
+        the slowest servers to one transition, like "Configure".
+
+    Returns
+    -------
+    JsonResponse
+        A dictionary with the keys ``by_transition``, ``by_server``, ``slowest``, and ``dead_times``, mapped to
+        the results of the corresponding functions in :mod:`~attpcdaq.daq.transitions`, and ``incidents``, the
+        latest transitions that didn't finish within their timeouts, from
+        :func:`~attpcdaq.daq.watchdog.recent_incidents`.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    events = TransitionEvent.objects.filter(ecc_server__experiment=request.experiment)
+    runs = RunMetadata.objects.filter(experiment=request.experiment)
+
+    return JsonResponse({
+        'by_transition': summarize_by_transition(events),
+        'by_server': summarize_by_server(events),
+        'slowest': slowest_servers(events, transition=request.GET.get('transition') or None),
+        'dead_times': dead_times(runs),
+        'incidents': recent_incidents(TransitionIncident.objects.filter(ecc_server__experiment=request.experiment)),
+    })
+
+
+@login_required
+@needs_experiment
+def preflight_check(request):
+    """Check whether the current experiment is ready to start a run.
+
+    This runs the same checks as "Start all" without starting anything. See
+    :func:`~attpcdaq.daq.preflight.run_preflight`.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET.
+
+    Returns
+    -------
+    JsonResponse
+        The pre-flight report.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    return JsonResponse(run_preflight(request.experiment))
+
+
+def export_metrics(request):
+    """Export the control-plane and performance metrics in the OpenMetrics text format.
+
+    The values come from the in-memory metrics of this process and the snapshots written by the other processes
+    (see :mod:`attpcdaq.metrics`), so this view doesn't query the database. It doesn't require a login, so that
+    Prometheus can scrape it.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET.
+
+    Returns
+    -------
+    HttpResponse
+        The metrics, with the OpenMetrics content type.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    families = metrics.REGISTRY.collect_all()
+    metrics.add_derived_metrics(families)
+    return HttpResponse(metrics.render(families), content_type=metrics.CONTENT_TYPE)
+
+
 class PanelTitleMixin(object):
     """A mixin that provides a panel title to be used in a template.
 
@@ -494,9 +839,15 @@ class ListRunMetadataView(LoginRequiredMixin, NeedsExperimentMixin, ListView):
     template_name = 'daq/run_metadata_list.html'
 
     def get_queryset(self):
-        """Filter the queryset based on the Experiment, and sort by run number."""
+        """Filter the queryset based on the Experiment, and sort by run number.
+
+        Each run is annotated with ``file_count`` and ``total_bytes`` from its recorded GRAW files.
+
+        """
         expt = self.request.experiment
-        return RunMetadata.objects.filter(experiment=expt).order_by('run_number')
+        return RunMetadata.objects.filter(experiment=expt) \
+            .annotate(file_count=Count('files'), total_bytes=Sum('files__size')) \
+            .order_by('run_number')
 
 
 class UpdateRunMetadataView(LoginRequiredMixin, PanelTitleMixin, UpdateView):
@@ -6,6 +6,7 @@ could be shared between multiple views.
 """
 
 from ..models import ECCServer, DataRouter
+from ..circuitbreakers import circuit_breaker_states
 
 import logging
 logger = logging.getLogger(__name__)
@@ -92,6 +93,14 @@ def get_data_router_statuses(request):
         Whether the router is available.
     'is_clean'
         Whether the staging directory is clean.
+    'data_rate'
+        The rate at which the router is writing data, in bytes per second.
+    'is_stalled'
+        Whether the router has stopped writing data during a run.
+    'disk_free'
+        The free space on the router's staging volume, in bytes, or None if unknown.
+    'time_to_full'
+        The estimated number of seconds until the staging volume is full, or None if no data is being written.
 
     Returns
     -------
@@ -101,17 +110,34 @@ def get_data_router_statuses(request):
     """
     data_router_status_list = []
     for router in DataRouter.objects.filter(experiment=request.experiment):
+        time_to_full = router.time_to_full
         router_res = {
             'success': True,
             'pk': router.pk,
             'is_online': router.is_online,
             'is_clean': router.staging_directory_is_clean,
+            'data_rate': router.data_rate,
+            'is_stalled': router.is_stalled,
+            'disk_free': router.disk_free_bytes,
+            'time_to_full': time_to_full.total_seconds() if time_to_full is not None else None,
         }
         data_router_status_list.append(router_res)
 
     return data_router_status_list
 
 
+def get_circuit_breaker_states(request):
+    """Get the circuit breakers that are open or have counted failures, with the names of the current experiment's
+    ECC servers and data routers that use each endpoint.
+
+    See :func:`~attpcdaq.daq.circuitbreakers.circuit_breaker_states` for the contents of the list.
+
+    """
+    experiment = request.experiment
+    return circuit_breaker_states(ECCServer.objects.filter(experiment=experiment).only('name', 'ip_address', 'port'),
+                                  DataRouter.objects.filter(experiment=experiment).only('name', 'ip_address'))
+
+
 def get_status(request):
     """Returns some information about the system's status.
 
@@ -138,6 +164,10 @@ def get_status(request):
         Status of each ECC server. See :func:`get_ecc_server_statuses` for details.
     'data_router_status_list'
         Status of each data router. See :func:`get_data_router_statuses` for details.
+    'total_data_rate'
+        The sum of the data rates of all data routers, in bytes per second.
+    'circuit_breakers'
+        The circuit breakers that are open or have counted failures. See :func:`get_circuit_breaker_states`.
 
     This is helpful when generating JSON responses to update the main page periodically.
 
@@ -176,6 +206,8 @@ def get_status(request):
         'overall_state_name': overall_state_name,
         'ecc_server_status_list': ecc_server_status_list,
         'data_router_status_list': data_router_status_list,
+        'total_data_rate': sum(r['data_rate'] for r in data_router_status_list),
+        'circuit_breakers': get_circuit_breaker_states(request),
         'run_number': run_number,
         'start_time': start_time,
         'run_duration': duration_str,
@@ -5,19 +5,28 @@ The views in this module render the pages of the web app.
 """
 
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, HttpResponseNotAllowed
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse, reverse_lazy
 from django.db import transaction
 from django.views.generic.edit import FormView
 
-from ..models import DataSource, ECCServer, DataRouter, RunMetadata, Observable, Measurement
-from ..forms import ExperimentForm, ConfigSelectionForm, EasySetupForm, ExperimentChoiceForm
+from ..models import DataSource, ECCServer, DataRouter, RunMetadata, Observable, Measurement, TaskTiming
+from ..models import TraceSpan, TransitionEvent, TransitionIncident, RunSequence
+from ..forms import ExperimentForm, ConfigSelectionForm, EasySetupForm, ExperimentChoiceForm, RunSequenceForm
+from ..forms import PollScheduleForm
 from ..workertasks import WorkerInterface
+from ..hostlimits import host_slot, ssh_host, host_usage
+from ..pollleases import poll_lease_usage
+from ..pollschedule import get_poll_schedule
+from ..watchdog import recent_incidents
+from ..instrumentation import summarize, summarize_queues, HISTOGRAM_EDGES
+from ..tracing import timeline
+from ..transitions import summarize_by_server, summarize_by_transition, slowest_servers, dead_times
 from ..middleware import needs_experiment, NeedsExperimentMixin
 from .api import PanelTitleMixin
-from .helpers import calculate_overall_state
+from .helpers import calculate_overall_state, get_circuit_breaker_states
 
 from attpcdaq.logs.models import LogEntry
 
@@ -61,7 +70,8 @@ def status(request):
         'latest_run': latest_run,
         'experiment': experiment,
         'logentry_list': logs,
-        'system_state': system_state
+        'system_state': system_state,
+        'circuit_breakers': get_circuit_breaker_states(request),
     })
 
 
@@ -102,7 +112,12 @@ def choose_config(request, pk):
 @login_required
 @needs_experiment
 def experiment_settings(request):
-    """Renders the experiment settings page."""
+    """Renders the experiment settings page.
+
+    The page also has a form for the experiment's poll schedule, which is submitted to
+    :func:`poll_schedule_settings`.
+
+    """
 
     experiment = request.experiment
 
@@ -112,7 +127,41 @@ def experiment_settings(request):
         return redirect(reverse('daq/experiment_settings'))
     else:
         form = ExperimentForm(instance=experiment)
-        return render(request, 'daq/experiment_settings.html', {'form': form})
+        poll_form = PollScheduleForm(instance=get_poll_schedule(experiment))
+        return render(request, 'daq/experiment_settings.html', {'form': form, 'poll_form': poll_form})
+
+
+@login_required
+@needs_experiment
+def poll_schedule_settings(request):
+    """Saves the poll schedule of the current experiment.
+
+    The schedule sets how often the ECC servers and data routers are checked (see
+    :mod:`~attpcdaq.daq.pollschedule`). If the experiment doesn't have a schedule yet, one is created.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be POST.
+
+    Returns
+    -------
+    HttpResponse
+        A redirect to the experiment settings page, or the page with the errors if the form was invalid.
+
+    """
+    if request.method != 'POST':
+        logger.error('Received non-POST HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['POST'])
+
+    experiment = request.experiment
+    poll_form = PollScheduleForm(request.POST, instance=get_poll_schedule(experiment))
+    if poll_form.is_valid():
+        poll_form.save()
+        return redirect(reverse('daq/experiment_settings'))
+
+    form = ExperimentForm(instance=experiment)
+    return render(request, 'daq/experiment_settings.html', {'form': form, 'poll_form': poll_form})
 
 
 @login_required
@@ -149,7 +198,7 @@ def show_log_page(request, pk, program):
         logger.error('Cannot show log for program %s', program)
         return HttpResponseBadRequest('Bad program name')
 
-    with WorkerInterface(ip_address) as wint:
+    with host_slot(ssh_host(ip_address), 'tail_file'), WorkerInterface(ip_address) as wint:
         log_content = wint.tail_file(path)
 
     return render(request, 'daq/log_file.html', context={'log_content': log_content})
@@ -363,6 +412,168 @@ def measurement_chart(request):
     })
 
 
+@login_required
+def task_timing(request):
+    """Renders a page summarizing the timing of recent Celery tasks.
+
+    The latency percentiles, queue wait, and outcomes of each task are shown for each ECC server or data router
+    it acted on. See :func:`~attpcdaq.daq.instrumentation.summarize`. The time spent waiting in each Celery queue
+    is summarized too (see :func:`~attpcdaq.daq.instrumentation.summarize_queues`). The operations currently
+    running or queued on each remote host are also listed (see :func:`~attpcdaq.daq.hostlimits.host_usage`), along
+    with the status checks that haven't finished (see :func:`~attpcdaq.daq.pollleases.poll_lease_usage`).
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+
+    Returns
+    -------
+    HttpResponse
+        The rendered page.
+
+    """
+    timings = TaskTiming.objects.all()
+    summaries = summarize(timings)
+    for summary in summaries:
+        summary['task_short_name'] = summary['task'].rpartition('.')[2]
+
+    return render(request, 'daq/task_timing.html', {
+        'summaries': summaries,
+        'queues': summarize_queues(timings),
+        'histogram_edges': HISTOGRAM_EDGES,
+        'hosts': host_usage(),
+        'poll_leases': poll_lease_usage(),
+    })
+
+
+@login_required
+def trace_list(request):
+    """Renders a list of the most recent traces.
+
+    Each trace is listed by its root span, which is usually the view that started it.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+
+    Returns
+    -------
+    HttpResponse
+        The rendered page.
+
+    """
+    roots = TraceSpan.objects.filter(parent_id__isnull=True).order_by('-start_time')[:50]
+    return render(request, 'daq/trace_list.html', {'roots': roots})
+
+
+@login_required
+def trace_detail(request, trace_id):
+    """Renders a timeline of the spans in one trace.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+    trace_id : str
+        The ID of the trace.
+
+    Returns
+    -------
+    HttpResponse
+        The rendered page.
+
+    """
+    spans = TraceSpan.objects.filter(trace_id=trace_id)
+    rows = timeline(spans)
+    if not rows:
+        return HttpResponseNotFound('No trace exists with ID {}'.format(trace_id))
+
+    return render(request, 'daq/trace_detail.html', {
+        'trace_id': trace_id,
+        'rows': rows,
+        'total': max(row['offset'] + row['duration'] for row in rows),
+    })
+
+
+@login_required
+@needs_experiment
+def transition_report(request):
+    """Renders a report of the ECC server transition latencies and the dead time between runs.
+
+    The latencies are shown for each transition and for each ECC server in the current experiment, along with the
+    servers that are slowest to finish transitions. See :mod:`~attpcdaq.daq.transitions`. The latest transitions that
+    didn't finish within their timeouts are listed too (see :mod:`~attpcdaq.daq.watchdog`).
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+
+    Returns
+    -------
+    HttpResponse
+        The rendered page.
+
+    """
+    events = TransitionEvent.objects.filter(ecc_server__experiment=request.experiment)
+    runs = RunMetadata.objects.filter(experiment=request.experiment)
+
+    return render(request, 'daq/transition_report.html', {
+        'by_transition': summarize_by_transition(events),
+        'by_server': summarize_by_server(events),
+        'slowest': slowest_servers(events),
+        'dead_times': dead_times(runs),
+        'incidents': recent_incidents(TransitionIncident.objects.filter(ecc_server__experiment=request.experiment)),
+    })
+
+
+@login_required
+@needs_experiment
+def run_sequencer(request):
+    """Renders the run sequencer page, and starts a new sequence when its form is submitted.
+
+    A sequence can only be started while a run is in progress and no other sequence is active. The page also shows
+    the planned and actual boundaries of the most recent sequences.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+
+    Returns
+    -------
+    HttpResponse
+        The rendered page, or a redirect back to it after a sequence is started.
+
+    """
+    experiment = request.experiment
+    active_sequence = RunSequence.objects.filter(experiment=experiment, state=RunSequence.ACTIVE).first()
+
+    if request.method == 'POST' and active_sequence is None:
+        form = RunSequenceForm(request.POST)
+        if form.is_valid():
+            if experiment.is_running:
+                sequence = form.save(commit=False)
+                sequence.experiment = experiment
+                sequence.save()
+                return redirect(reverse('daq/run_sequencer'))
+            else:
+                form.add_error(None, 'Start a run before starting a sequence.')
+    else:
+        form = RunSequenceForm()
+
+    sequences = (RunSequence.objects.filter(experiment=experiment)
+                 .prefetch_related('boundaries__run', 'boundaries__next_run')[:10])
+
+    return render(request, 'daq/run_sequencer.html', {
+        'form': form,
+        'active_sequence': active_sequence,
+        'sequences': sequences,
+    })
+
+
 class ExperimentChoiceView(LoginRequiredMixin, FormView):
     form_class = ExperimentChoiceForm
     success_url = reverse_lazy('daq/status')
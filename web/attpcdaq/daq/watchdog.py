@@ -0,0 +1,275 @@
+"""A watchdog for ECC server transitions that never finish.
+
+:attr:`ECCServer.is_transitioning <attpcdaq.daq.models.ECCServer.is_transitioning>` is set when a transition is
+requested, and is cleared when a state poll sees that the ECC server has finished. If the worker dies in the middle
+of a transition, the reply to a request is lost, or the polls can't reach the server, the flag can stay set. The
+status page then shows a transition that never ends, and run control refuses to change the state.
+
+:func:`reconcile_transitions` is run every few seconds by
+:func:`~attpcdaq.daq.tasks.reconcile_transitions_task`. It finds the ECC servers that have been transitioning for
+longer than their transition's timeout, from the ``TRANSITION_TIMEOUTS`` setting, and asks all of them for their
+state at once. Then, for each server:
+
+- If it has finished transitioning, its state is updated, which clears the flag.
+- If it can't be reached, the flag is cleared and the server is marked offline, since its state is unknown.
+- If it is still transitioning, the flag is left alone and the problem is escalated by logging an error.
+
+Each of these is recorded as a :class:`~attpcdaq.daq.models.TransitionIncident`, along with the time it cost.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+from .models import ECCServer, EccStateClient, ECCError, HostSlot, TraceSpan, TransitionEvent, TransitionIncident
+from .hostlimits import HostBusyError, host_slots, ecc_host
+from .tracing import close_spans
+from .. import metrics
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def transition_timeout(transition):
+    """Get the time a transition may take before the watchdog checks on it.
+
+    Parameters
+    ----------
+    transition : str
+        The name of the transition, like "Configure", or an empty string if it isn't known.
+
+    Returns
+    -------
+    float
+        The timeout, in seconds.
+
+    """
+    timeouts = getattr(settings, 'TRANSITION_TIMEOUTS', {})
+    return timeouts.get(transition, getattr(settings, 'TRANSITION_TIMEOUT', 120))
+
+
+def find_stuck_transitions(now):
+    """Find the ECC servers that have been transitioning for longer than their transition's timeout.
+
+    A server that is transitioning without a start time, which happens if the flag was set before the start time
+    was recorded, is given the current time as its start time.
+
+    Parameters
+    ----------
+    now : datetime
+        The current time.
+
+    Returns
+    -------
+    list[tuple]
+        A tuple of the ECC server and the latest :class:`~attpcdaq.daq.models.TransitionEvent` requesting its
+        transition, or None, for each stuck server.
+
+    """
+    ecc_servers = list(ECCServer.objects.filter(is_transitioning=True).order_by('name'))
+    if not ecc_servers:
+        return []
+
+    missing = [e.pk for e in ecc_servers if e.transition_started_time is None]
+    if missing:
+        ECCServer.objects.filter(pk__in=missing).update(transition_started_time=now)
+        for ecc_server in ecc_servers:
+            if ecc_server.transition_started_time is None:
+                ecc_server.transition_started_time = now
+
+    # The flag is set just before the request is made, so the request is never older than the start time
+    earliest = min(e.transition_started_time for e in ecc_servers)
+    requests = {}
+    for event in (TransitionEvent.objects
+                  .filter(ecc_server__in=ecc_servers, event=TransitionEvent.REQUESTED, time__gte=earliest)
+                  .order_by('time')):
+        requests[event.ecc_server_id] = event
+
+    stuck = []
+    for ecc_server in ecc_servers:
+        request = requests.get(ecc_server.pk)
+        if request is not None and request.time < ecc_server.transition_started_time:
+            request = None
+        transition = request.transition if request is not None else ''
+        deadline = ecc_server.transition_started_time + timedelta(seconds=transition_timeout(transition))
+        if deadline <= now:
+            stuck.append((ecc_server, request))
+
+    return stuck
+
+
+def _get_state(ecc_url, timeout):
+    return EccStateClient(ecc_url, timeout=timeout).GetState()
+
+
+def _query_states(ecc_servers, timeout):
+    """Ask each ECC server for its state in its own thread.
+
+    Returns
+    -------
+    list
+        The result of ``GetState``, or the exception it raised, for each server.
+
+    """
+    with ThreadPoolExecutor(max_workers=len(ecc_servers)) as executor:
+        futures = [executor.submit(_get_state, e.ecc_url, timeout) for e in ecc_servers]
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as err:
+            results.append(err)
+    return results
+
+
+def _time_lost(incident, now):
+    deadline = incident.started_time + timedelta(seconds=transition_timeout(incident.transition))
+    return max((now - deadline).total_seconds(), 0)
+
+
+def _resolve(incident, resolution, message, now):
+    """Close an incident, and count the time it cost."""
+    incident.resolution = resolution
+    incident.message = message[:200]
+    incident.resolved_time = now
+    incident.time_lost = _time_lost(incident, now)
+    incident.save()
+
+    metrics.TRANSITION_TIME_LOST.inc(incident.time_lost, transition=incident.transition)
+
+
+def reconcile_transitions(now=None):
+    """Check the ECC servers whose transitions have outlasted their timeouts, and clear the stale flags.
+
+    The states of all of the stuck servers are requested at once, using a slot on each server from
+    :mod:`~attpcdaq.daq.hostlimits`. If a slot isn't free, the servers are checked again on the next run. The
+    database is only updated from this thread.
+
+    Open incidents whose transitions have ended since the last run, because a state poll saw the end of the
+    transition, are closed with the resolution they already have.
+
+    Parameters
+    ----------
+    now : datetime, optional
+        The current time. This defaults to :func:`datetime.now`.
+
+    Returns
+    -------
+    list[TransitionIncident]
+        The incidents that were opened, updated, or closed.
+
+    """
+    if now is None:
+        now = datetime.now()
+
+    open_incidents = {i.ecc_server_id: i for i in TransitionIncident.objects.filter(resolved_time__isnull=True)}
+    stuck = find_stuck_transitions(now)
+    start_times = {ecc_server.pk: ecc_server.transition_started_time for ecc_server, _ in stuck}
+
+    # An incident is over once its transition isn't stuck, even if the server has started another transition since
+    changed = []
+    for ecc_server_pk, incident in list(open_incidents.items()):
+        if start_times.get(ecc_server_pk) != incident.started_time:
+            _resolve(incident, incident.resolution, incident.message, now)
+            changed.append(incident)
+            del open_incidents[ecc_server_pk]
+
+    if not stuck:
+        return changed
+
+    ecc_servers = [ecc_server for ecc_server, _ in stuck]
+    timeout = getattr(settings, 'TRANSITION_WATCHDOG_REQUEST_TIMEOUT', 5)
+    try:
+        with host_slots([ecc_host(e) for e in ecc_servers], 'GetState', HostSlot.TRANSITION, timeout=timeout):
+            results = _query_states(ecc_servers, timeout)
+    except HostBusyError as err:
+        logger.warning('Could not check stuck transitions: %s', err)
+        return changed
+
+    for (ecc_server, request), result in zip(stuck, results):
+        incident = open_incidents.get(ecc_server.pk)
+        if incident is None:
+            incident = TransitionIncident(
+                ecc_server=ecc_server,
+                ecc_server_name=ecc_server.name,
+                transition=request.transition if request is not None else '',
+                started_time=ecc_server.transition_started_time,
+                detected_time=now,
+            )
+        is_new = incident.pk is None
+
+        if not isinstance(result, Exception):
+            try:
+                ecc_server.update_state(result)
+            except ECCError as err:
+                result = err
+
+        if isinstance(result, Exception):
+            resolution = TransitionIncident.UNREACHABLE
+            message = '{}: {}'.format(type(result).__name__, result)
+            ecc_server.is_transitioning = False
+            ecc_server.is_online = False
+            ecc_server.save(update_fields=['is_transitioning', 'is_online'])
+            if request is not None:
+                request.record(TransitionEvent.FAILED)
+            close_spans(TraceSpan.TRANSITION, ecc_server.name)
+            logger.warning('Cleared transitioning flag of %s, which could not be reached: %s',
+                           ecc_server.name, message)
+        elif ecc_server.is_transitioning:
+            resolution = TransitionIncident.ESCALATED
+            message = 'Still transitioning in state {}'.format(ecc_server.get_state_display())
+            if incident.resolution != resolution:
+                logger.error('%s is still performing the %s transition %d seconds after it started, which is longer '
+                             'than its timeout of %d seconds', ecc_server.name, incident.transition or 'unknown',
+                             (now - incident.started_time).total_seconds(), transition_timeout(incident.transition))
+        else:
+            resolution = TransitionIncident.CLEARED
+            message = 'Finished in state {}'.format(ecc_server.get_state_display())
+            logger.warning('Cleared stale transitioning flag of %s', ecc_server.name)
+
+        if is_new or incident.resolution != resolution:
+            metrics.TRANSITION_INCIDENTS.inc(transition=incident.transition, resolution=resolution)
+
+        if resolution == TransitionIncident.ESCALATED:
+            incident.resolution = resolution
+            incident.message = message[:200]
+            incident.time_lost = _time_lost(incident, now)
+            incident.save()
+        else:
+            _resolve(incident, resolution, message, now)
+        changed.append(incident)
+
+    return changed
+
+
+def recent_incidents(incidents, count=20):
+    """List the latest of the given transition incidents.
+
+    Parameters
+    ----------
+    incidents : QuerySet
+        The incidents to list, like the incidents of the servers in one experiment.
+    count : int, optional
+        The number of incidents to list.
+
+    Returns
+    -------
+    list[dict]
+        One dictionary per incident, newest first, with the keys ``ecc_server``, ``transition``, ``resolution``,
+        the name of the resolution, ``is_open``, ``started``, the time the transition started, ``time_lost``, in
+        seconds, and ``message``.
+
+    """
+    names = dict(TransitionIncident.resolution_choices)
+    return [{
+        'ecc_server': incident.ecc_server_name,
+        'transition': incident.transition,
+        'resolution': names.get(incident.resolution, incident.resolution),
+        'is_open': incident.resolved_time is None,
+        'started': incident.started_time,
+        'time_lost': incident.time_lost,
+        'message': incident.message,
+    } for incident in incidents.order_by('-detected_time')[:count]]
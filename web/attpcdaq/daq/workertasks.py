@@ -9,8 +9,13 @@ from paramiko.client import SSHClient
 from paramiko.config import SSHConfig
 from paramiko.sftp_file import SFTPFile
 from paramiko import AutoAddPolicy
+from functools import wraps
 import os
 import re
+import shlex
+
+from .. import metrics
+from . import tracing
 
 
 def mkdir_recursive(sftp, path):
@@ -51,6 +56,89 @@ def mkdir_recursive(sftp, path):
         return
 
 
+def quote_remote_path(path):
+    """Escape a path so it can be passed to a shell command on the remote host.
+
+    This works like :func:`shlex.quote`, except that a leading ``~/`` is left unquoted so that the remote
+    shell will still expand it to the home directory.
+
+    Parameters
+    ----------
+    path : str
+        The path to escape.
+
+    Returns
+    -------
+    str
+        The escaped path.
+
+    """
+    if path == '~':
+        return path
+    elif path.startswith('~/'):
+        return '~/' + shlex.quote(path[2:])
+    else:
+        return shlex.quote(path)
+
+
+def timed_remote_call(method):
+    """Decorate a :class:`WorkerInterface` method to record its duration in the SSH call latency metric.
+
+    If a trace is active, the call is also recorded as a span (see :mod:`attpcdaq.daq.tracing`).
+
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        from .models import TraceSpan  # The models module imports this one
+        with metrics.SSH_CALL_DURATION.time(host=self.hostname, operation=method.__name__), \
+                tracing.span(method.__name__, TraceSpan.SSH, target=self.hostname):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def blob_path(store_root, checksum):
+    """Get the path to a blob in the content-addressed backup store.
+
+    Parameters
+    ----------
+    store_root : str
+        The root directory of the backup store.
+    checksum : str
+        The SHA-256 hex digest of the file.
+
+    Returns
+    -------
+    str
+        The path ``store_root/objects/[aa]/[checksum]``.
+
+    """
+    return os.path.join(store_root, 'objects', checksum[:2], checksum)
+
+
+def parse_checksums(lines):
+    """Parse the output of ``shasum``.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        The lines printed by ``shasum``. Each has the format ``[digest]  [path]``.
+
+    Returns
+    -------
+    dict
+        The digests, keyed by path.
+
+    """
+    checksums = {}
+    for line in lines:
+        digest, _, path = line.strip().partition(' ')
+        if digest:
+            checksums[path.strip().lstrip('*')] = digest
+
+    return checksums
+
+
 class WorkerInterface(object):
     """An interface to perform tasks on the DAQ worker nodes.
 
@@ -72,10 +160,14 @@ class WorkerInterface(object):
         is listed there, the name of the user running the code will be used.
     config_path : str, optional
         The path to the SSH config file. The default is ``~/.ssh/config``.
+    timeout : float, optional
+        The timeout for connecting, and for each read from the remote host, in seconds. By default, there is no
+        timeout.
 
     """
-    def __init__(self, hostname, port=22, username=None, config_path=None):
+    def __init__(self, hostname, port=22, username=None, config_path=None, timeout=None):
         self.hostname = hostname
+        self.timeout = timeout
         self.client = SSHClient()
 
         self.client.load_system_host_keys()
@@ -95,7 +187,14 @@ class WorkerInterface(object):
         else:
             full_hostname = hostname
 
-        self.client.connect(full_hostname, port, username=username)
+        from .models import TraceSpan  # The models module imports this one
+        with metrics.SSH_CALL_DURATION.time(host=hostname, operation='connect'), \
+                tracing.span('connect', TraceSpan.SSH, target=hostname):
+            if timeout is None:
+                self.client.connect(full_hostname, port, username=username)
+            else:
+                self.client.connect(full_hostname, port, username=username, timeout=timeout,
+                                    banner_timeout=timeout, auth_timeout=timeout)
 
     def __enter__(self):
         return self
@@ -103,6 +202,48 @@ class WorkerInterface(object):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.client.close()
 
+    def _exec(self, command):
+        """Start a shell command on the remote host, with reads from it timing out after :attr:`timeout` seconds."""
+        if self.timeout is None:
+            return self.client.exec_command(command)
+        return self.client.exec_command(command, timeout=self.timeout)
+
+    def _open_sftp(self):
+        """Open an SFTP session, with reads from it timing out after :attr:`timeout` seconds."""
+        sftp = self.client.open_sftp()
+        if self.timeout is not None:
+            sftp.get_channel().settimeout(self.timeout)
+        return sftp
+
+    def _exec_checked(self, command):
+        """Run a shell command on the remote host and wait for it to finish.
+
+        Parameters
+        ----------
+        command : str
+            The command to run. Any paths in it should already be escaped.
+
+        Returns
+        -------
+        list[str]
+            The lines written to stdout by the command.
+
+        Raises
+        ------
+        RuntimeError
+            If the command exits with a nonzero status.
+
+        """
+        _, stdout, stderr = self._exec(command)
+        lines = list(stdout)
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status != 0:
+            message = stderr.read().decode('utf-8', errors='replace').strip()
+            raise RuntimeError('Remote command failed with status {}: {}'.format(exit_status, message))
+
+        return lines
+
+    @timed_remote_call
     def find_data_router(self):
         """Find the working directory of the data router process.
 
@@ -119,7 +260,7 @@ class WorkerInterface(object):
             If ``lsof`` finds something strange instead of a process called ``dataRouter``.
 
         """
-        stdin, stdout, stderr = self.client.exec_command('lsof -a -d cwd -c dataRouter -Fcn')
+        stdin, stdout, stderr = self._exec('lsof -a -d cwd -c dataRouter -Fcn')
         for line in stdout:
             if line[0] == 'c' and not re.match('cdataRouter', line):
                 raise RuntimeError("lsof found {} instead of dataRouter".format(line[1:].strip()))
@@ -128,6 +269,7 @@ class WorkerInterface(object):
         else:
             raise RuntimeError("lsof didn't find dataRouter")
 
+    @timed_remote_call
     def get_graw_list(self):
         """Get a list of GRAW files in the data router's working directory.
 
@@ -139,7 +281,7 @@ class WorkerInterface(object):
         """
         data_dir = self.find_data_router()
 
-        with self.client.open_sftp() as sftp:
+        with self._open_sftp() as sftp:
             full_list = sftp.listdir(data_dir)
 
         graws = filter(lambda s: re.match(r'.*\.graw$', s), full_list)
@@ -147,6 +289,66 @@ class WorkerInterface(object):
 
         return list(full_graw_paths)
 
+    @timed_remote_call
+    def get_graw_size(self):
+        """Get the total size of the GRAW files in the data router's working directory.
+
+        The sizes are read from a single directory listing, so this is cheap enough to call frequently
+        while the files are being written.
+
+        Returns
+        -------
+        int
+            The total size of the GRAW files, in bytes.
+
+        """
+        data_dir = self.find_data_router()
+
+        with self._open_sftp() as sftp:
+            listing = sftp.listdir_attr(data_dir)
+
+        return sum(attrs.st_size for attrs in listing if re.match(r'.*\.graw$', attrs.filename))
+
+    @timed_remote_call
+    def get_disk_usage(self, path=None):
+        """Get the size and free space of the filesystem containing a directory.
+
+        This runs ``df -Pk`` on the remote host, which reports the filesystem's ``statvfs`` figures in the
+        portable POSIX format.
+
+        Parameters
+        ----------
+        path : str, optional
+            The directory to check. If this is not given, the data router's working directory is used.
+
+        Returns
+        -------
+        total : int
+            The size of the filesystem, in bytes.
+        free : int
+            The space available to unprivileged users, in bytes.
+
+        Raises
+        ------
+        RuntimeError
+            If the command fails or its output can't be parsed.
+
+        """
+        if path is None:
+            path = self.find_data_router()
+
+        lines = self._exec_checked('df -Pk {}'.format(quote_remote_path(path)))
+
+        # The filesystem name and mount point can contain spaces, so match the numeric columns
+        for line in lines[1:]:
+            match = re.search(r'\s(\d+)\s+(\d+)\s+(\d+)\s+\d+%\s', line)
+            if match:
+                total_kb, _, free_kb = (int(x) for x in match.groups())
+                return total_kb * 1024, free_kb * 1024
+
+        raise RuntimeError('Could not parse output of df: {}'.format(''.join(lines).strip()))
+
+    @timed_remote_call
     def working_dir_is_clean(self):
         """Check if there are GRAW files in the data router's working directory.
 
@@ -171,7 +373,7 @@ class WorkerInterface(object):
             True if the process is running.
         """
 
-        _, stdout, _ = self.client.exec_command('ps -e')
+        _, stdout, _ = self._exec('ps -e')
 
         for line in stdout:
             if re.search(process_name, line):
@@ -179,6 +381,7 @@ class WorkerInterface(object):
         else:
             return False
 
+    @timed_remote_call
     def check_ecc_server_status(self):
         """Checks if the ECC server is running.
 
@@ -189,6 +392,7 @@ class WorkerInterface(object):
         """
         return self._check_process_status(r'getEccSoapServer')
 
+    @timed_remote_call
     def check_data_router_status(self):
         """Checks if the data router is running.
 
@@ -223,6 +427,7 @@ class WorkerInterface(object):
         run_dir = os.path.join(pwd, experiment_name, run_name)
         return run_dir
 
+    @timed_remote_call
     def organize_files(self, experiment_name, run_number):
         """Organize the GRAW files at the end of a run.
 
@@ -237,18 +442,100 @@ class WorkerInterface(object):
         run_number : int
             The current run number.
 
+        Returns
+        -------
+        list[dict]
+            An inventory of the GRAW files in the run directory after the move. Each entry has the keys
+            ``path``, ``size`` (in bytes), and ``mtime`` (a Unix timestamp).
+
         """
         run_dir = self.build_run_dir_path(experiment_name, run_number)
 
         graws = self.get_graw_list()
 
-        with self.client.open_sftp() as sftp:
+        with self._open_sftp() as sftp:
             mkdir_recursive(sftp, run_dir)
             for srcpath in graws:
                 _, srcfile = os.path.split(srcpath)
                 destpath = os.path.join(run_dir, srcfile)
                 sftp.rename(srcpath, destpath)
 
+            # One listing gets the size and modification time of every file
+            inventory = [{'path': os.path.join(run_dir, attrs.filename),
+                          'size': attrs.st_size,
+                          'mtime': attrs.st_mtime}
+                         for attrs in sftp.listdir_attr(run_dir)
+                         if re.match(r'.*\.graw$', attrs.filename)]
+
+        return inventory
+
+    #: The hash algorithms supported by :meth:`checksum_graw_files`, mapped to the ``shasum`` option for each
+    CHECKSUM_ALGORITHMS = {
+        'sha1': '1',
+        'sha224': '224',
+        'sha256': '256',
+        'sha384': '384',
+        'sha512': '512',
+    }
+
+    @timed_remote_call
+    def checksum_graw_files(self, experiment_name, run_number, algorithm='sha256', parallelism=4):
+        """Compute checksums of the GRAW files in a run directory and write a manifest next to it.
+
+        The checksums are computed on the remote host by up to ``parallelism`` concurrent ``shasum`` processes.
+        The manifest is written to ``experiment_name/run_name.[algorithm]`` under the directory where the data
+        router is running, so the files can later be verified by running ``shasum -c`` in that directory.
+
+        Parameters
+        ----------
+        experiment_name : str
+            The name of the experiment directory.
+        run_number : int
+            The run number.
+        algorithm : str, optional
+            The hash algorithm. Must be one of the keys of :attr:`CHECKSUM_ALGORITHMS`.
+        parallelism : int, optional
+            The maximum number of files to hash at once.
+
+        Returns
+        -------
+        dict
+            The hex digest of each GRAW file, keyed by its full path.
+
+        Raises
+        ------
+        ValueError
+            If the algorithm is not supported or the parallelism is less than 1.
+        RuntimeError
+            If the remote command fails.
+
+        """
+        try:
+            shasum_algorithm = self.CHECKSUM_ALGORITHMS[algorithm]
+        except KeyError:
+            raise ValueError('Unsupported checksum algorithm: {}'.format(algorithm)) from None
+
+        if parallelism < 1:
+            raise ValueError('Parallelism must be at least 1')
+
+        run_dir = self.build_run_dir_path(experiment_name, run_number)
+        experiment_dir, run_name = os.path.split(run_dir)
+        manifest_name = '{}.{}'.format(run_name, algorithm)
+
+        command = ('cd {exp_dir} && find {run_name} -maxdepth 1 -name \'*.graw\' -print0 '
+                   '| xargs -0 -n 1 -P {procs} shasum -a {alg} > {tmp} && mv {tmp} {manifest} && cat {manifest}').format(
+            exp_dir=quote_remote_path(experiment_dir),
+            run_name=shlex.quote(run_name),
+            procs=int(parallelism),
+            alg=shasum_algorithm,
+            tmp=shlex.quote(manifest_name + '.tmp'),
+            manifest=shlex.quote(manifest_name),
+        )
+
+        checksums = parse_checksums(self._exec_checked(command))
+        return {os.path.join(experiment_dir, path): digest for path, digest in checksums.items() if path != '-'}
+
+    @timed_remote_call
     def backup_config_files(self, experiment_name, run_number, file_paths, backup_root):
         """Makes a copy of the config files on the remote computer.
 
@@ -269,7 +556,7 @@ class WorkerInterface(object):
         run_name = 'run_{:04d}'.format(run_number)
         backup_dest = os.path.join(backup_root, experiment_name, run_name)
 
-        with self.client.open_sftp() as sftp:
+        with self._open_sftp() as sftp:
             mkdir_recursive(sftp, backup_dest)
             for source_path in file_paths:
                 dest_path = os.path.join(backup_dest, os.path.basename(source_path))
@@ -277,6 +564,115 @@ class WorkerInterface(object):
                     buffer = src.read()
                     dest.write(buffer)
 
+    @timed_remote_call
+    def archive_config_files(self, experiment_name, run_number, file_paths, backup_root):
+        """Back up the config files into a compressed archive on the remote computer.
+
+        Unlike :meth:`backup_config_files`, the file contents never pass through this program. A single
+        shell command is run on the remote host to write the archive ``experiment_name/run_name.tar.gz`` under
+        ``backup_root`` and to compute the SHA-256 checksum of each file that went into it.
+
+        Parameters
+        ----------
+        experiment_name : str
+            The name of the experiment.
+        run_number : int
+            The run number.
+        file_paths : iterable of str
+            The *full* paths to the config files.
+        backup_root : str
+            Where the backups should be written. A leading ``~`` will be expanded on the remote host.
+
+        Returns
+        -------
+        dict
+            The SHA-256 hex digest of each archived file, keyed by file name.
+
+        Raises
+        ------
+        RuntimeError
+            If the remote command fails, e.g. because one of the files is missing.
+
+        """
+        run_name = 'run_{:04d}'.format(run_number)
+        backup_dest = os.path.join(backup_root, experiment_name)
+        archive_path = os.path.join(backup_dest, run_name + '.tar.gz')
+
+        file_paths = list(file_paths)
+        tar_members = ' '.join('-C {} {}'.format(quote_remote_path(os.path.dirname(p)),
+                                                 shlex.quote(os.path.basename(p)))
+                               for p in file_paths)
+        quoted_paths = ' '.join(quote_remote_path(p) for p in file_paths)
+
+        command = 'mkdir -p {dest} && tar -czf {archive} {members} && shasum -a 256 {paths}'.format(
+            dest=quote_remote_path(backup_dest),
+            archive=quote_remote_path(archive_path),
+            members=tar_members,
+            paths=quoted_paths,
+        )
+
+        checksums = parse_checksums(self._exec_checked(command))
+        return {os.path.basename(path): digest for path, digest in checksums.items()}
+
+    @timed_remote_call
+    def hash_files(self, file_paths):
+        """Compute the SHA-256 checksums of files on the remote computer.
+
+        Parameters
+        ----------
+        file_paths : iterable of str
+            The full paths to the files.
+
+        Returns
+        -------
+        dict
+            The hex digest of each file, keyed by its path.
+
+        Raises
+        ------
+        RuntimeError
+            If the checksums could not be computed, e.g. because one of the files is missing.
+
+        """
+        command = 'shasum -a 256 ' + ' '.join(quote_remote_path(p) for p in file_paths)
+        return parse_checksums(self._exec_checked(command))
+
+    @timed_remote_call
+    def store_blobs(self, blobs, store_root):
+        """Copy files into a content-addressed store on the remote computer.
+
+        Each file is copied to ``store_root/objects/[aa]/[checksum]``, where ``aa`` is the first two characters
+        of its checksum. Files that are already present in the store are not copied again. All of the copies
+        are made by a single command on the remote host.
+
+        Parameters
+        ----------
+        blobs : dict
+            Maps the full path of each file to its SHA-256 hex digest, as returned by :meth:`hash_files`.
+        store_root : str
+            The root directory of the store. A leading ``~`` will be expanded on the remote host.
+
+        Raises
+        ------
+        RuntimeError
+            If any of the copies failed.
+
+        """
+        commands = []
+        for source_path, checksum in blobs.items():
+            dest_path = blob_path(store_root, checksum)
+            dest = quote_remote_path(dest_path)
+            commands.append('mkdir -p {dir} && {{ [ -e {dest} ] || {{ cp {src} {tmp} && mv {tmp} {dest}; }}; }}'.format(
+                dir=quote_remote_path(os.path.dirname(dest_path)),
+                dest=dest,
+                src=quote_remote_path(source_path),
+                tmp=quote_remote_path(dest_path + '.tmp'),
+            ))
+
+        if commands:
+            self._exec_checked(' && '.join(commands))
+
+    @timed_remote_call
     def tail_file(self, path, num_lines=50):
         """Retrieve the tail of a text file on the remote host.
 
@@ -295,7 +691,7 @@ class WorkerInterface(object):
             The tail of the file's contents.
         """
         # Based on https://gist.github.com/volker48/3437288
-        with self.client.open_sftp() as sftp:
+        with self._open_sftp() as sftp:
             with sftp.open(path, 'r') as f:
                 f.seek(-1, SFTPFile.SEEK_END)
                 lines = 0
@@ -1,23 +1,35 @@
 import logging
 from datetime import datetime
 
+from .. import metrics
+
 
 class DjangoDatabaseHandler(logging.Handler):
 
     def __init__(self):
         logging.Handler.__init__(self)
 
+    def handle(self, record):
+        # Records wait on the handler's lock while another thread writes, so count them while they're here
+        metrics.LOG_HANDLER_PENDING.inc()
+        try:
+            return super().handle(record)
+        finally:
+            metrics.LOG_HANDLER_PENDING.dec()
+
     def emit(self, record):
         from .models import LogEntry
         try:
-            entry = LogEntry(logger_name=record.name,
-                             create_time=datetime.fromtimestamp(record.created),
-                             level=record.levelno,
-                             path_name=record.pathname,
-                             line_num=record.lineno,
-                             function_name=record.funcName,
-                             message=record.getMessage(),
-                             traceback=record.exc_text)
-            entry.save()
+            with metrics.LOG_HANDLER_EMIT_DURATION.time():
+                entry = LogEntry(logger_name=record.name,
+                                 create_time=datetime.fromtimestamp(record.created),
+                                 level=record.levelno,
+                                 path_name=record.pathname,
+                                 line_num=record.lineno,
+                                 function_name=record.funcName,
+                                 message=record.getMessage(),
+                                 traceback=record.exc_text)
+                entry.save()
+            metrics.LOG_RECORDS.inc(level=record.levelname)
         except Exception:
             self.handleError(record)
@@ -0,0 +1,650 @@
+"""In-memory metrics for monitoring the DAQ control system.
+
+The metrics defined at the bottom of this module are updated as the app polls the ECC servers and data routers,
+makes SOAP and SSH calls, and writes log records. They are kept in memory by the :data:`REGISTRY` of each process and
+exposed in the OpenMetrics text format by the ``/metrics`` view, so a scrape never touches the database.
+
+The web app and the Celery workers run in separate processes (and containers), so each one has its own registry. If
+the ``METRICS_DIR`` setting is given, each process periodically writes a snapshot of its registry to a JSON file in
+that directory, and the ``/metrics`` view merges all of the snapshots. The directory should be on a shared
+``tmpfs`` volume. Counters and histograms from different processes are added together. For gauges, the most
+recently set value wins, unless the gauge is created with ``merge='sum'``. Each process keeps its snapshot's
+modification time current, so a snapshot that hasn't been touched for :data:`STALE_SNAPSHOT_INTERVALS` snapshot
+intervals belongs to a process that has died, such as a Celery child killed at its time limit. The counters and
+histograms of a stale snapshot are added to the :data:`ACCUMULATED_SNAPSHOT`, which is always merged, so the totals
+never go backwards. Its gauges are dropped, and the stale snapshot is deleted.
+
+"""
+
+import fcntl
+import json
+import math
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: The content type of the OpenMetrics text format
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+#: The default bucket upper bounds for latency histograms, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+#: The number of snapshot intervals after which a snapshot that hasn't been updated is deleted
+STALE_SNAPSHOT_INTERVALS = 3
+
+#: The name of the snapshot file holding the counters and histograms of the processes that have died
+ACCUMULATED_SNAPSHOT = 'dead-processes.json'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry(object):
+    """Holds the metrics of one process and writes snapshots of them for the other processes.
+
+    Parameters
+    ----------
+    directory : str or callable, optional
+        The directory to write snapshots to, or a function returning it. If this is None, or the function returns
+        None, no snapshots are written.
+    interval : float or callable, optional
+        The minimum time between snapshots, in seconds, or a function returning it.
+
+    """
+    def __init__(self, directory=None, interval=5):
+        self._directory = directory
+        self._interval = interval
+        self._lock = threading.RLock()
+        self._metrics = OrderedDict()
+        self._pid = os.getpid()
+        self._writer = None
+        self._dirty = False
+        self._closed = False
+
+    @property
+    def directory(self):
+        """The directory where snapshots are written, or None."""
+        return self._directory() if callable(self._directory) else self._directory
+
+    @property
+    def interval(self):
+        """The minimum time between snapshots, in seconds."""
+        return self._interval() if callable(self._interval) else self._interval
+
+    @property
+    def snapshot_path(self):
+        """The path of this process's snapshot file."""
+        return os.path.join(self.directory, '{}-{}.json'.format(socket.gethostname(), os.getpid()))
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('A metric named {} is already registered'.format(metric.name))
+            self._metrics[metric.name] = metric
+
+    def changed(self):
+        """Called by the metrics when they change. Starts the snapshot writer if needed."""
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # This is a forked child. The parent's counts are in the parent's snapshot, so start from zero.
+                self._pid = pid
+                self._writer = None
+                for metric in self._metrics.values():
+                    metric.reset_after_fork()
+
+            self._dirty = True
+            if self._writer is None and not self._closed and self.directory is not None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+
+    def close(self):
+        """Stop writing snapshots. The writer thread stops after its current interval."""
+        with self._lock:
+            self._closed = True
+            self._writer = None
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.interval)
+            if self._writer is not threading.current_thread():
+                return
+            with self._lock:
+                dirty = self._dirty
+                self._dirty = False
+            try:
+                if dirty:
+                    self.write_snapshot()
+                else:
+                    self.touch_snapshot()
+            except Exception:
+                logger.exception('Failed to write metrics snapshot')
+
+    def collect(self):
+        """Get the current values of this process's metrics.
+
+        Returns
+        -------
+        list[dict]
+            A dictionary for each metric, in the format written to the snapshot files.
+
+        """
+        with self._lock:
+            return [metric.collect() for metric in self._metrics.values()]
+
+    def write_snapshot(self):
+        """Write this process's metrics to its snapshot file."""
+        path = self.snapshot_path
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.collect(), f)
+        os.replace(tmp_path, path)
+
+    def touch_snapshot(self):
+        """Mark this process's snapshot as current without rewriting it, so it isn't deleted as stale."""
+        try:
+            os.utime(self.snapshot_path)
+        except FileNotFoundError:
+            self.write_snapshot()
+
+    def collect_all(self):
+        """Get the metrics of all processes.
+
+        This reads the snapshots written by the other processes, if there is a snapshot directory, and merges them
+        with the current values in this process. Snapshots that haven't been updated for
+        :data:`STALE_SNAPSHOT_INTERVALS` intervals are retired instead, since their processes have died (see
+        :meth:`retire_snapshot`).
+
+        Returns
+        -------
+        list[dict]
+            The merged metrics.
+
+        """
+        families = [self.collect()]
+
+        directory = self.directory
+        if directory is not None and os.path.isdir(directory):
+            own_path = self.snapshot_path
+            accumulated_path = os.path.join(directory, ACCUMULATED_SNAPSHOT)
+            oldest = time.time() - STALE_SNAPSHOT_INTERVALS * self.interval
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if not name.endswith('.json') or path in (own_path, accumulated_path):
+                    continue
+                try:
+                    if os.path.getmtime(path) < oldest:
+                        self.retire_snapshot(path)
+                        logger.info('Retired stale metrics snapshot %s', path)
+                        continue
+                    with open(path) as f:
+                        families.append(json.load(f))
+                except FileNotFoundError:
+                    continue  # Retired by another process
+                except (OSError, ValueError):
+                    logger.warning('Could not read metrics snapshot %s', path)
+
+            # This is read last, so that it includes any snapshot retired while the others were being read
+            try:
+                with open(accumulated_path) as f:
+                    families.append(json.load(f))
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError):
+                logger.warning('Could not read metrics snapshot %s', accumulated_path)
+
+        return merge(families)
+
+    def retire_snapshot(self, path):
+        """Add the counters and histograms of a dead process's snapshot to the accumulated snapshot, and delete it.
+
+        The gauges of the dead process are dropped. This holds a lock on the snapshot directory, so a snapshot that
+        several processes find stale at once is only added once.
+
+        Parameters
+        ----------
+        path : str
+            The path of the stale snapshot.
+
+        """
+        directory = os.path.dirname(path)
+        accumulated_path = os.path.join(directory, ACCUMULATED_SNAPSHOT)
+        with open(accumulated_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path) as f:
+                    stale = json.load(f)
+            except FileNotFoundError:
+                return  # Retired by another process
+            except ValueError:
+                logger.warning('Deleted unreadable metrics snapshot %s', path)
+                stale = []
+
+            try:
+                with open(accumulated_path) as f:
+                    accumulated = json.load(f)
+            except FileNotFoundError:
+                accumulated = []
+
+            totals = [family for family in stale if family['type'] in ('counter', 'histogram')]
+            tmp_path = accumulated_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(merge([accumulated, totals]), f)
+            os.replace(tmp_path, accumulated_path)
+            os.remove(path)
+
+
+def merge(snapshots):
+    """Merge the metrics from several processes.
+
+    Parameters
+    ----------
+    snapshots : list[list[dict]]
+        The metrics of each process, as returned by :meth:`Registry.collect`.
+
+    Returns
+    -------
+    list[dict]
+        The merged metrics, in the order they were first seen.
+
+    """
+    merged = OrderedDict()
+    for families in snapshots:
+        for family in families:
+            target = merged.setdefault(family['name'], dict(family, samples=OrderedDict()))
+            for sample in family['samples']:
+                key = _label_key(sample['labels'])
+                existing = target['samples'].get(key)
+                if existing is None:
+                    target['samples'][key] = dict(sample)
+                elif family['type'] == 'histogram':
+                    existing['value'] = {
+                        'buckets': [a + b for a, b in zip(existing['value']['buckets'], sample['value']['buckets'])],
+                        'sum': existing['value']['sum'] + sample['value']['sum'],
+                        'count': existing['value']['count'] + sample['value']['count'],
+                    }
+                elif family['type'] == 'counter' or family.get('merge') == 'sum':
+                    existing['value'] += sample['value']
+                elif sample['time'] > existing['time']:
+                    target['samples'][key] = dict(sample)
+
+    for family in merged.values():
+        family['samples'] = list(family['samples'].values())
+    return list(merged.values())
+
+
+class Metric(object):
+    """Base class for the metric types.
+
+    Parameters
+    ----------
+    name : str
+        The name of the metric family. For counters, this should not end in ``_total``.
+    documentation : str
+        A description of the metric.
+    labelnames : iterable of str, optional
+        The names of the labels. Each update must give a value for each of these.
+    registry : Registry, optional
+        The registry to add the metric to.
+
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry if registry is not None else REGISTRY
+        self._values = {}
+        self._times = {}
+        self.registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Expected labels {}, got {}'.format(self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _update(self, labels, func):
+        key = self._key(labels)
+        with self.registry._lock:
+            self.registry.changed()
+            self._values[key] = func(self._values.get(key))
+            self._times[key] = time.time()
+
+    def reset_after_fork(self):
+        self._values = {}
+        self._times = {}
+
+    def get(self, **labels):
+        """Get the current value in this process for the given labels, or None if it hasn't been set."""
+        return self._values.get(self._key(labels))
+
+    def remove(self, **labels):
+        """Remove the series with the given labels."""
+        key = self._key(labels)
+        with self.registry._lock:
+            self.registry.changed()
+            self._values.pop(key, None)
+            self._times.pop(key, None)
+
+    def _export_value(self, value):
+        return value
+
+    def collect(self):
+        """Get the metric's samples in the snapshot format."""
+        return {
+            'name': self.name,
+            'type': self.type,
+            'help': self.documentation,
+            'samples': [{'labels': dict(zip(self.labelnames, key)), 'value': self._export_value(value),
+                         'time': self._times[key]}
+                        for key, value in sorted(self._values.items())],
+        }
+
+
+class Counter(Metric):
+    """A value that only increases."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Add to the counter."""
+        if amount < 0:
+            raise ValueError('Counters can only increase')
+        self._update(labels, lambda value: (value or 0) + amount)
+
+
+class Gauge(Metric):
+    """A value that can go up and down.
+
+    Parameters
+    ----------
+    merge : str, optional
+        How to combine the values from different processes: "latest" to use the most recently set value, or "sum"
+        to add them.
+
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, merge='latest'):
+        super().__init__(name, documentation, labelnames, registry)
+        self.merge = merge
+
+    def reset_after_fork(self):
+        if self.merge == 'sum':
+            super().reset_after_fork()
+
+    def set(self, value, **labels):
+        """Set the gauge to the given value."""
+        self._update(labels, lambda old: float(value))
+
+    def inc(self, amount=1, **labels):
+        """Add to the gauge."""
+        self._update(labels, lambda value: (value or 0) + amount)
+
+    def dec(self, amount=1, **labels):
+        """Subtract from the gauge."""
+        self.inc(-amount, **labels)
+
+    def collect(self):
+        family = super().collect()
+        family['merge'] = self.merge
+        return family
+
+
+class Histogram(Metric):
+    """Counts observations in buckets.
+
+    Parameters
+    ----------
+    buckets : iterable of float, optional
+        The upper bounds of the buckets, in increasing order. A final bucket for larger values is added
+        automatically.
+
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Call a function with each observation.
+
+        Parameters
+        ----------
+        listener : callable
+            A function taking the observed amount and a dictionary of the labels.
+
+        """
+        self._listeners.append(listener)
+
+    def observe(self, amount, **labels):
+        """Record an observation."""
+        def add(value):
+            if value is None:
+                value = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    value['buckets'][i] += 1
+                    break
+            else:
+                value['buckets'][-1] += 1
+            value['sum'] += amount
+            value['count'] += 1
+            return value
+
+        self._update(labels, add)
+
+        for listener in self._listeners:
+            listener(amount, labels)
+
+    @contextmanager
+    def time(self, **labels):
+        """A context manager that observes the time taken by its body, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _export_value(self, value):
+        return {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+
+    def collect(self):
+        family = super().collect()
+        family['bucket_bounds'] = list(self.buckets)
+        return family
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels.items()) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    elif value == -math.inf:
+        return '-Inf'
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    else:
+        return repr(value)
+
+
+def render(families):
+    """Format metrics in the OpenMetrics text format.
+
+    Parameters
+    ----------
+    families : list[dict]
+        The metrics, as returned by :meth:`Registry.collect_all`.
+
+    Returns
+    -------
+    str
+        The exposition text, ending with ``# EOF``.
+
+    """
+    lines = []
+    for family in families:
+        name = family['name']
+        lines.append('# TYPE {} {}'.format(name, family['type']))
+        lines.append('# HELP {} {}'.format(name, _escape(family['help'])))
+        for sample in family['samples']:
+            labels = OrderedDict(sorted(sample['labels'].items()))
+            value = sample['value']
+            if family['type'] == 'counter':
+                lines.append('{}_total{} {}'.format(name, _format_labels(labels), _format_value(value)))
+            elif family['type'] == 'histogram':
+                cumulative = 0
+                bounds = list(family['bucket_bounds']) + [math.inf]
+                for bound, count in zip(bounds, value['buckets']):
+                    cumulative += count
+                    bucket_labels = OrderedDict(labels, le=_format_value(float(bound)))
+                    lines.append('{}_bucket{} {}'.format(name, _format_labels(bucket_labels), cumulative))
+                lines.append('{}_count{} {}'.format(name, _format_labels(labels), value['count']))
+                lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(value['sum'])))
+            else:
+                lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(value)))
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def add_derived_metrics(families, now=None):
+    """Add the metrics that depend on the time of the scrape.
+
+    This adds ``attpcdaq_last_poll_age_seconds``, the time since the last successful poll of each host, and
+    updates ``attpcdaq_run_duration_seconds`` for runs that are still in progress.
+
+    Parameters
+    ----------
+    families : list[dict]
+        The metrics, as returned by :meth:`Registry.collect_all`. This is modified in place.
+    now : float, optional
+        The current time, as a Unix timestamp.
+
+    """
+    if now is None:
+        now = time.time()
+
+    by_name = {family['name']: family for family in families}
+
+    poll_times = by_name.get(LAST_POLL_TIME.name)
+    if poll_times is not None:
+        families.append({
+            'name': 'attpcdaq_last_poll_age_seconds',
+            'type': 'gauge',
+            'help': 'Time since the last successful poll of each host',
+            'samples': [dict(sample, value=max(now - sample['value'], 0)) for sample in poll_times['samples']],
+        })
+
+    durations = by_name.get(RUN_DURATION.name)
+    if durations is not None:
+        running = {_label_key(s['labels']): s['value'] for s in by_name.get(RUN_RUNNING.name, {}).get('samples', [])}
+        starts = {_label_key(s['labels']): s['value']
+                  for s in by_name.get(RUN_START_TIME.name, {}).get('samples', [])}
+        for sample in durations['samples']:
+            key = _label_key(sample['labels'])
+            if running.get(key) and key in starts:
+                sample['value'] = max(now - starts[key], 0)
+
+
+def _metrics_dir():
+    from django.conf import settings
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _snapshot_interval():
+    from django.conf import settings
+    return getattr(settings, 'METRICS_SNAPSHOT_INTERVAL', 5)
+
+
+#: The registry holding the metrics of this process
+REGISTRY = Registry(directory=_metrics_dir, interval=_snapshot_interval)
+
+# Control-plane metrics
+
+ECC_STATE = Gauge('attpcdaq_ecc_state', 'State of the ECC server state machine (1 = idle to 5 = running)',
+                  ['ecc_server'])
+ECC_TRANSITIONING = Gauge('attpcdaq_ecc_transitioning', 'Whether the ECC server is performing a transition',
+                          ['ecc_server'])
+ECC_ONLINE = Gauge('attpcdaq_ecc_online', 'Whether the ECC server process is running', ['ecc_server'])
+DATA_ROUTER_ONLINE = Gauge('attpcdaq_data_router_online', 'Whether the data router process is running',
+                           ['data_router'])
+DATA_ROUTER_CLEAN = Gauge('attpcdaq_data_router_clean',
+                          'Whether the data router staging directory has no unorganized GRAW files', ['data_router'])
+RUN_NUMBER = Gauge('attpcdaq_run_number', 'Number of the current or most recent run', ['experiment'])
+RUN_RUNNING = Gauge('attpcdaq_run_running', 'Whether a run is in progress', ['experiment'])
+RUN_START_TIME = Gauge('attpcdaq_run_start_timestamp_seconds', 'Start time of the current or most recent run',
+                       ['experiment'])
+RUN_DURATION = Gauge('attpcdaq_run_duration_seconds', 'Duration of the current or most recent run',
+                     ['experiment'])
+LAST_POLL_TIME = Gauge('attpcdaq_last_poll_timestamp_seconds', 'Time of the last successful poll of each host',
+                       ['host', 'poll'])
+
+# Performance metrics
+
+SOAP_CALL_DURATION = Histogram('attpcdaq_soap_call_duration_seconds', 'Duration of SOAP calls to ECC servers',
+                               ['host', 'operation'])
+SSH_CALL_DURATION = Histogram('attpcdaq_ssh_call_duration_seconds', 'Duration of SSH operations on remote hosts',
+                              ['host', 'operation'])
+POLL_CYCLE_DURATION = Histogram('attpcdaq_poll_cycle_duration_seconds',
+                                'Time taken to start one poll of all hosts', ['poll'])
+POLL_TARGETS_SKIPPED = Counter('attpcdaq_poll_targets_skipped',
+                               'Poll tasks not queued because the last check of the target had not finished', ['poll'])
+POLL_CYCLES_SKIPPED = Counter('attpcdaq_poll_cycles_skipped',
+                              'Poll cycles that queued nothing because every target was still being checked', ['poll'])
+TASK_DURATION = Histogram('attpcdaq_task_duration_seconds', 'Duration of Celery tasks', ['task'])
+TASK_QUEUE_WAIT = Histogram('attpcdaq_task_queue_wait_seconds', 'Time Celery tasks waited in each queue', ['queue'])
+LOG_HANDLER_PENDING = Gauge('attpcdaq_log_handler_pending',
+                            'Log records waiting to be written to the database', merge='sum')
+LOG_HANDLER_EMIT_DURATION = Histogram('attpcdaq_log_handler_emit_duration_seconds',
+                                      'Time taken to write a log record to the database')
+LOG_RECORDS = Counter('attpcdaq_log_records', 'Log records written to the database', ['level'])
+REQUEST_DURATION = Histogram('attpcdaq_request_duration_seconds', 'Time taken to handle web requests', ['view'])
+REQUEST_DB_DURATION = Histogram('attpcdaq_request_db_duration_seconds',
+                                'Time spent in database queries while handling web requests', ['view'])
+REQUEST_QUERIES = Histogram('attpcdaq_request_queries', 'Number of database queries made by web requests', ['view'],
+                            buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+RUN_ROLLOVER_DURATION = Histogram('attpcdaq_run_rollover_duration_seconds',
+                                  'Time taken by each phase of rolling over to the next run', ['phase'],
+                                  buckets=(1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180))
+STATE_CHANGE_DURATION = Histogram('attpcdaq_state_change_duration_seconds',
+                                  'Time taken to bring all ECC servers to a state, such as a cold start from Idle '
+                                  'to Running', ['from_state', 'to_state'],
+                                  buckets=(1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 240, 300, 480))
+STATE_CHANGE_STEP_DURATION = Histogram('attpcdaq_state_change_step_duration_seconds',
+                                       'Time taken by each step of a multi-step state change', ['transition'],
+                                       buckets=(1, 2.5, 5, 10, 15, 20, 30, 45, 60, 90, 120))
+HOST_SLOTS = Gauge('attpcdaq_host_slots', 'Operations using or waiting for a slot on each remote host',
+                   ['host', 'state'], merge='sum')
+HOST_SLOT_WAIT_DURATION = Histogram('attpcdaq_host_slot_wait_seconds', 'Time spent waiting for a slot on a remote host',
+                                    ['host', 'priority'])
+HOST_SLOT_TIMEOUTS = Counter('attpcdaq_host_slot_timeouts',
+                             'Operations that gave up waiting for a slot on a remote host', ['host', 'priority'])
+CIRCUIT_BREAKER_OPEN = Gauge('attpcdaq_circuit_breaker_open',
+                             'Whether the status checks of each remote endpoint are paused after repeated failures',
+                             ['endpoint'])
+CIRCUIT_BREAKER_REJECTED = Counter('attpcdaq_circuit_breaker_rejected',
+                                   'Status checks refused without contacting the endpoint since its breaker was open',
+                                   ['endpoint'])
+TRANSITION_INCIDENTS = Counter('attpcdaq_transition_incidents',
+                               'ECC server transitions that did not finish within their timeout, by what the '
+                               'watchdog did about them', ['transition', 'resolution'])
+TRANSITION_TIME_LOST = Counter('attpcdaq_transition_time_lost_seconds',
+                               'Time from the end of the timeout of a stuck transition until its flag was cleared',
+                               ['transition'])
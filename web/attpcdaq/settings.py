@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 
 import os
 from datetime import timedelta
+from kombu import Queue
 import logging
 
 IS_PRODUCTION = 'DAQ_IS_PRODUCTION' in os.environ
@@ -29,13 +30,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'crispy_forms',
-    'attpcdaq.daq',
+    'attpcdaq.daq.apps.DaqConfig',
     'attpcdaq.tags',
     'attpcdaq.accounts',
     'attpcdaq.logs',
 ]
 
 MIDDLEWARE = [
+    'attpcdaq.daq.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -113,6 +115,107 @@ STATICFILES_DIRS = (
 
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
 
+# How config files are backed up at the end of each run. With 'store', each unique file is kept once in a
+# content-addressed store on the remote host, and the run's manifest is recorded in the database. With 'archive',
+# the files are bundled into one compressed archive per run on the remote host. With 'copy', each file is copied
+# separately over SFTP.
+CONFIG_BACKUP_MODE = 'store'
+
+# Checksums of the GRAW files are computed on the data router hosts after the files are organized at the end of
+# each run. This sets the hash algorithm and the number of files that are hashed at once on each host.
+GRAW_CHECKSUM_ALGORITHM = 'sha256'
+GRAW_CHECKSUM_PARALLELISM = 4
+
+# Poll the ECC servers' state with a lightweight SOAP client instead of zeep. Set this to False to use zeep for
+# every request.
+ECC_FAST_GET_STATE = True
+
+# The data rate of each data router is measured from the growth of its staging directory during a run. A router
+# is flagged as stalled if it writes no data for this many seconds (set to None to disable the alarm). Samples
+# are kept for the length of DATA_RATE_HISTORY.
+DATA_RATE_STALL_SECONDS = 60
+DATA_RATE_HISTORY = timedelta(hours=1)
+
+# The free space on each data router's staging volume is checked along with its status, and the samples are kept
+# for the length of DISK_USAGE_HISTORY. A warning is logged when the disk is projected to fill up within
+# DISK_FULL_WARNING_TIME at the current data rate, or before a run starts if a run of EXPECTED_RUN_LENGTH
+# would not fit.
+DISK_USAGE_HISTORY = timedelta(hours=6)
+DISK_FULL_WARNING_TIME = timedelta(minutes=30)
+EXPECTED_RUN_LENGTH = timedelta(hours=1)
+
+# The duration, queue wait, and outcome of each Celery task run are recorded for the task timing page. The records
+# are kept for the length of TASK_TIMING_HISTORY.
+TASK_TIMING_ENABLED = True
+TASK_TIMING_HISTORY = timedelta(hours=1)
+
+# Metrics for the /metrics endpoint are kept in memory by each process. If METRICS_DIR is set, each process writes
+# a snapshot of its metrics there every METRICS_SNAPSHOT_INTERVAL seconds so that the web app can export the
+# metrics of the Celery workers too. In production, this is a tmpfs volume shared by the web and celery containers.
+# Snapshots that haven't been updated for a few intervals are from processes that have died. Their counters and
+# histograms are kept in an accumulated snapshot, and the rest is deleted.
+METRICS_DIR = os.environ.get('DAQ_METRICS_DIR')
+METRICS_SNAPSHOT_INTERVAL = 5
+
+# Each request's time, database queries, and SOAP and SSH calls are reported in a Server-Timing header. Requests that
+# take longer than SLOW_REQUEST_THRESHOLD are logged along with their SLOW_REQUEST_TOP_QUERIES slowest queries.
+SLOW_REQUEST_THRESHOLD = timedelta(seconds=2)
+SLOW_REQUEST_TOP_QUERIES = 5
+
+# The views that change the state of the ECC servers start a trace that follows the request through the Celery tasks
+# to the SOAP and SSH calls. The spans are kept for the length of TRACE_HISTORY.
+TRACING_ENABLED = True
+TRACE_HISTORY = timedelta(days=1)
+
+# Operations like rolling over to the next run poll the ECC servers every RUN_CONTROL_POLL_INTERVAL seconds while
+# they wait for a transition, and give up if it takes longer than RUN_CONTROL_TRANSITION_TIMEOUT seconds.
+RUN_CONTROL_POLL_INTERVAL = 0.25
+RUN_CONTROL_TRANSITION_TIMEOUT = 60
+
+# Before a run starts, every ECC server and data router is checked in parallel, and any check that hasn't finished
+# PREFLIGHT_DEADLINE seconds after the request, including the wait for the host slots, fails. The run is started or
+# refused at that point. Each staging volume must have at least PREFLIGHT_MIN_FREE_BYTES free.
+PREFLIGHT_DEADLINE = 2
+PREFLIGHT_MIN_FREE_BYTES = 1e9
+
+# At most HOST_CONCURRENCY['ssh'] SSH sessions are opened to each DAQ computer at once, and at most
+# HOST_CONCURRENCY['ecc'] SOAP calls are made to each ECC server at once. Set this to None to turn off the limits.
+# Status polls wait up to HOST_SLOT_POLL_TIMEOUT seconds for a free slot and other operations wait up to
+# HOST_SLOT_TIMEOUT seconds. A slot that isn't released after HOST_SLOT_LEASE seconds is given to someone else.
+HOST_CONCURRENCY = {'ssh': 2, 'ecc': 1}
+HOST_SLOT_POLL_TIMEOUT = 2
+HOST_SLOT_TIMEOUT = 30
+HOST_SLOT_LEASE = 120
+HOST_SLOT_RETRY_INTERVAL = 0.05
+
+# Each periodic status check takes a lease on its ECC server or data router when it is queued, and gives it back when
+# it finishes. Later poll cycles skip a target while its lease is held, so a slow host doesn't build up a backlog of
+# checks. A lease that isn't given back, for example because the worker died, expires after POLL_LEASE_TIMEOUT seconds.
+POLL_LEASE_TIMEOUT = 60
+
+# After CIRCUIT_BREAKER_THRESHOLD status checks of an ECC server or DAQ computer fail in a row, its checks are paused
+# and it is marked offline. One check is let through as a probe after CIRCUIT_BREAKER_BACKOFF seconds, and the wait
+# doubles after each failed probe, up to CIRCUIT_BREAKER_MAX_BACKOFF seconds. A successful check resumes the polls.
+CIRCUIT_BREAKER_THRESHOLD = 3
+CIRCUIT_BREAKER_BACKOFF = 5
+CIRCUIT_BREAKER_MAX_BACKOFF = 300
+
+# An ECC server that has been transitioning for longer than the timeout of its transition in TRANSITION_TIMEOUTS, in
+# seconds, is asked for its state by the transition watchdog. Transitions that aren't listed, or that weren't
+# requested by this app, use TRANSITION_TIMEOUT. The watchdog's GetState requests time out after
+# TRANSITION_WATCHDOG_REQUEST_TIMEOUT seconds.
+TRANSITION_TIMEOUTS = {
+    'Describe': 60,
+    'Prepare': 120,
+    'Configure': 120,
+    'Start': 30,
+    'Stop': 60,
+    'Breakup': 60,
+    'Undo': 30,
+}
+TRANSITION_TIMEOUT = 120
+TRANSITION_WATCHDOG_REQUEST_TIMEOUT = 5
+
 if IS_PRODUCTION:
     DEBUG = False
     ALLOWED_HOSTS = ['*']
@@ -192,18 +295,82 @@ else:
 
 CELERY_RESULT_BACKEND = 'rpc://'
 
+# The tasks are split between three queues, so that a backlog of polls or file operations can't hold up a state
+# change. Each queue is consumed by its own worker in celery_entrypoint.sh. A worker started without -Q consumes all
+# three. Tasks that aren't listed go to the bulk queue.
+CELERY_QUEUES = (Queue('control'), Queue('polling'), Queue('bulk'))
+CELERY_DEFAULT_QUEUE = 'bulk'
+CELERY_ROUTES = {
+    # State changes and starting and stopping runs
+    'attpcdaq.daq.tasks.eccserver_change_state_task': {'queue': 'control'},
+    'attpcdaq.daq.tasks.change_state_all_task': {'queue': 'control'},
+    'attpcdaq.daq.tasks.next_run_task': {'queue': 'control'},
+    'attpcdaq.daq.tasks.run_sequencer_task': {'queue': 'control'},
+    'attpcdaq.daq.tasks.run_sequence_boundary_task': {'queue': 'control'},
+    'attpcdaq.daq.tasks.reconcile_transitions_task': {'queue': 'control'},
+
+    # The periodic status checks
+    'attpcdaq.daq.tasks.eccserver_refresh_all_task': {'queue': 'polling'},
+    'attpcdaq.daq.tasks.eccserver_refresh_state_task': {'queue': 'polling'},
+    'attpcdaq.daq.tasks.check_ecc_server_online_all_task': {'queue': 'polling'},
+    'attpcdaq.daq.tasks.check_ecc_server_online_task': {'queue': 'polling'},
+    'attpcdaq.daq.tasks.check_data_router_status_all_task': {'queue': 'polling'},
+    'attpcdaq.daq.tasks.check_data_router_status_task': {'queue': 'polling'},
+    'attpcdaq.daq.tasks.sample_data_rate_all_task': {'queue': 'polling'},
+    'attpcdaq.daq.tasks.sample_data_rate_task': {'queue': 'polling'},
+
+    # File organization, checksums, config backups, and cleanup
+    'attpcdaq.daq.tasks.organize_files_all_task': {'queue': 'bulk'},
+    'attpcdaq.daq.tasks.organize_files_task': {'queue': 'bulk'},
+    'attpcdaq.daq.tasks.checksum_run_files_task': {'queue': 'bulk'},
+    'attpcdaq.daq.tasks.backup_config_files_all_task': {'queue': 'bulk'},
+    'attpcdaq.daq.tasks.backup_config_files_task': {'queue': 'bulk'},
+    'attpcdaq.daq.tasks.prune_task_timings_task': {'queue': 'bulk'},
+    'attpcdaq.daq.tasks.prune_samples_task': {'queue': 'bulk'},
+    'attpcdaq.daq.tasks.prune_trace_spans_task': {'queue': 'bulk'},
+}
+
 # Periodic tasks
+# The poll cycles only check the ECC servers and data routers that are due according to the active experiment's
+# PollSchedule, so they are started more often than any target is checked. The state poll runs fastest so that the
+# end of a transition is seen quickly. A cycle that can't find anything due returns after one query of its PollCycle
+# row, so the idle ticks cost about 3.5 queries a second in all. The old samples and records are deleted by the prune
+# tasks once a minute or less.
 CELERYBEAT_SCHEDULE = {
-    'update-state-every-5-sec': {
+    'update-state-every-half-sec': {
         'task': 'attpcdaq.daq.tasks.eccserver_refresh_all_task',
-        'schedule': timedelta(seconds=5),
+        'schedule': timedelta(seconds=0.5),
     },
-    'check-ecc-server-online-every-15-sec': {
+    'check-ecc-server-online-every-sec': {
         'task': 'attpcdaq.daq.tasks.check_ecc_server_online_all_task',
-        'schedule': timedelta(seconds=15),
+        'schedule': timedelta(seconds=1),
     },
-    'check-data-router-status-every-15-sec': {
+    'check-data-router-status-every-sec': {
         'task': 'attpcdaq.daq.tasks.check_data_router_status_all_task',
-        'schedule': timedelta(seconds=15),
+        'schedule': timedelta(seconds=1),
+    },
+    'sample-data-rate-every-sec': {
+        'task': 'attpcdaq.daq.tasks.sample_data_rate_all_task',
+        'schedule': timedelta(seconds=1),
+    },
+    'check-run-sequences-every-5-sec': {
+        'task': 'attpcdaq.daq.tasks.run_sequencer_task',
+        'schedule': timedelta(seconds=5),
+    },
+    'reconcile-transitions-every-10-sec': {
+        'task': 'attpcdaq.daq.tasks.reconcile_transitions_task',
+        'schedule': timedelta(seconds=10),
+    },
+    'prune-task-timings-every-minute': {
+        'task': 'attpcdaq.daq.tasks.prune_task_timings_task',
+        'schedule': timedelta(minutes=1),
+    },
+    'prune-samples-every-minute': {
+        'task': 'attpcdaq.daq.tasks.prune_samples_task',
+        'schedule': timedelta(minutes=1),
+    },
+    'prune-trace-spans-every-10-minutes': {
+        'task': 'attpcdaq.daq.tasks.prune_trace_spans_task',
+        'schedule': timedelta(minutes=10),
     },
 }
@@ -17,3 +17,9 @@ def active(request, pattern):
 def get_item(dictionary, key):
     # http://stackoverflow.com/a/8000091/3820658
     return dictionary.get(key)
+
+
+@register.filter
+def divide(value, divisor):
+    # Used to show sizes in the same decimal units as the JavaScript that refreshes them
+    return value / float(divisor)
@@ -20,6 +20,7 @@ from django.views.generic import RedirectView
 from .daq import urls as daq_urls
 from .logs import urls as logs_urls
 from .accounts import urls as account_urls
+from .daq.views import export_metrics
 
 
 urlpatterns = [
@@ -28,4 +29,5 @@ urlpatterns = [
     url(r'^accounts/', include(account_urls)),
     url(r'^daq/', include(daq_urls)),
     url(r'^logs/', include(logs_urls)),
+    url(r'^metrics$', export_metrics, name='metrics'),
 ]
@@ -0,0 +1,17 @@
+"""Benchmarks for the DAQ control system.
+
+Each module in this package can be run as a script from the ``web`` directory, e.g.::
+
+    python -m benchmarks.getstate
+
+"""
+
+import os
+
+
+def setup_django():
+    """Configure Django so that the app's modules can be imported outside of ``manage.py``."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attpcdaq.settings')
+
+    import django
+    django.setup()
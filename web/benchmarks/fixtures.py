@@ -0,0 +1,228 @@
+"""Fill a database with realistic volumes of data for the benchmarks.
+
+The generated experiment has a configurable number of ECC servers and data routers, a long run history with a
+measurement of every observable for each run, and a large log table. Rows are written with ``bulk_create`` in
+batches, so even the full scale (100k runs, 1M measurements, and 10M log entries) can be generated in a reasonable
+time.
+
+This module only generates the data. See :mod:`benchmarks.scenarios` for the timed scenarios that use it.
+
+"""
+
+import random
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from attpcdaq.daq.models import Experiment, ECCServer, ConfigId, DataRouter, DataSource, RunMetadata, Observable
+from attpcdaq.daq.models import Measurement
+from attpcdaq.logs.models import LogEntry
+
+#: The sizes of the generated data sets. Each one gives the arguments of :func:`generate`.
+SCALES = {
+    'small': dict(ecc_servers=11, data_routers=11, runs=1000, observables=10, log_entries=100000),
+    'medium': dict(ecc_servers=24, data_routers=24, runs=10000, observables=10, log_entries=1000000),
+    'full': dict(ecc_servers=48, data_routers=48, runs=100000, observables=10, log_entries=10000000),
+}
+
+#: The name of the generated experiment
+EXPERIMENT_NAME = 'Benchmark'
+
+#: The username of the generated user
+USERNAME = 'benchmark'
+
+#: The start time of the first generated run
+FIRST_RUN_TIME = datetime(2017, 1, 1)
+
+
+def bulk_create(model, objects, batch_size):
+    """Save the objects from an iterable in batches.
+
+    Parameters
+    ----------
+    model : django.db.models.Model
+        The model class.
+    objects : iterable
+        The unsaved model instances. This can be a generator, so the full set never has to be in memory.
+    batch_size : int
+        The number of objects to insert at once.
+
+    Returns
+    -------
+    int
+        The number of objects saved.
+
+    """
+    objects = iter(objects)
+    count = 0
+    while True:
+        batch = list(islice(objects, batch_size))
+        if not batch:
+            return count
+        model.objects.bulk_create(batch)
+        count += len(batch)
+
+
+def make_value(value_type, rand):
+    """Make a random serialized value for an observable of the given type."""
+    if value_type == Observable.INTEGER:
+        return str(rand.randint(0, 10000))
+    elif value_type == Observable.FLOAT:
+        return str(round(rand.uniform(0, 1000), 3))
+    else:
+        return rand.choice(['OK', 'Beam off', 'Trigger rate low', 'Pulser on'])
+
+
+def make_log_entries(count, rand, end_time):
+    """Generate unsaved log entries with timestamps spread over the time before ``end_time``."""
+    loggers = ['attpcdaq.daq.tasks', 'attpcdaq.daq.models', 'attpcdaq.daq.views.api', 'django.request']
+    levels = [LogEntry.INFO] * 16 + [LogEntry.WARNING] * 3 + [LogEntry.ERROR]
+    for i in range(count):
+        level = rand.choice(levels)
+        yield LogEntry(
+            logger_name=rand.choice(loggers),
+            create_time=end_time - timedelta(seconds=count - i),
+            path_name='/app/attpcdaq/daq/tasks.py',
+            line_num=rand.randint(1, 600),
+            function_name='eccserver_refresh_state_task',
+            message='Failed to refresh state of CoBo[{}]'.format(i % 48) if level == LogEntry.ERROR
+            else 'Benchmark log message {}'.format(i),
+            traceback='Traceback (most recent call last):\n  ...\nECCError: timeout' if level == LogEntry.ERROR
+            else None,
+            level=level,
+        )
+
+
+def matches_scale(scale):
+    """Check whether the database already holds the data for the given scale.
+
+    Parameters
+    ----------
+    scale : dict
+        The arguments of :func:`generate`.
+
+    Returns
+    -------
+    bool
+        True if the benchmark experiment exists and has the expected number of each object.
+
+    """
+    try:
+        experiment = Experiment.objects.get(name=EXPERIMENT_NAME)
+    except Experiment.DoesNotExist:
+        return False
+
+    return (ECCServer.objects.filter(experiment=experiment).count() == scale['ecc_servers']
+            and DataRouter.objects.filter(experiment=experiment).count() == scale['data_routers']
+            and RunMetadata.objects.filter(experiment=experiment).count() == scale['runs']
+            and Observable.objects.filter(experiment=experiment).count() == scale['observables']
+            and LogEntry.objects.count() == scale['log_entries'])
+
+
+def clear():
+    """Delete everything created by :func:`generate`."""
+    Experiment.objects.filter(name=EXPERIMENT_NAME).delete()
+    ConfigId.objects.filter(ecc_server__isnull=True).delete()
+    LogEntry.objects.all().delete()
+    User.objects.filter(username=USERNAME).delete()
+
+
+@transaction.atomic
+def generate(ecc_servers, data_routers, runs, observables, log_entries, batch_size=10000, seed=0, progress=None):
+    """Fill the database with a benchmark experiment.
+
+    The experiment is made active. Its ECC servers and data routers all point to 127.0.0.1, with the ECC servers
+    in the idle state and the data routers online with clean staging directories. If there is more than one ECC
+    server, the last one is named "Mutant" so that the special cases for the MuTAnT are exercised. Each data router
+    is given a data source, and the sources are spread evenly over the ECC servers.
+
+    All of the runs are finished, and each one has a measurement of every observable, so the total number of
+    measurements is ``runs * observables``.
+
+    Parameters
+    ----------
+    ecc_servers : int
+        The number of ECC servers.
+    data_routers : int
+        The number of data routers (and data sources).
+    runs : int
+        The number of runs.
+    observables : int
+        The number of observables.
+    log_entries : int
+        The number of log entries.
+    batch_size : int, optional
+        The number of rows to insert at once.
+    seed : int, optional
+        Seed for the random values.
+    progress : callable, optional
+        Called with a message before each step.
+
+    Returns
+    -------
+    Experiment
+        The new experiment.
+
+    """
+    if progress is None:
+        def progress(msg):
+            pass
+
+    rand = random.Random(seed)
+
+    User.objects.create_user(USERNAME, password=USERNAME)
+    experiment = Experiment.objects.create(name=EXPERIMENT_NAME, is_active=True)
+
+    progress('Creating {} ECC servers and {} data routers'.format(ecc_servers, data_routers))
+    ecc_list = []
+    for i in range(ecc_servers):
+        name = 'Mutant' if i == ecc_servers - 1 and ecc_servers > 1 else 'CoBo[{}]'.format(i)
+        ecc = ECCServer.objects.create(name=name, ip_address='127.0.0.1', experiment=experiment)
+        ecc.selected_config = ConfigId.objects.create(describe='describe-bench', prepare='prepare-bench',
+                                                      configure='configure-bench', ecc_server=ecc)
+        ecc.save()
+        ecc_list.append(ecc)
+
+    for i in range(data_routers):
+        router = DataRouter.objects.create(
+            name='DataRouter[{}]'.format(i),
+            ip_address='127.0.0.1',
+            port=46005 + i,
+            experiment=experiment,
+            is_online=True,
+            disk_total_bytes=4 * 1024 ** 4,
+            disk_free_bytes=2 * 1024 ** 4,
+        )
+        DataSource.objects.create(name='Source[{}]'.format(i), ecc_server=ecc_list[i % len(ecc_list)],
+                                  data_router=router)
+
+    types = [Observable.INTEGER, Observable.FLOAT, Observable.STRING]
+    obs_list = [Observable.objects.create(experiment=experiment, name='Observable {}'.format(i),
+                                          value_type=types[i % len(types)], order=i)
+                for i in range(observables)]
+
+    progress('Creating {} runs'.format(runs))
+    run_classes = [c for c, _ in RunMetadata.run_class_choices]
+    bulk_create(RunMetadata, (RunMetadata(
+        experiment=experiment,
+        run_number=i,
+        start_datetime=FIRST_RUN_TIME + timedelta(hours=i),
+        stop_datetime=FIRST_RUN_TIME + timedelta(hours=i, minutes=50),
+        title='Benchmark run {}'.format(i),
+        config_name='configure-bench',
+        run_class=rand.choice(run_classes),
+    ) for i in range(runs)), batch_size)
+
+    progress('Creating {} measurements'.format(runs * observables))
+    run_pks = list(RunMetadata.objects.filter(experiment=experiment).order_by('pk').values_list('pk', flat=True))
+    bulk_create(Measurement, (Measurement(run_metadata_id=run_pk, observable=obs,
+                                          serialized_value=make_value(obs.value_type, rand))
+                              for run_pk in run_pks for obs in obs_list), batch_size)
+
+    progress('Creating {} log entries'.format(log_entries))
+    end_time = FIRST_RUN_TIME + timedelta(hours=runs)
+    bulk_create(LogEntry, make_log_entries(log_entries, rand, end_time), batch_size)
+
+    return experiment
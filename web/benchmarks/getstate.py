@@ -0,0 +1,72 @@
+"""Compare the cost of polling an ECC server's state with zeep and with the lightweight client.
+
+A simulated ECC server (see :mod:`attpcdaq.daq.simulators.ecc`) is started on a local port, and each client polls
+it repeatedly. Three cases are timed:
+
+zeep, new client
+    A new :class:`~attpcdaq.daq.models.EccClient` for each request. This loads the WSDL file every time.
+zeep, cached client
+    One :class:`~attpcdaq.daq.models.EccClient` reused for every request.
+fast path
+    :class:`~attpcdaq.daq.models.EccStateClient`, as used by :meth:`~attpcdaq.daq.models.ECCServer.refresh_state`.
+
+"""
+
+import argparse
+import time
+
+from . import setup_django
+
+
+def time_calls(func, count):
+    """Call a function repeatedly and return the mean time per call, in seconds."""
+    func()  # Warm up, e.g. to open the connection
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=200, help='Number of requests per case')
+    args = parser.parse_args()
+
+    setup_django()
+    from attpcdaq.daq.models import EccClient, EccStateClient, ECCServer
+    from attpcdaq.daq.simulators.ecc import EccSimulator
+
+    simulator = EccSimulator(1, initial_state=ECCServer.READY)
+    simulator.start()
+    url = simulator.urls[0]
+
+    cached_client = []
+
+    def cached_get_state():
+        if not cached_client:
+            cached_client.append(EccClient(url))
+        return cached_client[0].GetState()
+
+    fast_client = EccStateClient(url)
+
+    cases = [
+        ('zeep, new client', lambda: EccClient(url).GetState()),
+        ('zeep, cached client', cached_get_state),
+        ('fast path', fast_client.GetState),
+    ]
+
+    try:
+        for name, func in cases:
+            try:
+                mean = time_calls(func, args.count)
+            except Exception as err:
+                # zeep may need to download schemas referenced by the WSDL file
+                print('{:<20s} failed: {}'.format(name, err))
+            else:
+                print('{:<20s} {:10.3f} ms/request'.format(name, mean * 1e3))
+    finally:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""Time the main DAQ control paths against a database filled with realistic volumes of data.
+
+The data is generated by :func:`benchmarks.fixtures.generate` in a separate benchmark database, so the data in the
+configured database is never touched. Each scenario is run a number of times, and the number of database queries
+and the latency of each call are recorded.
+
+The views are called through the Django test client. The Celery poll cycles are run in the current process with
+eager tasks, so the tasks for the individual ECC servers and data routers run one after another rather than in
+parallel. The ECC servers are simulated by an :class:`~attpcdaq.daq.simulators.ecc.EccSimulator`, and every data
+router and ECC server host is served by one local :class:`~attpcdaq.daq.simulators.ssh.FakeDaqNode`. In the
+change-state scenarios, each transition completes as soon as it is requested.
+
+The results are compared with a baseline stored as JSON in ``benchmarks/baselines``. Query counts are exact, so any
+change in them is reported. Latencies depend on the machine, so only large changes are reported.
+
+"""
+
+import argparse
+import contextlib
+import functools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from unittest.mock import patch
+
+from . import setup_django
+from .workerinterface import client_home
+
+#: A benchmark scenario. ``run`` is timed, and ``setup`` (which may be None) is called before each run.
+Scenario = namedtuple('Scenario', ('name', 'run', 'setup'))
+
+#: The directory holding the baseline files
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+
+def use_benchmark_database(keepdb=False):
+    """Create the benchmark database and switch the default connection to it.
+
+    This uses Django's test database machinery. With SQLite, the database is the file ``benchmark.sqlite3`` next
+    to ``manage.py``. With other backends, it's the configured database name with ``_benchmark`` appended.
+
+    Parameters
+    ----------
+    keepdb : bool, optional
+        Reuse the database if it already exists.
+
+    Returns
+    -------
+    str
+        The name of the original database, which is needed to destroy the benchmark database.
+
+    """
+    from django.conf import settings
+    from django.db import connection
+
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    if connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(settings.BASE_DIR, 'benchmark.sqlite3')
+    else:
+        test_settings['NAME'] = '{}_benchmark'.format(old_name)
+
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb, serialize=False)
+    return old_name
+
+
+@contextlib.contextmanager
+def restore_fixtures():
+    """Delete the runs and log entries created by the scenarios, so the database can be reused."""
+    from django.db.models import Max
+    from attpcdaq.daq.models import RunMetadata
+    from attpcdaq.logs.models import LogEntry
+
+    last_run_pk = RunMetadata.objects.aggregate(Max('pk'))['pk__max'] or 0
+    last_log_pk = LogEntry.objects.aggregate(Max('pk'))['pk__max'] or 0
+    try:
+        yield
+    finally:
+        RunMetadata.objects.filter(pk__gt=last_run_pk).delete()
+        LogEntry.objects.filter(pk__gt=last_log_pk).delete()
+
+
+class QueryCounter(object):
+    """A database execute wrapper that counts queries.
+
+    Unlike ``CaptureQueriesContext``, this has no limit on the number of queries it can count.
+
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(scenario, count):
+    """Run a scenario and record its query count and latency.
+
+    The scenario is run once before the measurement starts so that caches are warm.
+
+    Parameters
+    ----------
+    scenario : Scenario
+        The scenario to run.
+    count : int
+        The number of timed runs.
+
+    Returns
+    -------
+    dict
+        The largest number of queries made in one run, and the median and maximum latency in milliseconds.
+
+    """
+    from django.db import connection
+
+    times = []
+    queries = []
+    for i in range(count + 1):
+        if scenario.setup is not None:
+            scenario.setup()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            start = time.perf_counter()
+            scenario.run()
+            elapsed = time.perf_counter() - start
+        if i > 0:
+            times.append(elapsed)
+            queries.append(counter.count)
+
+    return {
+        'queries': max(queries),
+        'median_ms': round(statistics.median(times) * 1e3, 1),
+        'max_ms': round(max(times) * 1e3, 1),
+    }
+
+
+def make_scenarios(client, experiment):
+    """Build the list of scenarios.
+
+    Parameters
+    ----------
+    client : django.test.Client
+        A client that is logged in.
+    experiment : attpcdaq.daq.models.Experiment
+        The benchmark experiment.
+
+    Returns
+    -------
+    list[Scenario]
+
+    """
+    from django.urls import reverse
+    from attpcdaq.daq.models import ECCServer, PollRecord
+    from attpcdaq.daq import tasks
+    from attpcdaq.daq.pollschedule import clear_poll_cycle_times
+
+    def request(method, view_name, **data):
+        url = reverse(view_name)
+
+        def run():
+            response = getattr(client, method)(url, data)
+            if response.status_code != 200:
+                raise RuntimeError('{} returned status {}'.format(view_name, response.status_code))
+
+        return run
+
+    def set_run_state(running):
+        """Start or stop a run, and put the ECC servers in the matching state."""
+        experiment.refresh_from_db()
+        if running and not experiment.is_running:
+            experiment.start_run()
+        elif not running and experiment.is_running:
+            experiment.stop_run()
+        ECCServer.objects.filter(experiment=experiment).update(
+            state=ECCServer.RUNNING if running else ECCServer.READY, is_transitioning=False)
+
+    def reset_poll_records(running=None):
+        """Forget when the targets were last checked, so every target is due in the next poll cycle."""
+        if running is not None:
+            set_run_state(running)
+        PollRecord.objects.all().delete()
+        clear_poll_cycle_times()
+
+    return [
+        Scenario('status_page', request('get', 'daq/status'), None),
+        Scenario('refresh_state_all', request('get', 'daq/source_refresh_state_all'), None),
+        Scenario('download_run_metadata', request('get', 'daq/download_run_metadata'), None),
+        Scenario('measurement_chart', request('get', 'daq/measurement_chart'), None),
+        Scenario('source_change_state_all (start)',
+                 request('post', 'daq/source_change_state_all', target_state=ECCServer.RUNNING),
+                 functools.partial(set_run_state, False)),
+        Scenario('source_change_state_all (stop)',
+                 request('post', 'daq/source_change_state_all', target_state=ECCServer.READY),
+                 functools.partial(set_run_state, True)),
+        Scenario('poll: eccserver_refresh_all_task', tasks.eccserver_refresh_all_task, reset_poll_records),
+        Scenario('poll: check_ecc_server_online_all_task', tasks.check_ecc_server_online_all_task,
+                 reset_poll_records),
+        Scenario('poll: check_data_router_status_all_task', tasks.check_data_router_status_all_task,
+                 reset_poll_records),
+        Scenario('poll: sample_data_rate_all_task', tasks.sample_data_rate_all_task,
+                 functools.partial(reset_poll_records, True)),
+    ]
+
+
+def finish_transition(eccserver_pk, target_state):
+    """Stands in for queuing a transition task. The transition completes right away."""
+    from attpcdaq.daq.models import ECCServer
+    ECCServer.objects.filter(pk=eccserver_pk).update(state=target_state, is_transitioning=False)
+
+
+@contextlib.contextmanager
+def simulated_hardware(experiment, tmpdir):
+    """Point the experiment's ECC servers and data routers at local simulators.
+
+    The Celery tasks are run eagerly, and the tasks' SSH connections go to a fake DAQ computer.
+
+    """
+    from attpcdaq.celery import app
+    from attpcdaq.daq.models import ECCServer
+    from attpcdaq.daq.simulators.ecc import EccSimulator
+    from attpcdaq.daq.simulators.ssh import FakeDaqNode
+    from attpcdaq.daq.workertasks import WorkerInterface
+    from attpcdaq.daq import tasks, preflight
+
+    ecc_servers = ECCServer.objects.filter(experiment=experiment).order_by('pk')
+
+    with client_home(os.path.join(tmpdir, 'home')), \
+            EccSimulator(ecc_servers.count()) as simulator, \
+            FakeDaqNode(os.path.join(tmpdir, 'node')) as node, \
+            patch.object(tasks, 'WorkerInterface', functools.partial(WorkerInterface, port=node.port)), \
+            patch.object(preflight, 'WorkerInterface', functools.partial(WorkerInterface, port=node.port)), \
+            patch.object(tasks.eccserver_change_state_task, 'delay', finish_transition), \
+            patch.object(tasks.organize_files_all_task, 'delay'), \
+            patch.object(tasks.backup_config_files_all_task, 'delay'):
+        for ecc_server, port in zip(ecc_servers, simulator.ports):
+            ecc_server.ip_address = simulator.host
+            ecc_server.port = port
+            ecc_server.save()
+
+        always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        try:
+            yield
+        finally:
+            app.conf.task_always_eager = always_eager
+
+
+def compare(results, baseline, tolerance, min_change_ms):
+    """Compare results with a baseline.
+
+    Parameters
+    ----------
+    results : dict
+        The results of :func:`measure` for each scenario, keyed by name.
+    baseline : dict
+        The baseline results, in the same format.
+    tolerance : float
+        The fractional increase in median latency that counts as a regression.
+    min_change_ms : float
+        Changes in median latency smaller than this are ignored, since they are usually noise.
+
+    Returns
+    -------
+    notes : dict
+        A description of each difference, keyed by scenario name.
+    regressions : list[str]
+        The names of the scenarios that got worse.
+
+    """
+    notes = {}
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            notes[name] = 'new'
+            continue
+
+        messages = []
+        if result['queries'] != old['queries']:
+            messages.append('queries {} -> {}'.format(old['queries'], result['queries']))
+            if result['queries'] > old['queries']:
+                regressions.append(name)
+
+        if old['median_ms'] > 0 and abs(result['median_ms'] - old['median_ms']) >= min_change_ms:
+            ratio = result['median_ms'] / old['median_ms']
+            if ratio > 1 + tolerance or ratio < 1 / (1 + tolerance):
+                messages.append('median {:.2f}x baseline'.format(ratio))
+                if ratio > 1 + tolerance and name not in regressions:
+                    regressions.append(name)
+
+        notes[name] = ', '.join(messages)
+
+    return notes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', default='small', help='Size of the generated data set: small, medium, or full')
+    parser.add_argument('-n', '--count', type=int, default=10, help='Number of repetitions per scenario')
+    parser.add_argument('--only', nargs='+', help='Names of the scenarios to run')
+    parser.add_argument('--keepdb', action='store_true',
+                        help='Keep the benchmark database, and reuse it if it already holds this scale')
+    parser.add_argument('--baseline', help='Path to the baseline file. Default: baselines/<scale>.json')
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Fractional increase in median latency that counts as a regression')
+    parser.add_argument('--min-change', type=float, default=10,
+                        help='Smallest change in median latency that is reported, in ms')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from django.contrib.auth.models import User
+    from attpcdaq.daq.models import Experiment
+    from . import fixtures
+
+    if args.scale not in fixtures.SCALES:
+        parser.error('Unknown scale {}. Choose from {}.'.format(args.scale, ', '.join(sorted(fixtures.SCALES))))
+    scale = fixtures.SCALES[args.scale]
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, '{}.json'.format(args.scale))
+
+    # The fake DAQ computer's connections are reset when the client disconnects, which paramiko reports as errors
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+    setup_test_environment()
+    old_db_name = use_benchmark_database(keepdb=args.keepdb)
+
+    try:
+        if not fixtures.matches_scale(scale):
+            fixtures.clear()
+            print('Generating the {} data set'.format(args.scale))
+            start = time.perf_counter()
+            fixtures.generate(progress=lambda msg: print('  ' + msg), **scale)
+            print('  Done in {:.0f} s'.format(time.perf_counter() - start))
+
+        experiment = Experiment.objects.get(name=fixtures.EXPERIMENT_NAME)
+        client = Client()
+        client.force_login(User.objects.get(username=fixtures.USERNAME))
+
+        results = {}
+        with tempfile.TemporaryDirectory() as tmpdir, restore_fixtures(), simulated_hardware(experiment, tmpdir):
+            for scenario in make_scenarios(client, experiment):
+                if args.only and scenario.name not in args.only:
+                    continue
+                results[scenario.name] = measure(scenario, args.count)
+    finally:
+        if not args.keepdb:
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+
+    try:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = None
+
+    if baseline is not None and baseline['scale'] != scale:
+        print('The baseline in {} was made with a different scale, so it is ignored'.format(baseline_path))
+        baseline = None
+
+    notes, regressions = compare(results, baseline['scenarios'], args.tolerance, args.min_change) if baseline else ({}, [])
+
+    print('{:<45s} {:>8s} {:>11s} {:>11s}'.format('Scenario', 'Queries', 'Median (ms)', 'Max (ms)'))
+    for name, result in results.items():
+        print('{:<45s} {:>8d} {:>11.1f} {:>11.1f}  {}'.format(name, result['queries'], result['median_ms'],
+                                                              result['max_ms'], notes.get(name, '')))
+
+    if args.save:
+        if baseline is not None and args.only:
+            results = dict(baseline['scenarios'], **results)
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump({'scale': scale, 'scenarios': results}, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print('Saved the baseline to {}'.format(baseline_path))
+    elif regressions:
+        print('Regressions: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Time the SSH operations of WorkerInterface against a fake DAQ computer.
+
+A :class:`~attpcdaq.daq.simulators.ssh.FakeDaqNode` is started on a local port with a staging directory of
+synthetic GRAW files, a data router log, and a set of config files. The real
+:class:`~attpcdaq.daq.workertasks.WorkerInterface` then connects to it and each operation is timed. File
+organization is timed for each of the requested file counts.
+
+Since the fake node runs on the same machine, these numbers measure the cost of the SSH round trips and the
+client-side work, not the network latency to the real DAQ computers.
+
+"""
+
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+
+import paramiko
+
+from . import setup_django
+
+
+@contextlib.contextmanager
+def client_home(path):
+    """Temporarily use a new home directory containing an SSH key and an empty SSH config file.
+
+    :class:`~attpcdaq.daq.workertasks.WorkerInterface` reads the SSH config from the home directory, and
+    paramiko looks there for keys.
+
+    """
+    ssh_dir = os.path.join(path, '.ssh')
+    os.makedirs(ssh_dir, exist_ok=True)
+    paramiko.RSAKey.generate(2048).write_private_key_file(os.path.join(ssh_dir, 'id_rsa'))
+    open(os.path.join(ssh_dir, 'config'), 'w').close()
+
+    old_home = os.environ.get('HOME')
+    os.environ['HOME'] = path
+    try:
+        yield
+    finally:
+        if old_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = old_home
+
+
+def time_calls(func, count, setup=None):
+    """Call a function repeatedly and return the mean time per call, in seconds.
+
+    If ``setup`` is given, it is called before each call to ``func``, and it is not included in the time.
+
+    """
+    total = 0
+    for _ in range(count):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        total += time.perf_counter() - start
+    return total / count
+
+
+def print_result(name, seconds):
+    print('{:<40s} {:10.2f} ms'.format(name, seconds * 1e3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=20, help='Number of repetitions per case')
+    parser.add_argument('--files', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Numbers of GRAW files to organize')
+    parser.add_argument('--file-size', type=int, default=1024 ** 2, help='Size of each GRAW file, in bytes')
+    parser.add_argument('--log-lines', type=int, default=100000, help='Length of the data router log')
+    parser.add_argument('--tail-lines', type=int, default=50, help='Number of log lines to fetch')
+    args = parser.parse_args()
+
+    setup_django()
+    from attpcdaq.daq.workertasks import WorkerInterface
+    from attpcdaq.daq.simulators.ssh import FakeDaqNode
+
+    with tempfile.TemporaryDirectory() as tmpdir, client_home(os.path.join(tmpdir, 'home')):
+        with FakeDaqNode(os.path.join(tmpdir, 'node')) as node:
+            node.write_log(args.log_lines)
+            config_paths = node.create_config_files('benchmark')
+            backup_root = os.path.join(node.root, 'config_backups')
+
+            def connect():
+                with WorkerInterface(node.host, port=node.port):
+                    pass
+
+            print_result('connect', time_calls(connect, args.count))
+
+            with WorkerInterface(node.host, port=node.port) as wint:
+                node.create_graw_files(max(args.files), args.file_size)
+
+                print_result('check_data_router_status', time_calls(wint.check_data_router_status, args.count))
+                print_result('check_ecc_server_status', time_calls(wint.check_ecc_server_status, args.count))
+                print_result('find_data_router', time_calls(wint.find_data_router, args.count))
+                print_result('working_dir_is_clean ({} files)'.format(max(args.files)),
+                             time_calls(wint.working_dir_is_clean, args.count))
+                print_result('get_graw_size ({} files)'.format(max(args.files)),
+                             time_calls(wint.get_graw_size, args.count))
+                print_result('tail_file ({} lines)'.format(args.tail_lines),
+                             time_calls(lambda: wint.tail_file(node.log_path, args.tail_lines), args.count))
+                print_result('backup_config_files',
+                             time_calls(lambda: wint.backup_config_files('bench', 0, config_paths, backup_root),
+                                        args.count))
+
+                for num_files in args.files:
+                    run_numbers = iter(range(args.count))
+
+                    def setup():
+                        # Clear out the staging directory and write a new set of files
+                        for name in os.listdir(node.staging_dir):
+                            if name.endswith('.graw'):
+                                os.remove(os.path.join(node.staging_dir, name))
+                        node.create_graw_files(num_files, args.file_size)
+
+                    print_result('organize_files ({} files)'.format(num_files),
+                                 time_calls(lambda: wint.organize_files('bench{}'.format(num_files),
+                                                                        next(run_numbers)),
+                                            args.count, setup=setup))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,4 +8,18 @@ then
     exit 1  # If we got here, something is wrong.
 fi
 
-celery -A attpcdaq worker -B --concurrency 10  # start Celery
+# Start one worker for each queue (see CELERY_ROUTES in settings.py), so that state changes never wait behind
+# status polls or file operations. The control worker only takes one task at a time from the broker per process so
+# that a queued transition is picked up by the first free process.
+celery -A attpcdaq worker -Q control -n control@%h --concurrency ${CELERY_CONTROL_CONCURRENCY:-4} --prefetch-multiplier 1 &
+celery -A attpcdaq worker -Q polling -n polling@%h --concurrency ${CELERY_POLLING_CONCURRENCY:-6} &
+celery -A attpcdaq worker -Q bulk -n bulk@%h --concurrency ${CELERY_BULK_CONCURRENCY:-3} &
+celery -A attpcdaq beat &
+
+# Stop everything if any of them exits, so that the container is restarted
+trap 'kill $(jobs -p) 2>/dev/null' TERM INT
+wait -n
+status=$?
+kill $(jobs -p) 2>/dev/null
+wait
+exit $status